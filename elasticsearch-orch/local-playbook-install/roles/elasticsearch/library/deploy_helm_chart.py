@@ -13,7 +13,7 @@
 import json
 import logging
 import traceback
-from orchutils import helm3
+from orchutils.helpers import deployhelpers
 import baseutils
 from ansible.module_utils.basic import AnsibleModule
 
@@ -28,6 +28,11 @@ ANSIBLE_METADATA = {
 }
 
 RETURN = '''
+releases:
+    description: The deployment of each release in the cluster of each group of environments, with its status (deployed, failed or skipped), start time,
+                 duration in seconds and error
+    returned: always
+    type: list
 '''
 
 def run_helm():
@@ -37,7 +42,9 @@ def run_helm():
         'environments': {'type': 'list', 'required': True},
         'charts': {'type': 'list', 'required': True},
         'helm_repository_url': {'type': 'str', 'required': True},
-        'enforce_chart_requirements': {'type': 'bool', 'required': True}
+        'enforce_chart_requirements': {'type': 'bool', 'required': True},
+        'concurrency': {'type': 'int', 'required': False, 'default': deployhelpers.default_concurrency},
+        'environment_concurrency': {'type': 'int', 'required': False, 'default': deployhelpers.default_environment_concurrency}
     }
 
     result = {
@@ -55,24 +62,25 @@ def run_helm():
         enforce_chart_requirements = module.params['enforce_chart_requirements']
         helm_repository_url = module.params['helm_repository_url']
 
-        for element in charts:
-            name = element['name']
-            release = element['release']
-            logger.info("release = " + release)
-            namespace = element['namespace']
-            logger.info("namespace = " + namespace)
-            chartVersion = element['chartVersion']
-            valuesFile = element['valuesFile']
-            helm3.install_chart(name,
-                          chartVersion,
-                          valuesFile,
-                          release,
-                          namespace)
-
+        # Releases are deployed in the order given by the "dependsOn" list of each chart, once per cluster, with independent releases and clusters deployed concurrently
+        releases = deployhelpers.deploy_releases(charts,
+                                                 environments=environments,
+                                                 concurrency=module.params['concurrency'],
+                                                 environment_concurrency=module.params['environment_concurrency'],
+                                                 validate_manifest=enforce_chart_requirements,
+                                                 dry_run=module.check_mode)
+        for release in releases:
+            logger.info("release = {release} environments = {environments} status = {status} duration = {duration}".format(**release))
+        result['releases'] = releases
+        result['changed'] = any(release['status'] == 'deployed' for release in releases) and not module.check_mode
+        failed_releases = [release for release in releases if release['status'] != 'deployed']
+        if failed_releases:
+            module.fail_json(msg="Failed to deploy releases: " + ", ".join(release['release'] for release in failed_releases), **result)
 
     except Exception as e:
         print(e)
         logger.error(str(e), exc_info=True)
+        module.fail_json(msg=str(e), **result)
     module.exit_json(**result)
 
 
@@ -0,0 +1,146 @@
+"""
+Asynchronous (asyncio) counterparts of the baseutils helpers, for running commands against many targets concurrently from a single process.
+This module requires Python 3.5 or later and is not imported by the baseutils package itself. Import it directly:
+    from baseutils import aioutils
+"""
+import asyncio
+import codecs
+import io
+import locale
+import logging
+import subprocess
+import time
+
+from baseutils import baseutils
+
+logger = logging.getLogger(__name__)
+default_concurrency = 10  # Maximum number of awaitables run at once by gather and run when no concurrency is passed
+
+
+async def exe_cmd(cmd, working_dir=None, obfuscate=None, stdin=None, env=None, log_level=logging.INFO, raise_exception=True):
+    """
+    Asynchronous counterpart of baseutils.exe_cmd. The command runs as a child process of the event loop, so many commands can run at the same time.
+    If the calling task is cancelled or a baseutils.timeout active in the task expires, the command is killed together with any processes it started.
+    Args:
+        cmd: The command to execute. Either a string, which is run through the shell, or a list of arguments, which executes the binary in the first element directly
+             without a shell. Arguments in a list must not be shell escaped
+        working_dir: The directory to execution the command from (Optional)
+        obfuscate: A value to obfuscate in the logging (Optional)
+        stdin: A string to pass as standard input to the process (Optional)
+        env: Custom environment variables to be used in place of parent envrionment variables (Optional, default: parent process environment variables)
+        log_level: The default logging level. Default: INFO. Setting to None will disable logging in this function
+        raise_exception: Whether to raise an exception if the command return a non-zero return code (Default: True)
+    Returns: A tuple of (return code, output)
+    """
+    obfus_cmd = baseutils._display_cmd(cmd, obfuscate)
+    logger.info('Executing: %s' % (obfus_cmd))
+    try:
+        if isinstance(cmd, (list, tuple)):
+            p = await asyncio.create_subprocess_exec(*cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, stdin=subprocess.PIPE if stdin else None,
+                                                     cwd=working_dir, env=env, start_new_session=True)
+        else:
+            p = await asyncio.create_subprocess_shell(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, stdin=subprocess.PIPE if stdin else None,
+                                                      cwd=working_dir, env=env, start_new_session=True)
+    except OSError as e:
+        (rc, output) = baseutils._start_cmd_error(cmd, e)
+        baseutils._check_cmd_rc(rc, obfus_cmd, output, log_level, raise_exception)
+        return (rc, output)
+    try:
+        (stdout, stderr) = await asyncio.wait_for(p.communicate(stdin.encode(locale.getpreferredencoding(False)) if stdin and not isinstance(stdin, bytes) else stdin),
+                                                  baseutils.get_remaining_time())
+    except asyncio.TimeoutError:
+        baseutils.check_timeout()
+        raise
+    finally:
+        if p.returncode is None:
+            baseutils._kill_process(p)
+    # Decoding and newline translation match those of baseutils.exe_cmd
+    decoder = io.IncrementalNewlineDecoder(codecs.getincrementaldecoder(locale.getpreferredencoding(False))('replace'), translate=True)
+    output = decoder.decode(stdout, final=True)
+    if log_level is not None and logger.isEnabledFor(log_level):
+        for line in output.splitlines():
+            if line.strip():
+                logger.log(log_level, line)
+    baseutils._check_cmd_rc(p.returncode, obfus_cmd, output, log_level, raise_exception)
+    return (p.returncode, output)
+
+
+async def retry(func, *args, **kwargs):
+    """
+    Asynchronous counterpart of baseutils.retry. Awaits a coroutine function, retrying if an exception is raised, without blocking the event loop between attempts.
+    Args:
+        func: The coroutine function to call
+        *args: Any arguments that are passed to the function
+        **kwargs: Any keyword arguments that are passed to the function
+        interval: The time between retries. This parameter will be removed from kwargs before forwarding to the function (Optional, default: 10 seconds)
+        retry: The number of times to retry. This parameter will be removed from kwargs before forwarding to the function (Optional, default: 10)
+        policy: A baseutils.retry_policy object describing how to retry. See baseutils.retry (Optional)
+    Returns: The return value of the passed function
+    """
+    policy = kwargs.pop('policy', None) or baseutils.retry_policy()
+    overrides = {}
+    if 'interval' in kwargs:
+        overrides['interval'] = kwargs.pop('interval')
+    if 'retry' in kwargs:
+        overrides['retries'] = kwargs.pop('retry')
+    if overrides:
+        policy = policy.copy(**overrides)
+    start_time = time.time()
+    retries = 0
+    sleep_time = 0
+    try:
+        for i in range(1, policy.retries + 1):
+            try:
+                return await func(*args, **kwargs)
+            except Exception as e:
+                if i == policy.retries or not policy.is_retryable(e):
+                    raise
+                wait = policy.get_wait(i)
+                if policy.deadline is not None and time.time() + wait - start_time > policy.deadline:
+                    logger.warning('Function "{func}" failed. Not retrying as the deadline of {deadline} second(s) would be exceeded'.format(
+                        func=func.__name__, deadline=policy.deadline))
+                    raise
+                logger.warning('Function "{func}" failed. Retrying {retry} more time(s) in {interval} second(s)'.format(
+                    func=func.__name__, retry=policy.retries - i, interval=round(wait, 2)))
+                retries += 1
+                sleep_time += wait
+                await asyncio.sleep(wait)
+    finally:
+        baseutils._record_retry_stats(func, func.__name__, retries, sleep_time, time.time() - start_time)
+
+
+async def gather(aws, concurrency=None, return_exceptions=False):
+    """
+    Runs a series of awaitables concurrently, with at most a limited number running at any one time, and returns their results in order.
+    Example:
+        clusters = await gather([ibmcloud.ks_cluster_get(name) for name in cluster_names], concurrency=20)
+    Args:
+        aws: A list of awaitables, eg. coroutines, to run
+        concurrency: The maximum number of awaitables to run at once (Optional, default: default_concurrency)
+        return_exceptions: If True, exceptions are returned in place of the results of failed awaitables rather than raised (Optional, default: False)
+    Returns: A list of the results of the awaitables, in the same order as aws
+    """
+    semaphore = asyncio.Semaphore(concurrency or default_concurrency)
+
+    async def run_bounded(aw):
+        async with semaphore:
+            return await aw
+    return await asyncio.gather(*[run_bounded(aw) for aw in aws], return_exceptions=return_exceptions)
+
+
+def run(aws, concurrency=None, return_exceptions=False):
+    """
+    Synchronous entry point to gather for code that is not itself asynchronous. The awaitables are run to completion on a new event loop.
+    Args:
+        aws: A list of coroutines to run
+        concurrency: The maximum number of coroutines to run at once (Optional, default: default_concurrency)
+        return_exceptions: If True, exceptions are returned in place of the results of failed coroutines rather than raised (Optional, default: False)
+    Returns: A list of the results of the coroutines, in the same order as aws
+    """
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)  # Older Python versions only reap child processes of the current event loop
+    try:
+        return loop.run_until_complete(gather(aws, concurrency=concurrency, return_exceptions=return_exceptions))
+    finally:
+        asyncio.set_event_loop(None)
+        loop.close()
@@ -1,11 +1,25 @@
+import codecs
+import collections
+import copy
+import errno
+import functools
+import glob
+import hashlib
+import io
+import locale
 import logging
 import logmatic
+import math
 import os
+import pickle
+import random
 import requests
 import signal
 import smtplib
 import subprocess
+import sys
 import tempfile
+import threading
 import time
 try:  # python3
     from email.mime.multipart import MIMEMultipart
@@ -17,9 +31,27 @@ try:
     import fcntl
 except ImportError:
     pass  # fcntl is not available on Windows. The local_lock function will not work there
+try:  # python3.7+
+    import contextvars
+except ImportError:
+    contextvars = None
 
 
 logger = logging.getLogger(__name__)
+exe_cmd_read_size = 65536  # Size of the blocks read from the output of executed commands
+exe_cmd_tail_lines = 100  # Lines of output kept for error messages when output is not captured
+ttl_cache_enabled = os.environ.get('P2PAAS_TTL_CACHE', '').lower() == 'true'  # Whether functions decorated with ttl_cache cache their results
+ttl_cache_dir = os.environ.get('P2PAAS_TTL_CACHE_DIR')  # Directory of an on-disk cache shared between processes. If not set, caches are process-local
+unsafe_ttl_cache_dirs = set()  # Cache directories that have been refused as other users could modify them. See _get_ttl_cache_dir
+retry_stats = {}  # Retry statistics of each function called through retry, keyed by function name. See get_retry_stats
+retry_stats_lock = threading.Lock()
+lock_stats = {}  # Wait statistics of each lock acquired through local_lock, keyed by lock name. See get_lock_stats
+lock_stats_lock = threading.Lock()
+if contextvars:
+    # A context variable is local to each thread and each asyncio task, so timeouts set in one task or thread do not affect others
+    active_timeouts = contextvars.ContextVar('baseutils_active_timeouts', default=())
+else:
+    active_timeouts = threading.local()
 
 
 def configure_logger(custom_logger, file_path=None, stream=False, formatter=None, json_formatter=False, level=logging.INFO):
@@ -91,31 +123,233 @@ def discover_github_latest_patch_release(version_to_match, release_url, pat=None
     return version
 
 
-def exe_cmd(cmd, working_dir=None, obfuscate=None, stdin=None, env=None, log_level=logging.INFO, raise_exception=True):
+def exe_cmd(cmd, working_dir=None, obfuscate=None, stdin=None, env=None, log_level=logging.INFO, raise_exception=True, callback=None, capture_output=True):
     """
     Helper function for easily executing a command.
-        cmd: The command to execute
+    Output is read in large blocks and collected with linear cost, so commands returning many megabytes of output are handled efficiently.
+        cmd: The command to execute. Either a string, which is run through the shell, or a list of arguments, which executes the binary in the first element directly
+             without a shell. Arguments in a list must not be shell escaped
         working_dir: The directory to execution the command from (Optional)
         obfuscate: A value to obfuscate in the logging (Optional)
         stdin: A string to pass as standard input to the process (Optional)
         env: Custom environment variables to be used in place of parent envrionment variables (Optional, default: parent process environment variables)
         log_level: The default logging level. Default: INFO. Setting to None will disable logging in this function
         raise_exception: Whether to raise an exception if the command return a non-zero return code (Default: True)
+        callback: A function that is called with each line of output, including its line ending, as soon as it is produced (Optional)
+        capture_output: Whether to keep the output in memory so that it can be returned. If False, an empty string is returned as the output and only the last lines
+                        are kept for the exception message. Combine with callback to process very large output without holding it in memory (Optional, default: True)
+    Returns: A tuple of (return code, output)
+    """
+    obfus_cmd = _display_cmd(cmd, obfuscate)
+    logger.info('Executing: %s' % (obfus_cmd))
+    try:
+        p = _start_cmd(cmd, working_dir, stdin, env)
+    except OSError as e:
+        (rc, output) = _start_cmd_error(cmd, e)
+        _check_cmd_rc(rc, obfus_cmd, output, log_level, raise_exception)
+        return (rc, output)
+    output = [] if capture_output else collections.deque(maxlen=exe_cmd_tail_lines)
+    log_output = log_level is not None and logger.isEnabledFor(log_level)
+    watchdog = _watch_cmd(p)
+    try:
+        for line in _read_cmd_lines(p):
+            output.append(line)
+            if log_output and line.strip():
+                logger.log(log_level, line.rstrip())
+            if callback:
+                callback(line)
+        rc = p.wait()
+    finally:
+        _stop_cmd(p, watchdog)
+    output = ''.join(output)
+    _check_cmd_rc(rc, obfus_cmd, output, log_level, raise_exception)
+    return (rc, output if capture_output else '')
+
+
+def exe_cmd_stream(cmd, working_dir=None, obfuscate=None, stdin=None, env=None, log_level=logging.INFO, raise_exception=True, binary=False):
+    """
+    Executes a command and streams its output as it is produced, without keeping the whole output in memory.
+    The arguments and logging behave as per exe_cmd. Once the output is exhausted, the return code is checked and an exception raised as per exe_cmd,
+    with the last lines of output in the message. If the generator is closed before the output is exhausted, the command is killed.
+    Example:
+        for line in exe_cmd_stream('kubectl get pods --all-namespaces -o json'):
+            do_something(line)
+    Args:
+        binary: If True, raw blocks of bytes are yielded instead of lines and the output is not logged (Optional, default: False)
+    Returns: A generator of lines (including line endings) or blocks of bytes if binary is True
     """
-    obfus_cmd = cmd.replace(obfuscate, '***') if obfuscate else cmd
+    obfus_cmd = _display_cmd(cmd, obfuscate)
     logger.info('Executing: %s' % (obfus_cmd))
-    p = subprocess.Popen(cmd, shell=True, bufsize=0, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
-                         stdin=subprocess.PIPE if stdin else None, cwd=working_dir, universal_newlines=True, env=env)
+    try:
+        p = _start_cmd(cmd, working_dir, stdin, env)
+    except OSError as e:
+        (rc, output) = _start_cmd_error(cmd, e)
+        _check_cmd_rc(rc, obfus_cmd, output, log_level, raise_exception)
+        yield output.encode(locale.getpreferredencoding(False)) if binary else output
+        return
+    tail = collections.deque(maxlen=exe_cmd_tail_lines)
+    log_output = not binary and log_level is not None and logger.isEnabledFor(log_level)
+    watchdog = _watch_cmd(p)
+    try:
+        for data in (_read_cmd_blocks(p) if binary else _read_cmd_lines(p)):
+            tail.append(data)
+            if log_output and data.strip():
+                logger.log(log_level, data.rstrip())
+            yield data
+        rc = p.wait()
+    finally:
+        _stop_cmd(p, watchdog)
+    tail = b''.join(tail).decode(locale.getpreferredencoding(False), 'replace') if binary else ''.join(tail)
+    _check_cmd_rc(rc, obfus_cmd, tail, log_level, raise_exception)
+
+
+def _display_cmd(cmd, obfuscate):
+    """
+    Builds the form of a command that is logged and reported in exceptions. Argument lists are displayed as the equivalent shell escaped command.
+    """
+    if isinstance(cmd, (list, tuple)):
+        cmd = ' '.join(shell_escape(arg) for arg in cmd)
+    return cmd.replace(obfuscate, '***') if obfuscate else cmd
+
+
+def _start_cmd(cmd, working_dir, stdin, env):
+    """
+    Starts a command for exe_cmd with its standard output and error combined into a single binary pipe.
+    The command is started in a new session, so that the processes it starts share its process group and can be killed with it. See _kill_process.
+    """
+    if sys.version_info[0] >= 3:
+        session_kwargs = {'start_new_session': True}
+    else:
+        session_kwargs = {'preexec_fn': os.setsid} if hasattr(os, 'setsid') else {}
+    p = subprocess.Popen(list(cmd) if isinstance(cmd, (list, tuple)) else cmd, shell=not isinstance(cmd, (list, tuple)), bufsize=0,
+                         stdout=subprocess.PIPE, stderr=subprocess.STDOUT, stdin=subprocess.PIPE if stdin else None, cwd=working_dir, env=env,
+                         **session_kwargs)
     if stdin:
+        # Standard input is written from a separate thread so that a command producing output before consuming all its input cannot deadlock
+        stdin_writer = threading.Thread(target=_write_cmd_stdin, args=(p, stdin.encode(locale.getpreferredencoding(False)) if not isinstance(stdin, bytes) else stdin))
+        stdin_writer.daemon = True
+        stdin_writer.start()
+    return p
+
+
+def _write_cmd_stdin(p, stdin):
+    """
+    Writes standard input to a command started by _start_cmd and closes the pipe.
+    """
+    try:
         p.stdin.write(stdin)
+    except (IOError, OSError):
+        pass  # The command exited without reading all of its input
+    finally:
         p.stdin.close()
-    output = ''
-    for line in iter(p.stdout.readline, ''):
-        output += line
-        if line.strip():
-            logger.log(log_level, line.rstrip())
+
+
+def _read_cmd_blocks(p):
+    """
+    Reads the output of a command started by _start_cmd in large blocks of bytes.
+    """
+    fd = p.stdout.fileno()
+    block = os.read(fd, exe_cmd_read_size)
+    while block:
+        yield block
+        block = os.read(fd, exe_cmd_read_size)
+
+
+def _read_cmd_lines(p):
+    """
+    Reads the output of a command started by _start_cmd as lines of text.
+    Decoding and newline translation match those of subprocess in universal_newlines mode. Partial lines are collected as fragments so long lines
+    spanning many blocks are still assembled with linear cost.
+    """
+    decoder = io.IncrementalNewlineDecoder(codecs.getincrementaldecoder(locale.getpreferredencoding(False))('replace'), translate=True)
+    fragments = []
+    for block in _read_cmd_blocks(p):
+        text = decoder.decode(block)
+        start = 0
+        end = text.find('\n')
+        while end != -1:
+            fragments.append(text[start:end + 1])
+            yield ''.join(fragments)
+            fragments = []
+            start = end + 1
+            end = text.find('\n', start)
+        if start < len(text):
+            fragments.append(text[start:])
+    fragments.append(decoder.decode(b'', final=True))
+    if ''.join(fragments):
+        yield ''.join(fragments)
+
+
+def _watch_cmd(p):
+    """
+    Starts a timer that kills a command started by _start_cmd when the earliest active timeout expires, so that a timeout is enforced even where no
+    signal can interrupt the read of the command's output, eg. in worker threads.
+    Returns: The timer or None if no timeout is active
+    """
+    remaining_time = get_remaining_time()
+    if remaining_time is None:
+        return None
+    watchdog = threading.Timer(remaining_time, _kill_cmd, args=(p,))
+    watchdog.daemon = True
+    watchdog.expired_timeout = min(_get_active_timeouts(), key=lambda active_timeout: active_timeout.deadline)
+    watchdog.start()
+    return watchdog
+
+
+def _kill_cmd(p):
+    """
+    Kills a command that has exceeded a timeout. Runs in the timer thread started by _watch_cmd.
+    """
+    try:
+        if p.poll() is None:
+            p.timed_out = True
+            _kill_process(p)
+    except OSError:
+        pass  # The command has already exited
+
+
+def _kill_process(p):
+    """
+    Kills a command started in its own session, together with any processes it started that are still in its process group, eg. the commands run by a shell.
+    Falls back to killing only the command where process groups are not available.
+    """
+    try:
+        os.killpg(p.pid, signal.SIGKILL)
+    except (AttributeError, OSError):
+        p.kill()
+
+
+def _stop_cmd(p, watchdog=None):
+    """
+    Releases the resources of a command started by _start_cmd, killing it if it has not exited, eg. because the caller stopped reading its output.
+    If the command was killed by its watchdog, the exception of the expired timeout is raised.
+    """
+    if watchdog:
+        watchdog.cancel()
+    if p.poll() is None:
+        _kill_process(p)
+        p.wait()
     p.stdout.close()
-    rc = p.wait()
+    if watchdog and getattr(p, 'timed_out', False):
+        raise TimeoutException(watchdog.expired_timeout.error_message)
+
+
+def _start_cmd_error(cmd, error):
+    """
+    Converts a failure to execute the binary of an argument list command into the return code and output that a shell would have reported,
+    so that callers checking the return code see the same result with or without a shell.
+    """
+    if not isinstance(cmd, (list, tuple)) or error.errno not in [errno.ENOENT, errno.EACCES]:
+        raise error
+    if error.errno == errno.ENOENT:
+        return (127, '{binary}: not found\n'.format(binary=cmd[0]))
+    return (126, '{binary}: Permission denied\n'.format(binary=cmd[0]))
+
+
+def _check_cmd_rc(rc, obfus_cmd, output, log_level, raise_exception):
+    """
+    Raises an exception or logs the result of an executed command as per the raise_exception argument of exe_cmd.
+    """
     if rc:
         if raise_exception:
             raise Exception('Error executing command: {cmd}. RC: {rc}. Output: {output}'.format(
@@ -126,69 +360,266 @@ def exe_cmd(cmd, working_dir=None, obfuscate=None, stdin=None, env=None, log_lev
             logger.info('Command returned RC {rc} but received instruction not to raise exception. This may be normal'.format(rc=rc))
     else:
         logger.info('Command successful. Returning output')
-    return (rc, output)
 
 
 class local_lock:
     """
     A lock class to support locking against a local file. This allows some coordination between seperate processes on the same system.
     This class is intended to be use via the 'with' syntax.
-    Only a single thread and single process may acquire the lock at one time on a given system.
+    An exclusive lock may only be held by a single thread and single process at one time on a given system. A shared lock may be held by any number of
+    threads and processes at the same time, but not while the exclusive lock is held. Code that only reads the protected resource should take the shared lock.
+    The time spent waiting for each lock is recorded. See get_lock_stats.
     Warning: A thread must not attempt to acquire the lock more than once.
     This function does not work on Windows.
     Example:
         with local_lock():
             do_something
+        with local_lock(lock_name='config', shared=True, timeout=60):
+            read_something
     """
-    def __init__(self, lock_name='local'):
+    def __init__(self, lock_name='local', shared=False, timeout=None):
         """
         Constructor for the lock object.
         Args:
             lock_name: The name of the lock. Contention for locks will only occur between locks with the same name. The value must be safe for use as a filename (Optional)
+            shared: Whether to acquire the lock in shared mode rather than exclusively (Optional, default: False)
+            timeout: The maximum number of seconds to wait for the lock before raising a TimeoutException. Any active baseutils.timeout also limits the wait
+                     (Optional, default: wait indefinitely)
         """
+        self.lock_name = lock_name
         self.lock_file_path = os.path.join(tempfile.gettempdir(), 'py.{name}.lockfile'.format(name=lock_name))
         self.lock_file = None
+        self.shared = shared
+        self.timeout = timeout
 
     def __enter__(self):
         self.lock_file = open(self.lock_file_path, 'w')
-        fcntl.flock(self.lock_file, fcntl.LOCK_EX)
+        mode = fcntl.LOCK_SH if self.shared else fcntl.LOCK_EX
+        start_time = time.time()
+        try:
+            contended = not _try_flock(self.lock_file, mode)
+            if contended:
+                if self.timeout is None and get_remaining_time() is None:
+                    fcntl.flock(self.lock_file, mode)
+                else:
+                    self._wait(mode, start_time)
+        except BaseException:
+            self.lock_file.close()
+            raise
+        record_lock_wait(self.lock_name, contended, time.time() - start_time)
+
+    def _wait(self, mode, start_time):
+        """
+        Polls for the lock until it is acquired or the timeout expires.
+        """
+        interval = 0.01
+        while not _try_flock(self.lock_file, mode):
+            check_timeout()
+            if self.timeout is not None and time.time() - start_time >= self.timeout:
+                raise TimeoutException('Timed out after {timeout} seconds waiting for lock "{name}"'.format(timeout=self.timeout, name=self.lock_name))
+            sleep(interval)
+            interval = min(interval * 2, 0.5)
 
     def __exit__(self, type, value, traceback):
         fcntl.flock(self.lock_file, fcntl.LOCK_UN)
         self.lock_file.close()
 
 
+def _try_flock(lock_file, mode):
+    """
+    Attempts to lock a file without blocking.
+    Returns: True if the lock was acquired or False if it is held by another process
+    """
+    try:
+        fcntl.flock(lock_file, mode | fcntl.LOCK_NB)
+        return True
+    except (IOError, OSError) as e:
+        if e.errno not in [errno.EAGAIN, errno.EACCES]:
+            raise
+        return False
+
+
+def record_lock_wait(lock_name, contended, wait_time):
+    """
+    Adds an acquisition of a lock to its statistics. This is called by local_lock and may be called by other lock implementations so that all locks are reported together.
+    Args:
+        lock_name: The name of the lock
+        contended: Whether the lock was held by someone else when it was requested
+        wait_time: The time in seconds spent waiting to acquire the lock
+    """
+    with lock_stats_lock:
+        stats = lock_stats.setdefault(lock_name, {'acquisitions': 0, 'contended': 0, 'wait_time': 0, 'max_wait_time': 0})
+        stats['acquisitions'] += 1
+        stats['contended'] += 1 if contended else 0
+        stats['wait_time'] += wait_time
+        stats['max_wait_time'] = max(stats['max_wait_time'], wait_time)
+    if contended:
+        logger.debug('Waited {wait_time} second(s) for lock "{name}"'.format(wait_time=round(wait_time, 2), name=lock_name))
+
+
+def get_lock_stats():
+    """
+    Reports the contention of each lock acquired since the process started or reset_lock_stats was called.
+    Returns: A dictionary keyed by lock name of dictionaries containing:
+        acquisitions: The number of times the lock was acquired
+        contended: The number of acquisitions that had to wait for another holder of the lock
+        wait_time: The total time in seconds spent waiting for the lock
+        max_wait_time: The longest time in seconds spent waiting for the lock
+    """
+    with lock_stats_lock:
+        return copy.deepcopy(lock_stats)
+
+
+def reset_lock_stats():
+    """
+    Discards the lock statistics collected so far.
+    """
+    with lock_stats_lock:
+        lock_stats.clear()
+
+
+class retry_policy:
+    """
+    Describes how retry re-attempts a failing function: how many attempts are made, how long to wait between them and which exceptions are worth retrying.
+    The wait before each retry is interval * backoff ^ (attempt - 1), limited to max_interval. With jitter, a random wait between 0 and that value is used instead,
+    which spreads out the retries of concurrent callers against a rate-limited API.
+    Example:
+        policy = retry_policy(retries=8, interval=1, backoff=2, max_interval=30, jitter=True, deadline=120)
+        retry(client.read, path=path, policy=policy)
+    """
+    def __init__(self, retries=10, interval=10, backoff=1, max_interval=None, jitter=False, deadline=None, retry_on=None):
+        """
+        Constructor for the policy.
+        Args:
+            retries: The maximum number of attempts (Optional, default: 10)
+            interval: The time in seconds to wait before the first retry (Optional, default: 10)
+            backoff: The factor the wait is multiplied by after each retry. 1 waits the same interval before each retry (Optional, default: 1)
+            max_interval: The maximum time in seconds to wait between attempts (Optional, default: no limit)
+            jitter: Whether to wait a random time of up to the calculated wait (Optional, default: False)
+            deadline: The total time in seconds after which no further attempts are made. A retry is not attempted if its wait would pass the deadline (Optional, default: no limit)
+            retry_on: A function that is passed the raised exception and returns whether it should be retried (Optional, default: all exceptions are retried)
+        """
+        self.retries = retries
+        self.interval = interval
+        self.backoff = backoff
+        self.max_interval = max_interval
+        self.jitter = jitter
+        self.deadline = deadline
+        self.retry_on = retry_on
+
+    def copy(self, **kwargs):
+        """
+        Creates a copy of the policy with some of its properties replaced.
+        Args:
+            **kwargs: Any arguments of the constructor to replace
+        Returns: The new retry_policy object
+        """
+        properties = dict(self.__dict__)
+        properties.update(kwargs)
+        return retry_policy(**properties)
+
+    def get_wait(self, attempt):
+        """
+        Calculates the time to wait after a failed attempt.
+        Args:
+            attempt: The number of the attempt that failed, starting at 1
+        Returns: The time to wait in seconds
+        """
+        wait = self.interval * self.backoff ** (attempt - 1)
+        if self.max_interval is not None:
+            wait = min(wait, self.max_interval)
+        if self.jitter:
+            wait = random.uniform(0, wait)
+        return wait
+
+    def is_retryable(self, exception):
+        """
+        Returns whether an exception should be retried.
+        """
+        return self.retry_on is None or self.retry_on(exception)
+
+
 def retry(func, *args, **kwargs):
     """
     Helper method for retrying a function that fails by throwing an exception.
     If all retries fail, the exception that was raised by the failing function is re-raised.
+    The number of retries and the time spent waiting are recorded for each function. See get_retry_stats.
     Args:
         func: The function to retry
         *args: Any arguments that are passed to the function
         **kwargs: Any keyword arguments that are passed to the function
         interval: The time between retries. This parameter will be removed from kwargs before forwarding to the function (Optional, default: 10 seconds)
         retry: The number of times to retry. This parameter will be removed from kwargs before forwarding to the function (Optional, default: 10)
+        policy: A retry_policy object describing how to retry. interval and retry override the corresponding properties of the policy if also passed.
+                This parameter will be removed from kwargs before forwarding to the function (Optional, default: a fixed interval of 10 seconds for up to 10 attempts)
     Returns: The return value of the passed function
     """
+    policy = kwargs.pop('policy', None) or retry_policy()
+    overrides = {}
     if 'interval' in kwargs:
-        interval = kwargs['interval']
-        del kwargs['interval']
-    else:
-        interval = 10
+        overrides['interval'] = kwargs.pop('interval')
     if 'retry' in kwargs:
-        retry = kwargs['retry']
-        del kwargs['retry']
-    else:
-        retry = 10
-    for i in range(1, retry + 1):
-        try:
-            return func(*args, **kwargs)
-        except Exception:
-            if i == retry:
-                raise
-            else:
-                logger.warning('Function "{func}" failed. Retrying {retry} more time(s) in {interval} second(s)'.format(func=func.__name__, retry=retry - i, interval=interval))
-                time.sleep(interval)
+        overrides['retries'] = kwargs.pop('retry')
+    if overrides:
+        policy = policy.copy(**overrides)
+    func_name = getattr(func, '__name__', repr(func))
+    start_time = time.time()
+    retries = 0
+    sleep_time = 0
+    try:
+        for i in range(1, policy.retries + 1):
+            try:
+                return func(*args, **kwargs)
+            except Exception as e:
+                if i == policy.retries or not policy.is_retryable(e):
+                    raise
+                wait = policy.get_wait(i)
+                if policy.deadline is not None and time.time() + wait - start_time > policy.deadline:
+                    logger.warning('Function "{func}" failed. Not retrying as the deadline of {deadline} second(s) would be exceeded'.format(
+                        func=func_name, deadline=policy.deadline))
+                    raise
+                logger.warning('Function "{func}" failed. Retrying {retry} more time(s) in {interval} second(s)'.format(
+                    func=func_name, retry=policy.retries - i, interval=round(wait, 2)))
+                retries += 1
+                sleep_time += wait
+                sleep(wait)  # Wakes early and raises a TimeoutException if an active timeout expires while waiting
+    finally:
+        _record_retry_stats(func, func_name, retries, sleep_time, time.time() - start_time)
+
+
+def _record_retry_stats(func, func_name, retries, sleep_time, elapsed_time):
+    """
+    Adds the outcome of a call to retry to the statistics of the function.
+    """
+    module = getattr(func, '__module__', None)
+    key = '{module}.{name}'.format(module=module, name=func_name) if module else func_name
+    with retry_stats_lock:
+        stats = retry_stats.setdefault(key, {'calls': 0, 'retries': 0, 'sleep_time': 0, 'elapsed_time': 0})
+        stats['calls'] += 1
+        stats['retries'] += retries
+        stats['sleep_time'] += sleep_time
+        stats['elapsed_time'] += elapsed_time
+
+
+def get_retry_stats():
+    """
+    Reports how much retrying has taken place for each function called through retry since the process started or reset_retry_stats was called.
+    Returns: A dictionary keyed by function name of dictionaries containing:
+        calls: The number of calls to retry for the function
+        retries: The total number of retries
+        sleep_time: The total time in seconds spent waiting between attempts
+        elapsed_time: The total time in seconds spent in retry, including the time taken by the function
+    """
+    with retry_stats_lock:
+        return copy.deepcopy(retry_stats)
+
+
+def reset_retry_stats():
+    """
+    Discards the retry statistics collected so far.
+    """
+    with retry_stats_lock:
+        retry_stats.clear()
 
 
 def send_mail(mail_from, mail_to, subject, body, cc=None, bcc=None, smtp_server='localhost'):
@@ -231,10 +662,19 @@ def shell_escape(value):
     return "'" + value.replace("'", "'\"'\"'") + "'"
 
 
+class TimeoutException(Exception):
+    """
+    Raised when the period of a timeout is exceeded.
+    """
+
+
 class timeout:
     """
     A timeout class to allow for an exception to be triggered when a passed time period is exceeded.
-    This class is intended to be use via the 'with' syntax.
+    This class is intended to be use via the 'with' syntax. Timeouts can be nested, in which case the earliest deadline applies.
+    Each thread and asyncio task has its own timeouts. In the main thread, when no asyncio event loop is running, the code in the block is interrupted by a
+    SIGALRM signal once the timeout expires. Elsewhere the timeout is enforced cooperatively: commands run through exe_cmd are killed when it expires and
+    polling loops should wait with baseutils.sleep or call check_timeout. get_remaining_time reports the time left.
     Example:
         with timeout(seconds=500):
             do_something
@@ -242,13 +682,269 @@ class timeout:
     def __init__(self, seconds=1, error_message='A timeout exception has occurred due to exceeding timeout period of SECONDS seconds'):
         self.seconds = seconds
         self.error_message = error_message.replace('SECONDS', str(seconds))
+        self.deadline = None
+        self.use_alarm = False
+        self.previous_handler = None
+        self.previous_timeouts = ()
+
+    @property
+    def expired(self):
+        """
+        Whether the deadline of the timeout has passed.
+        """
+        return self.deadline is not None and time.time() >= self.deadline
 
     def handle_timeout(self, signum, frame):
-        raise Exception(self.error_message)
+        check_timeout()
+        _set_alarm()  # The signal arrived before any deadline passed, so wait for the earliest one again
 
     def __enter__(self):
-        signal.signal(signal.SIGALRM, self.handle_timeout)
-        signal.alarm(self.seconds)
+        self.deadline = time.time() + self.seconds
+        self.previous_timeouts = _get_active_timeouts()
+        _set_active_timeouts(self.previous_timeouts + (self,))
+        self.use_alarm = _can_use_alarm()
+        if self.use_alarm:
+            self.previous_handler = signal.signal(signal.SIGALRM, self.handle_timeout)
+            _set_alarm()
+        return self
 
     def __exit__(self, type, value, traceback):
-        signal.alarm(0)
+        if self.use_alarm:
+            signal.alarm(0)
+            signal.signal(signal.SIGALRM, self.previous_handler)
+        _set_active_timeouts(self.previous_timeouts)
+        if self.use_alarm:
+            _set_alarm()  # Restores the alarm of any enclosing timeout
+
+
+def _get_active_timeouts():
+    """
+    Returns a tuple of the timeouts active in the current thread or asyncio task, outermost first.
+    """
+    if contextvars:
+        return active_timeouts.get()
+    return getattr(active_timeouts, 'timeouts', ())
+
+
+def _set_active_timeouts(timeouts):
+    """
+    Replaces the timeouts active in the current thread or asyncio task.
+    Args:
+        timeouts: A tuple of the active timeouts, outermost first
+    """
+    if contextvars:
+        active_timeouts.set(timeouts)
+    else:
+        active_timeouts.timeouts = timeouts
+
+
+def _can_use_alarm():
+    """
+    Returns whether a timeout can interrupt the current code with SIGALRM, which is only delivered to the main thread and would interrupt whichever task an
+    asyncio event loop happens to be running.
+    """
+    if not hasattr(signal, 'SIGALRM') or not _in_main_thread():
+        return False
+    asyncio = sys.modules.get('asyncio')
+    return not (asyncio and hasattr(asyncio, '_get_running_loop') and asyncio._get_running_loop())
+
+
+def _in_main_thread():
+    """
+    Returns whether the current thread is the main thread of the interpreter.
+    """
+    if hasattr(threading, 'main_thread'):  # python3.4+
+        return threading.current_thread() is threading.main_thread()
+    return isinstance(threading.current_thread(), threading._MainThread)
+
+
+def _set_alarm():
+    """
+    Schedules SIGALRM for the earliest deadline of the active timeouts that use it, or cancels it if there are none.
+    """
+    deadlines = [active_timeout.deadline for active_timeout in _get_active_timeouts() if active_timeout.use_alarm]
+    signal.alarm(max(1, int(math.ceil(min(deadlines) - time.time()))) if deadlines else 0)
+
+
+def get_remaining_time():
+    """
+    Returns the number of seconds until the earliest active timeout of the current thread or asyncio task expires.
+    Returns: The remaining time in seconds, 0 if a timeout has expired, or None if no timeout is active
+    """
+    timeouts = _get_active_timeouts()
+    if not timeouts:
+        return None
+    return max(0, min(active_timeout.deadline for active_timeout in timeouts) - time.time())
+
+
+def check_timeout():
+    """
+    Raises a TimeoutException if any active timeout of the current thread or asyncio task has expired.
+    Polling loops that may run outside the main thread should call this, or wait with sleep, so that the timeout stops them.
+    """
+    expired_timeouts = [active_timeout for active_timeout in _get_active_timeouts() if active_timeout.expired]
+    if expired_timeouts:
+        raise TimeoutException(min(expired_timeouts, key=lambda active_timeout: active_timeout.deadline).error_message)
+
+
+def sleep(seconds):
+    """
+    Sleeps for a number of seconds, waking early if an active timeout expires first, in which case a TimeoutException is raised.
+    Args:
+        seconds: The time to sleep in seconds
+    """
+    remaining_time = get_remaining_time()
+    time.sleep(seconds if remaining_time is None else min(seconds, remaining_time))
+    check_timeout()
+
+
+def set_ttl_cache(enabled=True, cache_dir=None):
+    """
+    Enables or disables caching for functions decorated with ttl_cache.
+    Args:
+        enabled: Whether decorated functions cache their results (Optional, default: True)
+        cache_dir: A directory in which to store cached results so that they are shared between processes, eg. Ansible forks. As cached values are unpickled from it,
+                   the directory is only used if it is owned by the current user and not writable by other users. Otherwise, or if not set, results are cached in the
+                   memory of each process (Optional)
+    """
+    global ttl_cache_enabled, ttl_cache_dir
+    ttl_cache_enabled = enabled
+    ttl_cache_dir = cache_dir
+
+
+def _get_ttl_cache_dir():
+    """
+    Returns the directory of the on-disk cache of ttl_cache, creating it accessible only by the current user if it does not exist.
+    Cached values are unpickled from the directory, so a directory that is not owned by the current user or is writable by other users is not used and
+    a warning is logged once for it.
+    Returns: The path of the directory or None if values should be cached in memory
+    """
+    cache_dir = ttl_cache_dir
+    if not cache_dir or cache_dir in unsafe_ttl_cache_dirs:
+        return None
+    try:
+        os.makedirs(cache_dir, 0o700)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+    stat = os.stat(cache_dir)
+    if (hasattr(os, 'getuid') and stat.st_uid != os.getuid()) or stat.st_mode & 0o022:
+        logger.warning('Caching in memory as cache directory {path} is not owned by the current user or is writable by other users'.format(path=cache_dir))
+        unsafe_ttl_cache_dirs.add(cache_dir)
+        return None
+    return cache_dir
+
+
+class ttl_cache:
+    """
+    A decorator that caches the return values of a function for a period of time, keyed by the arguments of each call.
+    Caching only takes place while enabled through set_ttl_cache or by setting the P2PAAS_TTL_CACHE environment variable to "true".
+    Exceptions are not cached. Each call returns a copy of the cached value, so callers may modify the values they receive.
+    The decorated function has two additional functions:
+        invalidate(*args, **kwargs): Discards the cached value for the passed arguments, or all cached values of the function if no arguments are passed
+        refresh(*args, **kwargs): Calls the function regardless of the cache and caches the new value
+    Example:
+        @ttl_cache(seconds=60)
+        def ks_worker_pool_ls(cluster_name):
+            ...
+        ks_worker_pool_ls.invalidate(cluster_name)
+    """
+    def __init__(self, seconds, env_keys=None):
+        """
+        Constructor for the decorator.
+        Args:
+            seconds: The number of seconds a value is cached for
+            env_keys: A list of environment variables that the result of the function depends on. Their values form part of the cache key (Optional)
+        """
+        self.seconds = seconds
+        self.env_keys = env_keys or []
+        self.values = {}
+        self.lock = threading.Lock()
+        self.name = None
+
+    def __call__(self, func):
+        self.name = '{module}.{name}'.format(module=func.__module__, name=func.__name__)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not ttl_cache_enabled:
+                return func(*args, **kwargs)
+            key = self._get_key(args, kwargs)
+            (found, value) = self._load(key)
+            if found:
+                logger.debug('Using cached result of {name}'.format(name=self.name))
+                return value
+            value = func(*args, **kwargs)
+            self._store(key, value)
+            return value
+
+        @functools.wraps(func)
+        def refresh(*args, **kwargs):
+            value = func(*args, **kwargs)
+            if ttl_cache_enabled:
+                self._store(self._get_key(args, kwargs), value)
+            return value
+        wrapper.invalidate = self.invalidate
+        wrapper.refresh = refresh
+        return wrapper
+
+    def invalidate(self, *args, **kwargs):
+        """
+        Discards cached values of the decorated function.
+        Args:
+            *args: The arguments of the call to discard the cached value of. If no arguments are passed, all cached values of the function are discarded
+            **kwargs: The keyword arguments of the call to discard the cached value of
+        """
+        cache_dir = _get_ttl_cache_dir()
+        if args or kwargs:
+            key = self._get_key(args, kwargs)
+            with self.lock:
+                self.values.pop(key, None)
+            paths = [self._get_path(cache_dir, key)] if cache_dir else []
+        else:
+            with self.lock:
+                self.values.clear()
+            paths = glob.glob(self._get_path(cache_dir, '*')) if cache_dir else []
+        for path in paths:
+            try:
+                os.remove(path)
+            except OSError as e:
+                if e.errno != errno.ENOENT:
+                    raise
+
+    def _get_key(self, args, kwargs):
+        key = repr((args, sorted(kwargs.items()), [os.environ.get(env_key) for env_key in self.env_keys]))
+        return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+    def _get_path(self, cache_dir, key):
+        return os.path.join(cache_dir, '{name}.{key}.cache'.format(name=self.name, key=key))
+
+    def _load(self, key):
+        """
+        Returns a tuple of (found, value) for a cache key. Values are read from the on-disk cache if one is configured, as other processes may have updated it.
+        """
+        cache_dir = _get_ttl_cache_dir()
+        if cache_dir:
+            path = self._get_path(cache_dir, key)
+            try:
+                if os.path.getmtime(path) + self.seconds > time.time():
+                    with open(path, 'rb') as fh:
+                        return (True, pickle.load(fh))
+            except (OSError, IOError, EOFError, pickle.UnpicklingError):
+                pass  # The value is missing, or is being replaced or removed by another process
+            return (False, None)
+        with self.lock:
+            if key in self.values and self.values[key][0] > time.time():
+                return (True, copy.deepcopy(self.values[key][1]))
+        return (False, None)
+
+    def _store(self, key, value):
+        cache_dir = _get_ttl_cache_dir()
+        if cache_dir:
+            (fd, tmp_path) = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+            with os.fdopen(fd, 'wb') as fh:
+                pickle.dump(value, fh, pickle.HIGHEST_PROTOCOL)
+            os.rename(tmp_path, self._get_path(cache_dir, key))  # Readers in other processes only ever see complete values
+        else:
+            with self.lock:
+                self.values[key] = (time.time() + self.seconds, copy.deepcopy(value))
@@ -0,0 +1,59 @@
+import asyncio
+import unittest
+
+import baseutils
+from baseutils import aioutils
+
+
+class TestAIOUtils(unittest.TestCase):
+    def test_exe_cmd(self):
+        self.assertEqual([(0, 'value\n'), (0, 'a b;$HOME\n'), (0, 'input')], aioutils.run([
+            aioutils.exe_cmd('echo value'),
+            aioutils.exe_cmd(['echo', 'a b;$HOME']),
+            aioutils.exe_cmd(['cat'], stdin='input')
+        ]))
+        self.assertEqual(127, aioutils.run([aioutils.exe_cmd(['fake_cmd'], raise_exception=False)])[0][0])
+        with self.assertRaises(Exception) as context:
+            aioutils.run([aioutils.exe_cmd('echo failure && exit 3')])
+        self.assertIn('RC: 3. Output: failure', str(context.exception))
+
+    def test_gather(self):
+        running = []
+        max_running = []
+
+        async def task(value):
+            running.append(value)
+            max_running.append(len(running))
+            await asyncio.sleep(0.01)
+            running.remove(value)
+            return value
+        self.assertEqual(list(range(10)), aioutils.run([task(i) for i in range(10)], concurrency=3))
+        self.assertEqual(3, max(max_running))
+        results = aioutils.run([task(1), aioutils.exe_cmd('exit 1')], return_exceptions=True)
+        self.assertEqual(1, results[0])
+        self.assertIsInstance(results[1], Exception)
+
+    def test_retry(self):
+        attempts = []
+
+        async def flaky():
+            attempts.append(None)
+            if len(attempts) < 3:
+                raise ValueError('failure')
+            return len(attempts)
+        self.assertEqual([3], aioutils.run([aioutils.retry(flaky, interval=0)]))
+        del attempts[:]
+        with self.assertRaises(ValueError):
+            aioutils.run([aioutils.retry(flaky, retry=2, interval=0)])
+
+    def test_timeout(self):
+        async def slow_cmd():
+            with baseutils.timeout(seconds=1):
+                return await aioutils.exe_cmd(['sleep', '30'])
+
+        async def fast_cmd():
+            await asyncio.sleep(1.5)  # The timeout of the other task does not apply to this task
+            return await aioutils.exe_cmd(['echo', 'value'])
+        results = aioutils.run([slow_cmd(), fast_cmd()], return_exceptions=True)
+        self.assertIsInstance(results[0], baseutils.TimeoutException)
+        self.assertEqual((0, 'value\n'), results[1])
@@ -0,0 +1,9 @@
+import sys
+import unittest
+
+if sys.version_info >= (3, 5):
+    from aioutils_cases import TestAIOUtils  # noqa: F401 The tests of aioutils use syntax that is only valid on Python 3.5 or later
+
+
+if __name__ == '__main__':
+    unittest.main()
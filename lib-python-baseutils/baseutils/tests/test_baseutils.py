@@ -4,6 +4,8 @@ import os
 import shutil
 import sys
 import tempfile
+import threading
+import time
 import unittest
 from mock import patch
 
@@ -63,6 +65,37 @@ class TestUtils(unittest.TestCase):
             baseutils.exe_cmd('fake_cmd', log_level=logging.NOTSET)
         e_msg = str(context.exception)
         self.assertFalse('is not recognized' in e_msg or 'not found' in e_msg)
+        # Output spanning many read blocks, including a line longer than a block, is returned intact
+        long_line = 'x' * (baseutils.exe_cmd_read_size * 3)
+        (rc, output) = baseutils.exe_cmd('cat', stdin='first\n{long_line}\nlast'.format(long_line=long_line))
+        self.assertEqual('first\n{long_line}\nlast'.format(long_line=long_line), output)
+        lines = []
+        self.assertEqual((0, ''), baseutils.exe_cmd('echo line1 && echo line2', callback=lines.append, capture_output=False, log_level=None))
+        self.assertEqual(['line1\n', 'line2\n'], lines)
+
+    @patch('baseutils.baseutils.logger')
+    def test_exe_cmd_argv(self, mock_logger):
+        # Arguments are passed to the executable as-is without shell interpretation
+        self.assertEqual((0, 'a b;$HOME\n'), baseutils.exe_cmd(['echo', 'a b;$HOME']))
+        self.assertEqual(['x\n'], list(baseutils.exe_cmd_stream(['echo', 'x'])))
+        self.assertEqual(127, baseutils.exe_cmd(['fake_cmd'], raise_exception=False)[0])
+        with self.assertRaises(Exception) as context:
+            baseutils.exe_cmd(['fake_cmd', 'secret'], obfuscate='secret')
+        self.assertIn('not found', str(context.exception))
+        self.assertNotIn('secret', str(context.exception))
+        self.assertTrue(all('secret' not in str(call) for call in mock_logger.method_calls))
+
+    def test_exe_cmd_stream(self):
+        self.assertEqual(['line1\n', 'line2\n'], list(baseutils.exe_cmd_stream('echo line1 && echo line2')))
+        self.assertEqual(b'line1\n', b''.join(baseutils.exe_cmd_stream('echo line1', binary=True)))
+        with self.assertRaises(Exception) as context:
+            list(baseutils.exe_cmd_stream('echo failure && exit 3'))
+        self.assertIn('RC: 3. Output: failure', str(context.exception))
+        self.assertEqual([], list(baseutils.exe_cmd_stream('exit 3', raise_exception=False)))
+        # Closing the stream early terminates the command
+        stream = baseutils.exe_cmd_stream('while true; do echo line; done')
+        self.assertEqual('line\n', next(stream))
+        stream.close()
 
     def test_local_lock(self):
         # This is nix-specific and will not work on windows
@@ -72,6 +105,25 @@ class TestUtils(unittest.TestCase):
             with baseutils.local_lock('lock_name'):
                 self.assertTrue(True)
 
+    def test_local_lock_modes(self):
+        if sys.platform == 'win32':
+            return
+        baseutils.reset_lock_stats()
+        with baseutils.local_lock('test_lock_modes', shared=True):
+            # Shared locks can be held at the same time but exclude the exclusive lock
+            with baseutils.local_lock('test_lock_modes', shared=True, timeout=1):
+                with self.assertRaises(baseutils.TimeoutException):
+                    with baseutils.local_lock('test_lock_modes', timeout=0.2):
+                        self.fail('The exclusive lock was acquired while shared locks were held')
+        with baseutils.local_lock('test_lock_modes', timeout=1):
+            with self.assertRaises(baseutils.TimeoutException):
+                with baseutils.timeout(seconds=1):
+                    with baseutils.local_lock('test_lock_modes', shared=True):
+                        self.fail('A shared lock was acquired while the exclusive lock was held')
+        stats = baseutils.get_lock_stats()['test_lock_modes']
+        self.assertEqual(3, stats['acquisitions'])
+        self.assertEqual(0, stats['contended'])
+
     def test_retry(self):
         pid = os.getpid()
         self.assertEquals(pid, baseutils.retry(os.getpid))
@@ -84,6 +136,43 @@ class TestUtils(unittest.TestCase):
         except Exception as e:
             self.assertIsInstance(e, ValueError)
 
+    @patch('time.sleep')
+    def test_retry_policy(self, mock_sleep):
+        attempts = []
+
+        def flaky(error=ValueError):
+            attempts.append(error)
+            raise error('failed')
+        baseutils.reset_retry_stats()
+        policy = baseutils.retry_policy(retries=5, interval=1, backoff=2, max_interval=5)
+        self.assertRaises(ValueError, baseutils.retry, flaky, policy=policy)
+        self.assertEqual([1, 2, 4, 5], [call[0][0] for call in mock_sleep.call_args_list])
+        # Backward compatible arguments override the policy
+        mock_sleep.reset_mock()
+        self.assertRaises(ValueError, baseutils.retry, flaky, policy=policy, retry=2, interval=3)
+        self.assertEqual([3], [call[0][0] for call in mock_sleep.call_args_list])
+        # Exceptions rejected by the predicate are not retried
+        del attempts[:]
+        policy = baseutils.retry_policy(retry_on=lambda e: not isinstance(e, KeyError))
+        self.assertRaises(KeyError, baseutils.retry, flaky, KeyError, policy=policy)
+        self.assertEqual(1, len(attempts))
+        # No attempt is made that would pass the deadline
+        del attempts[:]
+        clock = [1000]
+        mock_sleep.side_effect = lambda seconds: clock.append(clock.pop() + seconds)
+        with patch('time.time', side_effect=lambda: clock[0]):
+            self.assertRaises(ValueError, baseutils.retry, flaky, policy=baseutils.retry_policy(interval=10, deadline=25))
+        self.assertEqual(3, len(attempts))
+        mock_sleep.side_effect = None
+        # Jitter waits up to the calculated interval
+        mock_sleep.reset_mock()
+        self.assertRaises(ValueError, baseutils.retry, flaky, policy=baseutils.retry_policy(retries=20, interval=2, jitter=True))
+        self.assertTrue(all(0 <= call[0][0] <= 2 for call in mock_sleep.call_args_list))
+        stats = baseutils.get_retry_stats()['{module}.flaky'.format(module=__name__)]
+        self.assertEqual(5, stats['calls'])
+        self.assertEqual(4 + 1 + 0 + 2 + 19, stats['retries'])
+        self.assertGreaterEqual(stats['sleep_time'], 12 + 3 + 20)
+
     @patch('smtplib.SMTP')
     def test_send_mail(self, mock_smtp):
         mock_smtp_instance = mock_smtp.return_value
@@ -96,10 +185,96 @@ class TestUtils(unittest.TestCase):
     def test_shell_escape(self):
         self.assertEqual(baseutils.shell_escape('a\'b'), '\'a\'"\'"\'b\'')
 
+    def test_ttl_cache(self):
+        calls = []
+
+        @baseutils.ttl_cache(seconds=60)
+        def cached_func(value, suffix=''):
+            calls.append(value)
+            return [value + suffix]
+        self.assertEqual(['a'], cached_func('a'))
+        self.assertEqual(['a'], cached_func('a'))
+        self.assertEqual(2, len(calls))  # Caching is disabled by default
+        tmpdir = tempfile.mkdtemp()
+        try:
+            for cache_dir in [None, tmpdir]:
+                baseutils.set_ttl_cache(cache_dir=cache_dir)
+                calls = []
+                result = cached_func('a')
+                result.append('modified')
+                self.assertEqual(['a'], cached_func('a'))
+                self.assertEqual(['a'], calls)
+                self.assertEqual(['a-b'], cached_func('a', suffix='-b'))
+                self.assertEqual(['a', 'a'], calls)
+                cached_func.invalidate('a')
+                cached_func('a')
+                cached_func('a', suffix='-b')
+                self.assertEqual(['a', 'a', 'a'], calls)
+                self.assertEqual(['c'], cached_func.refresh('c'))
+                cached_func('c')
+                self.assertEqual(['a', 'a', 'a', 'c'], calls)
+                cached_func.invalidate()
+                cached_func('a')
+                cached_func('c')
+                self.assertEqual(['a', 'a', 'a', 'c', 'a', 'c'], calls)
+                cached_func.invalidate()
+            self.assertEqual([], os.listdir(tmpdir))
+            # A directory that other users could write cached values to is not read from
+            os.chmod(tmpdir, 0o777)
+            baseutils.set_ttl_cache(cache_dir=tmpdir)
+            calls = []
+            cached_func('a')
+            self.assertEqual(['a'], cached_func('a'))
+            self.assertEqual(['a'], calls)
+            self.assertEqual([], os.listdir(tmpdir))
+            cached_func.invalidate()
+        finally:
+            baseutils.set_ttl_cache(enabled=False)
+            shutil.rmtree(tmpdir)
+
     def test_timeout(self):
         timeout = baseutils.timeout()
         self.assertRaises(Exception, timeout.handle_timeout)
 
+    def test_nested_timeout(self):
+        self.assertIsNone(baseutils.get_remaining_time())
+        with baseutils.timeout(seconds=60):
+            with self.assertRaises(baseutils.TimeoutException) as context:
+                with baseutils.timeout(seconds=1):
+                    self.assertLessEqual(baseutils.get_remaining_time(), 1)
+                    time.sleep(5)  # Interrupted by the alarm of the inner timeout
+            self.assertIn('timeout period of 1 seconds', str(context.exception))
+            self.assertGreater(baseutils.get_remaining_time(), 50)
+            baseutils.check_timeout()
+        self.assertIsNone(baseutils.get_remaining_time())
+
+    def test_thread_timeout(self):
+        errors = []
+
+        def sleep_forever():
+            while True:
+                baseutils.sleep(5)
+        tasks = [lambda: baseutils.exe_cmd(['sleep', '30']), sleep_forever,
+                 lambda: baseutils.exe_cmd('sleep 30; echo done'),  # The processes started by the shell are killed with it
+                 lambda: baseutils.retry(dict, 'value', interval=30)]  # Waiting between retries stops at the deadline
+
+        def run():
+            for task in tasks:
+                try:
+                    with baseutils.timeout(seconds=1):
+                        task()
+                except Exception as e:
+                    errors.append(e)
+        start_time = time.time()
+        thread = threading.Thread(target=run)
+        thread.start()
+        thread.join(30)
+        self.assertLess(time.time() - start_time, 10)
+        self.assertEqual(4, len(errors))
+        self.assertTrue(all(isinstance(error, baseutils.TimeoutException) for error in errors))
+        # Timeouts of other threads do not apply to the main thread
+        self.assertIsNone(baseutils.get_remaining_time())
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,24 @@
+"""
+Asynchronous (asyncio) variants of the most frequently used orchutils CLI wrappers, for querying or operating on many clusters concurrently from one process.
+Each function accepts an env argument so that different calls can target different clusters, eg. using environments built by cluster_env.
+These modules require Python 3.5 or later. Use baseutils.aioutils.gather or baseutils.aioutils.run to run calls with a concurrency limit.
+"""
+import os
+
+
+def cluster_env(orch_dir, env=None):
+    """
+    Builds the environment variables for CLI calls against the cluster whose configuration is stored in a given orchestration directory.
+    This matches the environment the orchutils modules configure for themselves when P2PAAS_ORCH_DIR is set, without modifying the current process environment.
+    orchutils.aio.k8s also runs the kubectl binary of the orchestration directory given in P2PAAS_ORCH_DIR, as orchutils.k8s does.
+    Args:
+        orch_dir: The orchestration directory of the cluster, as would be passed in P2PAAS_ORCH_DIR
+        env: The environment to base the result on (Optional, default: the current process environment)
+    Returns: A dictionary of environment variables
+    """
+    cluster_env = dict(os.environ if env is None else env)
+    cluster_env['P2PAAS_ORCH_DIR'] = orch_dir
+    cluster_env['KUBECONFIG'] = os.path.join(orch_dir, '.kube', 'config')
+    cluster_env['IBMCLOUD_HOME'] = orch_dir
+    cluster_env['HELM_HOME'] = os.path.join(orch_dir, '.helm')
+    return cluster_env
@@ -0,0 +1,34 @@
+import json
+import logging
+
+from baseutils import aioutils
+from orchutils import helm3
+from orchutils.helmmodels.releaserevision import ReleaseRevision
+
+logger = logging.getLogger(__name__)
+
+
+async def get_manifest(release, resource_type=None, env=None):
+    """
+    Asynchronous variant of orchutils.helm3.get_manifest.
+    Args:
+        release: The name of the release to retrieve manifest for
+        resource_type: Limits the returned resources to the specified resource type (Optional)
+        env: The environment for helm, eg. with KUBECONFIG set for the cluster to query (Optional, default: the current process environment)
+    Returns: A list of manifest resources
+    """
+    (rc, output) = await aioutils.retry(aioutils.exe_cmd, helm3._get_manifest_cmd(release), env=env, log_level=logging.NOTSET,
+                                        interval=10, retry=6)  # Output can contain secrets so don't log
+    return helm3._parse_manifest(output, resource_type)
+
+
+async def history(release, env=None):
+    """
+    Asynchronous variant of orchutils.helm3.history.
+    Args:
+        release: The name of the release to retrieve the revision history for
+        env: The environment for helm, eg. with KUBECONFIG set for the cluster to query (Optional, default: the current process environment)
+    Returns: A list of ReleaseRevision objects
+    """
+    (rc, output) = await aioutils.retry(aioutils.exe_cmd, helm3._history_cmd(release), env=env, interval=10, retry=6)
+    return ReleaseRevision.parse_release_revisions(json.loads(output))
@@ -0,0 +1,31 @@
+import logging
+
+from baseutils import aioutils
+from orchutils import ibmcloud
+
+logger = logging.getLogger(__name__)
+
+
+async def ks_cluster_get(cluster_name, env=None):
+    """
+    Asynchronous variant of orchutils.ibmcloud.ks_cluster_get.
+    Args:
+        cluster_name: The name of the cluster to retrieve or its ID
+        env: The environment for the ibmcloud cli, eg. with IBMCLOUD_HOME set for the account to query (Optional, default: the current process environment)
+    Returns: An IKSCluster object representing the cluster or None if it cannot be found
+    """
+    (rc, output) = await aioutils.exe_cmd(ibmcloud._ks_cluster_get_cmd(cluster_name), env=env, raise_exception=False)
+    return ibmcloud._parse_ks_cluster_get(rc, output)
+
+
+async def ks_worker_get(cluster_name, worker_id, env=None):
+    """
+    Asynchronous variant of orchutils.ibmcloud.ks_worker_get.
+    Args:
+        cluster_name. The name of the cluster to retrieve worker from
+        worker_id. The id of the worker to look up
+        env: The environment for the ibmcloud cli, eg. with IBMCLOUD_HOME set for the account to query (Optional, default: the current process environment)
+    Returns: An IKSWorker object representing the worker or None if it cannot be found
+    """
+    (rc, output) = await aioutils.exe_cmd(ibmcloud._ks_worker_get_cmd(cluster_name, worker_id), env=env, raise_exception=False)
+    return ibmcloud._parse_ks_worker_get(rc, output)
@@ -0,0 +1,35 @@
+import logging
+import os
+
+from baseutils import aioutils
+from orchutils import k8s
+
+logger = logging.getLogger(__name__)
+
+
+async def get(kind, namespace=None, name=None, labels=None, env=None):
+    """
+    Asynchronous variant of orchutils.k8s.get. kubectl is always used, regardless of the backend configured in orchutils.k8s.
+    An exception is thrown for invalid types or the name of a resource that does not exist.
+    Args:
+        kind: The kind of the resources, eg. deployment
+        namespace: The namespace of the resources. Setting to "all" triggers the flag --all-namespaces (Optional, default is as per kubecfg configuration)
+        name: The name of an individual resource (Optional, default: retrieve all)
+        labels: A label selector query to be passed to kubectl. Can either be a string of the form "label1=value1,labe2=value2" or a dictionary with "key: value" pairs (Optional)
+        env: The environment for kubectl, eg. with KUBECONFIG set for the cluster to query (Optional, default: the current process environment)
+    Returns: List of dictionary resources. If name is specified, a single resource as a dictionary
+    """
+    if isinstance(labels, dict):
+        labels = ','.join('{key}={value}'.format(key=key, value=value) for (key, value) in labels.items())
+    cmd = [_get_kubectl_binary(env)] + k8s._get_cmd(kind, namespace, name, labels)[1:]
+    (rc, output) = await aioutils.retry(aioutils.exe_cmd, cmd, env=env, log_level=k8s._get_log_level(kind), interval=10, retry=6)
+    return k8s._parse_get_output(output)
+
+
+def _get_kubectl_binary(env):
+    """
+    Returns the kubectl binary for an environment. As in orchutils.k8s, the kubectl of the orchestration directory in P2PAAS_ORCH_DIR is used if it is set.
+    """
+    if env and env.get('P2PAAS_ORCH_DIR'):
+        return os.path.join(env['P2PAAS_ORCH_DIR'], 'kubectl')
+    return k8s.kubectl_binary
@@ -9,6 +9,7 @@ from datetime import datetime
 
 import baseutils
 from orchutils import k8s
+from orchutils.helpers import rollouthelpers
 from orchutils.helmmodels.releaserevision import ReleaseRevision
 
 logger = logging.getLogger(__name__)
@@ -408,15 +409,18 @@ def get_tiller_version():
     return tiller_deployment['spec']['template']['spec']['containers'][0]['image'].split(':')[-1]
 
 
-def wait_for_release_resources(release):
+def wait_for_release_resources(release, concurrency=1):
     """
     Waits until a release's resources are all initalised.
     For resources with replicas, this means all pods must be started and passing their probes.
     For load_balancer services, this means waiting until the ingresses are initialised.
     If this is an upgrade of a release with replicas, the pre-upgrade state of the pods is required to know when they have been replaced.
     Pods will only be waited upon if their Deployment or Statefule set is configured for RollingUpdate and either their image tag or env vars have been updated.
+    With the api backend of orchutils.k8s, all resources are tracked together from watch events and concurrency has no effect.
     Args:
         release: The name of the release to wait on
+        concurrency: The number of resources to poll in parallel. With a value greater than 1, all resources are tracked at the same time
+                     and the wait fails as soon as a pod error is detected anywhere in the release (Optional, default: 1, one resource at a time)
     """
     manifest = get_manifest(release)
     time.sleep(2)  # Waiting to ensure new replica values has been rolled our from manifest to the deployed resources
@@ -425,34 +429,64 @@ def wait_for_release_resources(release):
     logger.info('Configuring timeout period set to {timeout} seconds for release "{release}"'.format(timeout=timeout_value, release=release))
     with baseutils.timeout(seconds=timeout_value):
         logger.info('Waiting for resources in release "{release}" to enter ready state'.format(release=release))
+        _wait_for_resources(manifest, concurrency)
+
+
+def _wait_for_resources(manifest, concurrency):
+    """
+    Waits for the resources of a manifest to become ready. Used by wait_for_release_resources.
+    With the api backend, all resources are tracked from watch events. Otherwise, the resources are polled concurrently if concurrency is greater than 1,
+    or one at a time.
+    """
+    if k8s.get_api_client():
+        # Track all resources concurrently from watch events rather than polling each resource in turn
+        rollouthelpers.wait_for_resources(manifest)
+    elif concurrency > 1:
+        rollouthelpers.poll_for_resources(manifest, max_workers=concurrency)
+    else:
         for resource in manifest:
             kind = resource['kind'].lower()
             name = resource['metadata']['name']
             namespace = resource['metadata'].get('namespace')
             if kind in ['deployment', 'daemonset', 'statefulset']:
-                logger.info('Tracking rollout status of "{kind}" "{name}"'.format(kind=kind, name=name))
-                rollout_status = ''
-                try:
-                    while ('rolling update complete' not in rollout_status
-                           and 'successfully rolled out' not in rollout_status
-                           and 'roll out complete' not in rollout_status):
-                        time.sleep(5)
-                        rollout_status = k8s.rollout_status(kind, name, namespace=namespace)
-                        _check_for_resource_pod_errors(kind, namespace, name)
-                    logger.info('Pods for "{kind}" "{name}" have been rolled out'.format(kind=kind, name=name))
-                except Exception as e:
-                    if 'Status is available only for RollingUpdate strategy type' in str(e):
-                        logger.info('"{kind}" "{name}" is not configured for rolling updates'.format(kind=kind, name=name))
-                    else:
-                        raise
+                _wait_for_rollout(kind, name, namespace)
             elif kind == 'service' and resource['spec'].get('type') == 'LoadBalancer':
-                resource_ready = False
-                while not resource_ready:
-                    time.sleep(5)
-                    live_resource = k8s.get(kind, namespace=namespace, name=name)
-                    ingress = live_resource['status']['loadBalancer'].get('ingress')
-                    if ingress and 'ip' in ingress[0] and 'clusterIP' in live_resource['spec']:
-                        resource_ready = True
+                _wait_for_load_balancer(kind, name, namespace)
+
+
+def _wait_for_rollout(kind, name, namespace):
+    """
+    Waits for the rollout of a Deployment, DaemonSet or StatefulSet to complete, polling its rollout status. Used by wait_for_release_resources.
+    An exception is raised if a pod of the resource enters an error state.
+    """
+    logger.info('Tracking rollout status of "{kind}" "{name}"'.format(kind=kind, name=name))
+    rollout_status = ''
+    try:
+        while ('rolling update complete' not in rollout_status
+               and 'successfully rolled out' not in rollout_status
+               and 'roll out complete' not in rollout_status):
+            time.sleep(5)
+            rollout_status = k8s.rollout_status(kind, name, namespace=namespace)
+            _check_for_resource_pod_errors(kind, namespace, name)
+        logger.info('Pods for "{kind}" "{name}" have been rolled out'.format(kind=kind, name=name))
+    except Exception as e:
+        if 'Status is available only for RollingUpdate strategy type' in str(e):
+            logger.info('"{kind}" "{name}" is not configured for rolling updates'.format(kind=kind, name=name))
+        else:
+            raise
+
+
+def _wait_for_load_balancer(kind, name, namespace):
+    """
+    Waits for the ingress of a LoadBalancer service to be initialised. Used by wait_for_release_resources.
+    """
+    resource_ready = False
+    while not resource_ready:
+        time.sleep(5)
+        live_resource = k8s.get(kind, namespace=namespace, name=name)
+        ingress = live_resource['status']['loadBalancer'].get('ingress')
+        if ingress and 'ip' in ingress[0] and 'clusterIP' in live_resource['spec']:
+            resource_ready = True
 
 
 def _check_for_resource_pod_errors(kind, namespace, name):
@@ -464,36 +498,7 @@ def _check_for_resource_pod_errors(kind, namespace, name):
         namespace: The namespace of the resource owning the pods
         name: The name of the resource owning the pods
     """
-    live_resource = k8s.get(kind, namespace=namespace, name=name)
-    # Evaluate pods specific to the new converging state only. Do not include pods that may have been in a bad state pre-upgrade
-    if kind == 'deployment':
-        replica_sets = k8s.get('replicaset', namespace=namespace, labels=live_resource['spec']['selector']['matchLabels'])
-        for replica_set in replica_sets:
-            if live_resource['metadata']['annotations']['deployment.kubernetes.io/revision'] == replica_set['metadata']['annotations']['deployment.kubernetes.io/revision']:
-                match_labels = replica_set['spec']['selector']['matchLabels']
-                break
-    elif kind == 'daemonset':
-        match_labels = live_resource['spec']['selector']['matchLabels']
-        match_labels['pod-template-generation'] = live_resource['metadata']['generation']
-    elif kind == 'statefulset':
-        match_labels = live_resource['spec']['selector']['matchLabels']
-        match_labels['controller-revision-hash'] = live_resource['status']['updateRevision']
-    pods = k8s.get('pod', namespace=namespace, labels=match_labels)
-    for pod in pods:
-        pod_name = pod['metadata']['name']
-        for container_status in pod['status'].get('containerStatuses', []):
-            wait_reason = container_status['state'].get('waiting', {}).get('reason')
-            if wait_reason and (wait_reason == 'CrashLoopBackOff' or wait_reason == 'ErrImagePull' or wait_reason == 'InvalidImageName' or wait_reason == 'RunContainerError' or
-                                wait_reason == 'ImagePullBackOff' or wait_reason.endswith(' not found') or wait_reason.startswith('Couldn\'t find ')):
-                # A failed container has been identified. Log useful information before raising exception
-                k8s.describe('pod', namespace=namespace, name=pod_name)
-                k8s.logs(pod_name, namespace=namespace, container=container_status['name'])
-                raise Exception('The pod {pod} has entered the failed waiting state "{state}" during chart upgrade. {message}'.format(
-                    pod=pod_name, state=wait_reason, message=container_status['state']['waiting'].get('message', '')))
-            if container_status.get('restartCount', 0) > 0:
-                k8s.describe('pod', namespace=namespace, name=pod_name)
-                k8s.logs(pod_name, namespace=namespace, container=container_status['name'])
-                raise Exception('The pod {pod} has restarted (failed) during chart upgrade'.format(pod=pod_name))
+    rollouthelpers.check_for_resource_pod_errors(kind, namespace, name)
 
 
 def install_helm(helm_version):
@@ -1,18 +1,37 @@
+import collections
+import copy
+import hashlib
 import json
 import logging
 import os
+import re
 import shutil
 import tempfile
+import threading
 import time
 import yaml
-from datetime import datetime
 
 from baseutils import baseutils
 from orchutils import k8s
+from orchutils.helpers import rollouthelpers
 from orchutils.helmmodels.releaserevision import ReleaseRevision
 
 logger = logging.getLogger(__name__)
 helm_binary = '/usr/local/bin/helm'
+# Shared by all processes of the current user. The directory must be owned by the user and not writable by others. See _ensure_cache_dir
+chart_cache_dir = os.environ.get('P2PAAS_HELM_CACHE_DIR') or os.path.join(os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache'), 'py.helm3')
+repo_index_ttl = 3600  # Seconds for which a downloaded repository index is used before it is refreshed
+helm_env = {}  # The output of "helm env" for each Helm configuration, keyed by the HELM_ environment variables in effect
+manifest_cache_size = 16  # Maximum number of release revisions whose manifests or hooks are held in memory. 0 disables the cache
+manifest_cache = collections.OrderedDict()  # (subcommand, KUBECONFIG, HELM_NAMESPACE, release, revision) -> documents, in least recently used order
+manifest_cache_lock = threading.Lock()
+# Templates for "helm get all" that print the revision of a release on the first line, followed by the output of "helm get manifest" or "helm get hooks"
+release_resource_templates = {
+    'manifest': '{{.Release.Version}}\n{{.Release.Manifest}}\n',
+    'hooks': '{{.Release.Version}}\n{{range .Release.Hooks}}---\n# Source: {{.Path}}\n{{.Manifest}}\n{{end}}'
+}
+yaml_loader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)  # The libyaml based loader is used when PyYAML has been built with it
+kind_pattern = re.compile(r'^kind:[ \t]*[\'"]?([\w.-]+)', re.MULTILINE)
 
 def set_helm_home(helm_home):
     """
@@ -29,29 +48,84 @@ def set_helm_home(helm_home):
 def add_repo(name, username, password, repo_url='https://na.artifactory.swg-devops.com/artifactory/wce-p2paas-helm-virtual'):
     """
     Adds a new helm repository to the helm configuration. It is safe to re-add an already existing repository.
+    If the repository is already configured with the same url and credentials and its index was downloaded less than repo_index_ttl seconds ago, nothing is done.
     Args:
         name: The name of the repository to add. This is the local name which will be used to reference the repository
         username: The username for authentication to the repository
         password: The password for authentication to the repository
         repo_url: The url to the repository. This is the full remote url to the Helm repository (Optional, default is corporate artifactory wce-p2paas-helm-virtual repository)
     """
-    logger.info('Configuring Helm repository {repo}'.format(repo=name))
-    baseutils.exe_cmd('{helm} repo add {repo} {repo_url} --username {username} --password {password}'.format(
-        helm=helm_binary,
-        repo=baseutils.shell_escape(name),
-        repo_url=baseutils.shell_escape(repo_url),
-        username=baseutils.shell_escape(username),
-        password=baseutils.shell_escape(password)), obfuscate=baseutils.shell_escape(password))
-    baseutils.exe_cmd('{helm} repo update {repo}'.format(helm=helm_binary, repo=baseutils.shell_escape(name)))
+    with baseutils.local_lock(lock_name=_get_cache_lock_name('repos')):
+        repo = _get_repos().get(name, {})
+        if (repo.get('url', '').rstrip('/') == repo_url.rstrip('/') and repo.get('username') == username and repo.get('password') == password
+                and _is_repo_index_fresh(name)):
+            logger.info('Helm repository {repo} is already configured'.format(repo=name))
+            return
+        logger.info('Configuring Helm repository {repo}'.format(repo=name))
+        # Adding a repository also downloads its index
+        baseutils.exe_cmd([helm_binary, 'repo', 'add', name, repo_url, '--username', username, '--password', password, '--force-update'],
+                          obfuscate=baseutils.shell_escape(password))
 
 
-def update_repos():
+def update_repos(force=False):
     """
     Updates locally cached metadata for all available chart repositories.
+    The update is skipped if the indexes of all repositories were downloaded less than repo_index_ttl seconds ago, unless force is set.
+    Args:
+        force: Whether to update the repositories regardless of when they were last updated (Optional, default: False)
+    """
+    with baseutils.local_lock(lock_name=_get_cache_lock_name('repos')):
+        if not force and all(_is_repo_index_fresh(name) for name in _get_repos()):
+            logger.info('Helm repository metadata is up to date')
+            return
+        logger.info('Updating Helm repository metadata')
+        baseutils.exe_cmd([helm_binary, 'repo', 'update'])
+        logger.info('Helm repository metadata updated')
+
+
+def _get_helm_env():
+    """
+    Retrieves the locations Helm uses for its configuration, as reported by "helm env". The result is cached for each Helm configuration.
+    Returns: A dictionary of the Helm environment variables
+    """
+    key = tuple(sorted((name, value) for (name, value) in os.environ.items() if name.startswith('HELM_') or name in ['HOME', 'XDG_CACHE_HOME', 'XDG_CONFIG_HOME']))
+    if key not in helm_env:
+        (rc, output) = baseutils.exe_cmd([helm_binary, 'env'], log_level=logging.NOTSET)
+        env = {}
+        for line in output.splitlines():
+            (name, separator, value) = line.partition('=')
+            if separator:
+                env[name.strip()] = value.strip().strip('"')
+        helm_env[key] = env
+    return helm_env[key]
+
+
+def _get_repos():
     """
-    logger.info('Updating Helm repository metadata')
-    baseutils.exe_cmd('{helm} repo update'.format(helm=helm_binary))
-    logger.info('Helm repository metadata updated')
+    Reads the repositories configured in Helm.
+    Returns: A dictionary of repository configurations, keyed by repository name
+    """
+    repo_config = _get_helm_env().get('HELM_REPOSITORY_CONFIG')
+    if not repo_config or not os.path.exists(repo_config):
+        return {}
+    with open(repo_config) as fh:
+        config = yaml.safe_load(fh) or {}
+    return dict((repo['name'], repo) for repo in config.get('repositories') or [])
+
+
+def _is_repo_index_fresh(name):
+    """
+    Returns whether the cached index of a repository was downloaded less than repo_index_ttl seconds ago.
+    """
+    index_file = os.path.join(_get_helm_env().get('HELM_REPOSITORY_CACHE', ''), '{name}-index.yaml'.format(name=name))
+    return os.path.exists(index_file) and time.time() - os.path.getmtime(index_file) < repo_index_ttl
+
+
+def _get_cache_lock_name(name):
+    """
+    Returns the name of the local lock protecting an item of the chart cache.
+    """
+    return 'helm3_cache_{hash}'.format(hash=hashlib.sha1('{dir}:{name}'.format(dir=os.path.abspath(chart_cache_dir), name=name).encode('utf-8')).hexdigest())
 
 
 def delete(release_name, purge=True):
@@ -61,10 +135,7 @@ def delete(release_name, purge=True):
         release_name: The release to delete
         purge: Whether to purge all Helm history for the release (Optional, default: True)
     """
-    baseutils.exe_cmd('{helm} delete {release_name} {purge}'.format(
-        helm=helm_binary,
-        release_name=baseutils.shell_escape(release_name),
-        purge='--purge' if purge else ''))
+    baseutils.exe_cmd([helm_binary, 'delete', release_name] + (['--purge'] if purge else []))
 
 def uninstall(release_name, namespace):
     """
@@ -73,70 +144,149 @@ def uninstall(release_name, namespace):
         release_name: The release to delete
         purge: Whether to purge all Helm history for the release (Optional, default: True)
     """
-    baseutils.exe_cmd('{helm} uninstall {release_name} {namespace}'.format(
-        helm=helm_binary,
-        release_name=baseutils.shell_escape(release_name),
-        namespace=baseutils.shell_escape(namespace)))
+    baseutils.exe_cmd([helm_binary, 'uninstall', release_name, namespace])
 
 
 def install_chart(chart, version, valuesFile, release, namespace, validate_manifest=False, dry_run=False, debug=False):
     """
     Install a new chart with a specified release name.
+    The chart archive is taken from the local chart cache, so it is only downloaded if this version of the chart has not been used before. See pull_chart.
+    Every render is performed locally from the archive. The manifest is only rendered ahead of the install, with helm template, if it is to be validated.
     Args:
         chart: The name of the chart to install
         version: The version of the chart to install
         valuesFile: A file containing chart values
         release: The name to assign to the deployed release
         namespace: The namespace to deploy the release into
-        validate_manifest: Validate the manifest meets a predermined set of criteria. See #validate_manifest_requirements for details (Optional, default: True)
+        validate_manifest: Validate the manifest meets a predermined set of criteria. See #validate_manifest_requirements for details (Optional, default: False)
         dry_run: Perform the install in dry-run mode. No changes will be made in the Kubernetes cluster (Optional, default: False)
         debug: Perform the install in debug mode, increasing logging output (Optional, default: False)
     """
     logger.info('Installing chart {chart} (release: {release}) valuesFile: {valuesFile} with version {version} {dry_run}'.format(chart=chart, release=release, valuesFile=valuesFile, version=version, dry_run=dry_run))
-    validate_manifest = False
-    try:
-        (rc, output) = baseutils.exe_cmd('{helm} install {release} {chart} --values {valuesFile} --version {version} --namespace {namespace} --dry-run'.format(
-            helm=helm_binary,
-            release=baseutils.shell_escape(release),
-            chart=baseutils.shell_escape(chart),
-            valuesFile=baseutils.shell_escape(valuesFile),
-            version=baseutils.shell_escape(version),
-            namespace=baseutils.shell_escape(namespace),
-            working_dir=os.environ.get('HELM_HOME'), log_level=logging.NOTSET, raise_exception=False))  # Logging is disabled as output can contain secrets
-
-        if rc:
-            helm_error = output.strip().splitlines()[-1] if output else ''
-            if helm_error:
-                logger.error(helm_error)
-            raise Exception('Failed to parse Helm template. {helm_error}'.format(helm_error=helm_error))
-        elif validate_manifest:
-            # Remove non-yaml output, everything above first "MANIFEST:"
-            manifest = output.partition('MANIFEST:')[2]
-            # Remove non-yaml output after the manifest
-            manifest = manifest.partition('[{year}'.format(year=datetime.now().year))[0]
-            errors = validate_manifest_requirements(manifest)
-            if len(errors) > 0:
-                for error in errors:
-                    logger.error(error)
-                raise Exception('Chart pre-approval validation failed. Reason: {failure_reasons}'.format(failure_reasons='. '.join(errors)))
-        deploy_cmd = '{helm} install {release} {chart} --values {valuesFile} --version {version} --namespace {namespace}'.format(
-            helm=helm_binary,
-            release=baseutils.shell_escape(release),
-            chart=baseutils.shell_escape(chart),
-            valuesFile=baseutils.shell_escape(valuesFile),
-            version=baseutils.shell_escape(version),
-            namespace=baseutils.shell_escape(namespace),
-            dry_run='--dry-run' if dry_run else '',
-            debug='--debug' if debug else '')
-        _attempt_chart_deploy(deploy_cmd)
-    finally:
-        logger.info("completed")
+    chart_archive = pull_chart(chart, version)
+    if validate_manifest:
+        errors = validate_manifest_requirements(template_chart(chart_archive, version, valuesFile, release, namespace))
+        if len(errors) > 0:
+            for error in errors:
+                logger.error(error)
+            raise Exception('Chart pre-approval validation failed. Reason: {failure_reasons}'.format(failure_reasons='. '.join(errors)))
+    deploy_cmd = [helm_binary, 'install', release, chart_archive, '--values', valuesFile, '--namespace', namespace] + (
+        ['--dry-run'] if dry_run else []) + (['--debug'] if debug else [])
+    _attempt_chart_deploy(deploy_cmd)
     logger.info('Install request for chart {chart} (release: {release}) valuesFile: {valuesFile} with version {version} passed to Kubernetes'.format(chart=chart, release=release, valuesFile=valuesFile, version=version))
 
 
-def upgrade_chart(chart, version, valuesFile, release, namespace, dry_run=False, debug=False):
+def pull_chart(chart, version):
+    """
+    Retrieves the archive of a chart from the local chart cache, downloading it from its repository if it is not cached.
+    Chart versions are immutable, so once a version of a chart has been downloaded it is reused by every process of the user without contacting the repository.
+    Archives are stored in chart_cache_dir by the sha256 digest of their content, so identical archives are only stored once.
+    Args:
+        chart: The chart to retrieve, eg. "p2paas/p2paas-console-ui". If this is the path of a local chart directory or archive, it is returned as is
+        version: The version of the chart to retrieve
+    Returns: The path of the chart archive
+    """
+    if os.path.exists(chart):
+        return chart
+    (repo_name, separator, chart_name) = chart.partition('/')
+    repo_url = _get_repos().get(repo_name, {}).get('url', repo_name) if separator else ''
+    key = hashlib.sha1(json.dumps([repo_url.rstrip('/'), chart_name or chart, version]).encode('utf-8')).hexdigest()
+    ref_file = os.path.join(_ensure_cache_dir('refs'), key)
+    with baseutils.local_lock(lock_name=_get_cache_lock_name(key)):
+        archive = _get_cached_chart_archive(ref_file)
+        if archive:
+            logger.info('Using cached archive of chart {chart} version {version}'.format(chart=chart, version=version))
+            return archive
+        download_dir = tempfile.mkdtemp(dir=_ensure_cache_dir('tmp'))
+        try:
+            baseutils.exe_cmd([helm_binary, 'pull', chart, '--version', version, '--destination', download_dir], working_dir=os.environ.get('HELM_HOME'))
+            downloads = [file_name for file_name in os.listdir(download_dir) if file_name.endswith('.tgz')]
+            if len(downloads) != 1:
+                raise Exception('Failed to locate the downloaded archive of chart {chart} version {version}'.format(chart=chart, version=version))
+            digest = _get_file_digest(os.path.join(download_dir, downloads[0]))
+            archive = os.path.join(_ensure_cache_dir('archives'), '{digest}.tgz'.format(digest=digest))
+            if not os.path.exists(archive):
+                os.rename(os.path.join(download_dir, downloads[0]), archive)
+            tmp_ref_file = '{ref_file}.{pid}.tmp'.format(ref_file=ref_file, pid=os.getpid())
+            with open(tmp_ref_file, 'w') as fh:
+                fh.write(digest)
+            os.rename(tmp_ref_file, ref_file)
+        finally:
+            shutil.rmtree(download_dir)
+    return archive
+
+
+def _get_cached_chart_archive(ref_file):
+    """
+    Returns the path of the archive a cache reference points to, or None if it is not cached or the archive does not match its digest.
+    """
+    if not os.path.exists(ref_file):
+        return None
+    with open(ref_file) as fh:
+        digest = fh.read().strip()
+    archive = os.path.join(chart_cache_dir, 'archives', '{digest}.tgz'.format(digest=digest))
+    if not os.path.exists(archive) or _get_file_digest(archive) != digest:
+        return None
+    return archive
+
+
+def _get_file_digest(path):
+    """
+    Returns the sha256 digest of a file's content.
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as fh:
+        for block in iter(lambda: fh.read(65536), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _ensure_cache_dir(name):
+    """
+    Creates a directory of the chart cache if it does not exist. Directories are created accessible only by the current user.
+    An exception is raised if the cache directory is not owned by the current user or is writable by other users, as its charts could then be replaced.
+    Returns: The path of the directory
+    """
+    for path in (chart_cache_dir, os.path.join(chart_cache_dir, name)):
+        try:
+            os.makedirs(path, 0o700)
+        except OSError:
+            if not os.path.isdir(path):
+                raise
+        stat = os.stat(path)
+        if (hasattr(os, 'getuid') and stat.st_uid != os.getuid()) or stat.st_mode & 0o022:
+            raise Exception('Refusing to use chart cache directory {path} as it is not owned by the current user or is writable by other users'.format(path=path))
+    return path
+
+
+def template_chart(chart, version, valuesFile, release, namespace):
+    """
+    Renders the manifest of a chart locally, without contacting the Kubernetes cluster.
+    Args:
+        chart: The chart to render. Either the name of a chart in a repository or the path of a local chart directory or archive, eg. as returned by pull_chart
+        version: The version of the chart to render
+        valuesFile: A file containing chart values
+        release: The name of the release to render the chart for
+        namespace: The namespace of the release
+    Returns: The rendered manifest as a string
+    """
+    cmd = [helm_binary, 'template', release, chart, '--values', valuesFile, '--namespace', namespace] + ([] if os.path.exists(chart) else ['--version', version])
+    # Logging is disabled as output can contain secrets
+    (rc, output) = baseutils.exe_cmd(cmd, working_dir=os.environ.get('HELM_HOME'), log_level=logging.NOTSET, raise_exception=False)
+    if rc:
+        helm_error = output.strip().splitlines()[-1] if output else ''
+        if helm_error:
+            logger.error(helm_error)
+        raise Exception('Failed to parse Helm template. {helm_error}'.format(helm_error=helm_error))
+    return output
+
+
+def upgrade_chart(chart, version, valuesFile, release, namespace, dry_run=False, debug=False, skip_unchanged=True):
     """
     Upgrade a specific release of a chart. This could be due to a new chart version being available or updated values for the chart.
+    The chart archive is taken from the local chart cache. See pull_chart.
+    Unless skip_unchanged is False, the chart is first rendered locally and compared with the manifest and hooks of the latest revision of the release.
+    The upgrade is skipped if the latest revision is deployed from the same chart version and no resource would change.
     Args:
         chart: The name of the chart to upgrade
         version: The version of the chart to upgrade to
@@ -145,23 +295,75 @@ def upgrade_chart(chart, version, valuesFile, release, namespace, dry_run=False,
         namespace: The namespace to deploy the release into
         dry_run: Perform the upgrade in dry-run mode. No changes will be made in the Kubernetes cluster (Optional, default: False)
         debug: Perform the upgrade in debug mode, increasing logging output (Optional, default: False)
+        skip_unchanged: Skip the upgrade if the rendered chart matches the deployed release (Optional, default: True)
+    Returns: A list of the resources of the rendered manifest that are new or changed, which can be passed to wait_for_release_resources,
+             or None if the manifests were not compared
     """
     logger.info('Upgrading chart {chart} (release: {release}) values {valuesFile} to version {version}'.format(chart=chart, release=release, valuesFile=valuesFile, version=version))
-    try:
-        deploy_cmd = '{helm} upgrade --values {values_file} {release} {chart} --values {valuesFile} --version {version} --namespace {namespace}'.format(
-            helm=helm_binary,
-            values_file=baseutils.shell_escape(values_file),
-            release=baseutils.shell_escape(release),
-            chart=baseutils.shell_escape(chart),
-            valuesFile=baseutils.shell_escape(valuesFile),
-            version=baseutils.shell_escape(version),
-            namespace=baseutils.shell_escape(namespace),
-            dry_run='--dry-run' if dry_run else '',
-            debug='--debug' if debug else '')
-        _attempt_chart_deploy(deploy_cmd)
-    finally:
-        os.remove(values_file)
+    chart_archive = pull_chart(chart, version)
+    changed_resources = None
+    if skip_unchanged:
+        changed_resources = _get_changed_resources(chart, chart_archive, version, valuesFile, release, namespace)
+        if changed_resources == []:
+            logger.info('Skipping upgrade of release {release} as the chart {chart} version {version} with values {valuesFile} matches the deployed release'.format(
+                release=release, chart=chart, version=version, valuesFile=valuesFile))
+            return changed_resources
+    deploy_cmd = [helm_binary, 'upgrade', release, chart_archive, '--values', valuesFile, '--namespace', namespace] + (
+        ['--dry-run'] if dry_run else []) + (['--debug'] if debug else [])
+    _attempt_chart_deploy(deploy_cmd)
     logger.info('Upgrade request for chart {chart} (release: {release}) values {valuesFile} to version {version} passed to Kubernetes'.format(chart=chart, release=release, valuesFile=valuesFile, version=version))
+    return changed_resources
+
+
+def _get_changed_resources(chart, chart_archive, version, valuesFile, release, namespace):
+    """
+    Compares a chart rendered with helm template against the latest revision of a release. Used by upgrade_chart.
+    Resources are matched by kind, namespace and name. Hooks, including tests, are compared with the hooks of the revision so that changed hooks are run.
+    Returns: A list of the rendered resources that are new or changed, an empty list if nothing changed, or None if the release must be upgraded regardless,
+             eg. because its latest revision is not deployed or is of a different chart version
+    """
+    latest_revision = _get_latest_release_revision(release)
+    chart_name = os.path.basename(chart.rstrip('/'))
+    if latest_revision.status.lower() != 'deployed' or latest_revision.chart != '{chart}-{version}'.format(chart=chart_name, version=version):
+        logger.info('Release {release} revision {revision} ({chart}) is {status}. Its manifest will not be compared'.format(
+            release=release, revision=latest_revision.revision, chart=latest_revision.chart, status=latest_revision.status))
+        return None
+    rendered_resources = []
+    rendered_hooks = []
+    for resource in _parse_manifest(template_chart(chart_archive, version, valuesFile, release, namespace)):
+        if 'helm.sh/hook' in ((resource.get('metadata') or {}).get('annotations') or {}):
+            rendered_hooks.append(resource)
+        else:
+            rendered_resources.append(resource)
+    deployed_hooks = _normalize_resources(get_hooks(release, revision=latest_revision.revision), namespace)
+    if _normalize_resources(rendered_hooks, namespace) != deployed_hooks:
+        logger.info('Hooks of release {release} have changed'.format(release=release))
+        return None
+    deployed_resources = _normalize_resources(get_manifest(release, revision=latest_revision.revision), namespace)
+    changed_resources = []
+    for (key, resource) in _normalize_resources(rendered_resources, namespace).items():
+        if deployed_resources.pop(key, None) != resource:
+            logger.info('{kind} {name} in namespace {namespace} of release {release} has changed'.format(kind=key[0], namespace=key[1], name=key[2], release=release))
+            changed_resources.append(resource)
+    if deployed_resources:
+        logger.info('Resources of release {release} have been removed from the chart: {resources}'.format(
+            release=release, resources=', '.join('{kind} {name}'.format(kind=key[0], name=key[2]) for key in sorted(deployed_resources))))
+        return None
+    return changed_resources
+
+
+def _normalize_resources(resources, namespace):
+    """
+    Normalizes resources for comparison, setting the namespace of each resource to the namespace of the release when it is not set in the chart.
+    Returns: A dictionary of the resources keyed by a tuple of (kind, namespace, name)
+    """
+    normalized_resources = {}
+    for resource in resources:
+        resource = copy.deepcopy(resource)
+        metadata = resource['metadata'] = resource.get('metadata') or {}
+        metadata['namespace'] = metadata.get('namespace') or namespace
+        normalized_resources[(resource['kind'], metadata['namespace'], metadata.get('name'))] = resource
+    return normalized_resources
 
 
 def _attempt_chart_deploy(deploy_cmd, attempt=0):
@@ -169,7 +371,7 @@ def _attempt_chart_deploy(deploy_cmd, attempt=0):
     Attempts to perofrm a chart deployment. The actual deploy command must be passed as an argument.
     Retries will be attempted if the failure reason can be calculated as being "safe to retry".
     Args:
-        deploy_cmd: The command to use to deploy (install/upgrade) the chart
+        deploy_cmd: The command to use to deploy (install/upgrade) the chart as a list of arguments
     """
     try:
         baseutils.exe_cmd(deploy_cmd, working_dir=os.environ.get('HELM_HOME'))
@@ -189,7 +391,7 @@ def list_releases(filter=None):
         filter: A regex filter that will be passed through to the "helm list <filter>" command
     Returns: The output from the helm list command
     """
-    cmd = '{helm} list {filter}'.format(helm=helm_binary, filter=baseutils.shell_escape(filter or ''))
+    cmd = [helm_binary, 'list'] + ([filter] if filter else [])
     (rc, output) = baseutils.retry(baseutils.exe_cmd, cmd, interval=10, retry=6)
     return output
 
@@ -201,7 +403,7 @@ def search_charts(search_term):
         search_term: A search term that will be passed through to the "helm search <search_term>" command
     Returns: The output from the helm search command
     """
-    (rc, output) = baseutils.exe_cmd('{helm} search {search_term}'.format(helm=helm_binary, search_term=baseutils.shell_escape(search_term)))
+    (rc, output) = baseutils.exe_cmd([helm_binary, 'search', search_term])
     return output
 
 
@@ -317,45 +519,179 @@ def get_max_replicas_count_in_manifest(manifest):
     return max(replica_counts)
 
 
-def get_manifest(release, resource_type=None):
+def get_manifest(release, resource_type=None, revision=None):
     """
     Retrieves the Helm manifest for a deployed release as an array of resources.
+    The manifest is parsed one resource at a time and resources of other types are skipped without being parsed. See iter_manifest.
     Args:
         release: The name of the release to retrieve manifest for
         resource_type: Limits the returned resources to the specified resource type (Optional)
+        revision: The revision of the release to retrieve the manifest of (Optional, default: the latest revision)
     Returns: A list of manifest resources
     """
-    full_manifest = None
-    manifest = []
-    cmd = '{helm} get manifest {release}'.format(helm=helm_binary, release=baseutils.shell_escape(release))
-    (rc, output) = baseutils.retry(baseutils.exe_cmd, cmd, log_level=logging.NOTSET, interval=10, retry=6)  # Output can contain secrets so don't log
-    full_manifest = yaml.safe_load_all(output)
-    for resource in full_manifest:
-        if resource and 'kind' in resource:  # This implies the resource is a valid k8s manifest
-            if not resource_type or resource_type == resource['kind']:
-                manifest.append(resource)
-    return manifest
+    return baseutils.retry(_get_release_resources, 'manifest', release, [resource_type] if resource_type else None, revision, interval=10, retry=6)
+
+
+def iter_manifest(release, resource_type=None, revision=None):
+    """
+    Retrieves the Helm manifest for a deployed release, yielding each resource as soon as it has been read and parsed from the output of helm.
+    Parsed manifests are cached for each revision of a release, so the manifest of a revision is only retrieved and parsed once.
+    Unlike get_manifest, failures are not retried.
+    Args:
+        release: The name of the release to retrieve manifest for
+        resource_type: Limits the returned resources to the specified resource type (Optional)
+        revision: The revision of the release to retrieve the manifest of (Optional, default: the latest revision)
+    Returns: A generator of manifest resources
+    """
+    return _iter_release_resources('manifest', release, [resource_type] if resource_type else None, revision)
+
+
+def _get_manifest_cmd(release, revision=None):
+    """
+    Builds the helm command used by get_manifest.
+    """
+    return [helm_binary, 'get', 'manifest', release] + (['--revision', str(int(revision))] if revision else [])
+
+
+def _parse_manifest(output, resource_type=None):
+    """
+    Parses the output of the command built by _get_manifest_cmd into a list of resources, optionally limited to a single resource type.
+    """
+    return list(_iter_documents(_split_documents(output.splitlines(True)), [resource_type] if resource_type else None))
 
 
-def get_hooks(release, resource_types=None, hook_types=None):
+def get_hooks(release, resource_types=None, hook_types=None, revision=None):
     """
     Retrieves the Helm hooks for a deployed release as a list of resources.
+    As with get_manifest, hooks are parsed one at a time and are cached for each revision of a release.
     Args:
         release: The name of the release to retrieve the hooks for
         resource_types: A list of resource types resource types to limit the returned hooks to (Optional)
         hook_types: A list of hook types to limit the returned hooks to (Optional)
+        revision: The revision of the release to retrieve the hooks of (Optional, default: the latest revision)
     Returns: A list of Kubernetes resources
     """
-    cmd = '{helm} get hooks {release}'.format(helm=helm_binary, release=baseutils.shell_escape(release))
-    (rc, output) = baseutils.retry(baseutils.exe_cmd, cmd, log_level=logging.NOTSET, interval=10, retry=6)  # Output can contain secrets so don't log
-    hooks = list(yaml.safe_load_all(output))
-    if resource_types:
-        hooks = [hook for hook in hooks if hook['kind'] in resource_types]
+    hooks = baseutils.retry(_get_release_resources, 'hooks', release, resource_types, revision, interval=10, retry=6)
     if hook_types:
         hooks = [hook for hook in hooks if hook['metadata']['annotations']['helm.sh/hook'] in hook_types]
     return hooks
 
 
+def _get_release_resources(subcommand, release, kinds, revision):
+    """
+    Retrieves the resources output by "helm get <subcommand>" for a release as a list. Used by get_manifest and get_hooks.
+    """
+    return list(_iter_release_resources(subcommand, release, kinds, revision))
+
+
+def _iter_release_resources(subcommand, release, kinds, revision):
+    """
+    Retrieves the resources output by "helm get <subcommand>" for a revision of a release, optionally limited to a list of resource types.
+    A cached copy of the documents of the revision is used if there is one. Otherwise, the output of helm is streamed and each resource is yielded once its
+    document is complete, and the documents are cached once the output has been read in full.
+    Without a revision the latest revision is retrieved and the cache is keyed by the revision helm prints ahead of the documents, so callers that already know
+    the revision should pass it to be served from the cache without running helm.
+    """
+    key = _get_release_resources_key(subcommand, release, revision) if revision else None
+    with manifest_cache_lock:
+        documents = manifest_cache.pop(key, None) if key else None
+        if documents is not None:
+            manifest_cache[key] = documents  # Re-inserted as the most recently used entry
+    if documents is not None:
+        for resource in _iter_documents(documents, kinds):
+            yield copy.deepcopy(resource)
+        return
+    # Output can contain secrets so don't log
+    if revision:
+        lines = baseutils.exe_cmd_stream([helm_binary, 'get', subcommand, release, '--revision', str(int(revision))], log_level=logging.NOTSET)
+    else:
+        lines = baseutils.exe_cmd_stream([helm_binary, 'get', 'all', release, '--template', release_resource_templates[subcommand]], log_level=logging.NOTSET)
+        revision = next(lines, '').strip()
+        key = _get_release_resources_key(subcommand, release, revision) if revision.isdigit() else None  # Otherwise helm failed and the stream raises the error
+    documents = []
+    for document in _split_documents(lines):
+        documents.append(document)
+        for resource in _iter_documents([document], kinds):
+            yield copy.deepcopy(resource)
+    if key and manifest_cache_size > 0:
+        with manifest_cache_lock:
+            manifest_cache[key] = documents
+            while len(manifest_cache) > manifest_cache_size:
+                manifest_cache.popitem(last=False)
+
+
+def _get_release_resources_key(subcommand, release, revision):
+    """
+    Returns the manifest_cache key of the output of "helm get <subcommand>" for a revision of a release in the current Helm configuration.
+    """
+    return (subcommand, os.environ.get('KUBECONFIG'), os.environ.get('HELM_NAMESPACE'), release, int(revision))
+
+
+def _split_documents(lines):
+    """
+    Splits the lines of a multi-document YAML stream into its documents as they are read.
+    Returns: A generator of documents, each a list of [kind, text, resource]. The kind is read from the text without parsing the document, or is None if it
+             cannot be determined that way. resource is None until the document is parsed by _iter_documents
+    """
+    document_lines = []
+    for line in lines:
+        if line.startswith(('---', '...')) and line[3:4] in ('', ' ', '\t', '\r', '\n'):
+            if any(document_line.strip() and not document_line.lstrip().startswith('#') for document_line in document_lines):
+                yield _new_document(''.join(document_lines))
+            document_lines = [line[3:].lstrip()] if line.startswith('---') and line[3:].strip() else []
+        else:
+            document_lines.append(line)
+    if any(document_line.strip() and not document_line.lstrip().startswith('#') for document_line in document_lines):
+        yield _new_document(''.join(document_lines))
+
+
+def _new_document(text):
+    """
+    Creates a document entry for _split_documents.
+    """
+    match = kind_pattern.search(text)
+    return [match.group(1) if match else None, text, None]
+
+
+def _iter_documents(documents, kinds=None):
+    """
+    Parses documents split by _split_documents, yielding the Kubernetes resources among them, optionally limited to a list of resource types.
+    Documents whose kind is known not to match are not parsed. Each document is parsed at most once, after which the parsed resource is kept in place of its text.
+    The resources yielded are those held by the documents and must be copied before being returned to a caller.
+    """
+    for document in documents:
+        if kinds and document[0] is not None and document[0] not in kinds:
+            continue
+        text = document[1]
+        if text is not None:
+            resource = yaml.load(text, Loader=yaml_loader)
+            if not isinstance(resource, dict) or 'kind' not in resource:  # Only valid k8s resources are kept
+                resource = None
+            document[0] = resource['kind'] if resource else None
+            document[2] = resource
+            document[1] = None  # Cleared last, as other threads may be reading the document
+        if document[2] is not None and (not kinds or document[2]['kind'] in kinds):
+            yield document[2]
+
+
+def get_latest_revision(release):
+    """
+    Retrieves the number of the latest revision of a release.
+    Args:
+        release: The name of the release to look up
+    Returns: The revision number
+    """
+    return _get_latest_release_revision(release).revision
+
+
+def _get_latest_release_revision(release):
+    """
+    Retrieves the latest revision of a release as a ReleaseRevision object.
+    """
+    (rc, output) = baseutils.retry(baseutils.exe_cmd, _history_cmd(release) + ['--max', '1'], interval=10, retry=6)
+    return ReleaseRevision.parse_release_revisions(json.loads(output))[-1]
+
+
 def history(release):
     """
     Retrieves the revision history for a specified release.
@@ -363,11 +699,17 @@ def history(release):
         release: The name of the release to retrieve the revision history for
     Returns: A list of ReleaseRevision objects
     """
-    cmd = '{helm} history {release} -o json'.format(helm=helm_binary, release=baseutils.shell_escape(release))
-    (rc, output) = baseutils.retry(baseutils.exe_cmd, cmd, interval=10, retry=6)
+    (rc, output) = baseutils.retry(baseutils.exe_cmd, _history_cmd(release), interval=10, retry=6)
     return ReleaseRevision.parse_release_revisions(json.loads(output))
 
 
+def _history_cmd(release):
+    """
+    Builds the helm command used by history.
+    """
+    return [helm_binary, 'history', release, '-o', 'json']
+
+
 def rollback(release, revision):
     """
     Rolls a release back to a specified revision.
@@ -375,10 +717,7 @@ def rollback(release, revision):
         release: The name of the release to rollback
         revision: The revision number to roll back to
     """
-    baseutils.exe_cmd('{helm} rollback {release} {revision}'.format(
-        helm=helm_binary,
-        release=baseutils.shell_escape(release),
-        revision=int(revision)))
+    baseutils.exe_cmd([helm_binary, 'rollback', release, str(int(revision))])
 
 
 def test(release, seconds=1260):
@@ -389,10 +728,7 @@ def test(release, seconds=1260):
         release: The name of the release to test
         seconds: The timeout to apply to the tests in seconds (Optional, default: 1260)
     """
-    (rc, output) = baseutils.exe_cmd('{helm} test {release} --timeout {timeout}'.format(
-        helm=helm_binary,
-        release=baseutils.shell_escape(release),
-        timeout=int(seconds)))
+    (rc, output) = baseutils.exe_cmd([helm_binary, 'test', release, '--timeout', str(int(seconds))])
 
 
 def get_tiller_version():
@@ -405,51 +741,99 @@ def get_tiller_version():
     return tiller_deployment['spec']['template']['spec']['containers'][0]['image'].split(':')[-1]
 
 
-def wait_for_release_resources(release):
+def wait_for_release_resources(release, concurrency=1, resources=None):
     """
     Waits until a release's resources are all initalised.
     For resources with replicas, this means all pods must be started and passing their probes.
     For load_balancer services, this means waiting until the ingresses are initialised.
     If this is an upgrade of a release with replicas, the pre-upgrade state of the pods is required to know when they have been replaced.
     Pods will only be waited upon if their Deployment or Statefule set is configured for RollingUpdate and either their image tag or env vars have been updated.
+    With the api backend of orchutils.k8s, all resources are tracked together from watch events and concurrency has no effect.
     Args:
         release: The name of the release to wait on
+        concurrency: The number of resources to poll in parallel. With a value greater than 1, all resources are tracked at the same time
+                     and the wait fails as soon as a pod error is detected anywhere in the release (Optional, default: 1, one resource at a time)
+        resources: Limits the wait to these resources of the release, eg. the changed resources returned by upgrade_chart (Optional, default: all resources of the release)
     """
-    manifest = get_manifest(release)
+    manifest = _get_resources_to_wait_for(release, resources)
+    if not manifest:
+        return
     time.sleep(2)  # Waiting to ensure new replica values has been rolled our from manifest to the deployed resources
     max_replicas = get_max_replicas_count_in_manifest(manifest)
     timeout_value = max(900, (max_replicas * 300) + 60)  # Minimum timeout value is 900. Otherwise, define it base on max number of replicas of any resource
     logger.info('Configuring timeout period set to {timeout} seconds for release "{release}"'.format(timeout=timeout_value, release=release))
     with baseutils.timeout(seconds=timeout_value):
         logger.info('Waiting for resources in release "{release}" to enter ready state'.format(release=release))
+        _wait_for_resources(manifest, concurrency)
+
+
+def _get_resources_to_wait_for(release, resources):
+    """
+    Returns the resources wait_for_release_resources waits for: the passed resources, or the manifest of the release if no resources are passed.
+    An empty list is returned if the passed resources are empty, eg. because upgrade_chart found no changed resources.
+    """
+    if resources is None:
+        return get_manifest(release)
+    if not resources:
+        logger.info('No resources of release "{release}" have changed'.format(release=release))
+    return resources
+
+
+def _wait_for_resources(manifest, concurrency):
+    """
+    Waits for the resources of a manifest to become ready. Used by wait_for_release_resources.
+    With the api backend, all resources are tracked from watch events. Otherwise, the resources are polled concurrently if concurrency is greater than 1,
+    or one at a time.
+    """
+    if k8s.get_api_client():
+        # Track all resources concurrently from watch events rather than polling each resource in turn
+        rollouthelpers.wait_for_resources(manifest)
+    elif concurrency > 1:
+        rollouthelpers.poll_for_resources(manifest, max_workers=concurrency)
+    else:
         for resource in manifest:
             kind = resource['kind'].lower()
             name = resource['metadata']['name']
             namespace = resource['metadata'].get('namespace')
             if kind in ['deployment', 'daemonset', 'statefulset']:
-                logger.info('Tracking rollout status of "{kind}" "{name}"'.format(kind=kind, name=name))
-                rollout_status = ''
-                try:
-                    while ('rolling update complete' not in rollout_status
-                           and 'successfully rolled out' not in rollout_status
-                           and 'roll out complete' not in rollout_status):
-                        time.sleep(5)
-                        rollout_status = k8s.rollout_status(kind, name, namespace=namespace)
-                        _check_for_resource_pod_errors(kind, namespace, name)
-                    logger.info('Pods for "{kind}" "{name}" have been rolled out'.format(kind=kind, name=name))
-                except Exception as e:
-                    if 'Status is available only for RollingUpdate strategy type' in str(e):
-                        logger.info('"{kind}" "{name}" is not configured for rolling updates'.format(kind=kind, name=name))
-                    else:
-                        raise
+                _wait_for_rollout(kind, name, namespace)
             elif kind == 'service' and resource['spec'].get('type') == 'LoadBalancer':
-                resource_ready = False
-                while not resource_ready:
-                    time.sleep(5)
-                    live_resource = k8s.get(kind, namespace=namespace, name=name)
-                    ingress = live_resource['status']['loadBalancer'].get('ingress')
-                    if ingress and 'ip' in ingress[0] and 'clusterIP' in live_resource['spec']:
-                        resource_ready = True
+                _wait_for_load_balancer(kind, name, namespace)
+
+
+def _wait_for_rollout(kind, name, namespace):
+    """
+    Waits for the rollout of a Deployment, DaemonSet or StatefulSet to complete, polling its rollout status. Used by wait_for_release_resources.
+    An exception is raised if a pod of the resource enters an error state.
+    """
+    logger.info('Tracking rollout status of "{kind}" "{name}"'.format(kind=kind, name=name))
+    rollout_status = ''
+    try:
+        while ('rolling update complete' not in rollout_status
+               and 'successfully rolled out' not in rollout_status
+               and 'roll out complete' not in rollout_status):
+            baseutils.sleep(5)
+            rollout_status = k8s.rollout_status(kind, name, namespace=namespace)
+            _check_for_resource_pod_errors(kind, namespace, name)
+        logger.info('Pods for "{kind}" "{name}" have been rolled out'.format(kind=kind, name=name))
+    except Exception as e:
+        if 'Status is available only for RollingUpdate strategy type' in str(e):
+            logger.info('"{kind}" "{name}" is not configured for rolling updates'.format(kind=kind, name=name))
+        else:
+            raise
+
+
+def _wait_for_load_balancer(kind, name, namespace):
+    """
+    Waits for the ingress of a LoadBalancer service to be initialised. Used by wait_for_release_resources.
+    """
+    resource_ready = False
+    while not resource_ready:
+        baseutils.sleep(5)
+        live_resource = k8s.get(kind, namespace=namespace, name=name)
+        ingress = live_resource['status']['loadBalancer'].get('ingress')
+        if ingress and 'ip' in ingress[0] and 'clusterIP' in live_resource['spec']:
+            resource_ready = True
 
 
 def _check_for_resource_pod_errors(kind, namespace, name):
@@ -461,36 +845,7 @@ def _check_for_resource_pod_errors(kind, namespace, name):
         namespace: The namespace of the resource owning the pods
         name: The name of the resource owning the pods
     """
-    live_resource = k8s.get(kind, namespace=namespace, name=name)
-    # Evaluate pods specific to the new converging state only. Do not include pods that may have been in a bad state pre-upgrade
-    if kind == 'deployment':
-        replica_sets = k8s.get('replicaset', namespace=namespace, labels=live_resource['spec']['selector']['matchLabels'])
-        for replica_set in replica_sets:
-            if live_resource['metadata']['annotations']['deployment.kubernetes.io/revision'] == replica_set['metadata']['annotations']['deployment.kubernetes.io/revision']:
-                match_labels = replica_set['spec']['selector']['matchLabels']
-                break
-    elif kind == 'daemonset':
-        match_labels = live_resource['spec']['selector']['matchLabels']
-        match_labels['pod-template-generation'] = live_resource['metadata']['generation']
-    elif kind == 'statefulset':
-        match_labels = live_resource['spec']['selector']['matchLabels']
-        match_labels['controller-revision-hash'] = live_resource['status']['updateRevision']
-    pods = k8s.get('pod', namespace=namespace, labels=match_labels)
-    for pod in pods:
-        pod_name = pod['metadata']['name']
-        for container_status in pod['status'].get('containerStatuses', []):
-            wait_reason = container_status['state'].get('waiting', {}).get('reason')
-            if wait_reason and (wait_reason == 'CrashLoopBackOff' or wait_reason == 'ErrImagePull' or wait_reason == 'InvalidImageName' or wait_reason == 'RunContainerError' or
-                                wait_reason == 'ImagePullBackOff' or wait_reason.endswith(' not found') or wait_reason.startswith('Couldn\'t find ')):
-                # A failed container has been identified. Log useful information before raising exception
-                k8s.describe('pod', namespace=namespace, name=pod_name)
-                k8s.logs(pod_name, namespace=namespace, container=container_status['name'])
-                raise Exception('The pod {pod} has entered the failed waiting state "{state}" during chart upgrade. {message}'.format(
-                    pod=pod_name, state=wait_reason, message=container_status['state']['waiting'].get('message', '')))
-            if container_status.get('restartCount', 0) > 0:
-                k8s.describe('pod', namespace=namespace, name=pod_name)
-                k8s.logs(pod_name, namespace=namespace, container=container_status['name'])
-                raise Exception('The pod {pod} has restarted (failed) during chart upgrade'.format(pod=pod_name))
+    rollouthelpers.check_for_resource_pod_errors(kind, namespace, name)
 
 
 def install_helm(helm_version):
@@ -502,20 +857,20 @@ def install_helm(helm_version):
         helm_version: The version of helm that should be installed, eg: v2.11.1
     """
     # First check and ensure that the correct client version is present
-    (rc, output) = baseutils.exe_cmd('{helm} version --client'.format(helm=helm_binary), raise_exception=False, log_level=logging.NOTSET)
+    (rc, output) = baseutils.exe_cmd([helm_binary, 'version', '--client'], raise_exception=False, log_level=logging.NOTSET)
     if rc or helm_version not in output:
         tmp_dir = tempfile.mkdtemp()
         try:
-            helm_tar = baseutils.shell_escape(os.path.join(tmp_dir, 'helm.tar.gz'))
-            baseutils.exe_cmd('/usr/bin/curl -L {url} -o {helm_tar}'.format(
-                url=baseutils.shell_escape('https://storage.googleapis.com/kubernetes-helm/helm-{version}-linux-amd64.tar.gz'.format(version=helm_version)), helm_tar=helm_tar))
-            baseutils.exe_cmd('/bin/tar -xzvf {helm_tar} -C {tmp_dir} && rm -f {helm_tar}'.format(helm_tar=helm_tar, tmp_dir=baseutils.shell_escape(tmp_dir)))
-            os.rename(os.path.join(tmp_dir, 'linux-amd64', 'helm'), helm_binary.strip('\''))
-            os.chmod(helm_binary.strip('\''), 0o755)
+            helm_tar = os.path.join(tmp_dir, 'helm.tar.gz')
+            baseutils.exe_cmd(['/usr/bin/curl', '-L', 'https://storage.googleapis.com/kubernetes-helm/helm-{version}-linux-amd64.tar.gz'.format(version=helm_version),
+                               '-o', helm_tar])
+            baseutils.exe_cmd(['/bin/tar', '-xzvf', helm_tar, '-C', tmp_dir])
+            os.rename(os.path.join(tmp_dir, 'linux-amd64', 'helm'), helm_binary)
+            os.chmod(helm_binary, 0o755)
         finally:
             shutil.rmtree(tmp_dir)
     # Secondly check that the correct version of Tiller is installed into the Kubernetes cluster
-    (rc, output) = baseutils.exe_cmd('{helm} version'.format(helm=helm_binary), raise_exception=False, log_level=logging.NOTSET)
+    (rc, output) = baseutils.exe_cmd([helm_binary, 'version'], raise_exception=False, log_level=logging.NOTSET)
     if rc:
         # Tiller is not installed. We must check if the service account exists yet
         service_accounts = k8s.get('serviceaccount', namespace='kube-system')
@@ -547,15 +902,15 @@ def install_helm(helm_version):
                     'namespace': 'kube-system'
                 }]
             })
-        baseutils.exe_cmd('{helm} init  --history-max 20 --service-account tiller --override "spec.template.spec.containers[0].command"="{{/tiller,--storage=secret}}"'
-                          .format(helm=helm_binary))
+        baseutils.exe_cmd([helm_binary, 'init', '--history-max', '20', '--service-account', 'tiller', '--override',
+                           'spec.template.spec.containers[0].command={/tiller,--storage=secret}'])
     elif output.count(helm_version) != 2:
         # Tiller is installed but it is an old version. Upgrade it
-        baseutils.exe_cmd('{helm} init --history-max 20 --service-account tiller --override "spec.template.spec.containers[0].command"="{{/tiller,--storage=secret}}" --upgrade'
-                          .format(helm=helm_binary))
+        baseutils.exe_cmd([helm_binary, 'init', '--history-max', '20', '--service-account', 'tiller', '--override',
+                           'spec.template.spec.containers[0].command={/tiller,--storage=secret}', '--upgrade'])
     else:
         # Tiller is correctly configured. We still need to init the client to facilitate the usage of helm repositories
-        baseutils.exe_cmd('{helm} init --client-only'.format(helm=helm_binary))
+        baseutils.exe_cmd([helm_binary, 'init', '--client-only'])
 
 
 def upgrade_tiller(namespace):
@@ -566,9 +921,7 @@ def upgrade_tiller(namespace):
         namespace: The namespace of the Tiller deployment
     """
     # Check if Tiller is already at the correct version
-    (rc, output) = baseutils.exe_cmd('{helm} version --tiller-namespace {namespace} --short'.format(
-            helm=helm_binary,
-            namespace=baseutils.shell_escape(namespace)))
+    (rc, output) = baseutils.exe_cmd([helm_binary, 'version', '--tiller-namespace', namespace, '--short'])
     output = output.strip().splitlines()
     client_version = output[0].strip().split()[1]
     tiller_version = output[1].strip().split()[1]
@@ -580,8 +933,5 @@ def upgrade_tiller(namespace):
         override = None
         if 'command' in container_spec:
             override = '"spec.template.spec.containers[0].command"="{{{{{command}}}}}"'.format(command=','.join(container_spec['command']))
-        baseutils.exe_cmd('{helm} init --history-max 20 --tiller-namespace {namespace} --service-account {service_account_name} {override} --upgrade'.format(
-            helm=helm_binary,
-            namespace=baseutils.shell_escape(namespace),
-            service_account_name=baseutils.shell_escape(service_account_name),
-            override='--override {override}'.format(override=baseutils.shell_escape(override)) if override else ''))
+        baseutils.exe_cmd([helm_binary, 'init', '--history-max', '20', '--tiller-namespace', namespace, '--service-account', service_account_name] + (
+            ['--override', override] if override else []) + ['--upgrade'])
@@ -48,7 +48,9 @@ class ReleaseRevision(object):
 
     @updated.setter
     def updated(self, updated):
-        if isinstance(updated, six.string_types):
+        if isinstance(updated, six.string_types) and updated[:4].isdigit():  # Helm 3 reports RFC 3339 timestamps, which are read to the second
+            self._updated = datetime.datetime.strptime(updated[:19], '%Y-%m-%dT%H:%M:%S')
+        elif isinstance(updated, six.string_types):
             self._updated = datetime.datetime.strptime(updated, '%a %b %d %H:%M:%S %Y')
         else:
             self._updated = updated
@@ -0,0 +1,34 @@
+import os
+
+from orchutils import aio
+from orchutils import ibmcloud
+from orchutils import k8s
+
+
+def get_base_env():
+    """
+    Captures the configuration of the current process that use_cluster_env restores before configuring a cluster.
+    It should be called before starting a pool of processes that manage different clusters and passed to each task of the pool.
+    Returns: A dictionary of the environment variables and the kubectl binary of the current process
+    """
+    return {'env': dict(os.environ), 'kubectl_binary': k8s.kubectl_binary}
+
+
+def use_cluster_env(orch_dir, base_env):
+    """
+    Configures the current process to manage the cluster of an orchestration directory.
+    The processes of a pool are reused for several tasks, so the base configuration is restored first and any Kubernetes and IKS API clients are discarded.
+    Nothing of a cluster previously managed by the process is used, even when orch_dir is not set.
+    Args:
+        orch_dir: The orchestration directory of the cluster, as would be passed in P2PAAS_ORCH_DIR, or None for the cluster of the base configuration
+        base_env: The configuration of the process that started the pool, as returned by get_base_env
+    """
+    for key in set(os.environ) - set(base_env['env']):
+        del os.environ[key]
+    os.environ.update(base_env['env'])
+    k8s.kubectl_binary = base_env['kubectl_binary']
+    if orch_dir:
+        os.environ.update(aio.cluster_env(orch_dir))
+        k8s.kubectl_binary = os.path.join(orch_dir, 'kubectl')
+    k8s.set_backend(k8s.backend)  # Discards any API client created for a different cluster or inherited from the parent process
+    ibmcloud.set_backend(ibmcloud.backend)
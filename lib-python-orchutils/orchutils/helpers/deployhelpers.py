@@ -0,0 +1,126 @@
+import collections
+import concurrent.futures
+import logging
+import time
+
+from orchutils import helm3
+from orchutils.helpers import clusterhelpers
+
+logger = logging.getLogger(__name__)
+default_concurrency = 4  # Number of releases deployed at the same time in each cluster
+default_environment_concurrency = 4  # Number of clusters deployed at the same time
+
+
+def deploy_releases(charts, environments=None, concurrency=default_concurrency, environment_concurrency=default_environment_concurrency,
+                    validate_manifest=False, dry_run=False):
+    """
+    Installs a set of Helm charts into the clusters of one or more environments, deploying releases that do not depend on each other at the same time.
+    A chart can declare the releases it depends on, eg. Kafka on Zookeeper, with a "dependsOn" list. A release is only deployed once all of its dependencies
+    have been deployed successfully in the same cluster. If a release fails, the releases that depend on it are skipped, while independent releases continue.
+    Environments are grouped by the cluster they target and each release is installed once per cluster, as installing it again for another environment of
+    the same cluster would conflict with the existing release. Environments without their own orchestration directory all target the cluster of the current
+    environment. Different clusters are deployed concurrently, each in its own process.
+    Args:
+        charts: A list of dictionaries describing the charts to install. Each dictionary has the keys "name", "chartVersion", "valuesFile", "release" and
+                "namespace" as passed to helm3.install_chart and an optional "dependsOn" key, listing the names of the releases that must be deployed first
+        environments: A list of dictionaries describing the environments to deploy to, eg. with "category", "metro" and "offering" keys. An optional "orch_dir"
+                      key holds the orchestration directory of the environment's cluster, as would be passed in P2PAAS_ORCH_DIR
+                      (Optional, default: a single environment for the current cluster)
+        concurrency: The maximum number of releases to deploy at the same time in each cluster (Optional, default: default_concurrency)
+        environment_concurrency: The maximum number of clusters to deploy to at the same time (Optional, default: default_environment_concurrency)
+        validate_manifest: Validate the manifests of the charts before they are installed. See helm3.install_chart (Optional, default: False)
+        dry_run: Perform the installs in dry-run mode. See helm3.install_chart (Optional, default: False)
+    Returns: A list with a dictionary for each release in each cluster, in the order the clusters first appear in environments and the order of charts.
+             Each dictionary holds the "environments" of the cluster, "release", "namespace", "chart" and "chartVersion", the "status" of the release
+             (deployed, failed or skipped), the "start" time and "duration" of its deployment in seconds and the "error" message of a failed or skipped release
+    """
+    _check_dependencies(charts)
+    clusters = collections.OrderedDict()  # orch_dir -> the environments targeting the cluster, without their orch_dir
+    for environment in environments or [{}]:
+        clusters.setdefault(environment.get('orch_dir'), []).append(dict((key, value) for (key, value) in environment.items() if key != 'orch_dir'))
+    base_env = clusterhelpers.get_base_env()
+    executor = concurrent.futures.ProcessPoolExecutor(max_workers=min(environment_concurrency, len(clusters)))
+    try:
+        futures = [executor.submit(_deploy_cluster, orch_dir, base_env, cluster_environments, charts, concurrency, validate_manifest, dry_run)
+                   for (orch_dir, cluster_environments) in clusters.items()]
+        return [result for future in futures for result in future.result()]
+    finally:
+        executor.shutdown(wait=True)
+
+
+def _check_dependencies(charts):
+    """
+    Checks that the dependencies of the charts refer to releases in the list and do not form a cycle, so that every release can be scheduled.
+    """
+    dependencies = dict((chart['release'], chart.get('dependsOn') or []) for chart in charts)
+    for (release, depends_on) in dependencies.items():
+        unknown_releases = [dependency for dependency in depends_on if dependency not in dependencies]
+        if unknown_releases:
+            raise Exception('Release {release} depends on releases that are not being deployed: {releases}'.format(release=release, releases=', '.join(unknown_releases)))
+    resolved = set()
+    while len(resolved) < len(dependencies):
+        ready = [release for (release, depends_on) in dependencies.items() if release not in resolved and resolved.issuperset(depends_on)]
+        if not ready:
+            raise Exception('Circular dependency between releases: {releases}'.format(releases=', '.join(sorted(set(dependencies) - resolved))))
+        resolved.update(ready)
+
+
+def _deploy_cluster(orch_dir, base_env, environments, charts, concurrency, validate_manifest, dry_run):
+    """
+    Deploys the charts into the cluster of a group of environments, starting each release as soon as its dependencies have been deployed.
+    Runs in a process of the pool created by deploy_releases, so the cluster's configuration can be set in the process environment.
+    The process may have deployed another cluster before, so its configuration is first reset to base_env. See clusterhelpers.use_cluster_env.
+    Returns: A list of the result dictionaries of the releases, in the order of charts
+    """
+    clusterhelpers.use_cluster_env(orch_dir, base_env)
+    cluster_name = ', '.join('/'.join(environment.get(key) or '' for key in ('category', 'metro', 'offering')).strip('/') or 'current'
+                             for environment in environments)
+    results = dict((chart['release'], {'environments': environments, 'release': chart['release'], 'namespace': chart['namespace'], 'chart': chart['name'],
+                                       'chartVersion': chart['chartVersion'], 'status': None, 'start': None, 'duration': None, 'error': None}) for chart in charts)
+    pending_charts = list(charts)
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=concurrency)
+    try:
+        running_futures = {}
+        while pending_charts or running_futures:
+            for chart in list(pending_charts):
+                dependency_statuses = [results[dependency]['status'] for dependency in chart.get('dependsOn') or []]
+                if any(status in ('failed', 'skipped') for status in dependency_statuses):
+                    pending_charts.remove(chart)
+                    failed_dependencies = [dependency for dependency in chart['dependsOn'] if results[dependency]['status'] in ('failed', 'skipped')]
+                    results[chart['release']].update(status='skipped', error='Dependencies were not deployed: {releases}'.format(releases=', '.join(failed_dependencies)))
+                    logger.warning('Skipping release {release} for environments {environments} as its dependencies were not deployed: {releases}'.format(
+                        release=chart['release'], environments=cluster_name, releases=', '.join(failed_dependencies)))
+                elif all(status == 'deployed' for status in dependency_statuses):
+                    pending_charts.remove(chart)
+                    running_futures[executor.submit(_deploy_release, chart, validate_manifest, dry_run)] = chart['release']
+            if not running_futures:
+                continue
+            (done_futures, not_done_futures) = concurrent.futures.wait(running_futures, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done_futures:
+                release = running_futures.pop(future)
+                (start, duration, error) = future.result()
+                results[release].update(status='failed' if error else 'deployed', start=start, duration=duration, error=error)
+                if error:
+                    logger.error('Failed to deploy release {release} for environments {environments}: {error}'.format(
+                        release=release, environments=cluster_name, error=error))
+                else:
+                    logger.info('Deployed release {release} for environments {environments} in {duration} second(s)'.format(
+                        release=release, environments=cluster_name, duration=round(duration, 2)))
+    finally:
+        executor.shutdown(wait=True)
+    return [results[chart['release']] for chart in charts]
+
+
+def _deploy_release(chart, validate_manifest, dry_run):
+    """
+    Installs the chart of a single release. Runs in a thread of the pool created by _deploy_cluster.
+    Returns: A tuple of (start time, duration in seconds, error message or None)
+    """
+    start = time.time()
+    try:
+        helm3.install_chart(chart['name'], chart['chartVersion'], chart['valuesFile'], chart['release'], chart['namespace'],
+                            validate_manifest=validate_manifest, dry_run=dry_run)
+        error = None
+    except Exception as e:
+        error = str(e)
+    return (start, time.time() - start, error)
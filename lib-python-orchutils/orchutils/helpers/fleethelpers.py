@@ -0,0 +1,139 @@
+import concurrent.futures
+import hashlib
+import json
+import logging
+import os
+
+import baseutils
+from orchutils import ibmcloud
+from orchutils.helpers import clusterhelpers
+
+logger = logging.getLogger(__name__)
+default_concurrency = 4  # Number of clusters that have workers replaced at the same time
+
+
+def patch_clusters(clusters, kube_version, state_file, concurrency=default_concurrency, batch_size=1, max_per_group=1):
+    """
+    Updates a fleet of IKS clusters to a Kubernetes version. The masters of the clusters are updated and then the outdated workers of the clusters
+    are replaced, with up to concurrency clusters updating their master or replacing workers at the same time. Each cluster is handled in its own process,
+    so at most concurrency * batch_size workers are being replaced across the fleet at any time.
+    Progress is recorded in a JSON state file. If the function is run again with the same state file and version, eg. after a crash, clusters whose masters
+    or workers have completed are skipped and worker replacement resumes with the workers that are still outdated, skipping workers recorded as replaced.
+    A failure in one cluster does not stop the other clusters. Once all clusters have been processed, an exception listing the failed clusters is raised.
+    Args:
+        clusters: A list of clusters to update. Each element is either the name of a cluster or a dictionary with a "name" key and an optional "orch_dir" key.
+                  orch_dir is the orchestration directory holding the cluster's configuration, as would be passed in P2PAAS_ORCH_DIR (Optional, default: current environment)
+        kube_version: The version to upgrade Kubernetes to in the form major.minor.patch
+        state_file: The path of the file to record progress in. It is created if it does not exist
+        concurrency: The maximum number of clusters to update masters or replace workers in at the same time (Optional, default: default_concurrency)
+        batch_size: The maximum number of workers to replace at the same time in each cluster. See ibmcloud.replace_iks_workers (Optional, default: 1)
+        max_per_group: The maximum number of workers from the same zone and worker pool to replace at the same time. See ibmcloud.replace_iks_workers (Optional, default: 1)
+    Returns: A dictionary of the state of each cluster, keyed by cluster name
+    """
+    clusters = [cluster if isinstance(cluster, dict) else {'name': cluster} for cluster in clusters]
+    with baseutils.local_lock(lock_name=_get_state_lock_name(state_file)):
+        state = _load_state(state_file)
+        for cluster in clusters:
+            if state.get(cluster['name'], {}).get('kube_version') != kube_version:
+                state[cluster['name']] = {'kube_version': kube_version, 'master_updated': False, 'workers_replaced': False, 'replaced_workers': []}
+        _save_state(state_file, state)
+    failures = {}
+    pending_clusters = [cluster for cluster in clusters if not state[cluster['name']]['master_updated']]
+    if pending_clusters:
+        logger.info('Updating masters of clusters: {clusters}'.format(clusters=', '.join(cluster['name'] for cluster in pending_clusters)))
+        failures.update(_run_for_clusters(_update_cluster_master, pending_clusters, min(concurrency, len(pending_clusters)), kube_version, state_file))
+    pending_clusters = [cluster for cluster in clusters if cluster['name'] not in failures and not state[cluster['name']]['workers_replaced']]
+    if pending_clusters:
+        logger.info('Replacing workers of clusters: {clusters}'.format(clusters=', '.join(cluster['name'] for cluster in pending_clusters)))
+        failures.update(_run_for_clusters(_replace_cluster_workers, pending_clusters, concurrency, kube_version, state_file, batch_size, max_per_group))
+    state = _load_state(state_file)
+    if failures:
+        raise Exception('Failed to patch clusters to version {version}. {failures}'.format(
+            version=kube_version,
+            failures=' '.join('{cluster}: {error}.'.format(cluster=cluster, error=error) for (cluster, error) in sorted(failures.items()))))
+    return dict((cluster['name'], state[cluster['name']]) for cluster in clusters)
+
+
+def _run_for_clusters(func, clusters, max_workers, *args):
+    """
+    Runs a function for each cluster in a pool of processes. The function is passed the cluster, the configuration of the current process, as returned by
+    clusterhelpers.get_base_env, and args.
+    Returns: A dictionary of the exceptions raised for failed clusters, keyed by cluster name
+    """
+    failures = {}
+    base_env = clusterhelpers.get_base_env()
+    executor = concurrent.futures.ProcessPoolExecutor(max_workers=max_workers)
+    try:
+        cluster_futures = dict((executor.submit(func, cluster, base_env, *args), cluster['name']) for cluster in clusters)
+        for future in concurrent.futures.as_completed(cluster_futures):
+            cluster_name = cluster_futures[future]
+            try:
+                future.result()
+            except Exception as e:
+                logger.error('Failed to patch cluster {cluster}: {error}'.format(cluster=cluster_name, error=e))
+                failures[cluster_name] = e
+    finally:
+        executor.shutdown(wait=True)
+    return failures
+
+
+def _update_cluster_master(cluster, base_env, kube_version, state_file):
+    """
+    Updates the master of a cluster and records its completion in the state file. Runs in a process of the pool created by _run_for_clusters.
+    """
+    clusterhelpers.use_cluster_env(cluster.get('orch_dir'), base_env)
+    ibmcloud.update_iks_cluster(cluster['name'], kube_version)
+    _update_cluster_state(state_file, cluster['name'], master_updated=True)
+
+
+def _replace_cluster_workers(cluster, base_env, kube_version, state_file, batch_size, max_per_group):
+    """
+    Replaces the outdated workers of a cluster, recording each replaced worker in the state file. Runs in a process of the pool created by _run_for_clusters.
+    Workers already on their target version and workers recorded in the state file as replaced by an earlier run are not replaced.
+    """
+    clusterhelpers.use_cluster_env(cluster.get('orch_dir'), base_env)
+    replaced_workers = set(_load_state(state_file)[cluster['name']]['replaced_workers'])
+    workers = [worker for worker in ibmcloud.ks_worker_ls.refresh(cluster['name']) if worker.kube_version != worker.target_version and worker.id not in replaced_workers]
+
+    def record_progress(cluster_name, worker, completed, total):
+        cluster_state = _load_state(state_file)[cluster_name]
+        _update_cluster_state(state_file, cluster_name, replaced_workers=cluster_state['replaced_workers'] + [worker.id])
+    ibmcloud.replace_iks_workers(cluster['name'], workers, batch_size=batch_size, max_per_group=max_per_group, progress_callback=record_progress)
+    _update_cluster_state(state_file, cluster['name'], workers_replaced=True)
+
+
+def _update_cluster_state(state_file, cluster_name, **kwargs):
+    """
+    Updates properties of a cluster in the state file. The file is locked for the update as it is shared by the processes of all clusters.
+    """
+    with baseutils.local_lock(lock_name=_get_state_lock_name(state_file)):
+        state = _load_state(state_file)
+        state[cluster_name].update(kwargs)
+        _save_state(state_file, state)
+
+
+def _get_state_lock_name(state_file):
+    """
+    Returns the name of the local lock that protects a state file.
+    """
+    return 'fleet_state_{hash}'.format(hash=hashlib.sha1(os.path.abspath(state_file).encode('utf-8')).hexdigest())
+
+
+def _load_state(state_file):
+    """
+    Reads the state file, returning an empty state if it does not exist.
+    """
+    if not os.path.exists(state_file):
+        return {}
+    with open(state_file) as fh:
+        return json.load(fh)
+
+
+def _save_state(state_file, state):
+    """
+    Writes the state file. The file is replaced atomically so that a crash cannot leave it partially written.
+    """
+    tmp_file = '{state_file}.tmp'.format(state_file=state_file)
+    with open(tmp_file, 'w') as fh:
+        json.dump(state, fh, indent=2, sort_keys=True)
+    os.rename(tmp_file, state_file)
@@ -1,7 +1,7 @@
 import json
 import logging
-import time
 
+import baseutils
 from orchutils import k8s
 
 logger = logging.getLogger(__name__)
@@ -75,7 +75,7 @@ def wait_for_node_namespace_pods(node, namespace):
     pods_ready = False
     while not pods_ready:
         pods_ready = True
-        time.sleep(15)
+        baseutils.sleep(15)
         pods = k8s.get('pod', namespace=namespace)
         for pod in pods:
             pod_status = pod['status']
@@ -91,3 +91,36 @@ def wait_for_node_namespace_pods(node, namespace):
                     else:  # A non-running, non-succeeded pod is not ready
                         pods_ready = False
                         break
+
+
+def get_pdbs_without_headroom():
+    """
+    Retrieves the PodDisruptionBudgets in all namespaces that are currently below their desired number of healthy pods.
+    A budget in this state is still recovering from an earlier disruption, eg. pods evicted from a drained node that are not yet ready elsewhere.
+    Budgets that are healthy but never allow a disruption, eg. maxUnavailable: 0, are not included as waiting would not change them.
+    Returns: A list of PodDisruptionBudget resources
+    """
+    pdbs = []
+    for pdb in k8s.get('poddisruptionbudget', namespace='all'):
+        status = pdb.get('status', {})
+        if status.get('currentHealthy', 0) < status.get('desiredHealthy', 0):
+            pdbs.append(pdb)
+    return pdbs
+
+
+def wait_for_pdb_headroom(seconds=1800, interval=15):
+    """
+    Waits until every PodDisruptionBudget in the cluster is back to its desired number of healthy pods.
+    This is intended to be called between batches of node maintenance, so that the next nodes are not drained while pods from the previous nodes are still starting.
+    The wait will time out after a specified time, resulting in an exception.
+    Args:
+        seconds: The timeout for the wait (Optional, default: 1800)
+        interval: The time in seconds between checks (Optional, default: 15)
+    """
+    with baseutils.timeout(seconds=seconds):
+        pdbs = get_pdbs_without_headroom()
+        while pdbs:
+            logger.info('Waiting for PodDisruptionBudgets to recover: {pdbs}'.format(
+                pdbs=', '.join('{namespace}/{name}'.format(namespace=pdb['metadata'].get('namespace'), name=pdb['metadata']['name']) for pdb in pdbs)))
+            baseutils.sleep(interval)
+            pdbs = get_pdbs_without_headroom()
@@ -0,0 +1,309 @@
+import logging
+import threading
+from concurrent import futures
+from six.moves import queue
+
+import baseutils
+from orchutils import k8s
+from orchutils.k8sclient import rollout_status_message
+
+logger = logging.getLogger(__name__)
+workload_kinds = ['deployment', 'daemonset', 'statefulset']
+failed_wait_reasons = ['CrashLoopBackOff', 'ErrImagePull', 'InvalidImageName', 'RunContainerError', 'ImagePullBackOff']
+rollout_complete_messages = ['rolling update complete', 'successfully rolled out', 'roll out complete']
+default_max_workers = 8
+
+
+def get_pod_failure(pod):
+    """
+    Checks if a pod has entered an error state during a rollout.
+    A pod is considered failed if one of its containers is waiting for a failure reason, eg. CrashLoopBackOff or ImagePullBackOff, or if a container has restarted.
+    Args:
+        pod: The pod to check as a dictionary
+    Returns: A tuple of (container name, error message) describing the failure or None if the pod has not failed
+    """
+    pod_name = pod['metadata']['name']
+    for container_status in (pod.get('status') or {}).get('containerStatuses', []):
+        waiting = container_status['state'].get('waiting') or {}
+        wait_reason = waiting.get('reason')
+        if wait_reason and (wait_reason in failed_wait_reasons or wait_reason.endswith(' not found') or wait_reason.startswith('Couldn\'t find ')):
+            return (container_status['name'], 'The pod {pod} has entered the failed waiting state "{state}" during chart upgrade. {message}'.format(
+                pod=pod_name, state=wait_reason, message=waiting.get('message', '')))
+        if container_status.get('restartCount', 0) > 0:
+            return (container_status['name'], 'The pod {pod} has restarted (failed) during chart upgrade'.format(pod=pod_name))
+    return None
+
+
+def raise_pod_failure(pod, namespace):
+    """
+    Raises an exception if a pod has failed. Before raising, the pod is described and the logs of the failed container are captured for failure analysis.
+    Args:
+        pod: The pod to check as a dictionary
+        namespace: The namespace of the pod
+    """
+    failure = get_pod_failure(pod)
+    if failure:
+        (container, message) = failure
+        k8s.describe('pod', namespace=namespace, name=pod['metadata']['name'])
+        k8s.logs(pod['metadata']['name'], namespace=namespace, container=container)
+        raise Exception(message)
+
+
+def check_for_resource_pod_errors(kind, namespace, name):
+    """
+    Checks if pods from a resource enter an error state.
+    If an error state is detected, an exception is raised.
+    Args:
+        kind: The kind of the resource owning the pods
+        namespace: The namespace of the resource owning the pods
+        name: The name of the resource owning the pods
+    """
+    live_resource = k8s.get(kind, namespace=namespace, name=name)
+    # Evaluate pods specific to the new converging state only. Do not include pods that may have been in a bad state pre-upgrade
+    if kind == 'deployment':
+        replica_sets = k8s.get('replicaset', namespace=namespace, labels=live_resource['spec']['selector']['matchLabels'])
+        for replica_set in replica_sets:
+            if live_resource['metadata']['annotations']['deployment.kubernetes.io/revision'] == replica_set['metadata']['annotations']['deployment.kubernetes.io/revision']:
+                match_labels = replica_set['spec']['selector']['matchLabels']
+                break
+    elif kind == 'daemonset':
+        match_labels = live_resource['spec']['selector']['matchLabels']
+        match_labels['pod-template-generation'] = live_resource['metadata']['generation']
+    elif kind == 'statefulset':
+        match_labels = live_resource['spec']['selector']['matchLabels']
+        match_labels['controller-revision-hash'] = live_resource['status']['updateRevision']
+    pods = k8s.get('pod', namespace=namespace, labels=match_labels)
+    for pod in pods:
+        raise_pod_failure(pod, namespace)
+
+
+def is_tracked_resource(resource):
+    """
+    Checks if a manifest resource is one that must be waited upon during a release, ie. a workload or a LoadBalancer service.
+    Args:
+        resource: The manifest resource as a dictionary
+    Returns: True if the resource should be waited upon
+    """
+    kind = resource['kind'].lower()
+    return kind in workload_kinds or (kind == 'service' and resource['spec'].get('type') == 'LoadBalancer')
+
+
+def check_resource_ready(resource):
+    """
+    Polls a manifest resource once to determine if it is ready.
+    Workloads are ready when their rollout is complete. An exception is raised if a pod of the converging revision has failed.
+    LoadBalancer services are ready when their ingress has been assigned an ip.
+    Args:
+        resource: The manifest resource as a dictionary
+    Returns: A tuple of (whether the resource is ready, a status message)
+    """
+    kind = resource['kind'].lower()
+    name = resource['metadata']['name']
+    namespace = resource['metadata'].get('namespace')
+    if kind in workload_kinds:
+        try:
+            rollout_status = k8s.rollout_status(kind, name, namespace=namespace)
+            check_for_resource_pod_errors(kind, namespace, name)
+        except Exception as e:
+            if 'Status is available only for RollingUpdate strategy type' in str(e):
+                return (True, 'not configured for rolling updates')
+            raise
+        return (any(message in rollout_status for message in rollout_complete_messages), rollout_status.strip())
+    live_resource = k8s.get(kind, namespace=namespace, name=name)
+    ingress = live_resource['status']['loadBalancer'].get('ingress')
+    if ingress and 'ip' in ingress[0] and 'clusterIP' in live_resource['spec']:
+        return (True, 'load balancer ingress {ip} is ready'.format(ip=ingress[0]['ip']))
+    return (False, 'waiting for load balancer ingress')
+
+
+def poll_for_resources(resources, max_workers=default_max_workers, interval=5):
+    """
+    Waits for the workloads and load balancer services in a list of manifest resources to become ready, polling all of them concurrently.
+    Every pending resource is polled each interval using a bounded pool of worker threads. Progress is logged per resource as its status changes.
+    The wait fails as soon as a pod error is detected for any resource. Polling results are collected on the calling thread,
+    so any baseutils.timeout active in the caller covers the whole wait, including when the caller is itself a worker thread.
+    Args:
+        resources: The list of manifest resources as dictionaries
+        max_workers: The maximum number of resources to poll at the same time (Optional, default: 8)
+        interval: The number of seconds between polls of each resource (Optional, default: 5)
+    """
+    pending = [resource for resource in resources if is_tracked_resource(resource)]
+    total = len(pending)
+    statuses = {}
+    polls = {}
+    executor = futures.ThreadPoolExecutor(max_workers=max_workers)
+    try:
+        while pending:
+            baseutils.sleep(interval)
+            polls = dict((executor.submit(check_resource_ready, resource), resource) for resource in pending)
+            not_done = set(polls)
+            while not_done:
+                # A short timeout keeps the calling thread responsive to signals such as baseutils.timeout
+                (done, not_done) = futures.wait(not_done, timeout=1, return_when=futures.FIRST_EXCEPTION)
+                baseutils.check_timeout()
+                for poll in done:
+                    poll.result()  # Re-raise a failure as soon as it is detected. Outstanding polls are cancelled below
+            for (poll, resource) in polls.items():
+                (ready, status) = poll.result()
+                key = (resource['kind'].lower(), resource['metadata'].get('namespace'), resource['metadata']['name'])
+                if statuses.get(key) != status:
+                    statuses[key] = status
+                    logger.info('"{kind}" "{name}": {status}'.format(kind=key[0], name=key[2], status=status))
+                if ready:
+                    pending.remove(resource)
+                    logger.info('"{kind}" "{name}" is ready ({count} of {total} resources ready)'.format(
+                        kind=key[0], name=key[2], count=total - len(pending), total=total))
+    finally:
+        for poll in polls:
+            poll.cancel()
+        executor.shutdown(wait=False)
+
+
+class ResourceWaiter(object):
+    """
+    Waits for the workloads and load balancer services of a release to become ready, driven by watch events from the Kubernetes API rather than polling.
+    A single watch stream is opened per namespace for each kind of resource involved. Events are consumed on the calling thread,
+    so any baseutils.timeout active in the caller continues to apply. Readiness and failure detection match the polling implementation in
+    helm.wait_for_release_resources: rollouts are tracked via their kubectl rollout status and pods of the new revision are checked for errors.
+    Requires the api backend of orchutils.k8s.
+    """
+    def __init__(self, resources, default_namespace='default'):
+        """
+        Constructor for the waiter.
+        Args:
+            resources: The list of manifest resources of the release as dictionaries
+            default_namespace: The namespace of resources in the manifest that do not specify one (Optional, default: default)
+        """
+        self.tracked = []
+        self.live = {}
+        self.events = queue.Queue()
+        self.stop_event = threading.Event()
+        self.statuses = {}
+        for resource in resources:
+            if is_tracked_resource(resource):
+                namespace = resource['metadata'].get('namespace') or default_namespace
+                self.tracked.append((resource['kind'].lower(), namespace, resource['metadata']['name']))
+        for (kind, namespace, name) in self.tracked:
+            self.live.setdefault((kind, namespace), {})
+            if kind in workload_kinds:
+                self.live.setdefault(('pod', namespace), {})
+            if kind == 'deployment':
+                self.live.setdefault(('replicaset', namespace), {})
+
+    def wait(self):
+        """
+        Blocks until all tracked resources are ready.
+        An exception is raised as soon as a pod of a tracked workload fails or a rollout exceeds its progress deadline.
+        """
+        threads = []
+        for (kind, namespace) in self.live:
+            thread = threading.Thread(target=self._watch, args=(kind, namespace))
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+        try:
+            pending = list(self.tracked)
+            while pending:
+                try:
+                    event = self.events.get(timeout=1)  # Short timeout so the main thread remains responsive to signals such as baseutils.timeout
+                except queue.Empty:
+                    baseutils.check_timeout()
+                    continue
+                while event:
+                    self._handle_event(event)
+                    try:
+                        event = self.events.get_nowait()
+                    except queue.Empty:
+                        event = None
+                pending = [key for key in pending if not self._is_ready(*key)]
+        finally:
+            self.stop_event.set()
+
+    def _watch(self, kind, namespace):
+        """
+        Streams events for one kind of resource in one namespace onto the event queue. Runs in a background thread.
+        """
+        try:
+            for (event_type, resource) in k8s.watch(kind, namespace=namespace, stop_event=self.stop_event):
+                self.events.put((kind, namespace, event_type, resource))
+        except Exception as e:
+            if not self.stop_event.is_set():
+                self.events.put((kind, namespace, 'ERROR', e))
+
+    def _handle_event(self, event):
+        """
+        Updates the live view of resources from a watch event.
+        """
+        (kind, namespace, event_type, resource) = event
+        if event_type == 'ERROR':
+            raise resource
+        if event_type == 'DELETED':
+            self.live[(kind, namespace)].pop(resource['metadata']['name'], None)
+        else:
+            self.live[(kind, namespace)][resource['metadata']['name']] = resource
+
+    def _is_ready(self, kind, namespace, name):
+        """
+        Evaluates whether a tracked resource is ready, raising an exception if it has failed.
+        """
+        resource = self.live[(kind, namespace)].get(name)
+        if not resource:
+            return False
+        if kind == 'service':
+            ingress = (resource.get('status') or {}).get('loadBalancer', {}).get('ingress')
+            return bool(ingress and 'ip' in ingress[0] and 'clusterIP' in resource['spec'])
+        try:
+            (status, done) = rollout_status_message(resource)
+        except Exception as e:
+            if 'Status is available only for RollingUpdate strategy type' in str(e):
+                logger.info('"{kind}" "{name}" is not configured for rolling updates'.format(kind=kind, name=name))
+                return True
+            raise
+        if self.statuses.get((kind, namespace, name)) != status:
+            self.statuses[(kind, namespace, name)] = status
+            logger.info(status.rstrip())
+        for pod in self._get_current_pods(kind, namespace, resource):
+            raise_pod_failure(pod, namespace)
+        if done:
+            logger.info('Pods for "{kind}" "{name}" have been rolled out'.format(kind=kind, name=name))
+        return done
+
+    def _get_current_pods(self, kind, namespace, resource):
+        """
+        Retrieves the pods belonging to the converging revision of a workload. Pods that may have been in a bad state pre-upgrade are excluded.
+        """
+        if kind == 'deployment':
+            revision = resource['metadata'].get('annotations', {}).get('deployment.kubernetes.io/revision')
+            owner_uids = [replica_set['metadata']['uid'] for replica_set in self.live[('replicaset', namespace)].values()
+                          if _is_owned_by(replica_set, resource) and replica_set['metadata'].get('annotations', {}).get('deployment.kubernetes.io/revision') == revision]
+            revision_label = (None, None)
+        elif kind == 'daemonset':
+            owner_uids = [resource['metadata']['uid']]
+            revision_label = ('pod-template-generation', str(resource['metadata'].get('generation')))
+        else:
+            owner_uids = [resource['metadata']['uid']]
+            revision_label = ('controller-revision-hash', (resource.get('status') or {}).get('updateRevision'))
+        pods = []
+        for pod in self.live[('pod', namespace)].values():
+            owner_references = pod['metadata'].get('ownerReferences') or []
+            if any(owner_reference.get('uid') in owner_uids for owner_reference in owner_references):
+                if not revision_label[0] or pod['metadata'].get('labels', {}).get(revision_label[0]) == revision_label[1]:
+                    pods.append(pod)
+        return pods
+
+
+def _is_owned_by(resource, owner):
+    """
+    Checks if a resource has an owner reference to another resource.
+    """
+    return any(owner_reference.get('uid') == owner['metadata']['uid'] for owner_reference in resource['metadata'].get('ownerReferences') or [])
+
+
+def wait_for_resources(resources):
+    """
+    Waits for the workloads and load balancer services in a list of manifest resources to become ready, using watch events. See ResourceWaiter for details.
+    Requires the api backend of orchutils.k8s.
+    Args:
+        resources: The list of manifest resources as dictionaries
+    """
+    ResourceWaiter(resources, default_namespace=k8s.get_api_client().default_namespace).wait()
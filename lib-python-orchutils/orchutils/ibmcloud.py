@@ -6,11 +6,13 @@ import requests
 import semver
 import shutil
 import tempfile
+import threading
 import time
 
 import baseutils
 from orchutils import k8s
 from orchutils.helpers import k8shelpers
+from orchutils.iksclient import IKSClient
 from orchutils.ibmcloudmodels.albcertificate import ALBCertificate
 from orchutils.ibmcloudmodels.clusteralbs import ClusterALBs
 from orchutils.ibmcloudmodels.ikscluster import IKSCluster
@@ -30,7 +32,22 @@ os.environ['IKS_BETA_VERSION'] = '1'  # Remove when new behaviour released for "
 if 'P2PAAS_ORCH_DIR' in os.environ and 'IBMCLOUD_HOME' not in os.environ:
     # Support customisation of the IBMCLOUD_HOME path to facilitate simultaneous management of multiple clusters from a single server
     os.environ['IBMCLOUD_HOME'] = os.environ['P2PAAS_ORCH_DIR']
+ibmcloud_binary = '/usr/local/bin/ibmcloud'
 cli_update_lock_name = 'ibmcloud_cli_update'
+backends = ['cli', 'api']
+backend = os.environ.get('P2PAAS_IKS_BACKEND', 'cli')  # "api" talks directly to the containers API. The ibmcloud cli remains the fallback
+api_client = None
+api_client_lock = threading.Lock()
+# Read-only calls are cached for these periods when caching is enabled. See baseutils.set_ttl_cache
+# Cached results are keyed on IBMCLOUD_HOME as the account and region they are retrieved from depend on its configuration
+cache_env_keys = ['IBMCLOUD_HOME']
+cluster_cache_seconds = 30
+worker_cache_seconds = 30
+worker_pool_cache_seconds = 60
+alb_cache_seconds = 60
+subnet_cache_seconds = 300
+kube_version_cache_seconds = 3600
+kp_key_cache_seconds = 300
 
 
 def set_config_dir(home_dir):
@@ -46,13 +63,52 @@ def set_config_dir(home_dir):
     os.environ['IBMCLOUD_HOME'] = home_dir
 
 
+def set_backend(backend_name):
+    """
+    Selects the backend used by the functions in this module that support direct API access (ks_cluster_get, ks_cluster_ls, ks_worker_get, ks_worker_ls,
+    ks_worker_pool_get, ks_worker_pool_ls, ks_worker_pool_rm and the worker and master updates of replace_iks_workers and update_iks_cluster).
+    The "api" backend talks to the containers API over a pooled, keep-alive HTTPS session. See orchutils.iksclient.IKSClient for how it authenticates.
+    The "cli" backend runs the ibmcloud cli per call. Functions without API support always use the cli.
+    The same can be achieved by setting the P2PAAS_IKS_BACKEND environment variable before this module is imported.
+    Args:
+        backend_name: The backend to use. Must be either "cli" or "api"
+    """
+    global backend, api_client
+    if backend_name not in backends:
+        raise Exception('Invalid IKS backend "{backend}". Must be one of: {backends}'.format(backend=backend_name, backends=', '.join(backends)))
+    with api_client_lock:
+        if api_client:
+            api_client.close()
+        backend = backend_name
+        api_client = None
+
+
+def get_api_client():
+    """
+    Retrieves the shared containers API client if the api backend is enabled, creating it on first use.
+    If the client cannot be created, for example because there are no credentials, a warning is logged and the module falls back to the cli backend.
+    Returns: The IKSClient object or None if the cli should be used
+    """
+    global backend, api_client
+    if backend != 'api':
+        return None
+    with api_client_lock:
+        if api_client is None:
+            try:
+                api_client = IKSClient()
+            except Exception as e:
+                logger.warning('Unable to create IKS API client, falling back to the ibmcloud cli: {error}'.format(error=str(e)))
+                backend = 'cli'
+    return api_client
+
+
 def apply_pull_secret(cluster_name):
     """
     Triggers the application of default image pull secrets to an IKS cluster.
     Args:
         cluster_name: The name of the cluster to apply the pull secrets to
     """
-    baseutils.exe_cmd('/usr/local/bin/ibmcloud ks cluster pull-secret apply --cluster {cluster}'.format(cluster=baseutils.shell_escape(cluster_name)))
+    baseutils.exe_cmd([ibmcloud_binary, 'ks', 'cluster', 'pull-secret', 'apply', '--cluster', cluster_name])
 
 
 def configure_kubecfg(cluster_name):
@@ -61,7 +117,7 @@ def configure_kubecfg(cluster_name):
     Args:
         environment: The name of the IKS environment to configure locally
     """
-    cmd = '/usr/local/bin/ibmcloud ks cluster config --cluster {cluster_name}'.format(cluster_name=baseutils.shell_escape(cluster_name))
+    cmd = [ibmcloud_binary, 'ks', 'cluster', 'config', '--cluster', cluster_name]
     (rc, output) = baseutils.retry(baseutils.exe_cmd, cmd, interval=10, retry=6)
 
 
@@ -72,11 +128,11 @@ def configure_alb(alb_id, enable=True):
         alb_id: The ID of the ALB to configure
         enable: Whether to enable or disable the ALB. True enabled, False disables (Optional, default: True)
     """
-    baseutils.exe_cmd('/usr/local/bin/ibmcloud ks alb configure classic --alb-id {alb} {enable}'.format(
-        alb=baseutils.shell_escape(alb_id),
-        enable='--enable' if enable else '--disable'))
+    baseutils.exe_cmd([ibmcloud_binary, 'ks', 'alb', 'configure', 'classic', '--alb-id', alb_id, '--enable' if enable else '--disable'])
+    get_albs.invalidate()
 
 
+@baseutils.ttl_cache(seconds=alb_cache_seconds, env_keys=cache_env_keys)
 def get_albs(cluster_name):
     """
     Retrieves a list of ALBs for a given IKS cluster.
@@ -84,7 +140,7 @@ def get_albs(cluster_name):
         cluster_name: The name of the cluster to retrieve ALBs for or its ID
     Returns: A list of ALB objects
     """
-    (rc, output) = baseutils.exe_cmd('/usr/local/bin/ibmcloud ks alb ls --cluster {cluster} --json'.format(cluster=baseutils.shell_escape(cluster_name)))
+    (rc, output) = baseutils.exe_cmd([ibmcloud_binary, 'ks', 'alb', 'ls', '--cluster', cluster_name, '--json'])
     return ClusterALBs(json.loads(output))
 
 
@@ -105,40 +161,123 @@ def get_iks_clusters(cluster_name=None):
     return result
 
 
-def replace_iks_workers(cluster_name, workers):
+def replace_iks_workers(cluster_name, workers, batch_size=1, max_per_group=1, progress_callback=None):
     """
-    Drain and replace a series of workers, 1 at a time, in an IKS cluster.
+    Drain and replace a series of workers in an IKS cluster. By default, workers are replaced 1 at a time.
     A pod's terminationGracePeriodSeconds is obeyed during the draining of a node.
+    With a batch_size greater than 1, up to batch_size workers are drained and reloaded together and then waited on. Batches are picked across zones and worker pools,
+    with at most max_per_group workers from the same zone and worker pool in a batch, so that capacity remains available in every zone.
+    Before each batch is drained, the function waits until all PodDisruptionBudgets have recovered from the previous batch.
     Args:
         cluster_name. The name of the cluster to replace workers in or its ID
-        workers: A list of one or more worker objects to sequentially replace
-    """
+        workers: A list of one or more worker objects to replace
+        batch_size: The maximum number of workers to replace at the same time (Optional, default: 1)
+        max_per_group: The maximum number of workers from the same zone and worker pool to replace at the same time (Optional, default: 1)
+        progress_callback: A function called after each worker is replaced or skipped, with the arguments (cluster_name, worker, completed, total) (Optional)
+    """
+    completed = 0
+    for batch in _get_worker_batches(workers, batch_size, max_per_group):
+        if batch_size > 1:
+            k8shelpers.wait_for_pdb_headroom()
+        reloading_workers = []
+        for worker in batch:
+            # Ensure worker still exists, for example, in case of an auto-scaling cluster
+            current_worker = baseutils.retry(ks_worker_get, cluster_name, worker.id, interval=30, retry=40)
+            if current_worker and current_worker.state != 'deleted':
+                reloading_workers.append(current_worker)
+            else:
+                completed += 1
+                _report_worker_progress(cluster_name, worker, completed, len(workers), progress_callback)
+        if len(reloading_workers) > 1:
+            for worker in reloading_workers:  # Prevent pods evicted from one worker in the batch being scheduled to another
+                k8s.cordon(worker.private_ip)
+        for worker in list(reloading_workers):
+            k8s.drain(worker.private_ip)
+            reloaded = _reload_worker(cluster_name, worker)
+            ks_worker_ls.invalidate()
+            if not reloaded:
+                reloading_workers.remove(worker)
+                completed += 1
+                _report_worker_progress(cluster_name, worker, completed, len(workers), progress_callback)
+        for worker in reloading_workers:
+            # The workers reload concurrently, so waiting on each in turn takes as long as the slowest worker
+            wait_for_worker(cluster_name, worker)
+            completed += 1
+            _report_worker_progress(cluster_name, worker, completed, len(workers), progress_callback)
+
+
+def _get_worker_batches(workers, batch_size, max_per_group):
+    """
+    Splits a list of workers into the batches used by replace_iks_workers.
+    Workers are grouped by zone and worker pool and each batch takes workers from the groups in turn, starting with the group after the one the previous batch started with.
+    A batch size of 1 retains the original order of the workers.
+    Args:
+        workers: The list of workers to split
+        batch_size: The maximum number of workers in a batch
+        max_per_group: The maximum number of workers from the same zone and worker pool in a batch
+    Returns: A list of batches, each a list of workers
+    """
+    if batch_size <= 1:
+        return [[worker] for worker in workers]
+    groups = []
+    group_keys = []
     for worker in workers:
-        # Ensure worker still exists, for example, in case of an auto-scaling cluster
-        worker = baseutils.retry(ks_worker_get, cluster_name, worker.id, interval=30, retry=40)
-        if not worker or worker.state == 'deleted':
-            continue
-        k8s.drain(worker.private_ip)
-        if worker.kube_version == worker.target_version:
-            cmd = '/usr/local/bin/ibmcloud ks worker reload --cluster {cluster} --worker {worker} -f'.format(
-                cluster=baseutils.shell_escape(cluster_name),
-                worker=baseutils.shell_escape(worker.id))
-        elif 'pending' not in worker.kube_version:  # pending will be in the version field if the update has already been triggered
-            cmd = '/usr/local/bin/ibmcloud ks worker update --cluster {cluster} --worker {worker} -f'.format(
-                cluster=baseutils.shell_escape(cluster_name),
-                worker=baseutils.shell_escape(worker.id))
+        key = (worker.location, worker.pool_name)
+        if key not in group_keys:
+            group_keys.append(key)
+            groups.append([])
+        groups[group_keys.index(key)].append(worker)
+    batches = []
+    while any(groups):
+        batch = []
+        for group in groups:
+            group_count = min(max_per_group, batch_size - len(batch), len(group))
+            batch.extend(group[:group_count])
+            del group[:group_count]
+        batches.append(batch)
+        groups.append(groups.pop(0))
+    return batches
+
+
+def _reload_worker(cluster_name, worker):
+    """
+    Triggers the reload of a worker, or its update if it is not on its target version.
+    Args:
+        cluster_name. The name of the cluster the worker belongs to
+        worker: The worker to reload. Its state is set to reload_pending if the reload is triggered
+    Returns: True if the worker is being reloaded, False if the worker was deleted before the reload could be triggered
+    """
+    action = None
+    if worker.kube_version == worker.target_version:
+        action = 'reload'
+    elif 'pending' not in worker.kube_version:  # pending will be in the version field if the update has already been triggered
+        action = 'update'
+    if action:
         try:
-            baseutils.retry(baseutils.exe_cmd, cmd, interval=30, retry=40)
+            client = get_api_client()
+            if client:
+                baseutils.retry(client.reload_worker if action == 'reload' else client.update_worker, cluster_name, worker.id, interval=30, retry=40)
+            else:
+                baseutils.retry(baseutils.exe_cmd, [ibmcloud_binary, 'ks', 'worker', action, '--cluster', cluster_name, '--worker', worker.id, '-f'], interval=30, retry=40)
         except Exception as e:
             exc_message = str(e)
             if 'The specified worker has already been deleted' in exc_message:
-                continue
+                return False
             elif 'The worker node is already up to date with the latest version' not in exc_message:
                 # It's possible that a call to reload can return a failure from the api but still go through. Subsequent retries from the baseutils.retry
                 # function will then get this error message back. If the error is present, we can continue as normal.
                 raise
-        worker.state = 'reload_pending'
-        wait_for_worker(cluster_name, worker)
+    worker.state = 'reload_pending'
+    return True
+
+
+def _report_worker_progress(cluster_name, worker, completed, total, progress_callback):
+    """
+    Logs the progress of replace_iks_workers and passes it to the caller's progress callback, if any.
+    """
+    logger.info('Replaced {completed} of {total} workers in cluster {cluster}'.format(completed=completed, total=total, cluster=cluster_name))
+    if progress_callback:
+        progress_callback(cluster_name, worker, completed, total)
 
 
 def wait_for_worker(cluster_name, worker, seconds=5400):
@@ -157,7 +296,7 @@ def wait_for_worker(cluster_name, worker, seconds=5400):
     with baseutils.timeout(seconds=seconds):
         worker_still_exists = True  # For tolerating a worker being scaled out during the reload
         while worker_still_exists and (worker.state != 'normal' or worker.status != 'Ready' or worker.kube_version != worker.target_version or worker.pending_operation):
-            time.sleep(30)
+            baseutils.sleep(30)
             worker = baseutils.retry(ks_worker_get, cluster_name, worker.id, interval=30, retry=40)
             worker_still_exists = worker and worker.state != 'deleted' and worker.state != 'provision_failed'
         if worker_still_exists:
@@ -178,21 +317,25 @@ def update_iks_cluster(cluster_name, kube_version):
         cluster_name: The name of the cluster to update
         kube_version: The version to upgrade Kubernetes to in the form major.minor.patch
     """
-    cluster = baseutils.retry(ks_cluster_get, cluster_name, interval=30, retry=40)
+    cluster = baseutils.retry(ks_cluster_get.refresh, cluster_name, interval=30, retry=40)
     upgrade_version = semver.parse_version_info(kube_version.split('_', 1)[0])
     current_version = semver.parse_version_info(cluster.master_kube_version.split('_', 1)[0])
     if upgrade_version > current_version:
         master_kube_version_prefix = '{version}_'.format(version=kube_version)
         if not cluster.master_kube_version.startswith(master_kube_version_prefix) and 'pending' not in cluster.master_kube_version:
-            cmd = '/usr/local/bin/ibmcloud ks cluster master update --cluster {cluster} --kube-version {version} -f'.format(
-                cluster=baseutils.shell_escape(cluster_name),
-                version=baseutils.shell_escape(kube_version))
-            (rc, output) = baseutils.retry(baseutils.exe_cmd, cmd, interval=30, retry=40)
+            client = get_api_client()
+            if client:
+                baseutils.retry(client.update_master, cluster_name, kube_version, interval=30, retry=40)
+            else:
+                cmd = [ibmcloud_binary, 'ks', 'cluster', 'master', 'update', '--cluster', cluster_name, '--kube-version', kube_version, '-f']
+                (rc, output) = baseutils.retry(baseutils.exe_cmd, cmd, interval=30, retry=40)
         while not cluster.master_kube_version.startswith(master_kube_version_prefix) or 'pending' in cluster.master_kube_version:
             time.sleep(30)
-            cluster = baseutils.retry(ks_cluster_get, cluster_name, interval=30, retry=40)
+            cluster = baseutils.retry(ks_cluster_get.refresh, cluster_name, interval=30, retry=40)
+        ks_worker_ls.invalidate()  # The target version of the workers changes with the master
 
 
+@baseutils.ttl_cache(seconds=cluster_cache_seconds, env_keys=cache_env_keys)
 def ks_cluster_get(cluster_name):
     """
     Retrieves the details of an IKS cluster.
@@ -200,9 +343,25 @@ def ks_cluster_get(cluster_name):
         cluster_name: The name of the cluster to retrieve or its ID
     Returns: An IKSCluster object representing the cluster or None if it cannot be found
     """
+    client = get_api_client()
+    if client:
+        return client.get_cluster(cluster_name)
+    (rc, output) = baseutils.exe_cmd(_ks_cluster_get_cmd(cluster_name), raise_exception=False)
+    return _parse_ks_cluster_get(rc, output)
+
+
+def _ks_cluster_get_cmd(cluster_name):
+    """
+    Builds the ibmcloud command used by ks_cluster_get.
+    """
+    return [ibmcloud_binary, 'ks', 'cluster', 'get', '--cluster', cluster_name, '--json']
+
+
+def _parse_ks_cluster_get(rc, output):
+    """
+    Converts the result of the command built by _ks_cluster_get_cmd into an IKSCluster object or None if the cluster could not be found.
+    """
     cluster = None
-    (rc, output) = baseutils.exe_cmd('/usr/local/bin/ibmcloud ks cluster get --cluster {cluster} --json'.format(
-        cluster=baseutils.shell_escape(cluster_name)), raise_exception=False)
     if rc:
         if '(A0006)' not in output and '(G0004)' not in output:  # The specified cluster could not be found
             raise Exception('Error during call to ibmcloud cli')
@@ -216,7 +375,10 @@ def ks_cluster_ls():
     Retrieves a list of available IKS clusters.
     Returns: A list of IKSCluster objects
     """
-    (rc, output) = baseutils.exe_cmd('/usr/local/bin/ibmcloud ks cluster ls --json')
+    client = get_api_client()
+    if client:
+        return client.list_clusters()
+    (rc, output) = baseutils.exe_cmd([ibmcloud_binary, 'ks', 'cluster', 'ls', '--json'])
     return IKSCluster.parse_iks_clusters(json.loads(output))
 
 
@@ -228,10 +390,25 @@ def ks_worker_get(cluster_name, worker_id):
         worker_id. The id of the worker to look up
     Returns: An IKSWorker object representing the worker or None if it cannot be found
     """
+    client = get_api_client()
+    if client:
+        return client.get_worker(cluster_name, worker_id)
+    (rc, output) = baseutils.exe_cmd(_ks_worker_get_cmd(cluster_name, worker_id), raise_exception=False)
+    return _parse_ks_worker_get(rc, output)
+
+
+def _ks_worker_get_cmd(cluster_name, worker_id):
+    """
+    Builds the ibmcloud command used by ks_worker_get.
+    """
+    return [ibmcloud_binary, 'ks', 'worker', 'get', '--cluster', cluster_name, '--worker', worker_id, '--json']
+
+
+def _parse_ks_worker_get(rc, output):
+    """
+    Converts the result of the command built by _ks_worker_get_cmd into an IKSWorker object or None if the worker could not be found.
+    """
     worker = None
-    (rc, output) = baseutils.exe_cmd('/usr/local/bin/ibmcloud ks worker get --cluster {cluster} --worker {worker} --json'.format(
-        cluster=baseutils.shell_escape(cluster_name),
-        worker=baseutils.shell_escape(worker_id)), raise_exception=False)
     if rc:
         if '(E0011)' not in output:  # The specified worker node could not be found. (E0011)
             raise Exception('Error during call to ibmcloud cli')
@@ -240,6 +417,7 @@ def ks_worker_get(cluster_name, worker_id):
     return worker
 
 
+@baseutils.ttl_cache(seconds=worker_cache_seconds, env_keys=cache_env_keys)
 def ks_worker_ls(cluster_name, worker_pool_name=None):
     """
     Retrieves a list of worker nodes in an IKS cluster.
@@ -249,9 +427,11 @@ def ks_worker_ls(cluster_name, worker_pool_name=None):
         worker_pool. The name of a worker pool to limit the retrieval for (Optional, default: all pools)
     Returns: A list of IKSWroker objects
     """
-    (rc, output) = baseutils.exe_cmd('/usr/local/bin/ibmcloud ks worker ls --cluster {cluster} {worker_pool} --json'.format(
-        cluster=baseutils.shell_escape(cluster_name),
-        worker_pool='--worker-pool {pool_name}'.format(pool_name=baseutils.shell_escape(worker_pool_name)) if worker_pool_name else ''))
+    client = get_api_client()
+    if client:
+        return client.list_workers(cluster_name, worker_pool_name=worker_pool_name)
+    (rc, output) = baseutils.exe_cmd([ibmcloud_binary, 'ks', 'worker', 'ls', '--cluster', cluster_name] + (
+        ['--worker-pool', worker_pool_name] if worker_pool_name else []) + ['--json'])
     return IKSWorker.parse_iks_workers(json.loads(output))
 
 
@@ -267,16 +447,12 @@ def ks_worker_pool_create_classic(cluster_name, worker_pool_name, machine_type,
         labels: A dictionary of key-value pairs representing labels to apply to workers in the worker pool (Optional)
     Returns: The IKSWorkerPool model for the newly created worker pool
     """
-    baseutils.exe_cmd(('/usr/local/bin/ibmcloud ks worker-pool create classic --cluster {cluster_name} --machine-type {machine_type} --name {worker_pool_name} '
-                       '--size-per-zone {size_per_zone} --hardware {hardware} {labels}').format(
-                       cluster_name=baseutils.shell_escape(cluster_name),
-                       worker_pool_name=baseutils.shell_escape(worker_pool_name),
-                       machine_type=baseutils.shell_escape(machine_type),
-                       size_per_zone=int(size_per_zone),
-                       hardware=baseutils.shell_escape(hardware),
-                       labels=' '.join(['--label {label}'.format(
-                           label=baseutils.shell_escape('{key}={value}'.format(key=key, value=value))) for (key, value) in labels.items()]) if labels else ''
-                       ))
+    cmd = [ibmcloud_binary, 'ks', 'worker-pool', 'create', 'classic', '--cluster', cluster_name, '--machine-type', machine_type, '--name', worker_pool_name,
+           '--size-per-zone', str(int(size_per_zone)), '--hardware', hardware]
+    for (key, value) in (labels or {}).items():
+        cmd.extend(['--label', '{key}={value}'.format(key=key, value=value)])
+    baseutils.exe_cmd(cmd)
+    _invalidate_worker_pool_reads(cluster_name)
 
 
 def ks_worker_pool_get(cluster_name, worker_pool_name):
@@ -287,12 +463,14 @@ def ks_worker_pool_get(cluster_name, worker_pool_name):
         worker_pool_name: The name of the worker pool to retrieve
     Returns: An IKSWorkerPool model representing the worker pool
     """
-    (rc, output) = baseutils.exe_cmd('/usr/local/bin/ibmcloud ks worker-pool get --cluster {cluster} --worker-pool {worker_pool} --json'.format(
-        cluster=baseutils.shell_escape(cluster_name),
-        worker_pool=baseutils.shell_escape(worker_pool_name)))
+    client = get_api_client()
+    if client:
+        return client.get_worker_pool(cluster_name, worker_pool_name)
+    (rc, output) = baseutils.exe_cmd([ibmcloud_binary, 'ks', 'worker-pool', 'get', '--cluster', cluster_name, '--worker-pool', worker_pool_name, '--json'])
     return IKSWorkerPool(json.loads(output))
 
 
+@baseutils.ttl_cache(seconds=worker_pool_cache_seconds, env_keys=cache_env_keys)
 def ks_worker_pool_ls(cluster_name):
     """
     Retrieve all worker pools for a cluster.
@@ -300,7 +478,10 @@ def ks_worker_pool_ls(cluster_name):
         cluster_name: The name of the cluster to query
     Returns: A list of IKSWorkerPool models
     """
-    (rc, output) = baseutils.exe_cmd('/usr/local/bin/ibmcloud ks worker-pool ls --cluster {cluster} --json'.format(cluster=baseutils.shell_escape(cluster_name)))
+    client = get_api_client()
+    if client:
+        return client.list_worker_pools(cluster_name)
+    (rc, output) = baseutils.exe_cmd([ibmcloud_binary, 'ks', 'worker-pool', 'ls', '--cluster', cluster_name, '--json'])
     return IKSWorkerPool.parse_iks_worker_pools(json.loads(output))
 
 
@@ -311,9 +492,12 @@ def ks_worker_pool_rm(cluster_name, worker_pool_name):
         cluster_name: The name of the cluster to process
         worker_pool_name: The name of the worker pool to remove
     """
-    baseutils.exe_cmd('/usr/local/bin/ibmcloud ks worker-pool rm --cluster {cluster} --worker-pool {worker_pool} -f'.format(
-        cluster=baseutils.shell_escape(cluster_name),
-        worker_pool=baseutils.shell_escape(worker_pool_name)))
+    client = get_api_client()
+    if client:
+        client.remove_worker_pool(cluster_name, worker_pool_name)
+    else:
+        baseutils.exe_cmd([ibmcloud_binary, 'ks', 'worker-pool', 'rm', '--cluster', cluster_name, '--worker-pool', worker_pool_name, '-f'])
+    _invalidate_worker_pool_reads(cluster_name)
 
 
 def ks_worker_pool_labels(cluster_name, worker_pool_name, labels):
@@ -337,6 +521,7 @@ def ks_worker_pool_labels(cluster_name, worker_pool_name, labels):
         }
     )
     response.raise_for_status()
+    _invalidate_worker_pool_reads(cluster_name)
 
 
 def ks_zone_add_classic(cluster_name, zone, worker_pool_name, private_vlan_id, public_vlan_id=None):
@@ -349,12 +534,17 @@ def ks_zone_add_classic(cluster_name, zone, worker_pool_name, private_vlan_id, p
         private_vlan_id: The ID of the private vlan in the new zone to deploy the IKS pool to
         public_vlan_id: The ID of the public vlan in the new zone to deploy the IKS pool to. (Optional, default: no public vlan)
     """
-    baseutils.exe_cmd('/usr/local/bin/ibmcloud ks  zone add classic --cluster {cluster} --zone {zone} --worker-pool {pool} --private-vlan {private_vlan_id} {public_vlan}'.format(
-        cluster=baseutils.shell_escape(cluster_name),
-        zone=baseutils.shell_escape(zone),
-        pool=baseutils.shell_escape(worker_pool_name),
-        private_vlan_id=baseutils.shell_escape(private_vlan_id),
-        public_vlan='--public-vlan {public_vlan_id}'.format(public_vlan_id=baseutils.shell_escape(public_vlan_id)) if public_vlan_id else '--private-only'))
+    baseutils.exe_cmd([ibmcloud_binary, 'ks', 'zone', 'add', 'classic', '--cluster', cluster_name, '--zone', zone, '--worker-pool', worker_pool_name,
+                       '--private-vlan', str(private_vlan_id)] + (['--public-vlan', str(public_vlan_id)] if public_vlan_id else ['--private-only']))
+    _invalidate_worker_pool_reads(cluster_name)
+
+
+def _invalidate_worker_pool_reads(cluster_name):
+    """
+    Discards the cached worker pools and workers of a cluster after its worker pools are modified.
+    """
+    ks_worker_pool_ls.invalidate(cluster_name)
+    ks_worker_ls.invalidate()  # Cached for each combination of cluster and worker pool
 
 
 def ks_cluster_remove(cluster_name):
@@ -364,7 +554,10 @@ def ks_cluster_remove(cluster_name):
     Args:
         cluster_name: The name of the cluster to destroy
     """
-    baseutils.exe_cmd('/usr/local/bin/ibmcloud ks cluster rm --cluster {cluster} -f'.format(cluster=baseutils.shell_escape(cluster_name)))
+    baseutils.exe_cmd([ibmcloud_binary, 'ks', 'cluster', 'rm', '--cluster', cluster_name, '-f'])
+    ks_cluster_get.invalidate(cluster_name)
+    ks_worker_pool_ls.invalidate(cluster_name)
+    ks_worker_ls.invalidate()
 
 
 def ks_enable_key_protect(cluster_name, region, key_protect_instance_guid, key_id):
@@ -379,16 +572,13 @@ def ks_enable_key_protect(cluster_name, region, key_protect_instance_guid, key_i
         key_protect_instance_guid; The GUID of the Key Protect instance
         key_id: The ID of the key inside Key Protect to use. This should be a root key
     """
-    cluster = baseutils.retry(ks_cluster_get, cluster_name, interval=30, retry=40)
+    cluster = baseutils.retry(ks_cluster_get.refresh, cluster_name, interval=30, retry=40)
     if not cluster.key_protect_enabled:
-        baseutils.exe_cmd('/usr/local/bin/ibmcloud ks key-protect-enable --cluster {cluster} --key-protect-url {kp_url} --key-protect-instance {kp_guid} --crk {key_id}'.format(
-            cluster=baseutils.shell_escape(cluster_name),
-            kp_url=baseutils.shell_escape('{region}.kms.cloud.ibm.com'.format(region=region)),
-            kp_guid=baseutils.shell_escape(key_protect_instance_guid),
-            key_id=baseutils.shell_escape(key_id)))
+        baseutils.exe_cmd([ibmcloud_binary, 'ks', 'key-protect-enable', '--cluster', cluster_name, '--key-protect-url', '{region}.kms.cloud.ibm.com'.format(region=region),
+                           '--key-protect-instance', key_protect_instance_guid, '--crk', key_id])
     while not cluster.key_protect_enabled or cluster.master_status != 'Ready':
         time.sleep(30)
-        cluster = baseutils.retry(ks_cluster_get, cluster_name, interval=30, retry=40)
+        cluster = baseutils.retry(ks_cluster_get.refresh, cluster_name, interval=30, retry=40)
 
 
 def get_resource_service_instances(name=None, service=None, type=None, location=None):
@@ -402,9 +592,8 @@ def get_resource_service_instances(name=None, service=None, type=None, location=
         location: The location of the instances to query. "global" is a valid location (Optional)
     Returns: A list of ServiceInstance objects
     """
-    (rc, output) = baseutils.exe_cmd('/usr/local/bin/ibmcloud resource service-instances {service} {location} --output json'.format(
-        service='--service-name {service}'.format(service=baseutils.shell_escape(service)) if service else '',
-        location='--location {location}'.format(location=baseutils.shell_escape(location)) if location else ''))
+    (rc, output) = baseutils.exe_cmd([ibmcloud_binary, 'resource', 'service-instances'] + (['--service-name', service] if service else []) + (
+        ['--location', location] if location else []) + ['--output', 'json'])
     instances = ServiceInstance.parse_service_instances(json.loads(output) or [])
     if name:
         instances = [instance for instance in instances if instance.name == name]
@@ -422,12 +611,8 @@ def create_resource_service_instance(name, service, plan, location, parameters=N
         location: The location of the instance create. The location can be "global"
         paramaters: JSON paramaters (as a dictionary) that can be passed to the instance creation call (Optional)
     """
-    (rc, output) = baseutils.exe_cmd('/usr/local/bin/ibmcloud resource service-instance-create {name} {service} {plan} {location} {parameters}'.format(
-        name=baseutils.shell_escape(name),
-        service=baseutils.shell_escape(service),
-        plan=baseutils.shell_escape(plan),
-        location=baseutils.shell_escape(location),
-        parameters='--parameters {parameters}'.format(parameters=baseutils.shell_escape(json.dumps(parameters))) if parameters else ''))
+    (rc, output) = baseutils.exe_cmd([ibmcloud_binary, 'resource', 'service-instance-create', name, service, plan, location] + (
+        ['--parameters', json.dumps(parameters)] if parameters else []))
 
 
 def get_user_access_groups(user_email):
@@ -438,8 +623,7 @@ def get_user_access_groups(user_email):
         user_email: The email of the user to fetch environments for
     Returns: A list of environments that the user has editor access to
     """
-    (rc, output) = baseutils.exe_cmd('ibmcloud iam access-groups {user}'
-                                     .format(user='-u {user_email}'.format(user_email=user_email)))
+    (rc, output) = baseutils.exe_cmd([ibmcloud_binary, 'iam', 'access-groups', '-u', user_email])
     # Ignore the status and table header lines
     output_lines = output.splitlines()[2:]
     access_groups_list = []
@@ -460,8 +644,8 @@ def get_resource_service_keys(name=None, instance_id=None):
         instance_id: The ID of the service instance to filter the keys by. A service instance can still have multiple keys (Optional)
     Returns: A list of ServiceKey objects
     """
-    (rc, output) = baseutils.exe_cmd('/usr/local/bin/ibmcloud resource service-keys {instance} --output json'.format(
-        instance='--instance-id {instance}'.format(instance=baseutils.shell_escape(instance_id)) if instance_id else ''), log_level=logging.NOTSET)  # Don't log the keys
+    (rc, output) = baseutils.exe_cmd([ibmcloud_binary, 'resource', 'service-keys'] + (['--instance-id', instance_id] if instance_id else []) + ['--output', 'json'],
+                                     log_level=logging.NOTSET)  # Don't log the keys
     keys = ServiceKey.parse_service_keys(json.loads(output) or [])
     if name:
         keys = [key for key in keys if key.name == name]
@@ -479,14 +663,11 @@ def create_resource_service_key(name, role, instance_id, service_endpoint=None,
         service_endpoint: Type of service endpoint, 'public' or 'private' (Optional)
         paramaters: JSON paramaters (as a dictionary) that can be passed to the key creation call (Optional)
     """
-    (rc, output) = baseutils.exe_cmd('/usr/local/bin/ibmcloud resource service-key-create {name} {role} --instance-id  {instance_id} {service_endpoint} {parameters}'.format(
-        name=baseutils.shell_escape(name),
-        role=baseutils.shell_escape(role),
-        instance_id=baseutils.shell_escape(instance_id),
-        service_endpoint='--service-endpoint {service_endpoint}'.format(service_endpoint=baseutils.shell_escape(service_endpoint)) if service_endpoint else '',
-        parameters='--parameters {parameters}'.format(parameters=baseutils.shell_escape(json.dumps(parameters))) if parameters else ''))
+    (rc, output) = baseutils.exe_cmd([ibmcloud_binary, 'resource', 'service-key-create', name, role, '--instance-id', instance_id] + (
+        ['--service-endpoint', service_endpoint] if service_endpoint else []) + (['--parameters', json.dumps(parameters)] if parameters else []))
 
 
+@baseutils.ttl_cache(seconds=subnet_cache_seconds, env_keys=cache_env_keys)
 def get_subnets(ids=None, note=None):
     """
     Retrieves a list of subnets specific to the currently configured cli region.
@@ -496,7 +677,7 @@ def get_subnets(ids=None, note=None):
         note: A particular note value to look for (Optional)
     Returns: A list of subnet objects
     """
-    (rc, output) = baseutils.exe_cmd('/usr/local/bin/ibmcloud ks subnets --provider=classic --json')
+    (rc, output) = baseutils.exe_cmd([ibmcloud_binary, 'ks', 'subnets', '--provider=classic', '--json'])
     subnets = Subnet.parse_subnets(json.loads(output))
     if ids:
         subnets = [subnet for subnet in subnets if subnet.id in ids]
@@ -512,11 +693,12 @@ def add_cluster_subnet(cluster_name, subnet_id):
         cluster_name: The name of the IKS cluster to bind it to or its ID
         subnet_id: The ID of the subnet to add
     """
-    baseutils.exe_cmd('/usr/local/bin/ibmcloud ks cluster subnet add --cluster {cluster_name} --subnet-id {subnet_id}'.format(
-        cluster_name=baseutils.shell_escape(cluster_name),
-        subnet_id=baseutils.shell_escape(subnet_id)))
+    baseutils.exe_cmd([ibmcloud_binary, 'ks', 'cluster', 'subnet', 'add', '--cluster', cluster_name, '--subnet-id', str(subnet_id)])
+    get_subnets.invalidate()
+    ks_cluster_get.invalidate(cluster_name)
 
 
+@baseutils.ttl_cache(seconds=kube_version_cache_seconds, env_keys=cache_env_keys)
 def get_kube_versions(version_to_match=None):
     """
     Retrieves a list of available Kubernetes versions for IKS.
@@ -525,7 +707,7 @@ def get_kube_versions(version_to_match=None):
         version: A version for which the major and minor version should be matched for the returned supported version (Optional)
     Returns: A list of supported K8s versions. If version_to_match is specified, a single supported version or None
     """
-    (rc, output) = baseutils.exe_cmd('/usr/local/bin/ibmcloud ks versions --json')
+    (rc, output) = baseutils.exe_cmd([ibmcloud_binary, 'ks', 'versions', '--json'])
     kube_versions = json.loads(output)['kubernetes']
     if version_to_match:
         result = None
@@ -554,10 +736,10 @@ def login(api_key, region=None, resource_group=None):
         infra_username: Username for access to SoftLayer infrastructure (Optional)
         infra_api_key: API key for SoftLayer infrastructure (Optional)
     """
-    baseutils.exe_cmd('/usr/local/bin/ibmcloud login -a https://cloud.ibm.com {region} {resource_group} --apikey {api_key}'.format(
-        region='-r {region}'.format(region=baseutils.shell_escape(region)) if region else '--no-region',
-        resource_group='-g {resource_group}'.format(resource_group=baseutils.shell_escape(resource_group)) if resource_group else '',
-        api_key=baseutils.shell_escape(api_key)), obfuscate=baseutils.shell_escape(api_key))
+    baseutils.exe_cmd([ibmcloud_binary, 'login', '-a', 'https://cloud.ibm.com'] + (['-r', region] if region else ['--no-region']) + (
+        ['-g', resource_group] if resource_group else []) + ['--apikey', api_key], obfuscate=baseutils.shell_escape(api_key))
+    _invalidate_cached_reads()
+    set_backend(backend)  # Discards any API client created with the previous credentials
 
 
 def target(region=None, resource_group=None, org=None, space=None):
@@ -572,23 +754,31 @@ def target(region=None, resource_group=None, org=None, space=None):
     """
     target = None
     if region or resource_group or (org and space):
-        baseutils.exe_cmd('/usr/local/bin/ibmcloud target {region} {resource_group} {cf}'.format(
-            region='-r {region}'.format(region=baseutils.shell_escape(region)) if region else '',
-            resource_group='-g {resource_group}'.format(resource_group=baseutils.shell_escape(resource_group)) if resource_group else '',
-            cf='--cf -o {org} -s {space}'.format(org=baseutils.shell_escape(org), space=baseutils.shell_escape(space)) if (org and space) else ''))
+        baseutils.exe_cmd([ibmcloud_binary, 'target'] + (['-r', region] if region else []) + (['-g', resource_group] if resource_group else []) + (
+            ['--cf', '-o', org, '-s', space] if (org and space) else []))
+        _invalidate_cached_reads()
+        set_backend(backend)  # Discards any API client created for the previous resource group
     else:
-        (rc, output) = baseutils.exe_cmd('/usr/local/bin/ibmcloud target --output json')
+        (rc, output) = baseutils.exe_cmd([ibmcloud_binary, 'target', '--output', 'json'])
         target = Target(json.loads(output))
     return target
 
 
+def _invalidate_cached_reads():
+    """
+    Discards all cached results after the targeted account, region or resource group changes.
+    """
+    for func in [ks_cluster_get, ks_worker_ls, ks_worker_pool_ls, get_albs, get_subnets, get_kube_versions, kp_list]:
+        func.invalidate()
+
+
 def ks_alb_cert_ls(cluster_name):
     """
     List the current ALB certificates deployed for a cluster.
     Args:
         cluster_name: The name of the IKS cluster to check
     """
-    (rc, output) = baseutils.exe_cmd('/usr/local/bin/ibmcloud ks alb cert ls --cluster {cluster_name} --json'.format(cluster_name=baseutils.shell_escape(cluster_name)))
+    (rc, output) = baseutils.exe_cmd([ibmcloud_binary, 'ks', 'alb', 'cert', 'ls', '--cluster', cluster_name, '--json'])
     return ALBCertificate.parse_alb_certificates(json.loads(output) or [])
 
 
@@ -604,11 +794,8 @@ def ks_alb_cert_deploy(cluster_name, secret_name, cert_crn):
     """
     current_alb_certificates = ks_alb_cert_ls(cluster_name)
     update_flow = any(alb_certificate.secret_name == secret_name for alb_certificate in current_alb_certificates)
-    baseutils.exe_cmd('/usr/local/bin/ibmcloud ks alb cert deploy --cluster {cluster_name} --secret-name {secret_name} --cert-crn {cert_crn} {update}'.format(
-        cluster_name=baseutils.shell_escape(cluster_name),
-        secret_name=baseutils.shell_escape(secret_name),
-        cert_crn=baseutils.shell_escape(cert_crn),
-        update='--update' if update_flow else ''))
+    baseutils.exe_cmd([ibmcloud_binary, 'ks', 'alb', 'cert', 'deploy', '--cluster', cluster_name, '--secret-name', secret_name, '--cert-crn', cert_crn] + (
+        ['--update'] if update_flow else []))
 
 
 def ks_infra_credentials(username, api_key):
@@ -619,9 +806,8 @@ def ks_infra_credentials(username, api_key):
         infra_username: Username for access to SoftLayer infrastructure (Optional)
         infra_api_key: API key for SoftLayer infrastructure (Optional)
     """
-    baseutils.exe_cmd('/usr/local/bin/ibmcloud ks credential set classic --infrastructure-username {username} --infrastructure-api-key {api_key}'.format(
-        username=baseutils.shell_escape(username),
-        api_key=baseutils.shell_escape(api_key)), obfuscate=baseutils.shell_escape(api_key))
+    baseutils.exe_cmd([ibmcloud_binary, 'ks', 'credential', 'set', 'classic', '--infrastructure-username', username, '--infrastructure-api-key', api_key],
+                      obfuscate=baseutils.shell_escape(api_key))
 
 
 def ks_cluster_master_auditwebhook_set(cluster_name, remote_url):
@@ -632,9 +818,7 @@ def ks_cluster_master_auditwebhook_set(cluster_name, remote_url):
         cluster_name: The name of the IKS cluster to configure
         remote_url: The remove url to send webhooks to, including http:// as appropriate
     """
-    baseutils.exe_cmd('/usr/local/bin/ibmcloud ks cluster master audit-webhook set --cluster {cluster_name} --remote-server {remote_url}'.format(
-        cluster_name=baseutils.shell_escape(cluster_name),
-        remote_url=baseutils.shell_escape(remote_url)))
+    baseutils.exe_cmd([ibmcloud_binary, 'ks', 'cluster', 'master', 'audit-webhook', 'set', '--cluster', cluster_name, '--remote-server', remote_url])
 
 
 def ks_cluster_master_refresh(cluster_name):
@@ -644,7 +828,7 @@ def ks_cluster_master_refresh(cluster_name):
     Args:
         cluster_name: The name of the IKS cluster to refresh
     """
-    baseutils.exe_cmd('/usr/local/bin/ibmcloud ks cluster master refresh --cluster {cluster_name}'.format(cluster_name=baseutils.shell_escape(cluster_name)))
+    baseutils.exe_cmd([ibmcloud_binary, 'ks', 'cluster', 'master', 'refresh', '--cluster', cluster_name])
 
 
 def iam_oauth_tokens():
@@ -655,7 +839,7 @@ def iam_oauth_tokens():
         infra_username: Username for access to SoftLayer infrastructure (Optional)
         infra_api_key: API key for SoftLayer infrastructure (Optional)
     """
-    (rc, output) = baseutils.exe_cmd('/usr/local/bin/ibmcloud iam oauth-tokens --output json', log_level=logging.NOTSET)  # Don't log the oauth tokens
+    (rc, output) = baseutils.exe_cmd([ibmcloud_binary, 'iam', 'oauth-tokens', '--output', 'json'], log_level=logging.NOTSET)  # Don't log the oauth tokens
     return json.loads(output)
 
 
@@ -666,8 +850,7 @@ def iam_service_policies(service_id_name):
         service_id_name: The name of the Service ID to query
     Returns: A list of ServicePolicy objects
     """
-    (rc, output) = baseutils.exe_cmd('/usr/local/bin/ibmcloud iam service-policies {service_id_name} --output json'.format(
-        service_id_name=baseutils.shell_escape(service_id_name)))
+    (rc, output) = baseutils.exe_cmd([ibmcloud_binary, 'iam', 'service-policies', service_id_name, '--output', 'json'])
     policies = ServicePolicy.parse_service_policies(json.loads(output))
     return policies
 
@@ -684,10 +867,7 @@ def iam_service_policy_update(service_id_name, service_policy):
     try:
         with open(policy_file, 'w') as fh:
             json.dump(service_policy, fh, default=lambda o: getattr(o, 'to_json')())
-        (rc, output) = baseutils.exe_cmd('/usr/local/bin/ibmcloud iam service-policy-update {service_id_name} {policy_id} --file {policy} -f --output json'.format(
-            service_id_name=baseutils.shell_escape(service_id_name),
-            policy_id=baseutils.shell_escape(service_policy.id),
-            policy=baseutils.shell_escape(policy_file)))
+        (rc, output) = baseutils.exe_cmd([ibmcloud_binary, 'iam', 'service-policy-update', service_id_name, service_policy.id, '--file', policy_file, '-f', '--output', 'json'])
     finally:
         shutil.rmtree(tmp_dir)
 
@@ -702,15 +882,14 @@ def kp_create(instance_id, key_name, key_material=None, standard_key=False):
         standard_key: Set True if this should be a standard key. Otherwise it will be a root key (Optional, default: False)
     Returns: The ID of the new key
     """
-    cmd = '/usr/local/bin/ibmcloud kp create {key_name} --instance-id {instance_id} {key_material} {standard_key} --output json'.format(
-        key_name=baseutils.shell_escape(key_name),
-        instance_id=baseutils.shell_escape(instance_id),
-        key_material='--key-material {key_material}'.format(key_material=baseutils.shell_escape(key_material)) if key_material else '',
-        standard_key='--standard-key' if standard_key else '')
+    cmd = [ibmcloud_binary, 'kp', 'create', key_name, '--instance-id', instance_id] + (['--key-material', key_material] if key_material else []) + (
+        ['--standard-key'] if standard_key else []) + ['--output', 'json']
     (rc, output) = baseutils.retry(baseutils.exe_cmd, cmd, interval=10, retry=5)
+    kp_list.invalidate()
     return KPKey(json.loads(output))
 
 
+@baseutils.ttl_cache(seconds=kp_key_cache_seconds, env_keys=cache_env_keys)
 def kp_list(instance_id, name=None):
     """
     List and return all keys in a Key Protect instance.
@@ -719,7 +898,7 @@ def kp_list(instance_id, name=None):
         name: Filters the resultant key list to keys with a specified name (Optional)
     Returns: A list of KPKey objects
     """
-    cmd = '/usr/local/bin/ibmcloud kp list --instance-id {instance_id} --output json'.format(instance_id=baseutils.shell_escape(instance_id))
+    cmd = [ibmcloud_binary, 'kp', 'list', '--instance-id', instance_id, '--output', 'json']
     (rc, output) = baseutils.retry(baseutils.exe_cmd, cmd, interval=10, retry=5)
     keys = KPKey.parse_kp_keys(json.loads(output) or [])
     if name:
@@ -732,7 +911,9 @@ def file_volume_list():
     Args: None
     Returns: Returns a list of all file volumes with column headers specified in call
     """
-    cmd = '/usr/local/bin/ibmcloud sl file volume-list --column id --column username --column datacenter --column storage_type --column capacity_gb --column bytes_used --column ip_addr --column mount_addr --column notes'  # noqa
+    cmd = [ibmcloud_binary, 'sl', 'file', 'volume-list']
+    for column in ['id', 'username', 'datacenter', 'storage_type', 'capacity_gb', 'bytes_used', 'ip_addr', 'mount_addr', 'notes']:
+        cmd.extend(['--column', column])
     (rc, output) = baseutils.retry(baseutils.exe_cmd, cmd, interval=10, retry=5)
     file_volume_model_list = Volume.parse_volumes(output, 'file')
     return file_volume_model_list
@@ -743,7 +924,9 @@ def block_volume_list():
     Args: None
     Returns: Returns a list of all block volumes with column headers specified in call
     """
-    cmd = '/usr/local/bin/ibmcloud sl block volume-list --column id --column username --column datacenter --column storage_type --column capacity_gb --column bytes_used --column ip_addr --column notes'  # noqa
+    cmd = [ibmcloud_binary, 'sl', 'block', 'volume-list']
+    for column in ['id', 'username', 'datacenter', 'storage_type', 'capacity_gb', 'bytes_used', 'ip_addr', 'notes']:
+        cmd.extend(['--column', column])
     (rc, output) = baseutils.retry(baseutils.exe_cmd, cmd, interval=10, retry=5)
     block_volume_model_list = Volume.parse_volumes(output, 'block')
     return block_volume_model_list
@@ -755,8 +938,7 @@ def sl_volume_detail(volume_id, volume_type):
         volume_id: The ID of the block volume
     Returns: Returns a description of the block volume
     """
-    cmd = '/usr/local/bin/ibmcloud sl {volume_type} volume-detail {volume_id}'.format(
-        volume_type=baseutils.shell_escape(volume_type), volume_id=baseutils.shell_escape(volume_id))
+    cmd = [ibmcloud_binary, 'sl', volume_type, 'volume-detail', str(volume_id)]
     (rc, output) = baseutils.retry(baseutils.exe_cmd, cmd, interval=10, retry=5)
     output = output.split('\n')[1:]
     volume_details = {}
@@ -793,7 +975,7 @@ def sl_file_volume_cancel(volume_id):
     EXAMPLE:
     ibmcloud.sl_file_volume_cancel(12345678)
     This command cancels volume with ID 12345678 immediately and without asking for confirmation"""
-    baseutils.exe_cmd('/usr/local/bin/ibmcloud sl file volume-cancel {volume_id} --immediate -f'.format(volume_id=baseutils.shell_escape(volume_id)))
+    baseutils.exe_cmd([ibmcloud_binary, 'sl', 'file', 'volume-cancel', str(volume_id), '--immediate', '-f'])
 
 
 def sl_block_volume_cancel(volume_id):
@@ -803,7 +985,7 @@ def sl_block_volume_cancel(volume_id):
     EXAMPLE:
     ibmcloud.sl_block_volume_cancel(12345678)
     This command cancels volume with ID 12345678 immediately and without asking for confirmation"""
-    baseutils.exe_cmd('/usr/local/bin/ibmcloud sl block volume-cancel {volume_id} --immediate -f'.format(volume_id=baseutils.shell_escape(volume_id)))
+    baseutils.exe_cmd([ibmcloud_binary, 'sl', 'block', 'volume-cancel', str(volume_id), '--immediate', '-f'])
 
 
 def sl_call_api(service, method, init, mask='', parameters='', limit='', offset=''):
@@ -818,17 +1000,10 @@ def sl_call_api(service, method, init, mask='', parameters='', limit='', offset=
         offset (optional): Result offset (default: 0)
     Returns: The JSON result parsed as a python dict
     """
-    if mask:
-        mask = '--mask {mask}'.format(mask=baseutils.shell_escape(mask))
-    if parameters:
-        parameters = '--parameters {parameters}'.format(parameters=baseutils.shell_escape(parameters))
-    if limit:
-        limit = '--limit {limit}'.format(limit=baseutils.shell_escape(limit))
-    if offset:
-        offset = '--offset {offset}'.format(offset=baseutils.shell_escape(offset))
-    options = '--init {init} {mask} {parameters} {limit} {offset}'.format(init=baseutils.shell_escape(init), mask=mask, parameters=parameters,
-                                                                          limit=limit, offset=offset)
-    cmd = '/usr/local/bin/ibmcloud sl call-api {service} {method} {options}'.format(service=service, method=method, options=options)
+    cmd = [ibmcloud_binary, 'sl', 'call-api', service, method, '--init', str(init)]
+    for (option, value) in [('--mask', mask), ('--parameters', parameters), ('--limit', limit), ('--offset', offset)]:
+        if value:
+            cmd.extend([option, str(value)])
     (rc, output) = baseutils.exe_cmd(cmd)
     if output:
         return json.loads(output)
@@ -843,21 +1018,21 @@ def setup_cli(update=True):
     """
     logger.info('Acquiring log to query and insall/update IBM Cloud CLI')
     with baseutils.local_lock(lock_name=cli_update_lock_name):
-        if not os.path.exists('/usr/local/bin/ibmcloud'):
+        if not os.path.exists(ibmcloud_binary):
             logger.info('Installing IBM Cloud CLI')
             tmp_dir = tempfile.mkdtemp()
             try:
-                baseutils.exe_cmd('/usr/bin/curl -L https://clis.cloud.ibm.com/download/bluemix-cli/latest/linux64/archive -o {tmp_dir}/ibmcloud-cli.tar.gz'.format(
-                    tmp_dir=tmp_dir))
-                baseutils.exe_cmd('/bin/tar -xzvf {tmp_dir}/ibmcloud-cli.tar.gz -C {tmp_dir}'.format(tmp_dir=tmp_dir))
-                baseutils.exe_cmd('sudo mv {tmp_dir}/IBM_Cloud_CLI/ibmcloud /usr/local/bin/ibmcloud'.format(tmp_dir=tmp_dir))  # Travis needs sudo
+                cli_tar = os.path.join(tmp_dir, 'ibmcloud-cli.tar.gz')
+                baseutils.exe_cmd(['/usr/bin/curl', '-L', 'https://clis.cloud.ibm.com/download/bluemix-cli/latest/linux64/archive', '-o', cli_tar])
+                baseutils.exe_cmd(['/bin/tar', '-xzvf', cli_tar, '-C', tmp_dir])
+                baseutils.exe_cmd(['sudo', 'mv', os.path.join(tmp_dir, 'IBM_Cloud_CLI', 'ibmcloud'), ibmcloud_binary])  # Travis needs sudo
             finally:
                 shutil.rmtree(tmp_dir)
-            baseutils.exe_cmd('/usr/local/bin/ibmcloud config --check-version=false')
+            baseutils.exe_cmd([ibmcloud_binary, 'config', '--check-version=false'])
         elif update:
             logger.info('Updating IBM Cloud CLI...')
-            baseutils.exe_cmd('/usr/local/bin/ibmcloud update --force')
-            baseutils.exe_cmd('/usr/local/bin/ibmcloud plugin update -r "IBM Cloud" --all')
+            baseutils.exe_cmd([ibmcloud_binary, 'update', '--force'])
+            baseutils.exe_cmd([ibmcloud_binary, 'plugin', 'update', '-r', 'IBM Cloud', '--all'])
         else:
             logger.info('IBMCloud CLI is already present')
     for plugin_name in ['container-service', 'container-registry', 'key-protect']:
@@ -879,7 +1054,5 @@ def plugin_install(plugin_name, repository='IBM Cloud', version=None):
     logger.info('Acquiring lock to query status of IBM Cloud plugin "{plugin}"'.format(plugin=plugin_name))
     with baseutils.local_lock(lock_name=cli_update_lock_name):
         if version or plugin_name.startswith('/') or not os.path.exists(os.path.join(plugins_dir, plugin_name)):
-            baseutils.exe_cmd('/usr/local/bin/ibmcloud plugin install {plugin_name} {repository} {version} -f'.format(
-                plugin_name=baseutils.shell_escape(plugin_name),
-                repository='-r {repository}'.format(repository=baseutils.shell_escape(repository)) if repository else '',
-                version='-v {version}'.format(version=baseutils.shell_escape(version)) if version else ''))
+            baseutils.exe_cmd([ibmcloud_binary, 'plugin', 'install', plugin_name] + (['-r', repository] if repository else []) + (
+                ['-v', version] if version else []) + ['-f'])
@@ -0,0 +1,277 @@
+import atexit
+import json
+import logging
+import os
+import requests
+import threading
+import time
+from requests.adapters import HTTPAdapter
+
+from orchutils.ibmcloudmodels.ikscluster import IKSCluster
+from orchutils.ibmcloudmodels.iksworker import IKSWorker
+from orchutils.ibmcloudmodels.iksworkerpool import IKSWorkerPool
+
+logger = logging.getLogger(__name__)
+default_endpoint = 'https://containers.cloud.ibm.com'
+default_iam_endpoint = 'https://iam.cloud.ibm.com'
+default_pool_size = 20
+default_request_timeout = 60
+token_expiry_margin = 300  # IAM tokens are renewed this many seconds before they expire
+open_clients = set()  # Clients that have not been closed. They are closed when the interpreter exits
+open_clients_lock = threading.Lock()
+
+
+class IKSClient(object):
+    """
+    A client for the IBM Cloud Kubernetes Service (containers) API that talks directly to the API over a pooled, keep-alive HTTPS session.
+    An IAM token is retrieved once and reused until shortly before it expires, which avoids the start-up and token refresh overhead of running the ibmcloud cli per call.
+    The return values of the public methods are the same models returned by the cli-backed functions in orchutils.ibmcloud.
+    The client is safe for concurrent use from multiple threads.
+    """
+    def __init__(self, api_key=None, resource_group=None, endpoint=default_endpoint, iam_endpoint=default_iam_endpoint, pool_size=default_pool_size):
+        """
+        Constructor for the client object.
+        If no API key is passed or set in the IBMCLOUD_API_KEY environment variable, the client authenticates with the refresh token of the session of the
+        ibmcloud cli, as created by ibmcloud.login, from the configuration in IBMCLOUD_HOME. The targeted resource group of the cli is also used if none is passed.
+        Args:
+            api_key: An IBM Cloud API key (Optional, default: IBMCLOUD_API_KEY or the cli session)
+            resource_group: The ID of the resource group to target (Optional, default: the resource group targeted by the cli, if any)
+            endpoint: The base URL of the containers API (Optional, default: https://containers.cloud.ibm.com)
+            iam_endpoint: The base URL of the IAM token service (Optional, default: https://iam.cloud.ibm.com)
+            pool_size: The maximum number of pooled connections to each endpoint (Optional, default: 20)
+        """
+        self.api_key = api_key or os.environ.get('IBMCLOUD_API_KEY')
+        self.endpoint = endpoint.rstrip('/')
+        self.iam_endpoint = iam_endpoint.rstrip('/')
+        cli_config = {} if self.api_key else load_cli_config()
+        self.refresh_token = cli_config.get('IAMRefreshToken')
+        if not self.api_key and not self.refresh_token:
+            raise Exception('No IBM Cloud API key was provided and the ibmcloud cli is not logged in')
+        self.resource_group = resource_group or (cli_config.get('ResourceGroup') or {}).get('GUID')
+        self.token = None
+        self.token_expiration = 0
+        self._lock = threading.Lock()
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        with open_clients_lock:
+            open_clients.add(self)
+
+    def close(self):
+        """
+        Closes the pooled connections of the client.
+        """
+        with open_clients_lock:
+            open_clients.discard(self)
+        self.session.close()
+
+    def get_token(self):
+        """
+        Retrieves an IAM access token, requesting a new one if there is no token or the current token is about to expire.
+        Returns: The access token, without the "Bearer" prefix
+        """
+        with self._lock:
+            if not self.token or time.time() + token_expiry_margin > self.token_expiration:
+                if self.api_key:
+                    data = {'grant_type': 'urn:ibm:params:oauth:grant-type:apikey', 'apikey': self.api_key}
+                else:
+                    data = {'grant_type': 'refresh_token', 'refresh_token': self.refresh_token}
+                response = self.session.post('{endpoint}/identity/token'.format(endpoint=self.iam_endpoint), data=data, auth=('bx', 'bx'),
+                                             headers={'Accept': 'application/json'}, timeout=default_request_timeout)
+                if not response.ok:
+                    raise Exception('Failed to retrieve IAM token. Status code: {status_code}'.format(status_code=response.status_code))
+                token = response.json()
+                self.token = token['access_token']
+                self.refresh_token = token.get('refresh_token', self.refresh_token)
+                self.token_expiration = token['expiration']
+            return self.token
+
+    def request(self, method, path, body=None, params=None, timeout=default_request_timeout):
+        """
+        Sends a request to the containers API.
+        Transient failures (connection errors and 5xx responses) are retried. An authentication failure causes a new IAM token to be retrieved once.
+        An exception is raised for any unsuccessful response, with the description returned by the API, which is the same message the cli reports.
+        Args:
+            method: The HTTP method
+            path: The path of the API endpoint, eg. /global/v1/clusters
+            body: A body that will be json encoded (Optional)
+            params: Query parameters as a dictionary (Optional)
+            timeout: The request timeout in seconds (Optional, default: 60)
+        Returns: The parsed json response or None if the response has no content
+        """
+        reauthenticated = False
+        attempt = 0
+        while True:
+            attempt += 1
+            headers = {'Authorization': 'Bearer {token}'.format(token=self.get_token())}
+            if self.refresh_token:
+                headers['X-Auth-Refresh-Token'] = self.refresh_token  # Required by operations on classic infrastructure, eg. worker reloads
+            if self.resource_group:
+                headers['X-Auth-Resource-Group'] = self.resource_group
+            try:
+                response = self.session.request(method, self.endpoint + path, json=body, params=params, headers=headers, timeout=timeout)
+            except requests.exceptions.ConnectionError:
+                if attempt < 3:
+                    time.sleep(attempt)
+                    continue
+                raise
+            if response.status_code == 401 and not reauthenticated:
+                reauthenticated = True
+                response.close()
+                with self._lock:
+                    self.token = None
+                continue
+            if response.status_code >= 500 and attempt < 3:
+                response.close()
+                time.sleep(attempt)
+                continue
+            break
+        if not response.ok:
+            raise IKSAPIException(response)
+        return response.json() if response.content else None
+
+    def get_cluster(self, cluster_name):
+        """
+        Retrieves the details of an IKS cluster.
+        Args:
+            cluster_name: The name of the cluster to retrieve or its ID
+        Returns: An IKSCluster object representing the cluster or None if it cannot be found
+        """
+        try:
+            return IKSCluster(self.request('GET', '/global/v1/clusters/{cluster}'.format(cluster=cluster_name)))
+        except IKSAPIException as e:
+            if e.status_code == 404:
+                return None
+            raise
+
+    def list_clusters(self):
+        """
+        Retrieves a list of available IKS clusters.
+        Returns: A list of IKSCluster objects
+        """
+        return IKSCluster.parse_iks_clusters(self.request('GET', '/global/v1/clusters') or [])
+
+    def get_worker(self, cluster_name, worker_id):
+        """
+        Retrieves a specific worker of an IKS cluster.
+        Args:
+            cluster_name: The name of the cluster to retrieve the worker from
+            worker_id: The ID of the worker to look up
+        Returns: An IKSWorker object representing the worker or None if it cannot be found
+        """
+        try:
+            return IKSWorker(self.request('GET', '/global/v1/clusters/{cluster}/workers/{worker}'.format(cluster=cluster_name, worker=worker_id)))
+        except IKSAPIException as e:
+            if e.status_code == 404:
+                return None
+            raise
+
+    def list_workers(self, cluster_name, worker_pool_name=None):
+        """
+        Retrieves a list of the workers of an IKS cluster.
+        Args:
+            cluster_name: The name of the cluster to retrieve workers for
+            worker_pool_name: The name of a worker pool to limit the retrieval to (Optional, default: all pools)
+        Returns: A list of IKSWorker objects
+        """
+        workers = IKSWorker.parse_iks_workers(self.request('GET', '/global/v1/clusters/{cluster}/workers'.format(cluster=cluster_name)) or [])
+        if worker_pool_name:
+            workers = [worker for worker in workers if worker.pool_name == worker_pool_name]
+        return workers
+
+    def reload_worker(self, cluster_name, worker_id):
+        """
+        Triggers the reload of a worker of an IKS cluster.
+        Args:
+            cluster_name: The name of the cluster the worker belongs to
+            worker_id: The ID of the worker to reload
+        """
+        self.request('PUT', '/global/v1/clusters/{cluster}/workers/{worker}'.format(cluster=cluster_name, worker=worker_id), body={'action': 'reload'})
+
+    def update_worker(self, cluster_name, worker_id):
+        """
+        Triggers the update of a worker of an IKS cluster to the version of its master.
+        Args:
+            cluster_name: The name of the cluster the worker belongs to
+            worker_id: The ID of the worker to update
+        """
+        self.request('PUT', '/global/v1/clusters/{cluster}/workers/{worker}'.format(cluster=cluster_name, worker=worker_id), body={'action': 'update'})
+
+    def get_worker_pool(self, cluster_name, worker_pool_name):
+        """
+        Retrieves a worker pool of an IKS cluster.
+        Args:
+            cluster_name: The name of the cluster to query
+            worker_pool_name: The name of the worker pool to retrieve
+        Returns: An IKSWorkerPool object representing the worker pool
+        """
+        return IKSWorkerPool(self.request('GET', '/global/v1/clusters/{cluster}/workerpools/{pool}'.format(cluster=cluster_name, pool=worker_pool_name)))
+
+    def list_worker_pools(self, cluster_name):
+        """
+        Retrieves all worker pools of an IKS cluster.
+        Args:
+            cluster_name: The name of the cluster to query
+        Returns: A list of IKSWorkerPool objects
+        """
+        return IKSWorkerPool.parse_iks_worker_pools(self.request('GET', '/global/v1/clusters/{cluster}/workerpools'.format(cluster=cluster_name)) or [])
+
+    def remove_worker_pool(self, cluster_name, worker_pool_name):
+        """
+        Deletes a worker pool from an IKS cluster.
+        Args:
+            cluster_name: The name of the cluster to process
+            worker_pool_name: The name of the worker pool to remove
+        """
+        self.request('DELETE', '/global/v1/clusters/{cluster}/workerpools/{pool}'.format(cluster=cluster_name, pool=worker_pool_name))
+
+    def update_master(self, cluster_name, kube_version):
+        """
+        Triggers the update of the master of an IKS cluster.
+        Args:
+            cluster_name: The name of the cluster to update
+            kube_version: The version to upgrade Kubernetes to in the form major.minor.patch
+        """
+        self.request('PUT', '/global/v1/clusters/{cluster}'.format(cluster=cluster_name), body={'action': 'update', 'version': kube_version})
+
+
+def _close_open_clients():
+    """
+    Closes the clients that are still open when the interpreter exits.
+    """
+    with open_clients_lock:
+        clients = list(open_clients)
+    for client in clients:
+        client.close()
+
+
+atexit.register(_close_open_clients)
+
+
+class IKSAPIException(Exception):
+    """
+    An unsuccessful response from the containers API.
+    """
+    def __init__(self, response):
+        try:
+            error = response.json()
+        except ValueError:
+            error = {}
+        self.status_code = response.status_code
+        self.code = error.get('code')
+        self.description = error.get('description') or response.text
+        super(IKSAPIException, self).__init__('{description} ({code}). Status code: {status_code}'.format(
+            description=self.description, code=self.code, status_code=self.status_code))
+
+
+def load_cli_config():
+    """
+    Reads the configuration of the ibmcloud cli from IBMCLOUD_HOME, or the user's home directory if it is not set.
+    Returns: A dictionary of the cli configuration, empty if the cli has not been configured
+    """
+    config_file = os.path.join(os.environ.get('IBMCLOUD_HOME') or os.path.expanduser('~'), '.bluemix', 'config.json')
+    if not os.path.exists(config_file):
+        return {}
+    with open(config_file) as fh:
+        return json.load(fh)
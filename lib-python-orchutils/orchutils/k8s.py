@@ -1,25 +1,83 @@
 import json
 import logging
 import os
+import threading
 
 import baseutils
+from orchutils.k8sclient import KubeClient
 
 logger = logging.getLogger(__name__)
 kubectl_binary = '/usr/local/bin/kubectl'
 if 'P2PAAS_ORCH_DIR' in os.environ:
     # Support customisation of the kubectl binary path to facilitate simultaneous management of multiple clusters of differing versions from a single server
     os.environ['KUBECONFIG'] = os.path.join(os.environ['P2PAAS_ORCH_DIR'], '.kube', 'config')
-    kubectl_binary = baseutils.shell_escape(os.path.join(os.environ['P2PAAS_ORCH_DIR'], 'kubectl'))
+    kubectl_binary = os.path.join(os.environ['P2PAAS_ORCH_DIR'], 'kubectl')
+backends = ['kubectl', 'api']
+backend = os.environ.get('P2PAAS_K8S_BACKEND', 'kubectl')  # "api" talks directly to the API server. kubectl remains the fallback
+api_client = None
+api_client_lock = threading.Lock()
+
+
+def set_backend(backend_name):
+    """
+    Selects the backend used by the functions in this module that support direct API access (apply, delete, get, label, logs, rollout_status and taint).
+    The "api" backend talks to the Kubernetes API server over a pooled, keep-alive HTTPS session built from the current KUBECONFIG.
+    The "kubectl" backend forks a kubectl process per call. Functions without API support always use kubectl.
+    Watching resources with the watch function is only possible with the "api" backend.
+    The same can be achieved by setting the P2PAAS_K8S_BACKEND environment variable before this module is imported.
+    Args:
+        backend_name: The backend to use. Must be either "kubectl" or "api"
+    """
+    global backend, api_client
+    if backend_name not in backends:
+        raise Exception('Invalid Kubernetes backend "{backend}". Must be one of: {backends}'.format(backend=backend_name, backends=', '.join(backends)))
+    with api_client_lock:
+        if api_client:
+            api_client.close()
+        backend = backend_name
+        api_client = None
+
+
+def get_api_client():
+    """
+    Retrieves the shared Kubernetes API client if the api backend is enabled, creating it on first use.
+    If the client cannot be created, for example due to an unsupported kubeconfig, a warning is logged and the module falls back to the kubectl backend.
+    Returns: The KubeClient object or None if kubectl should be used
+    """
+    global backend, api_client
+    if backend != 'api':
+        return None
+    with api_client_lock:
+        if api_client is None:
+            try:
+                api_client = KubeClient(os.environ.get('KUBECONFIG'))
+            except Exception as e:
+                logger.warning('Unable to create Kubernetes API client, falling back to kubectl: {error}'.format(error=str(e)))
+                backend = 'kubectl'
+    return api_client
+
+
+def _namespace_args(namespace):
+    """
+    Builds the kubectl arguments selecting a namespace. A namespace of "all" selects all namespaces.
+    """
+    if namespace == 'all':
+        return ['--all-namespaces']
+    return ['-n', namespace] if namespace else []
 
 
 def apply(resource):
     """
     Executes a "kubectl apply" on a passed resource definition.
     The definition should be a python dictionary in a valid Kubernetes manifest format. It will be dumped to json before being passed to kubectl.
+    With the api backend, the resource is applied with server-side apply. See orchutils.k8sclient.KubeClient.apply for how this differs from kubectl apply.
     Args:
         resource: The resource to apply to Kubernetes
     """
-    (rc, output) = baseutils.exe_cmd('{kubectl} apply -f -'.format(kubectl=kubectl_binary), stdin=json.dumps(resource))
+    client = get_api_client()
+    if client:
+        return client.apply(resource)
+    (rc, output) = baseutils.exe_cmd([kubectl_binary, 'apply', '-f', '-'], stdin=json.dumps(resource))
 
 
 def cordon(node=None, labels=None):
@@ -31,10 +89,7 @@ def cordon(node=None, labels=None):
     """
     if isinstance(labels, dict):
         labels = ','.join('{key}={value}'.format(key=key, value=value) for (key, value) in labels.items())
-    baseutils.exe_cmd('{kubectl} cordon {node} {labels}'.format(
-        kubectl=kubectl_binary,
-        node=baseutils.shell_escape(node) if node else '',
-        labels='-l {labels}'.format(labels=baseutils.shell_escape(labels)) if labels else ''))
+    baseutils.exe_cmd([kubectl_binary, 'cordon'] + ([node] if node else []) + (['-l', labels] if labels else []))
 
 
 def delete(kind, namespace=None, name=None, wait=True, grace_period=None):
@@ -47,13 +102,12 @@ def delete(kind, namespace=None, name=None, wait=True, grace_period=None):
         wait: Wait for the resource to be completed removed before returning (Optional, default: True)
         grace_period: The grace period to pass for resources that support grace periods
     """
-    (rc, output) = baseutils.exe_cmd('{kubectl} delete {kind} {name} {namespace} --wait={wait} --grace_period={grace_period}'.format(
-        kubectl=kubectl_binary,
-        kind=baseutils.shell_escape(kind),
-        name=baseutils.shell_escape(name) if name else '',
-        namespace='-n {namespace}'.format(namespace=baseutils.shell_escape(namespace)) if namespace else '',
-        wait='true' if wait else 'false',
-        grace_period=int(grace_period) if grace_period else '-1'))
+    client = get_api_client()
+    if client:
+        return client.delete(kind, namespace=namespace, name=name, wait=wait, grace_period=grace_period)
+    (rc, output) = baseutils.exe_cmd([kubectl_binary, 'delete', kind] + ([name] if name else []) + (['-n', namespace] if namespace else []) + [
+        '--wait={wait}'.format(wait='true' if wait else 'false'),
+        '--grace_period={grace_period}'.format(grace_period=int(grace_period) if grace_period else '-1')])
 
 
 def describe(kind, namespace=None, name=None, labels=None):
@@ -69,12 +123,8 @@ def describe(kind, namespace=None, name=None, labels=None):
     """
     if isinstance(labels, dict):
         labels = ','.join('{key}={value}'.format(key=key, value=value) for (key, value) in labels.items())
-    (rc, output) = baseutils.exe_cmd('{kubectl} describe {kind} {name} {namespace} {labels}'.format(
-        kubectl=kubectl_binary,
-        kind=baseutils.shell_escape(kind),
-        name=baseutils.shell_escape(name) if name else '',
-        namespace='--all-namespaces' if namespace == 'all' else ('-n {namespace}'.format(namespace=baseutils.shell_escape(namespace)) if namespace else ''),
-        labels='-l {labels}'.format(labels=baseutils.shell_escape(labels)) if labels else ''), log_level=logging.NOTSET if 'secret' in kind.lower() else logging.INFO)
+    (rc, output) = baseutils.exe_cmd([kubectl_binary, 'describe', kind] + ([name] if name else []) + _namespace_args(namespace) + (['-l', labels] if labels else []),
+                                     log_level=logging.NOTSET if 'secret' in kind.lower() else logging.INFO)
     return output
 
 
@@ -87,12 +137,8 @@ def drain(node, force=True, delete_local_data=True, ignore_daemonsets=True):
         delete_local_data: Drain pods even if they use emptyDir. Data belonging to these pods will be lost (Optional, default: True)
         igrnore_daemonsets: Skip pods managed by DaemonSets. These pods are undrainable. Otherwise, a daemonset pod would cause the command to fail (Optional, default: True)
     """
-    cmd = '{kubectl} drain {node} {force} {delete_local_data} {ignore_daemonsets}'.format(
-        kubectl=kubectl_binary,
-        node=baseutils.shell_escape(node),
-        force='--force' if force else '',
-        delete_local_data='--delete-local-data' if delete_local_data else '',
-        ignore_daemonsets='--ignore-daemonsets' if ignore_daemonsets else '')
+    cmd = [kubectl_binary, 'drain', node] + (['--force'] if force else []) + (['--delete-local-data'] if delete_local_data else []) + (
+        ['--ignore-daemonsets'] if ignore_daemonsets else [])
     baseutils.retry(baseutils.exe_cmd, cmd, interval=10, retry=6)
 
 
@@ -127,13 +173,31 @@ def get(kind, namespace=None, name=None, labels=None):
     """
     if isinstance(labels, dict):
         labels = ','.join('{key}={value}'.format(key=key, value=value) for (key, value) in labels.items())
-    cmd = '{kubectl} get {kind} {name} {namespace} {labels} -o json'.format(
-        kubectl=kubectl_binary,
-        kind=baseutils.shell_escape(kind),
-        name=baseutils.shell_escape(name) if name else '',
-        namespace='--all-namespaces' if namespace == 'all' else ('-n {namespace}'.format(namespace=baseutils.shell_escape(namespace)) if namespace else ''),
-        labels='-l {labels}'.format(labels=baseutils.shell_escape(labels)) if labels else '')
-    (rc, output) = baseutils.retry(baseutils.exe_cmd, cmd, log_level=logging.NOTSET if 'secret' in kind.lower() else logging.INFO, interval=10, retry=6)
+    client = get_api_client()
+    if client:
+        return baseutils.retry(client.get, kind, namespace=namespace, name=name, labels=labels, interval=10, retry=6)
+    (rc, output) = baseutils.retry(baseutils.exe_cmd, _get_cmd(kind, namespace, name, labels), log_level=_get_log_level(kind), interval=10, retry=6)
+    return _parse_get_output(output)
+
+
+def _get_cmd(kind, namespace, name, labels):
+    """
+    Builds the kubectl command used by get. labels must already be in the string form of a label selector.
+    """
+    return [kubectl_binary, 'get', kind] + ([name] if name else []) + _namespace_args(namespace) + (['-l', labels] if labels else []) + ['-o', 'json']
+
+
+def _get_log_level(kind):
+    """
+    Returns the level at which the output of get is logged. Secrets are never logged.
+    """
+    return logging.NOTSET if 'secret' in kind.lower() else logging.INFO
+
+
+def _parse_get_output(output):
+    """
+    Parses the output of the kubectl command built by _get_cmd into a list of resources or a single resource.
+    """
     try:
         resources = json.loads(output)
     except Exception:
@@ -156,12 +220,10 @@ def label(label, kind, namespace=None, name=None):
         namespace: The namespace of the resource to label. Not all resources will be namespaced (Optional)
         name: The name of the resource to label (Optional)
     """
-    baseutils.exe_cmd('{kubectl} label {kind} {name} {namespace} {label} --overwrite'.format(
-        kubectl=kubectl_binary,
-        kind=baseutils.shell_escape(kind),
-        name=baseutils.shell_escape(name) if name else '',
-        namespace='-n {namespace}'.format(namespace=baseutils.shell_escape(namespace)) if namespace else '',
-        label=baseutils.shell_escape(label)))
+    client = get_api_client()
+    if client:
+        return client.label(label, kind, namespace=namespace, name=name)
+    baseutils.exe_cmd([kubectl_binary, 'label', kind] + ([name] if name else []) + (['-n', namespace] if namespace else []) + [label, '--overwrite'])
 
 
 def logs(name, namespace=None, container=None):
@@ -174,11 +236,10 @@ def logs(name, namespace=None, container=None):
         container: The container to pull logs for (Optional)
     Returns: The logs from a pod/container
     """
-    (rc, output) = baseutils.exe_cmd('{kubectl} logs {container} {name} {namespace}'.format(
-        kubectl=kubectl_binary,
-        container='-c {container}'.format(container=baseutils.shell_escape(container)) if container else '',
-        name=baseutils.shell_escape(name),
-        namespace='-n {namespace}'.format(namespace=baseutils.shell_escape(namespace)) if namespace else ''))
+    client = get_api_client()
+    if client:
+        return client.logs(name, namespace=namespace, container=container)
+    (rc, output) = baseutils.exe_cmd([kubectl_binary, 'logs'] + (['-c', container] if container else []) + [name] + (['-n', namespace] if namespace else []))
     return output
 
 
@@ -194,12 +255,11 @@ def rollout_status(kind, name, namespace=None, watch=False):
         watch: If True, kubectl will wait for the rollout to complete
     Returns: The output from kubectl
     """
-    (rc, output) = baseutils.exe_cmd('{kubectl} rollout status {kind} {name} {namespace} --watch={watch}'.format(
-        kubectl=kubectl_binary,
-        kind=baseutils.shell_escape(kind),
-        name=baseutils.shell_escape(name),
-        namespace='-n {namespace}'.format(namespace=baseutils.shell_escape(namespace)) if namespace else '',
-        watch='true' if watch else 'false'), raise_exception=False)
+    client = get_api_client()
+    if client:
+        return client.rollout_status(kind, name, namespace=namespace, watch=watch)
+    (rc, output) = baseutils.exe_cmd([kubectl_binary, 'rollout', 'status', kind, name] + (['-n', namespace] if namespace else []) + [
+        '--watch={watch}'.format(watch='true' if watch else 'false')], raise_exception=False)
     if rc:
         # If an error occurred, put the error message in the exception
         raise Exception(output)
@@ -217,11 +277,10 @@ def taint(taints, node=None, labels=None):
     """
     if isinstance(labels, dict):
         labels = ','.join('{key}={value}'.format(key=key, value=value) for (key, value) in labels.items())
-    baseutils.exe_cmd('{kubectl} taint node {node} {labels} {taints} --overwrite'.format(
-        kubectl=kubectl_binary,
-        node=baseutils.shell_escape(node) if node else '',
-        labels='-l {labels}'.format(labels=baseutils.shell_escape(labels)) if labels else '',
-        taints=' '.join([baseutils.shell_escape(taint) for taint in taints])))
+    client = get_api_client()
+    if client:
+        return client.taint(taints, node=node, labels=labels)
+    baseutils.exe_cmd([kubectl_binary, 'taint', 'node'] + ([node] if node else []) + (['-l', labels] if labels else []) + list(taints) + ['--overwrite'])
 
 
 def uncordon(node=None, labels=None):
@@ -233,10 +292,26 @@ def uncordon(node=None, labels=None):
     """
     if isinstance(labels, dict):
         labels = ','.join('{key}={value}'.format(key=key, value=value) for (key, value) in labels.items())
-    baseutils.exe_cmd('{kubectl} uncordon {node} {labels}'.format(
-        kubectl=kubectl_binary,
-        node=baseutils.shell_escape(node) if node else '',
-        labels='-l {labels}'.format(labels=baseutils.shell_escape(labels)) if labels else ''))
+    baseutils.exe_cmd([kubectl_binary, 'uncordon'] + ([node] if node else []) + (['-l', labels] if labels else []))
+
+
+def watch(kind, namespace=None, labels=None, stop_event=None):
+    """
+    Streams changes to resources of a specific kind. The existing resources are reported first as ADDED events.
+    Watching is only supported by the api backend. An exception is raised if the api backend is not enabled.
+    Args:
+        kind: The type of resource to watch
+        namespace: The namespace to watch. "all" watches all namespaces (Optional)
+        labels: A label selector query to filter the resources. Can either be a string of the form "label1=value1,labe2=value2" or a dictionary with "key: value" pairs (Optional)
+        stop_event: A threading.Event that ends the watch when set (Optional)
+    Returns: A generator of (event type, resource) tuples. The event type is one of ADDED, MODIFIED or DELETED
+    """
+    if isinstance(labels, dict):
+        labels = ','.join('{key}={value}'.format(key=key, value=value) for (key, value) in labels.items())
+    client = get_api_client()
+    if not client:
+        raise Exception('Watching resources requires the api backend')
+    return client.watch(kind, namespace=namespace, labels=labels, stop_event=stop_event)
 
 
 def install_kubectl(kubectl_version):
@@ -246,9 +321,8 @@ def install_kubectl(kubectl_version):
     Args:
         kubectl_version: The version of kubectl that should be installed, eg: v1.11.3
     """
-    (rc, output) = baseutils.exe_cmd('{kubectl} version --client --short'.format(kubectl=kubectl_binary), raise_exception=False, log_level=logging.NOTSET)
+    (rc, output) = baseutils.exe_cmd([kubectl_binary, 'version', '--client', '--short'], raise_exception=False, log_level=logging.NOTSET)
     if rc or kubectl_version not in output:
-        baseutils.exe_cmd('/usr/bin/curl -L {url} -o {kubectl}'.format(
-            url=baseutils.shell_escape('https://storage.googleapis.com/kubernetes-release/release/{version}/bin/linux/amd64/kubectl'.format(version=kubectl_version)),
-            kubectl=kubectl_binary))
-        os.chmod(kubectl_binary.strip('\''), 0o755)
+        baseutils.exe_cmd(['/usr/bin/curl', '-L', 'https://storage.googleapis.com/kubernetes-release/release/{version}/bin/linux/amd64/kubectl'.format(version=kubectl_version),
+                           '-o', kubectl_binary])
+        os.chmod(kubectl_binary, 0o755)
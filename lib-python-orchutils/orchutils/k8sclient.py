@@ -0,0 +1,711 @@
+import atexit
+import base64
+import json
+import logging
+import os
+import requests
+import tempfile
+import threading
+import time
+import yaml
+from requests.adapters import HTTPAdapter
+
+import baseutils
+
+logger = logging.getLogger(__name__)
+default_pool_size = 20
+default_request_timeout = 60
+default_watch_timeout = 60
+field_manager = 'orchutils'  # The field manager that owns the fields of resources created or updated by KubeClient.apply
+open_clients = set()  # Clients that have not been closed. They are closed when the interpreter exits
+open_clients_lock = threading.Lock()
+
+
+class KubeClient(object):
+    """
+    A client for the Kubernetes API server that talks directly to the API over a pooled, keep-alive HTTPS session.
+    The client is built from a kubeconfig file using the same resolution rules as kubectl. The kubeconfig is read once and
+    API discovery is performed at most once per client, which avoids the per-call overhead of forking a kubectl process.
+    The return values of the public methods mirror the shapes returned by the kubectl-backed functions in orchutils.k8s.
+    The client is safe for concurrent use from multiple threads.
+    """
+    def __init__(self, kubeconfig=None, context=None, pool_size=default_pool_size):
+        """
+        Constructor for the client object.
+        Args:
+            kubeconfig: The path to a kubeconfig file. Multiple paths can be separated as per the KUBECONFIG environment variable (Optional, default: KUBECONFIG or ~/.kube/config)
+            context: The kubeconfig context to use (Optional, default: the current-context of the kubeconfig)
+            pool_size: The maximum number of pooled connections to the API server (Optional, default: 20)
+        """
+        self.kubeconfig = kubeconfig or os.environ.get('KUBECONFIG') or os.path.join(os.path.expanduser('~'), '.kube', 'config')
+        self.context = context
+        self.pool_size = pool_size
+        self._temp_files = []
+        self._resources = None
+        self._lock = threading.Lock()
+        self._configure()
+        with open_clients_lock:
+            open_clients.add(self)
+
+    def _configure(self):
+        """
+        Parses the kubeconfig and (re)builds the HTTP session used to talk to the API server.
+        """
+        config = load_kubeconfig(self.kubeconfig)
+        context_name = self.context or config['current-context']
+        if not context_name or context_name not in config['contexts']:
+            raise Exception('Kubeconfig context "{context}" could not be found in {kubeconfig}'.format(context=context_name, kubeconfig=self.kubeconfig))
+        context = config['contexts'][context_name]
+        cluster = config['clusters'].get(context.get('cluster'))
+        if not cluster or not cluster.get('server'):
+            raise Exception('Kubeconfig cluster "{cluster}" has no server defined'.format(cluster=context.get('cluster')))
+        user = config['users'].get(context.get('user'), {})
+        self.server = cluster['server'].rstrip('/')
+        self.default_namespace = context.get('namespace') or 'default'
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=self.pool_size, pool_maxsize=self.pool_size)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        if cluster.get('insecure-skip-tls-verify'):
+            session.verify = False
+        else:
+            session.verify = self._resolve_file(cluster, 'certificate-authority') or True
+        self._configure_auth(session, user)
+        previous_session = getattr(self, 'session', None)
+        self.session = session
+        if previous_session:
+            previous_session.close()
+
+    def _configure_auth(self, session, user):
+        """
+        Configures a session to authenticate as a kubeconfig user.
+        Supported mechanisms are bearer tokens (including token files and oidc/auth-provider tokens), client certificates, basic auth and exec plugins that return a token.
+        Args:
+            session: The requests session to configure
+            user: The user entry from the kubeconfig
+        """
+        token = user.get('token')
+        if not token and user.get('tokenFile'):
+            with open(self._resolve_path(user, user['tokenFile'])) as fh:
+                token = fh.read().strip()
+        if not token and user.get('auth-provider'):
+            provider_config = user['auth-provider'].get('config') or {}
+            token = provider_config.get('id-token') or provider_config.get('access-token')
+        if not token and user.get('exec'):
+            token = self._exec_credential(user)
+        if token:
+            session.headers['Authorization'] = 'Bearer {token}'.format(token=token)
+        client_certificate = self._resolve_file(user, 'client-certificate')
+        client_key = self._resolve_file(user, 'client-key')
+        if client_certificate and client_key:
+            session.cert = (client_certificate, client_key)
+        if user.get('username') and user.get('password'):
+            session.auth = (user['username'], user['password'])
+
+    def _exec_credential(self, user):
+        """
+        Runs a kubeconfig exec credential plugin and returns the token it provides.
+        Args:
+            user: The user entry from the kubeconfig containing the exec configuration
+        Returns: The bearer token returned by the plugin
+        """
+        exec_config = user['exec']
+        env = os.environ.copy()
+        for env_var in exec_config.get('env') or []:
+            env[env_var['name']] = env_var['value']
+        (rc, output) = baseutils.exe_cmd([exec_config['command']] + (exec_config.get('args') or []), env=env, log_level=logging.NOTSET)  # Output contains credentials
+        token = json.loads(output).get('status', {}).get('token')
+        if not token:
+            raise Exception('Kubeconfig exec plugin "{command}" did not return a token'.format(command=exec_config['command']))
+        return token
+
+    def _resolve_path(self, entry, path):
+        """
+        Resolves a file path from a kubeconfig entry. Relative paths are relative to the kubeconfig file that defined the entry.
+        """
+        return path if os.path.isabs(path) else os.path.join(entry['_base_dir'], path)
+
+    def _resolve_file(self, entry, field):
+        """
+        Returns the path to a file referenced by a kubeconfig entry field.
+        If the entry contains the inline "<field>-data" variant, the data is written to a temporary file which is removed when the client is closed.
+        Args:
+            entry: The kubeconfig cluster or user entry
+            field: The name of the field, eg. certificate-authority
+        Returns: The path to the file or None if the field is not present
+        """
+        data = entry.get('{field}-data'.format(field=field))
+        if data:
+            (fd, path) = tempfile.mkstemp(prefix='orchutils-kube-')
+            try:
+                os.write(fd, base64.b64decode(data))
+            finally:
+                os.close(fd)
+            self._temp_files.append(path)
+            return path
+        elif entry.get(field):
+            return self._resolve_path(entry, entry[field])
+        return None
+
+    def close(self):
+        """
+        Closes the pooled connections of the client and removes any temporary credential files.
+        """
+        with open_clients_lock:
+            open_clients.discard(self)
+        session = getattr(self, 'session', None)
+        if session:
+            session.close()
+        while self._temp_files:
+            path = self._temp_files.pop()
+            if os.path.exists(path):
+                os.remove(path)
+
+    def request(self, method, path, params=None, body=None, content_type='application/json', raw=False, stream=False, timeout=default_request_timeout):
+        """
+        Sends a request to the API server.
+        Transient failures (connection errors and 5xx responses) are retried. Authentication failures cause the kubeconfig to be re-read once,
+        to pick up credentials that have been refreshed by other tooling.
+        An exception is raised for any unsuccessful response, with a message in the same form that kubectl reports server errors.
+        Args:
+            method: The HTTP method
+            path: The path of the API endpoint, eg. /api/v1/namespaces/default/pods
+            params: Query parameters as a dictionary (Optional)
+            body: A body that will be json encoded (Optional)
+            content_type: The content type of the body (Optional, default: application/json)
+            raw: Return the text of the response rather than a parsed json document (Optional, default: False)
+            stream: Return the response object without reading the body. The caller is responsible for closing it (Optional, default: False)
+            timeout: The request timeout in seconds (Optional, default: 60)
+        Returns: The parsed json response, or as per the raw and stream arguments
+        """
+        data = json.dumps(body) if body is not None else None
+        headers = {'Content-Type': content_type} if data is not None else None
+        reauthenticated = False
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                response = self.session.request(method, self.server + path, params=params, data=data, headers=headers, stream=stream, timeout=timeout)
+            except requests.exceptions.ConnectionError:
+                if attempt < 3:
+                    time.sleep(attempt)
+                    continue
+                raise
+            if response.status_code == 401 and not reauthenticated:
+                reauthenticated = True
+                response.close()
+                self._configure()
+                continue
+            if response.status_code >= 500 and attempt < 3:
+                response.close()
+                time.sleep(attempt)
+                continue
+            break
+        if not response.ok:
+            raise _api_exception(response)
+        if stream:
+            return response
+        return response.text if raw else (response.json() if response.content else {})
+
+    def discover(self):
+        """
+        Performs API discovery, building a lookup of the resource names accepted by kubectl to the API endpoint of each resource.
+        Discovery is only performed once for the life of the client.
+        Returns: A dictionary mapping lower-case resource names (kinds, plurals, singulars and short names) to resource descriptors
+        """
+        with self._lock:
+            if self._resources is None:
+                resources = {}
+                self._add_api_resources(resources, '/api/v1', 'v1')
+                for group in self.request('GET', '/apis').get('groups', []):
+                    group_version = group['preferredVersion']['groupVersion']
+                    try:
+                        self._add_api_resources(resources, '/apis/{group_version}'.format(group_version=group_version), group_version)
+                    except Exception as e:
+                        # Aggregated APIs can be temporarily unavailable. This must not block access to the rest of the API
+                        logger.warning('Unable to discover resources for API group version {group_version}: {error}'.format(group_version=group_version, error=e))
+                self._resources = resources
+        return self._resources
+
+    def _add_api_resources(self, resources, path, group_version):
+        """
+        Adds the resources of a single API group version to the discovery lookup. Names that are already present take precedence.
+        """
+        group = group_version.rpartition('/')[0]
+        for api_resource in self.request('GET', path).get('resources', []):
+            if '/' in api_resource['name']:
+                continue  # Sub-resources such as pods/log are not directly addressable
+            descriptor = {
+                'base_path': path,
+                'group_version': group_version,
+                'kind': api_resource['kind'],
+                'name': api_resource['name'],
+                'namespaced': api_resource['namespaced']
+            }
+            names = [api_resource['kind'], api_resource['name'], api_resource.get('singularName') or api_resource['kind']] + (api_resource.get('shortNames') or [])
+            for name in names:
+                name = name.lower()
+                resources.setdefault(name, descriptor)
+                if group:
+                    resources.setdefault('{name}.{group}'.format(name=name, group=group), descriptor)
+
+    def resolve(self, kind):
+        """
+        Resolves a resource name, as it would be passed to kubectl, to its API resource descriptor.
+        Args:
+            kind: The kind of the resource in any form accepted by kubectl, eg. Deployment, deployments, deploy, deployment.apps
+        Returns: A dictionary describing the resource's API endpoint
+        """
+        descriptor = self.discover().get(kind.lower())
+        if not descriptor:
+            raise Exception('error: the server doesn\'t have a resource type "{kind}"'.format(kind=kind))
+        return descriptor
+
+    def resource_path(self, descriptor, namespace=None, name=None, subresource=None):
+        """
+        Builds the API path for a resource.
+        Args:
+            descriptor: The resource descriptor as returned by resolve
+            namespace: The namespace. "all" addresses all namespaces. Ignored for cluster-scoped resources (Optional, default: the context namespace)
+            name: The name of an individual resource (Optional)
+            subresource: A sub-resource of the named resource, eg. log or status (Optional)
+        Returns: The API path
+        """
+        path = descriptor['base_path']
+        if descriptor['namespaced'] and namespace != 'all':
+            path += '/namespaces/{namespace}'.format(namespace=namespace or self.default_namespace)
+        path += '/' + descriptor['name']
+        if name:
+            path += '/' + name
+            if subresource:
+                path += '/' + subresource
+        return path
+
+    def get(self, kind, namespace=None, name=None, labels=None):
+        """
+        Retrieve one or more resources of a specific kind. See orchutils.k8s.get for details.
+        Returns: List of dictionary resources. If name is specified, a single resource as a dictionary
+        """
+        descriptor = self.resolve(kind)
+        params = {'labelSelector': labels} if labels else None
+        resource = self.request('GET', self.resource_path(descriptor, namespace=namespace, name=name), params=params)
+        if not name:
+            # Match kubectl, which populates the type information that the API omits from list items
+            for item in resource.get('items', []):
+                item.setdefault('apiVersion', descriptor['group_version'])
+                item.setdefault('kind', descriptor['kind'])
+            resource = resource.get('items', [])
+        return resource
+
+    def watch(self, kind, namespace=None, labels=None, stop_event=None, timeout_seconds=default_watch_timeout):
+        """
+        Streams changes to resources of a specific kind.
+        The current state is listed first and each existing resource is reported as ADDED. Changes are then streamed from the API server as they happen.
+        The stream is resumed transparently when the server closes it. If the server can no longer resume from the last seen version, the resources are
+        re-listed and any resources that were removed in the meantime are reported as DELETED.
+        Args:
+            kind: The kind of the resource in any form accepted by kubectl, eg. deployment
+            namespace: The namespace to watch. "all" watches all namespaces (Optional, default: the context namespace)
+            labels: A label selector to filter the resources, eg. app=myapp (Optional)
+            stop_event: A threading.Event that ends the watch when set. The open watch request is closed as soon as the event is set, so the watch
+                        ends without waiting for another event to arrive (Optional)
+            timeout_seconds: The maximum duration of each individual watch request before it is resumed (Optional, default: 60)
+        Returns: A generator of (event type, resource) tuples. The event type is one of ADDED, MODIFIED or DELETED
+        """
+        descriptor = self.resolve(kind)
+        path = self.resource_path(descriptor, namespace=namespace)
+        params = {'labelSelector': labels} if labels else {}
+        state = {'known': {}, 'resource_version': None, 'response': None}
+        finished = threading.Event()
+        if stop_event:
+            closer = threading.Thread(target=_close_watch_on_stop, args=(state, stop_event, finished))
+            closer.daemon = True
+            closer.start()
+        try:
+            while not (stop_event and stop_event.is_set()):
+                if state['resource_version'] is None:
+                    for event in self._list_for_watch(descriptor, path, params, state):
+                        yield event
+                for event in self._stream_watch(descriptor, path, params, state, stop_event, timeout_seconds):
+                    yield event
+        finally:
+            finished.set()
+
+    def _list_for_watch(self, descriptor, path, params, state):
+        """
+        Lists the resources being watched, to start the watch or to get back in sync when it cannot be resumed. Used by watch.
+        Returns: A list of DELETED events for the known resources that no longer exist, followed by ADDED events for the listed resources
+        """
+        resource_list = self.request('GET', path, params=params or None)
+        state['resource_version'] = resource_list['metadata'].get('resourceVersion')
+        listed = {}
+        for item in resource_list.get('items', []):
+            item.setdefault('apiVersion', descriptor['group_version'])
+            item.setdefault('kind', descriptor['kind'])
+            listed[(item['metadata'].get('namespace'), item['metadata']['name'])] = item
+        events = [('DELETED', item) for (key, item) in state['known'].items() if key not in listed]
+        state['known'] = listed
+        return events + [('ADDED', item) for item in listed.values()]
+
+    def _stream_watch(self, descriptor, path, params, state, stop_event, timeout_seconds):
+        """
+        Streams the events of a single watch request from the last seen resource version. Used by watch.
+        Returns: A generator of (event type, resource) tuples. It ends when the request ends, the watch is stopped or a re-list is required
+        """
+        state['response'] = self._open_watch(path, params, state, timeout_seconds)
+        if state['response'] is None:
+            return
+        try:
+            for line in state['response'].iter_lines():
+                if stop_event and stop_event.is_set():
+                    return
+                event = _parse_watch_event(descriptor, line, state) if line else None
+                if event:
+                    yield event
+                elif state['resource_version'] is None:
+                    return  # The resource version is too old to resume from. Re-list to get back in sync
+        except Exception as e:
+            if stop_event and stop_event.is_set():
+                return  # The response was closed as the watch was stopped
+            if not isinstance(e, requests.exceptions.RequestException):
+                raise
+            logger.debug('Watch of {kind} interrupted, resuming: {error}'.format(kind=descriptor['kind'], error=e))
+        finally:
+            state['response'].close()
+
+    def _open_watch(self, path, params, state, timeout_seconds):
+        """
+        Sends a watch request from the last seen resource version. Used by watch.
+        Returns: The streamed response, or None if the resource version has expired, in which case the resource version of the state is reset to None
+        """
+        watch_params = dict(params, watch='true', resourceVersion=state['resource_version'], timeoutSeconds=int(timeout_seconds), allowWatchBookmarks='true')
+        try:
+            return self.request('GET', path, params=watch_params, stream=True, timeout=timeout_seconds + default_request_timeout)
+        except Exception as e:
+            if '(Expired)' in str(e) or '(Gone)' in str(e):
+                state['resource_version'] = None
+                return None
+            raise
+
+    def apply(self, resource):
+        """
+        Creates a resource or updates it to match the passed manifest, using server-side apply under the orchutils field manager.
+        As with kubectl apply, fields that were set by a previous apply and are no longer in the manifest are removed. Unlike kubectl apply, the fields
+        applied are tracked by the API server in managedFields rather than in the last-applied-configuration annotation, and fields owned by other
+        managers are taken over rather than reported as conflicts.
+        API servers that do not support server-side apply are sent a strategic merge patch instead, which does not remove fields. See _apply_with_patch.
+        Args:
+            resource: The resource to apply as a dictionary in a valid Kubernetes manifest format
+        """
+        descriptor = self.resolve(resource['kind'])
+        metadata = resource.get('metadata', {})
+        resource = dict(resource, metadata=dict((key, value) for (key, value) in metadata.items() if key != 'managedFields'))
+        name = metadata['name']
+        namespace = metadata.get('namespace')
+        logger.info('Applying {kind} "{name}"'.format(kind=descriptor['kind'], name=name))
+        try:
+            self.request('PATCH', self.resource_path(descriptor, namespace=namespace, name=name), params={'fieldManager': field_manager, 'force': 'true'},
+                         body=resource, content_type='application/apply-patch+yaml')  # JSON is valid YAML
+        except Exception as e:
+            if '(UnsupportedMediaType)' not in str(e):
+                raise
+            self._apply_with_patch(descriptor, resource)
+
+    def _apply_with_patch(self, descriptor, resource):
+        """
+        Creates a resource or patches it if it already exists, for API servers without server-side apply.
+        Existing resources are updated with a strategic merge patch, falling back to a json merge patch for types that do not support it such as custom resources.
+        """
+        name = resource['metadata']['name']
+        namespace = resource['metadata'].get('namespace')
+        try:
+            self.request('GET', self.resource_path(descriptor, namespace=namespace, name=name))
+        except Exception as e:
+            if '(NotFound)' not in str(e):
+                raise
+            self.request('POST', self.resource_path(descriptor, namespace=namespace), body=resource)
+            return
+        path = self.resource_path(descriptor, namespace=namespace, name=name)
+        try:
+            self.request('PATCH', path, body=resource, content_type='application/strategic-merge-patch+json')
+        except Exception as e:
+            if '(UnsupportedMediaType)' not in str(e):
+                raise
+            self.request('PATCH', path, body=resource, content_type='application/merge-patch+json')
+
+    def delete(self, kind, namespace=None, name=None, wait=True, grace_period=None):
+        """
+        Delete a resource of a specific kind. See orchutils.k8s.delete for details.
+        """
+        if not name:
+            raise Exception('error: resource(s) were provided, but no name was specified')
+        descriptor = self.resolve(kind)
+        path = self.resource_path(descriptor, namespace=namespace, name=name)
+        options = {'kind': 'DeleteOptions', 'apiVersion': 'v1', 'propagationPolicy': 'Background'}
+        if grace_period:
+            options['gracePeriodSeconds'] = int(grace_period)
+        logger.info('Deleting {kind} "{name}"'.format(kind=descriptor['kind'], name=name))
+        self.request('DELETE', path, body=options)
+        while wait:
+            try:
+                self.request('GET', path)
+                baseutils.sleep(1)  # Stops at the deadline of an active baseutils.timeout
+            except Exception as e:
+                if '(NotFound)' not in str(e):
+                    raise
+                wait = False
+
+    def label(self, label, kind, namespace=None, name=None):
+        """
+        Applies a label to a resource, overwriting any existing value. A label of the form "key-" removes the label. See orchutils.k8s.label for details.
+        """
+        if not name:
+            raise Exception('error: resource(s) were provided, but no name was specified')
+        descriptor = self.resolve(kind)
+        labels = {}
+        for label_entry in label.split():
+            if label_entry.endswith('-') and '=' not in label_entry:
+                labels[label_entry[:-1]] = None
+            else:
+                (key, _, value) = label_entry.partition('=')
+                labels[key] = value
+        logger.info('Labelling {kind} "{name}" with {label}'.format(kind=descriptor['kind'], name=name, label=label))
+        self.request('PATCH', self.resource_path(descriptor, namespace=namespace, name=name), body={'metadata': {'labels': labels}},
+                     content_type='application/merge-patch+json')
+
+    def taint(self, taints, node=None, labels=None):
+        """
+        Applies or removes taints on one or more nodes, overwriting existing taints with the same key and effect. See orchutils.k8s.taint for details.
+        """
+        descriptor = self.resolve('node')
+        nodes = [self.get('node', name=node)] if node else self.get('node', labels=labels)
+        for node_resource in nodes:
+            node_taints = apply_taints(node_resource['spec'].get('taints') or [], taints)
+            logger.info('Tainting node "{node}" with {taints}'.format(node=node_resource['metadata']['name'], taints=', '.join(taints)))
+            self.request('PATCH', self.resource_path(descriptor, name=node_resource['metadata']['name']),
+                         body={'metadata': {'resourceVersion': node_resource['metadata']['resourceVersion']}, 'spec': {'taints': node_taints}},
+                         content_type='application/merge-patch+json')
+
+    def logs(self, name, namespace=None, container=None):
+        """
+        Retrieve the logs for a pod. See orchutils.k8s.logs for details.
+        Returns: The logs from the pod/container
+        """
+        descriptor = self.resolve('pod')
+        output = self.request('GET', self.resource_path(descriptor, namespace=namespace, name=name, subresource='log'),
+                              params={'container': container} if container else None, raw=True)
+        for line in output.splitlines():
+            if line.strip():
+                logger.info(line.rstrip())  # Log as kubectl would, as callers rely on the logs being captured for failure analysis
+        return output
+
+    def rollout_status(self, kind, name, namespace=None, watch=False):
+        """
+        Queries a resource for its rollout status, returning the same status messages as kubectl. See orchutils.k8s.rollout_status for details.
+        Returns: The rollout status message
+        """
+        (message, done) = rollout_status_message(self.get(kind, namespace=namespace, name=name))
+        while watch and not done:
+            baseutils.sleep(2)  # Stops at the deadline of an active baseutils.timeout
+            (message, done) = rollout_status_message(self.get(kind, namespace=namespace, name=name))
+        logger.info(message.rstrip())
+        return message
+
+
+def _close_open_clients():
+    """
+    Closes the clients that are still open when the interpreter exits, removing their temporary credential files.
+    """
+    with open_clients_lock:
+        clients = list(open_clients)
+    for client in clients:
+        client.close()
+
+
+atexit.register(_close_open_clients)
+
+
+def load_kubeconfig(kubeconfig):
+    """
+    Loads and merges kubeconfig files using the same rules as kubectl: the first file to define a named entry or the current context wins.
+    Args:
+        kubeconfig: One or more kubeconfig paths separated by the os path separator, as per the KUBECONFIG environment variable
+    Returns: A dictionary with "clusters", "contexts" and "users" dictionaries keyed by name and the "current-context"
+    """
+    config = {'clusters': {}, 'contexts': {}, 'users': {}, 'current-context': None}
+    for path in kubeconfig.split(os.pathsep):
+        if not path or not os.path.isfile(path):
+            continue
+        with open(path) as fh:
+            data = yaml.safe_load(fh) or {}
+        base_dir = os.path.dirname(os.path.abspath(path))
+        config['current-context'] = config['current-context'] or data.get('current-context')
+        for (section, field) in [('clusters', 'cluster'), ('contexts', 'context'), ('users', 'user')]:
+            for entry in data.get(section) or []:
+                if entry['name'] not in config[section]:
+                    config[section][entry['name']] = dict(entry.get(field) or {}, _base_dir=base_dir)
+    return config
+
+
+def apply_taints(current_taints, taints):
+    """
+    Calculates the new taints for a node using kubectl's taint syntax.
+    Args:
+        current_taints: The list of taints currently on the node
+        taints: A list of taints in the format ['key=value:effect', ..]. A trailing "-" removes a taint, eg. 'key:effect-' or 'key-'
+    Returns: The new list of taints for the node
+    """
+    new_taints = list(current_taints)
+    for taint in taints:
+        remove = taint.endswith('-')
+        (key_value, _, effect) = taint.rstrip('-').partition(':')
+        (key, _, value) = key_value.partition('=')
+        new_taints = [existing for existing in new_taints if existing['key'] != key or (effect and existing.get('effect') != effect)]
+        if not remove:
+            new_taint = {'key': key, 'effect': effect}
+            if value:
+                new_taint['value'] = value
+            new_taints.append(new_taint)
+    return new_taints
+
+
+def rollout_status_message(resource):
+    """
+    Calculates the rollout status of a Deployment, DaemonSet or StatefulSet from its live state.
+    The logic and messages match those of "kubectl rollout status" so that callers can parse them the same way.
+    An exception is raised if the rollout has failed or the resource does not support rollout status.
+    Args:
+        resource: The live resource as a dictionary
+    Returns: A tuple of (status message, whether the rollout is complete)
+    """
+    kind = resource['kind']
+    if kind == 'Deployment':
+        return _deployment_rollout_status(resource)
+    strategy = resource['spec'].get('updateStrategy') or {}
+    if kind not in ['DaemonSet', 'StatefulSet'] or strategy.get('type', 'RollingUpdate') != 'RollingUpdate':
+        raise Exception('error: Status is available only for RollingUpdate strategy type')
+    if kind == 'DaemonSet':
+        return _daemon_set_rollout_status(resource)
+    return _stateful_set_rollout_status(resource)
+
+
+def _deployment_rollout_status(resource):
+    """
+    Calculates the rollout status of a Deployment for rollout_status_message.
+    """
+    name = resource['metadata']['name']
+    status = resource.get('status') or {}
+    if resource['metadata'].get('generation', 0) > status.get('observedGeneration', 0):
+        return ('Waiting for deployment spec update to be observed...\n', False)
+    for condition in status.get('conditions') or []:
+        if condition['type'] == 'Progressing' and condition.get('reason') == 'ProgressDeadlineExceeded':
+            raise Exception('error: deployment "{name}" exceeded its progress deadline'.format(name=name))
+    replicas = resource['spec'].get('replicas', 1)
+    updated_replicas = status.get('updatedReplicas', 0)
+    if updated_replicas < replicas:
+        return ('Waiting for deployment "{name}" rollout to finish: {updated} out of {replicas} new replicas have been updated...\n'.format(
+            name=name, updated=updated_replicas, replicas=replicas), False)
+    if status.get('replicas', 0) > updated_replicas:
+        return ('Waiting for deployment "{name}" rollout to finish: {old} old replicas are pending termination...\n'.format(
+            name=name, old=status.get('replicas', 0) - updated_replicas), False)
+    if status.get('availableReplicas', 0) < updated_replicas:
+        return ('Waiting for deployment "{name}" rollout to finish: {available} of {updated} updated replicas are available...\n'.format(
+            name=name, available=status.get('availableReplicas', 0), updated=updated_replicas), False)
+    return ('deployment "{name}" successfully rolled out\n'.format(name=name), True)
+
+
+def _daemon_set_rollout_status(resource):
+    """
+    Calculates the rollout status of a DaemonSet for rollout_status_message.
+    """
+    name = resource['metadata']['name']
+    status = resource.get('status') or {}
+    if resource['metadata'].get('generation', 0) > status.get('observedGeneration', 0):
+        return ('Waiting for daemon set spec update to be observed...\n', False)
+    desired = status.get('desiredNumberScheduled', 0)
+    if status.get('updatedNumberScheduled', 0) < desired:
+        return ('Waiting for daemon set "{name}" rollout to finish: {updated} out of {desired} new pods have been updated...\n'.format(
+            name=name, updated=status.get('updatedNumberScheduled', 0), desired=desired), False)
+    if status.get('numberAvailable', 0) < desired:
+        return ('Waiting for daemon set "{name}" rollout to finish: {available} of {desired} updated pods are available...\n'.format(
+            name=name, available=status.get('numberAvailable', 0), desired=desired), False)
+    return ('daemon set "{name}" successfully rolled out\n'.format(name=name), True)
+
+
+def _stateful_set_rollout_status(resource):
+    """
+    Calculates the rollout status of a StatefulSet for rollout_status_message.
+    """
+    status = resource.get('status') or {}
+    observed_generation = status.get('observedGeneration', 0)
+    if observed_generation == 0 or resource['metadata'].get('generation', 0) > observed_generation:
+        return ('Waiting for statefulset spec update to be observed...\n', False)
+    replicas = resource['spec'].get('replicas', 1)
+    if status.get('readyReplicas', 0) < replicas:
+        return ('Waiting for {count} pods to be ready...\n'.format(count=replicas - status.get('readyReplicas', 0)), False)
+    partition = ((resource['spec'].get('updateStrategy') or {}).get('rollingUpdate') or {}).get('partition')
+    if partition is not None:
+        if status.get('updatedReplicas', 0) < replicas - partition:
+            return ('Waiting for partitioned roll out to finish: {updated} out of {count} new pods have been updated...\n'.format(
+                updated=status.get('updatedReplicas', 0), count=replicas - partition), False)
+        return ('partitioned roll out complete: {updated} new pods have been updated...\n'.format(updated=status.get('updatedReplicas', 0)), True)
+    if status.get('updateRevision') != status.get('currentRevision'):
+        return ('waiting for statefulset rolling update to complete {updated} pods at revision {revision}...\n'.format(
+            updated=status.get('updatedReplicas', 0), revision=status.get('updateRevision')), False)
+    return ('statefulset rolling update complete {current} pods at revision {revision}...\n'.format(
+        current=status.get('currentReplicas', 0), revision=status.get('currentRevision')), True)
+
+
+def _parse_watch_event(descriptor, line, state):
+    """
+    Parses a line of a watch stream and records the resource version and resource it reports in the watch state. Used by KubeClient.watch.
+    Returns: An (event type, resource) tuple or None for bookmarks and expired watches. Expired watches reset the resource version of the state to None
+    """
+    event = json.loads(line)
+    resource = event['object']
+    if event['type'] == 'ERROR':
+        if resource.get('code') == 410:
+            state['resource_version'] = None
+            return None
+        raise Exception('Error from server ({reason}): {message}'.format(reason=resource.get('reason') or 'Unknown', message=resource.get('message')))
+    state['resource_version'] = resource['metadata'].get('resourceVersion') or state['resource_version']
+    if event['type'] == 'BOOKMARK':
+        return None
+    resource.setdefault('apiVersion', descriptor['group_version'])
+    resource.setdefault('kind', descriptor['kind'])
+    key = (resource['metadata'].get('namespace'), resource['metadata']['name'])
+    if event['type'] == 'DELETED':
+        state['known'].pop(key, None)
+    else:
+        state['known'][key] = resource
+    return (event['type'], resource)
+
+
+def _close_watch_on_stop(state, stop_event, finished):
+    """
+    Closes the open request of a watch once its stop event is set, which unblocks the thread reading the stream. Runs in a background thread until the
+    watch is stopped or has finished.
+    """
+    while not finished.is_set():
+        if stop_event.wait(1):
+            response = state['response']
+            if response is not None and not finished.is_set():
+                response.close()
+            return
+
+
+def _api_exception(response):
+    """
+    Builds an exception for an unsuccessful API response. The message matches the form kubectl uses to report server errors.
+    Args:
+        response: The unsuccessful response
+    Returns: An Exception
+    """
+    try:
+        status = response.json()
+        reason = status.get('reason') or 'Unknown'
+        message = status.get('message') or response.text
+    except ValueError:
+        reason = response.reason.replace(' ', '') if response.reason else 'Unknown'
+        message = response.text
+    return Exception('Error from server ({reason}): {message}'.format(reason=reason, message=message))
@@ -1,12 +1,30 @@
+import collections
+import copy
+import hashlib
+import logging
 import os
+import pickle
+import six
+import tempfile
+import threading
 import yaml
 
 from orchutils import vault
 
+logger = logging.getLogger(__name__)
 offering_settings_files = ['app.yaml', 'infra.yaml', 'secret.yaml']
 settings_dir = '/var/orch/settings'
 if 'P2PAAS_SETTINGS_DIR' in os.environ:
     settings_dir = os.environ['P2PAAS_SETTINGS_DIR']
+cache_size = 128  # Maximum number of parsed settings files held in memory by read_settings_file. 0 disables the cache
+settings_cache = collections.OrderedDict()  # (path, encryption key) -> ((mtime, size), settings), in least recently used order
+decrypted_values_cache_size = 4096  # Maximum number of decrypted values held in memory by read_settings_file and get_settings. 0 disables the cache
+decrypted_values = collections.OrderedDict()  # (encryption key, ciphertext) -> plaintext, in least recently used order
+cache_lock = threading.Lock()
+snapshot_file = os.environ.get('P2PAAS_SETTINGS_SNAPSHOT')  # Path of a compiled settings snapshot used by get_settings. See compile_settings
+snapshot_version = 1
+loaded_snapshot = (None, None)  # ((path, mtime, size), snapshot) of the last snapshot read by get_settings
+snapshot_lock = threading.Lock()
 
 
 def get_settings(
@@ -31,28 +49,67 @@ def get_settings(
         metro_settings: Prefix for metro settings. If value is "metro", metro.yaml and metro-secret.yaml will be parsed (Optional, default: metro)
     Returns: A dictionary of collected settings
     """
+    if snapshot_file:
+        settings = _get_snapshot_settings((category, metro, offering), (global_settings, category_settings, metro_settings))
+        if settings is not None:
+            return settings
     settings = {}
-    _merge_settings_type(global_settings, settings_dir, settings, 'settings-global')
-    offerings_file = os.path.join(settings_dir, 'offerings.yaml')
-    if offering and os.path.exists(offerings_file):
-        offerings_settings = read_settings_file(offerings_file)
-        offering_settings = offerings_settings[offering]
-        offering_settings['offering']['name'] = offering
-        settings = merge_settings(settings, offering_settings)
+    for layer in _get_settings_layers(category, metro, offering, global_settings, category_settings, metro_settings):
+        new_settings = _read_settings_layer(layer)
+        if new_settings is not None:
+            merge_settings(settings, new_settings)
+    return settings
+
+
+def _get_settings_layers(category, metro, offering, global_settings, category_settings, metro_settings):
+    """
+    Lists the settings files merged by get_settings for an environment, in the order they are merged.
+    Returns: A list of (path, encryption key, optional, offering) tuples. Optional files are skipped if they do not exist.
+             Offering is only set for the offerings file, from which only the offering's section is merged
+    """
+    layers = _get_settings_type_layers(global_settings, settings_dir, 'settings-global')
+    if offering:
+        layers.append((os.path.join(settings_dir, 'offerings.yaml'), None, True, offering))
     if category:
         settings_sub_dir = os.path.join(settings_dir, category)
-        _merge_settings_type(category_settings, settings_sub_dir, settings, '-'.join(['settings', category]))
+        layers.extend(_get_settings_type_layers(category_settings, settings_sub_dir, '-'.join(['settings', category])))
         if metro:
             settings_sub_dir = os.path.join(settings_sub_dir, metro)
-            _merge_settings_type(metro_settings, settings_sub_dir, settings, '-'.join(['settings', category, metro]))
+            layers.extend(_get_settings_type_layers(metro_settings, settings_sub_dir, '-'.join(['settings', category, metro])))
             if offering:
                 encryption_key = '-'.join(['environment', offering, category, metro])
                 for setting_file in offering_settings_files:
-                    path = os.path.join(settings_sub_dir, offering, setting_file)
-                    if os.path.exists(path):
-                        new_settings = read_settings_file(path, encryption_key if setting_file == 'secret.yaml' else None)
-                        settings = merge_settings(settings, new_settings)
-    return settings
+                    layers.append((os.path.join(settings_sub_dir, offering, setting_file), encryption_key if setting_file == 'secret.yaml' else None, True, None))
+    return layers
+
+
+def _get_settings_type_layers(settings_type, settings_dir, decryption_key):
+    """
+    Lists the standard and encrypted settings files of a setting "type". The type is the prefix for the setting files' names.
+    Returns: A list of layers as per _get_settings_layers
+    """
+    return [
+        (os.path.join(settings_dir, '{type}.yaml'.format(type=settings_type)), None, False, None),
+        (os.path.join(settings_dir, '{type}-secret.yaml'.format(type=settings_type)), decryption_key, True, None)
+    ]
+
+
+def _read_settings_layer(layer, decrypt=True):
+    """
+    Reads the settings of a layer returned by _get_settings_layers.
+    Args:
+        layer: The layer to read
+        decrypt: Whether to decrypt the settings of encrypted layers (Optional, default: True)
+    Returns: A dictionary with the settings values or None if the layer is optional and its file does not exist
+    """
+    (path, encryption_key, optional, offering) = layer
+    if optional and not os.path.exists(path):
+        return None
+    new_settings = read_settings_file(path, encryption_key if decrypt else None)
+    if offering:
+        new_settings = new_settings[offering]
+        new_settings['offering']['name'] = offering
+    return new_settings
 
 
 def _merge_settings_type(settings_type, settings_dir, master_settings, decryption_key):
@@ -65,20 +122,18 @@ def _merge_settings_type(settings_type, settings_dir, master_settings, decryptio
         master_settings: Settings dictionary to merge new values into
         decryption_key: Name of decryption key to use for decrypting encrypted settings
     """
-    settings_filename = '{type}.yaml'.format(type=settings_type)
-    new_settings = read_settings_file(os.path.join(settings_dir, settings_filename))
-    merge_settings(master_settings, new_settings)
-    secret_filename = '{type}-secret.yaml'.format(type=settings_type)
-    path = os.path.join(settings_dir, secret_filename)
-    if os.path.exists(path):
-        new_settings = read_settings_file(path, decryption_key)
-        merge_settings(master_settings, new_settings)
+    for layer in _get_settings_type_layers(settings_type, settings_dir, decryption_key):
+        new_settings = _read_settings_layer(layer)
+        if new_settings is not None:
+            merge_settings(master_settings, new_settings)
 
 
 def read_settings_file(settings_file, encryption_key=None):
     """
     Reads a yaml file and returns it's contents as a dictionary. If an encryption key is provided, decrypt the file
     using our Vault library.
+    Parsed and decrypted contents are cached in memory until the file's modification time or size changes, holding up to cache_size files.
+    Decrypted values are also remembered for each encryption key so that a secret is only sent to Vault once per process, even if its file changes.
     Args:
         settings_file: Path to file containing the settings
         encryption_key: The key to decypher the settings (Optional)
@@ -86,13 +141,69 @@ def read_settings_file(settings_file, encryption_key=None):
     """
     if not os.path.isfile(settings_file) or os.path.abspath(settings_file) != settings_file:  # Second check is to prevent traversal attack
         raise IOError('Setting file not found: {settings_file}'.format(settings_file=settings_file))
+    stat = os.stat(settings_file)
+    cache_key = (settings_file, encryption_key)
+    file_version = (stat.st_mtime, stat.st_size)
+    with cache_lock:
+        cache_entry = settings_cache.pop(cache_key, None)
+        if cache_entry and cache_entry[0] == file_version:
+            settings_cache[cache_key] = cache_entry  # Re-inserted as the most recently used entry
+            return copy.deepcopy(cache_entry[1])
     with open(settings_file) as fh:
         new_settings = yaml.safe_load(fh)
         if new_settings is None:  # Empty Yaml file
             new_settings = {}
         if encryption_key:
-            vault.decrypt_dict(encryption_key, new_settings)
-        return new_settings
+            _decrypt_settings(encryption_key, new_settings)
+    if cache_size > 0:
+        with cache_lock:
+            settings_cache[cache_key] = (file_version, copy.deepcopy(new_settings))
+            while len(settings_cache) > cache_size:
+                settings_cache.popitem(last=False)
+    return new_settings
+
+
+def _decrypt_settings(encryption_key, new_settings):
+    """
+    Decrypts the values of a settings dictionary, only sending values to Vault that have not previously been decrypted with the same key.
+    Up to decrypted_values_cache_size decrypted values are kept, discarding the least recently used values first.
+    Args:
+        encryption_key: The name of the Vault transit encryption key to use for decryption
+        new_settings: The settings to decrypt. The dictionary is mutated to contain the decrypted values
+    """
+    index = vault._index_dict_for_vault(new_settings)
+    plaintexts = {}
+    pending = collections.OrderedDict()
+    pending_ciphertexts = set()
+    with cache_lock:
+        for (container, key) in index:
+            ciphertext = container[key]
+            if (encryption_key, ciphertext) in decrypted_values:
+                plaintexts[ciphertext] = decrypted_values[(encryption_key, ciphertext)] = decrypted_values.pop((encryption_key, ciphertext))  # Most recently used
+            elif ciphertext not in pending_ciphertexts:
+                pending[str(len(pending))] = ciphertext
+                pending_ciphertexts.add(ciphertext)
+    if pending:
+        ciphertexts = dict(pending)
+        vault.decrypt_dict(encryption_key, pending)
+        with cache_lock:
+            for (i, plaintext) in pending.items():
+                plaintexts[ciphertexts[i]] = plaintext
+                if decrypted_values_cache_size > 0:
+                    decrypted_values[(encryption_key, ciphertexts[i])] = plaintext
+            while len(decrypted_values) > max(decrypted_values_cache_size, 0):
+                decrypted_values.popitem(last=False)
+    for (container, key) in index:
+        container[key] = plaintexts[container[key]]
+
+
+def clear_cache():
+    """
+    Discards all cached settings files and decrypted values.
+    """
+    with cache_lock:
+        settings_cache.clear()
+        decrypted_values.clear()
 
 
 def merge_settings(master, partial):
@@ -114,6 +225,228 @@ def merge_settings(master, partial):
     return master
 
 
+def compile_settings(path=None, global_settings='global', category_settings='category', metro_settings='metro'):
+    """
+    Compiles the merged settings of every environment under settings_dir into a snapshot file, from which get_settings loads an environment in a single read.
+    The environments are the combinations of category, metro and offering accepted by get_settings, as found from the directories of settings_dir and offerings.yaml.
+    Merges shared by several environments, such as those of the global and category settings, are only performed once.
+    Encrypted settings are stored encrypted and are decrypted by get_settings, so no plaintext secrets are written to the snapshot.
+    The snapshot records a content hash of each settings file. When get_settings finds that a file of an environment has changed, the environments that include
+    the file are rebuilt and the snapshot is updated. Environments added after compilation are read from the settings files until the snapshot is recompiled.
+    Args:
+        path: The path of the snapshot file. It is also set as snapshot_file so that get_settings uses it (Optional, default: snapshot_file or .settings.snapshot in settings_dir)
+        global_settings: Prefix for global settings, as per get_settings. The snapshot is only used by get_settings for the same prefixes (Optional, default: global)
+        category_settings: Prefix for category settings, as per get_settings (Optional, default: category)
+        metro_settings: Prefix for metro settings, as per get_settings (Optional, default: metro)
+    Returns: The path of the snapshot file
+    """
+    global snapshot_file
+    path = path or snapshot_file or os.path.join(settings_dir, '.settings.snapshot')
+    prefixes = (global_settings, category_settings, metro_settings)
+    snapshot = {'version': snapshot_version, 'settings_dir': settings_dir, 'prefixes': prefixes, 'files': {}, 'environments': {}}
+    with snapshot_lock:
+        _build_snapshot_environments(snapshot, _get_environments(prefixes))
+        _save_snapshot(path, snapshot)
+    snapshot_file = path
+    return path
+
+
+def _get_environments(prefixes):
+    """
+    Finds the environments in settings_dir for which get_settings can be called.
+    Args:
+        prefixes: A tuple of the global, category and metro settings prefixes
+    Returns: A list of (category, metro, offering) tuples
+    """
+    offerings_file = os.path.join(settings_dir, 'offerings.yaml')
+    offerings = sorted(read_settings_file(offerings_file)) if os.path.exists(offerings_file) else []
+    environments = [(None, None, offering) for offering in [None] + offerings]
+    for category in sorted(os.listdir(settings_dir)):
+        category_dir = os.path.join(settings_dir, category)
+        if not os.path.isfile(os.path.join(category_dir, '{type}.yaml'.format(type=prefixes[1]))):
+            continue
+        environments.extend((category, None, offering) for offering in [None] + offerings)
+        for metro in sorted(os.listdir(category_dir)):
+            metro_dir = os.path.join(category_dir, metro)
+            if not os.path.isfile(os.path.join(metro_dir, '{type}.yaml'.format(type=prefixes[2]))):
+                continue
+            metro_offerings = offerings if os.path.exists(offerings_file) else sorted(name for name in os.listdir(metro_dir) if os.path.isdir(os.path.join(metro_dir, name)))
+            environments.extend((category, metro, offering) for offering in [None] + metro_offerings)
+    return environments
+
+
+def _build_snapshot_environments(snapshot, environments):
+    """
+    Merges the settings of environments into a snapshot, replacing any existing entries for the environments.
+    The result of merging each sequence of layers is kept for the duration of the build, so layers shared between environments are only merged once.
+    """
+    merged_layers = {(): ({}, {})}  # (settings, secrets) keyed by the layers merged to produce them
+    for environment in environments:
+        layers = _get_settings_layers(*(environment + snapshot['prefixes']))
+        for layer in layers:
+            snapshot['files'][layer[0]] = _get_file_version(layer[0])  # Recorded before reading, so a concurrent change is detected later
+        merged_count = len(layers)
+        while tuple(layers[:merged_count]) not in merged_layers:
+            merged_count -= 1
+        (settings, secrets) = copy.deepcopy(merged_layers[tuple(layers[:merged_count])])
+        for i in range(merged_count, len(layers)):
+            new_settings = _read_settings_layer(layers[i], decrypt=False)
+            if new_settings is not None:
+                _merge_snapshot_layer(settings, new_settings, secrets, layers[i][1])
+            merged_layers[tuple(layers[:i + 1])] = copy.deepcopy((settings, secrets))
+        snapshot['environments'][environment] = {'layers': [layer[0] for layer in layers], 'settings': settings, 'secrets': list(secrets.items())}
+
+
+def _merge_snapshot_layer(master, partial, secrets, encryption_key, path=()):
+    """
+    Merges settings as per merge_settings while tracking the locations of values that are still encrypted.
+    Args:
+        master: The settings to merge into. This dictionary is mutated
+        partial: The settings of the layer to merge
+        secrets: A dictionary of the locations of encrypted values in master, as tuples of keys, to their encryption keys. This dictionary is mutated
+        encryption_key: The encryption key of the layer's values or None if the layer is not encrypted
+        path: Internal parameter used as part of the functions recursive implementation. The location of master in the settings
+    """
+    for key in partial:
+        key_path = path + (key,)
+        if key in master and isinstance(master[key], dict) and isinstance(partial[key], dict):
+            _merge_snapshot_layer(master[key], partial[key], secrets, encryption_key, key_path)
+        else:
+            if key in master:
+                for value_path in _get_string_paths(master[key]):
+                    secrets.pop(key_path + value_path, None)
+            master[key] = partial[key]
+            if encryption_key:
+                for value_path in _get_string_paths(partial[key]):
+                    secrets[key_path + value_path] = encryption_key
+
+
+def _get_string_paths(value):
+    """
+    Returns the locations of the string values in a settings value, which are the values that are encrypted in secret settings files.
+    """
+    if isinstance(value, dict):
+        return [(key,) + value_path for (key, child) in value.items() for value_path in _get_string_paths(child)]
+    return [()] if isinstance(value, six.string_types) else []
+
+
+def _get_file_version(path, previous=None):
+    """
+    Identifies the content of a file by its modification time, size and content hash. The file is only hashed if its modification time or size differ from previous.
+    Returns: A tuple of (mtime, size, sha1) or None if the file does not exist
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    if previous and previous[:2] == (stat.st_mtime, stat.st_size):
+        return previous
+    with open(path, 'rb') as fh:
+        return (stat.st_mtime, stat.st_size, hashlib.sha1(fh.read()).hexdigest())
+
+
+def _get_snapshot_settings(environment, prefixes):
+    """
+    Loads the settings of an environment from the snapshot, first rebuilding the environments that include any of its settings files that have changed.
+    Returns: A dictionary of collected settings or None if the snapshot cannot be used for the environment
+    """
+    with snapshot_lock:
+        snapshot = _load_snapshot()
+        if snapshot is None or snapshot['prefixes'] != prefixes or snapshot['settings_dir'] != settings_dir or environment not in snapshot['environments']:
+            return None
+        _refresh_snapshot_environment(snapshot, environment)
+        entry = snapshot['environments'][environment]
+        settings = copy.deepcopy(entry['settings'])
+    _decrypt_snapshot_secrets(settings, entry['secrets'])
+    return settings
+
+
+def _refresh_snapshot_environment(snapshot, environment):
+    """
+    Rebuilds the environments of a snapshot that include any of the settings files of an environment that have changed and saves the updated snapshot.
+    """
+    changed_paths = set()
+    for path in snapshot['environments'][environment]['layers']:
+        previous = snapshot['files'].get(path)
+        current = _get_file_version(path, previous)
+        if (current and current[2]) != (previous and previous[2]):
+            changed_paths.add(path)
+        snapshot['files'][path] = current
+    if changed_paths:
+        environments = [name for (name, entry) in snapshot['environments'].items() if changed_paths.intersection(entry['layers'])]
+        logger.info('Settings files {paths} have changed. Rebuilding {count} environments of the settings snapshot'.format(
+            paths=', '.join(sorted(changed_paths)), count=len(environments)))
+        _build_snapshot_environments(snapshot, environments)
+        try:
+            _save_snapshot(snapshot_file, snapshot)
+        except (IOError, OSError) as e:
+            logger.warning('Unable to update settings snapshot {path}: {error}'.format(path=snapshot_file, error=e))
+
+
+def _decrypt_snapshot_secrets(settings, secrets):
+    """
+    Decrypts the values of an environment's settings that are still encrypted in the snapshot.
+    Args:
+        settings: The settings of the environment. The dictionary is mutated to contain the decrypted values
+        secrets: A list of (location, encryption key) tuples of the encrypted values, as recorded by _build_snapshot_environments
+    """
+    secret_paths = {}
+    for (path, encryption_key) in secrets:
+        secret_paths.setdefault(encryption_key, []).append(path)
+    for (encryption_key, paths) in secret_paths.items():
+        containers = []
+        for path in paths:
+            container = settings
+            for key in path[:-1]:
+                container = container[key]
+            containers.append((container, path[-1]))
+        values = dict((str(i), container[key]) for (i, (container, key)) in enumerate(containers))
+        _decrypt_settings(encryption_key, values)
+        for (i, (container, key)) in enumerate(containers):
+            container[key] = values[str(i)]
+
+
+def _load_snapshot():
+    """
+    Reads the snapshot file, reusing the previously read snapshot if the file has not changed.
+    Returns: The snapshot or None if there is no valid snapshot file
+    """
+    global loaded_snapshot
+    try:
+        stat = os.stat(snapshot_file)
+    except OSError:
+        return None
+    file_version = (snapshot_file, stat.st_mtime, stat.st_size)
+    if loaded_snapshot[0] != file_version:
+        try:
+            with open(snapshot_file, 'rb') as fh:
+                content = pickle.load(fh)
+            if hashlib.sha1(content['payload']).hexdigest() != content['hash']:
+                raise ValueError('content hash does not match')
+            snapshot = pickle.loads(content['payload'])
+        except (EOFError, KeyError, TypeError, ValueError, pickle.UnpicklingError) as e:
+            logger.warning('Ignoring invalid settings snapshot {path}: {error}'.format(path=snapshot_file, error=e))
+            return None
+        if snapshot['version'] != snapshot_version:
+            return None
+        loaded_snapshot = (file_version, snapshot)
+    return loaded_snapshot[1]
+
+
+def _save_snapshot(path, snapshot):
+    """
+    Writes a snapshot file with a content hash. The file is replaced atomically so that readers never see a partially written snapshot.
+    """
+    global loaded_snapshot
+    payload = pickle.dumps(snapshot, pickle.HIGHEST_PROTOCOL)
+    (fd, tmp_path) = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), suffix='.tmp')
+    with os.fdopen(fd, 'wb') as fh:
+        pickle.dump({'hash': hashlib.sha1(payload).hexdigest(), 'payload': payload}, fh, pickle.HIGHEST_PROTOCOL)
+    os.rename(tmp_path, path)
+    stat = os.stat(path)
+    loaded_snapshot = ((path, stat.st_mtime, stat.st_size), snapshot)
+
+
 def write_settings(category, metro, offering, new_settings, settings_type, overwrite_conflicts=True):
     """
     Writes offering-specific settings into a settings file. The passed settings data must be a dictionary and valid yaml and will be merged into existing settings.
@@ -12,8 +12,9 @@ helm_binary = '/usr/local/bin/helm'
 if 'P2PAAS_ORCH_DIR' in os.environ and 'HELM_HOME' not in os.environ:
     # Support customisation of the HEML_HOME path to facilitate simultaneous management of multiple clusters from a single server
     os.environ['HELM_HOME'] = os.path.join(os.environ['P2PAAS_ORCH_DIR'], '.helm')
-    helm_binary = baseutils.shell_escape(os.path.join(os.environ['P2PAAS_ORCH_DIR'], 'helm'))
+    helm_binary = os.path.join(os.environ['P2PAAS_ORCH_DIR'], 'helm')
 iks_ovpn_reservation_lock_name = 'sos_iks_ovpn_reservation'
+iks_ovpn_reservation_lock_timeout = 600  # Maximum number of seconds to wait for the Vault lock that serialises reservations across hosts
 vault_iks_ovpn_path = 'secret/ansible/sos/iks/ovpn'
 
 
@@ -33,12 +34,8 @@ def csutil_cluster_setup(cluster_name, service_name, cname):
         config_path = os.path.join(tmp_dir, iks_ovpn_config_name)
         with open(config_path, 'w') as fh:
             fh.write(iks_ovpn_config)
-        baseutils.exe_cmd(('/usr/local/bin/ibmcloud csutil cluster-setup --crn-service-name {service_name} --crn-cname {cname} '
-                           '--sos-config-path {config_path} --skip-prometheus=true {cluster_name} --silent').format(
-                               service_name=baseutils.shell_escape(service_name),
-                               cname=baseutils.shell_escape(cname),
-                               config_path=baseutils.shell_escape(config_path),
-                               cluster_name=baseutils.shell_escape(cluster_name)), env=_get_csutil_env())
+        baseutils.exe_cmd(['/usr/local/bin/ibmcloud', 'csutil', 'cluster-setup', '--crn-service-name', service_name, '--crn-cname', cname,
+                           '--sos-config-path', config_path, '--skip-prometheus=true', cluster_name, '--silent'], env=_get_csutil_env())
     finally:
         shutil.rmtree(tmp_dir)
 
@@ -51,13 +48,14 @@ def csutil_cluster_cleanup(cluster_name):
         cluster_name: The name of the cluster to clean up
     """
     release_iks_ovpn_config_reservation(cluster_name)
-    baseutils.exe_cmd('/usr/local/bin/ibmcloud csutil cluster-cleanup {cluster_name} --silent'.format(cluster_name=baseutils.shell_escape(cluster_name)), env=_get_csutil_env())
+    baseutils.exe_cmd(['/usr/local/bin/ibmcloud', 'csutil', 'cluster-cleanup', cluster_name, '--silent'], env=_get_csutil_env())
 
 
 def _reserve_iks_ovpn_config_name(cluster_name):
     """
     Get the name of the ovpn config associated to an IKS cluster.
     If one is not already associated with the cluster, a new one will be reserved.
+    Reservations are made while holding a Vault lock, so that two hosts can not reserve the same config.
     An exception is raised if a config cannot be reserved for the cluster.
     Args:
         cluster_name: The name of the cluster to retrieve the ovpn name for
@@ -67,8 +65,8 @@ def _reserve_iks_ovpn_config_name(cluster_name):
     if not iks_ovpn_config_name:
         available_ovpn_configs = vault.list_keys('{vault_path}/files'.format(vault_path=vault_iks_ovpn_path))
         vault_reservation_path = '{vault_path}/reservations'.format(vault_path=vault_iks_ovpn_path)
-        with baseutils.local_lock(lock_name=iks_ovpn_reservation_lock_name):
-            reserved_ovpn_configs = vault.list_keys(vault_reservation_path)
+        with baseutils.local_lock(lock_name=iks_ovpn_reservation_lock_name), _reservation_lock():
+            reserved_ovpn_configs = vault.list_keys(vault_reservation_path, cached=False)
             for config_name in available_ovpn_configs:
                 if config_name not in reserved_ovpn_configs:
                     iks_ovpn_config_name = config_name
@@ -92,19 +90,30 @@ def _get_current_iks_ovpn_config_name(cluster_name):
         for key in vpn_secret['data']:
             if key.endswith('.ovpn'):
                 iks_ovpn_config_name = key
-                with baseutils.local_lock(lock_name=iks_ovpn_reservation_lock_name):
-                    # Ensure the reservation system is in-sync with the current state of the IKS cluster
-                    vault_reservation_path = '{parent}/reservations/{config_name}'.format(parent=vault_iks_ovpn_path, config_name=iks_ovpn_config_name)
-                    current_reservation_owner = vault.read(vault_reservation_path, property='cluster')
-                    if current_reservation_owner:
-                        if current_reservation_owner != cluster_name:
-                            raise Exception('Cluster is using and ovpn config reserved by a different cluster')
-                    else:
-                        vault.write(vault_reservation_path, {'cluster': cluster_name})
+                # Ensure the reservation system is in-sync with the current state of the IKS cluster
+                vault_reservation_path = '{parent}/reservations/{config_name}'.format(parent=vault_iks_ovpn_path, config_name=iks_ovpn_config_name)
+                with baseutils.local_lock(lock_name=iks_ovpn_reservation_lock_name, shared=True):
+                    current_reservation_owner = vault.read(vault_reservation_path, property='cluster', cached=False)
+                if not current_reservation_owner:
+                    with baseutils.local_lock(lock_name=iks_ovpn_reservation_lock_name), _reservation_lock():
+                        # The reservation is checked again as it may have been made while no lock was held
+                        current_reservation_owner = vault.read(vault_reservation_path, property='cluster', cached=False)
+                        if not current_reservation_owner:
+                            vault.write(vault_reservation_path, {'cluster': cluster_name})
+                if current_reservation_owner and current_reservation_owner != cluster_name:
+                    raise Exception('Cluster is using and ovpn config reserved by a different cluster')
                 break
     return iks_ovpn_config_name
 
 
+def _reservation_lock():
+    """
+    Returns the Vault lock held while ovpn config reservations are checked and written. The local lock is taken first, so processes on the same host
+    wait for each other without polling Vault.
+    """
+    return vault.distributed_lock(iks_ovpn_reservation_lock_name, timeout=iks_ovpn_reservation_lock_timeout)
+
+
 def _get_csutil_env():
     """
     The csutil plugin makes a number of assumptions regards the system it runs on.
@@ -0,0 +1,26 @@
+import json
+import unittest
+from mock import AsyncMock
+from mock import patch
+
+from baseutils import aioutils
+from orchutils.aio import helm3
+from helmmodels.test_releaserevision import revisions_json
+
+
+class TestAIOHelm3(unittest.TestCase):
+    @patch('baseutils.aioutils.exe_cmd', new_callable=AsyncMock)
+    def test_get_manifest(self, mock_exe_cmd):
+        mock_exe_cmd.return_value = (0, '---\nkind: Service\nmetadata:\n  name: s1\n---\nkind: Deployment\nmetadata:\n  name: d1\n---\n# Empty\n')
+        (manifest, deployments) = aioutils.run([helm3.get_manifest('release'), helm3.get_manifest('release', resource_type='Deployment')])
+        self.assertEqual(['s1', 'd1'], [resource['metadata']['name'] for resource in manifest])
+        self.assertEqual(['d1'], [resource['metadata']['name'] for resource in deployments])
+        self.assertEqual(['get', 'manifest', 'release'], mock_exe_cmd.call_args_list[0][0][0][1:])
+
+    @patch('baseutils.aioutils.exe_cmd', new_callable=AsyncMock)
+    def test_history(self, mock_exe_cmd):
+        mock_exe_cmd.return_value = (0, json.dumps(revisions_json))
+        revisions = aioutils.run([helm3.history('release', env={'KUBECONFIG': 'c1'})])[0]
+        self.assertEqual(len(revisions_json), len(revisions))
+        self.assertEqual(['history', 'release', '-o', 'json'], mock_exe_cmd.call_args[0][0][1:])
+        self.assertEqual({'KUBECONFIG': 'c1'}, mock_exe_cmd.call_args[1]['env'])
@@ -0,0 +1,30 @@
+import json
+import unittest
+from mock import AsyncMock
+from mock import patch
+
+from baseutils import aioutils
+from orchutils.aio import ibmcloud
+from ibmcloudmodels.test_ikscluster import clusters_json
+from ibmcloudmodels.test_iksworker import workers_json
+
+
+class TestAIOIBMCloud(unittest.TestCase):
+    @patch('baseutils.aioutils.exe_cmd', new_callable=AsyncMock)
+    def test_ks_cluster_get(self, mock_exe_cmd):
+        mock_exe_cmd.side_effect = [(0, json.dumps(clusters_json[0])), (1, 'The specified cluster could not be found. (A0006)'), (1, '')]
+        (cluster, missing_cluster, failure) = aioutils.run([ibmcloud.ks_cluster_get(name, env={'IBMCLOUD_HOME': name}) for name in ['c1', 'c2', 'c3']],
+                                                           return_exceptions=True)
+        self.assertEqual('test-priv-nosub', cluster.name)
+        self.assertIsNone(missing_cluster)
+        self.assertIsInstance(failure, Exception)
+        self.assertEqual(['ks', 'cluster', 'get', '--cluster', 'c1', '--json'], mock_exe_cmd.call_args_list[0][0][0][1:])
+        self.assertEqual({'IBMCLOUD_HOME': 'c1'}, mock_exe_cmd.call_args_list[0][1]['env'])
+
+    @patch('baseutils.aioutils.exe_cmd', new_callable=AsyncMock)
+    def test_ks_worker_get(self, mock_exe_cmd):
+        mock_exe_cmd.side_effect = [(0, json.dumps(workers_json[0])), (1, 'The specified worker node could not be found. (E0011)')]
+        (worker, missing_worker) = aioutils.run([ibmcloud.ks_worker_get('cluster', 'w1'), ibmcloud.ks_worker_get('cluster', 'w2')])
+        self.assertEqual('kube-sjc03-cra8efa36505be48d0a382aa2fa7081082-w1', worker.id)
+        self.assertIsNone(missing_worker)
+        self.assertEqual(['--worker', 'w2', '--json'], mock_exe_cmd.call_args_list[1][0][0][-3:])
@@ -0,0 +1,36 @@
+import unittest
+from mock import AsyncMock
+from mock import patch
+
+from baseutils import aioutils
+from orchutils import aio
+from orchutils.aio import k8s
+
+
+class TestAIOK8s(unittest.TestCase):
+    def test_cluster_env(self):
+        env = aio.cluster_env('/orch/cluster1', env={'PATH': '/bin'})
+        self.assertEqual('/bin', env['PATH'])
+        self.assertEqual('/orch/cluster1/.kube/config', env['KUBECONFIG'])
+        self.assertEqual('/orch/cluster1', env['IBMCLOUD_HOME'])
+
+    @patch('baseutils.aioutils.exe_cmd', new_callable=AsyncMock)
+    def test_get(self, mock_exe_cmd):
+        mock_exe_cmd.side_effect = [
+            (0, '{"kind": "List", "items": [{"metadata": {"name": "p1"}}]}'),
+            (0, '{"kind": "Secret", "metadata": {"name": "s1"}}'),
+            (0, '{"kind": "List", "items": []}')
+        ]
+        (pods, secret) = aioutils.run([
+            k8s.get('pod', namespace='all', labels={'app': 'a1'}, env={'KUBECONFIG': 'c1'}),
+            k8s.get('secret', namespace='ns', name='s1', env={'KUBECONFIG': 'c2'})
+        ])
+        self.assertEqual([{'metadata': {'name': 'p1'}}], pods)
+        self.assertEqual('s1', secret['metadata']['name'])
+        self.assertEqual(['get', 'pod', '--all-namespaces', '-l', 'app=a1', '-o', 'json'], mock_exe_cmd.call_args_list[0][0][0][1:])
+        self.assertEqual({'KUBECONFIG': 'c1'}, mock_exe_cmd.call_args_list[0][1]['env'])
+        self.assertEqual(['get', 'secret', 's1', '-n', 'ns', '-o', 'json'], mock_exe_cmd.call_args_list[1][0][0][1:])
+        self.assertEqual(0, mock_exe_cmd.call_args_list[1][1]['log_level'])  # Secrets are not logged
+        # The kubectl of the orchestration directory of the environment is used
+        aioutils.run([k8s.get('pod', env=aio.cluster_env('/orch/cluster1'))])
+        self.assertEqual('/orch/cluster1/kubectl', mock_exe_cmd.call_args[0][0][0])
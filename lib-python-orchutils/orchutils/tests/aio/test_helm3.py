@@ -0,0 +1,9 @@
+import sys
+import unittest
+
+if sys.version_info >= (3, 5):
+    from aio.helm3_cases import TestAIOHelm3  # noqa: F401 The tests of orchutils.aio use syntax that is only valid on Python 3.5 or later
+
+
+if __name__ == '__main__':
+    unittest.main()
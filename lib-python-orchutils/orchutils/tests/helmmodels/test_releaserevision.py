@@ -52,6 +52,8 @@ class TestReleaseRevision(unittest.TestCase):
         str_time = 'Wed Mar 27 10:00:00 2019'
         revision.updated = str_time
         self.assertEqual(datetime.datetime.strptime(str_time, '%a %b %d %H:%M:%S %Y'), revision.updated)
+        revision.updated = '2019-03-27T10:00:00.123456789+01:00'  # Helm 3
+        self.assertEqual(datetime.datetime(2019, 3, 27, 10, 0, 0), revision.updated)
         obj_time = datetime.datetime.now()
         revision.updated = obj_time
         self.assertEqual(obj_time, revision.updated)
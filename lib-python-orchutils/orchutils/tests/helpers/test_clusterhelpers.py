@@ -0,0 +1,30 @@
+import os
+import unittest
+from mock import patch
+
+from orchutils import k8s
+from orchutils.helpers import clusterhelpers
+
+
+class TestClusterHelpers(unittest.TestCase):
+    @patch('orchutils.ibmcloud.set_backend')
+    @patch('orchutils.k8s.set_backend')
+    @patch('orchutils.k8s.kubectl_binary', '/usr/local/bin/kubectl')
+    @patch.dict('os.environ', {'KUBECONFIG': '/base/config'}, clear=True)
+    def test_use_cluster_env(self, mock_k8s_set_backend, mock_ibmcloud_set_backend):
+        base_env = clusterhelpers.get_base_env()
+        clusterhelpers.use_cluster_env('/orch/c1', base_env)
+        self.assertEqual('/orch/c1/.kube/config', os.environ['KUBECONFIG'])
+        self.assertEqual('/orch/c1', os.environ['IBMCLOUD_HOME'])
+        self.assertEqual('/orch/c1/kubectl', k8s.kubectl_binary)
+        os.environ['CLUSTER_VAR'] = 'c1'
+        # A cluster without an orchestration directory uses the base configuration, whichever cluster the process managed before
+        clusterhelpers.use_cluster_env(None, base_env)
+        self.assertEqual({'KUBECONFIG': '/base/config'}, dict(os.environ))
+        self.assertEqual('/usr/local/bin/kubectl', k8s.kubectl_binary)
+        self.assertEqual(2, mock_k8s_set_backend.call_count)
+        self.assertEqual(2, mock_ibmcloud_set_backend.call_count)
+
+
+if __name__ == '__main__':
+    unittest.main()
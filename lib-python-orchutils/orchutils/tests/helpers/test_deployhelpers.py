@@ -0,0 +1,94 @@
+import concurrent.futures
+import os
+import threading
+import unittest
+from mock import patch
+
+from orchutils.helpers import deployhelpers
+
+
+def chart(release, depends_on=None):
+    return {'name': 'repo/{release}'.format(release=release), 'chartVersion': '1.0.0', 'valuesFile': 'values.yaml', 'release': release,
+            'namespace': 'namespace', 'dependsOn': depends_on}
+
+
+@patch('concurrent.futures.ProcessPoolExecutor', concurrent.futures.ThreadPoolExecutor)  # Allows the mocks to be used by the environment tasks
+class TestDeployHelpers(unittest.TestCase):
+    @patch('orchutils.helm3.install_chart')
+    def test_deploy_releases(self, mock_install_chart):
+        events = []
+        events_lock = threading.Lock()
+        zookeeper_started = threading.Event()
+        kibana_started = threading.Event()
+
+        def install_chart(name, version, values_file, release, namespace, validate_manifest=False, dry_run=False):
+            with events_lock:
+                events.append(('start', release))
+            if release == 'zookeeper':
+                zookeeper_started.set()
+                self.assertTrue(kibana_started.wait(5))  # Independent releases are deployed at the same time
+            elif release == 'kibana':
+                kibana_started.set()
+                self.assertTrue(zookeeper_started.wait(5))
+            elif release == 'elasticsearch':
+                raise Exception('install failed')
+            with events_lock:
+                events.append(('end', release))
+        mock_install_chart.side_effect = install_chart
+        charts = [chart('kafka', ['zookeeper']), chart('zookeeper'), chart('elasticsearch'), chart('kibana'), chart('curator', ['elasticsearch'])]
+        results = deployhelpers.deploy_releases(charts, validate_manifest=True)
+        self.assertEqual(['kafka', 'zookeeper', 'elasticsearch', 'kibana', 'curator'], [result['release'] for result in results])
+        self.assertEqual(['deployed', 'deployed', 'failed', 'deployed', 'skipped'], [result['status'] for result in results])
+        self.assertLess(events.index(('end', 'zookeeper')), events.index(('start', 'kafka')))
+        self.assertEqual('install failed', results[2]['error'])
+        self.assertIn('elasticsearch', results[4]['error'])
+        self.assertIsNone(results[4]['start'])
+        self.assertTrue(all(result['duration'] >= 0 for result in results[:4]))
+        self.assertEqual(4, mock_install_chart.call_count)
+        self.assertTrue(mock_install_chart.call_args[1]['validate_manifest'])
+
+    @patch('orchutils.helm3.install_chart')
+    def test_deploy_releases_environments(self, mock_install_chart):
+        environments = [{'category': 'np', 'metro': 'sjc03', 'offering': 'o1', 'orch_dir': '/orch/sjc03'},
+                        {'category': 'np', 'metro': 'dal10', 'offering': 'o1'}, {'category': 'np', 'metro': 'dal10', 'offering': 'o2'},
+                        {'category': 'np', 'metro': 'sjc03', 'offering': 'o2', 'orch_dir': '/orch/sjc03'}]
+        with patch('orchutils.helpers.clusterhelpers.use_cluster_env') as mock_use_cluster_env:
+            results = deployhelpers.deploy_releases([chart('zookeeper'), chart('kafka', ['zookeeper'])], environments=environments)
+        self.assertEqual(['/orch/sjc03', None], [call[0][0] for call in mock_use_cluster_env.call_args_list])
+        # Environments sharing a cluster install each release once
+        self.assertEqual(4, mock_install_chart.call_count)
+        self.assertEqual(['zookeeper', 'kafka', 'zookeeper', 'kafka'], [result['release'] for result in results])
+        self.assertEqual(['deployed'] * 4, [result['status'] for result in results])
+        self.assertEqual([environments[0]['offering'], environments[3]['offering']], [environment['offering'] for environment in results[0]['environments']])
+        self.assertNotIn('orch_dir', results[0]['environments'][0])
+        self.assertEqual([('dal10', 'o1'), ('dal10', 'o2')], [(environment['metro'], environment['offering']) for environment in results[2]['environments']])
+        # Dependencies must be deployable
+        self.assertRaises(Exception, deployhelpers.deploy_releases, [chart('kafka', ['zookeeper'])])
+        self.assertRaises(Exception, deployhelpers.deploy_releases, [chart('a', ['b']), chart('b', ['a'])])
+        self.assertEqual(4, mock_install_chart.call_count)
+
+
+class TestDeployHelpersProcesses(unittest.TestCase):
+    @patch('orchutils.helm3.install_chart')
+    def test_deploy_releases_processes(self, mock_install_chart):
+        # The mock is inherited by the forked processes of the pool, which report the cluster configuration they deployed with through the error
+        def install_chart(name, version, values_file, release, namespace, validate_manifest=False, dry_run=False):
+            if release == 'zookeeper':
+                raise Exception(os.environ.get('KUBECONFIG'))
+        mock_install_chart.side_effect = install_chart
+        kubeconfig = os.environ.get('KUBECONFIG')
+        environments = [{'metro': 'sjc03', 'orch_dir': '/orch/sjc03'}, {'metro': 'dal10', 'orch_dir': '/orch/dal10'}]
+        results = deployhelpers.deploy_releases([chart('zookeeper'), chart('kafka', ['zookeeper']), chart('curator')], environments=environments)
+        self.assertEqual([[{'metro': 'sjc03'}]] * 3 + [[{'metro': 'dal10'}]] * 3, [result['environments'] for result in results])
+        self.assertEqual(['failed', 'skipped', 'deployed'] * 2, [result['status'] for result in results])
+        self.assertEqual(['/orch/sjc03/.kube/config', '/orch/dal10/.kube/config'], [results[0]['error'], results[3]['error']])
+        self.assertEqual(kubeconfig, os.environ.get('KUBECONFIG'))  # Each cluster is configured in its own process
+        self.assertEqual(0, mock_install_chart.call_count)
+        # A process deploying several clusters resets the configuration of the previous cluster
+        with patch.dict('os.environ', {'KUBECONFIG': '/base/config'}):
+            results = deployhelpers.deploy_releases([chart('zookeeper')], environments=[environments[0], {'metro': 'dal10'}], environment_concurrency=1)
+        self.assertEqual(['/orch/sjc03/.kube/config', '/base/config'], [result['error'] for result in results])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,92 @@
+import concurrent.futures
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from mock import patch
+
+from orchutils.helpers import fleethelpers
+from orchutils.ibmcloudmodels.iksworker import IKSWorker
+from ibmcloudmodels.test_iksworker import workers_json
+
+
+def cluster_workers(cluster_name):
+    return [
+        IKSWorker(dict(workers_json[0], id='{cluster}-w1'.format(cluster=cluster_name), kubeVersion='1.15.3_1515', targetVersion='1.16.2_1518')),
+        IKSWorker(dict(workers_json[0], id='{cluster}-w2'.format(cluster=cluster_name), kubeVersion='1.16.2_1518', targetVersion='1.16.2_1518'))
+    ]
+
+
+def replace_iks_workers(cluster_name, workers, batch_size=1, max_per_group=1, progress_callback=None):
+    for (i, worker) in enumerate(workers):
+        progress_callback(cluster_name, worker, i + 1, len(workers))
+
+
+@patch('concurrent.futures.ProcessPoolExecutor', concurrent.futures.ThreadPoolExecutor)  # Allows the mocks to be used by the cluster tasks
+class TestFleetHelpers(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.state_file = os.path.join(self.tmp_dir, 'state.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    @patch('orchutils.ibmcloud.replace_iks_workers')
+    @patch('orchutils.ibmcloud.ks_worker_ls')
+    @patch('orchutils.ibmcloud.update_iks_cluster')
+    def test_patch_clusters(self, mock_update_iks_cluster, mock_ks_worker_ls, mock_replace_iks_workers):
+        mock_update_iks_cluster.side_effect = lambda cluster_name, kube_version: self._fail_cluster(cluster_name, 'c2')
+        mock_ks_worker_ls.refresh.side_effect = cluster_workers
+        mock_replace_iks_workers.side_effect = replace_iks_workers
+        with self.assertRaises(Exception) as context:
+            fleethelpers.patch_clusters(['c1', 'c2', {'name': 'c3'}], '1.16.2', self.state_file, concurrency=2)
+        self.assertIn('c2: master update failed', str(context.exception))
+        self.assertEqual(3, mock_update_iks_cluster.call_count)
+        self.assertEqual(['c1', 'c3'], sorted(call[0][0] for call in mock_replace_iks_workers.call_args_list))
+        self.assertEqual(['c1-w1'], [worker.id for worker in mock_replace_iks_workers.call_args_list[0][0][1]])  # Up to date workers are not replaced
+        with open(self.state_file) as fh:
+            state = json.load(fh)
+        self.assertEqual({'kube_version': '1.16.2', 'master_updated': True, 'workers_replaced': True, 'replaced_workers': ['c1-w1']}, state['c1'])
+        self.assertFalse(state['c2']['master_updated'])
+        # A subsequent run only resumes the work of the failed cluster
+        mock_update_iks_cluster.side_effect = None
+        result = fleethelpers.patch_clusters(['c1', 'c2', 'c3'], '1.16.2', self.state_file)
+        self.assertEqual(4, mock_update_iks_cluster.call_count)
+        self.assertEqual('c2', mock_update_iks_cluster.call_args[0][0])
+        self.assertEqual('c2', mock_replace_iks_workers.call_args[0][0])
+        self.assertEqual(3, mock_replace_iks_workers.call_count)
+        self.assertTrue(all(cluster_state['workers_replaced'] for cluster_state in result.values()))
+        # Workers recorded as replaced by an interrupted run are not replaced again
+        with open(self.state_file, 'w') as fh:
+            json.dump(dict(state, c1={'kube_version': '1.16.2', 'master_updated': True, 'workers_replaced': False, 'replaced_workers': ['c1-w1']}), fh)
+        mock_ks_worker_ls.refresh.side_effect = lambda cluster_name: cluster_workers(cluster_name) + [
+            IKSWorker(dict(workers_json[0], id='c1-w3', kubeVersion='1.15.3_1515', targetVersion='1.16.2_1518'))]
+        fleethelpers.patch_clusters(['c1'], '1.16.2', self.state_file)
+        self.assertEqual(['c1-w3'], [worker.id for worker in mock_replace_iks_workers.call_args[0][1]])
+        mock_ks_worker_ls.refresh.side_effect = cluster_workers
+        # A new version resets the state
+        fleethelpers.patch_clusters(['c1'], '1.16.3', self.state_file)
+        self.assertEqual(5, mock_update_iks_cluster.call_count)
+        self.assertEqual(['c1-w1'], [worker.id for worker in mock_replace_iks_workers.call_args[0][1]])
+
+    @patch('orchutils.ibmcloud.replace_iks_workers')
+    @patch('orchutils.ibmcloud.ks_worker_ls')
+    @patch('orchutils.ibmcloud.update_iks_cluster')
+    @patch('orchutils.k8s.kubectl_binary', '/usr/local/bin/kubectl')
+    @patch.dict('os.environ', {'KUBECONFIG': '/base/config'})
+    def test_patch_clusters_env(self, mock_update_iks_cluster, mock_ks_worker_ls, mock_replace_iks_workers):
+        kubeconfigs = {}
+        mock_update_iks_cluster.side_effect = lambda cluster_name, kube_version: kubeconfigs.update({cluster_name: os.environ.get('KUBECONFIG')})
+        mock_ks_worker_ls.refresh.return_value = []
+        # Both clusters run in the same worker, which must not keep the configuration of the first cluster for the second
+        fleethelpers.patch_clusters([{'name': 'c1', 'orch_dir': '/orch/c1'}, 'c2'], '1.16.2', self.state_file, concurrency=1)
+        self.assertEqual({'c1': '/orch/c1/.kube/config', 'c2': '/base/config'}, kubeconfigs)
+
+    def _fail_cluster(self, cluster_name, failing_cluster_name):
+        if cluster_name == failing_cluster_name:
+            raise Exception('master update failed')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -119,9 +119,9 @@ class TestHelmHelpers(unittest.TestCase):
         ]
         self.assertIsNone(helmhelpers.import_certificates('release'))
         self.assertEqual(5, mock_exe_cmd.call_count)
-        self.assertIn('--cluster \'082c22b41bae42e2bca33e0e08b50617\'', mock_exe_cmd.call_args_list[4][0][0])
-        self.assertIn('873784046e45eef7491c45d830', mock_exe_cmd.call_args_list[4][0][0])
-        self.assertIn('--secret-name \'console.p2paas-console-ui\'', mock_exe_cmd.call_args_list[4][0][0])
+        cert_deploy_cmd = mock_exe_cmd.call_args_list[4][0][0]
+        self.assertEqual(['--cluster', '082c22b41bae42e2bca33e0e08b50617', '--secret-name', 'console.p2paas-console-ui'], cert_deploy_cmd[5:9])
+        self.assertTrue(cert_deploy_cmd[10].endswith('873784046e45eef7491c45d830'))
 
     @patch('baseutils.exe_cmd')
     def test_process_chart_deployment(self, mock_exe_cmd):
@@ -223,6 +223,23 @@ class TestK8sHelpers(unittest.TestCase):
             del signal.SIGALRM
             del signal.alarm
 
+    @patch('time.sleep')
+    @patch('orchutils.k8s.get')
+    def test_wait_for_pdb_headroom(self, mock_get, mock_sleep):
+        if os.name == 'nt':
+            signal.SIGALRM = signal.SIGTERM
+            signal.alarm = Mock()
+        recovering_pdb = {'metadata': {'namespace': 'ns', 'name': 'pdb1'}, 'status': {'currentHealthy': 1, 'desiredHealthy': 2, 'disruptionsAllowed': 0}}
+        blocking_pdb = {'metadata': {'namespace': 'ns', 'name': 'pdb2'}, 'status': {'currentHealthy': 2, 'desiredHealthy': 2, 'disruptionsAllowed': 0}}
+        recovered_pdb = {'metadata': {'namespace': 'ns', 'name': 'pdb1'}, 'status': {'currentHealthy': 2, 'desiredHealthy': 2, 'disruptionsAllowed': 0}}
+        mock_get.side_effect = [[recovering_pdb, blocking_pdb], [recovered_pdb, blocking_pdb]]
+        self.assertIsNone(k8shelpers.wait_for_pdb_headroom())
+        self.assertEqual(2, mock_get.call_count)
+        self.assertEqual(1, mock_sleep.call_count)
+        if os.name == 'nt':
+            del signal.SIGALRM
+            del signal.alarm
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,125 @@
+import unittest
+from mock import patch
+
+from orchutils.helpers import rollouthelpers
+
+deployment_manifest = {'kind': 'Deployment', 'metadata': {'name': 'd1', 'namespace': 'ns'}, 'spec': {'replicas': 1}}
+service_manifest = {'kind': 'Service', 'metadata': {'name': 's1', 'namespace': 'ns'}, 'spec': {'type': 'LoadBalancer'}}
+
+
+def live_deployment(updated_replicas):
+    return {
+        'kind': 'Deployment',
+        'metadata': {'name': 'd1', 'uid': 'd1-uid', 'generation': 2, 'annotations': {'deployment.kubernetes.io/revision': '2'}},
+        'spec': {'replicas': 1},
+        'status': {'observedGeneration': 2, 'replicas': 1, 'updatedReplicas': updated_replicas, 'availableReplicas': updated_replicas}
+    }
+
+
+def live_pod(name, owner_uid, container_statuses):
+    return {'metadata': {'name': name, 'ownerReferences': [{'uid': owner_uid}]}, 'status': {'containerStatuses': container_statuses}}
+
+
+replica_sets = [
+    {'metadata': {'name': 'd1-old', 'uid': 'rs1-uid', 'ownerReferences': [{'uid': 'd1-uid'}], 'annotations': {'deployment.kubernetes.io/revision': '1'}}},
+    {'metadata': {'name': 'd1-new', 'uid': 'rs2-uid', 'ownerReferences': [{'uid': 'd1-uid'}], 'annotations': {'deployment.kubernetes.io/revision': '2'}}}
+]
+crashing_container = [{'name': 'c1', 'restartCount': 0, 'state': {'waiting': {'reason': 'CrashLoopBackOff', 'message': 'crashing'}}}]
+running_container = [{'name': 'c1', 'restartCount': 0, 'state': {'running': {}}}]
+
+
+def mock_watch(events):
+    """
+    Creates a fake k8s.watch implementation that replays a list of (kind, event type, resource) tuples.
+    """
+    def watch(kind, namespace=None, labels=None, stop_event=None):
+        for (event_kind, event_type, resource) in events:
+            if event_kind == kind:
+                yield (event_type, resource)
+    return watch
+
+
+class TestRolloutHelpers(unittest.TestCase):
+    def test_get_pod_failure(self):
+        self.assertIsNone(rollouthelpers.get_pod_failure(live_pod('p1', 'uid', running_container)))
+        self.assertIsNone(rollouthelpers.get_pod_failure({'metadata': {'name': 'p1'}, 'status': {}}))
+        self.assertEqual(('c1', 'The pod p1 has entered the failed waiting state "CrashLoopBackOff" during chart upgrade. crashing'),
+                         rollouthelpers.get_pod_failure(live_pod('p1', 'uid', crashing_container)))
+        container_statuses = [{'name': 'c1', 'restartCount': 0, 'state': {'waiting': {'reason': 'secret "s1" not found'}}}]
+        self.assertEqual('c1', rollouthelpers.get_pod_failure(live_pod('p1', 'uid', container_statuses))[0])
+        container_statuses = [{'name': 'c2', 'restartCount': 1, 'state': {'running': {}}}]
+        self.assertEqual(('c2', 'The pod p1 has restarted (failed) during chart upgrade'), rollouthelpers.get_pod_failure(live_pod('p1', 'uid', container_statuses)))
+
+    @patch('orchutils.helpers.rollouthelpers.check_for_resource_pod_errors')
+    @patch('orchutils.k8s.get')
+    @patch('orchutils.k8s.rollout_status')
+    def test_check_resource_ready(self, mock_rollout_status, mock_get, mock_check_pods):
+        mock_rollout_status.return_value = 'Waiting for deployment "d1" rollout to finish: 0 out of 1 new replicas have been updated...\n'
+        self.assertEqual((False, mock_rollout_status.return_value.strip()), rollouthelpers.check_resource_ready(deployment_manifest))
+        mock_rollout_status.return_value = 'deployment "d1" successfully rolled out\n'
+        self.assertTrue(rollouthelpers.check_resource_ready(deployment_manifest)[0])
+        mock_rollout_status.side_effect = Exception('error: Status is available only for RollingUpdate strategy type')
+        self.assertTrue(rollouthelpers.check_resource_ready(deployment_manifest)[0])
+        mock_get.return_value = {'spec': {'clusterIP': '10.0.0.1'}, 'status': {'loadBalancer': {}}}
+        self.assertFalse(rollouthelpers.check_resource_ready(service_manifest)[0])
+        mock_get.return_value = {'spec': {'clusterIP': '10.0.0.1'}, 'status': {'loadBalancer': {'ingress': [{'ip': '1.2.3.4'}]}}}
+        self.assertTrue(rollouthelpers.check_resource_ready(service_manifest)[0])
+
+    @patch('orchutils.helpers.rollouthelpers.check_resource_ready')
+    def test_poll_for_resources(self, mock_check_resource_ready):
+        statefulset_manifest = {'kind': 'StatefulSet', 'metadata': {'name': 'ss1'}, 'spec': {}}
+        configmap_manifest = {'kind': 'ConfigMap', 'metadata': {'name': 'cm1'}}
+        polls = {'d1': [(False, 'rolling'), (True, 'done')], 'ss1': [(False, 'rolling'), (False, 'rolling'), (True, 'done')], 's1': [(True, 'done')]}
+        mock_check_resource_ready.side_effect = lambda resource: polls[resource['metadata']['name']].pop(0)
+        self.assertIsNone(rollouthelpers.poll_for_resources([statefulset_manifest, configmap_manifest, deployment_manifest, service_manifest], interval=0))
+        self.assertEqual(6, mock_check_resource_ready.call_count)
+        # A failure in any resource ends the wait without waiting for slower resources to converge
+        polls = {'d1': [(False, 'rolling')] * 10, 'ss1': [Exception('The pod ss1-0 has restarted (failed) during chart upgrade')]}
+
+        def check_resource_ready(resource):
+            result = polls[resource['metadata']['name']].pop(0)
+            if isinstance(result, Exception):
+                raise result
+            return result
+        mock_check_resource_ready.side_effect = check_resource_ready
+        with self.assertRaises(Exception) as context:
+            rollouthelpers.poll_for_resources([deployment_manifest, statefulset_manifest], interval=0)
+        self.assertIn('ss1-0 has restarted', str(context.exception))
+
+    @patch('orchutils.k8s.watch')
+    def test_wait(self, mock_k8s_watch):
+        mock_k8s_watch.side_effect = mock_watch([
+            ('replicaset', 'ADDED', replica_sets[0]),
+            ('replicaset', 'ADDED', replica_sets[1]),
+            ('pod', 'ADDED', live_pod('d1-old-1', 'rs1-uid', crashing_container)),  # Failures in pods from the previous revision are ignored
+            ('pod', 'ADDED', live_pod('d1-new-1', 'rs2-uid', running_container)),
+            ('deployment', 'ADDED', live_deployment(0)),
+            ('deployment', 'MODIFIED', live_deployment(1)),
+            ('service', 'ADDED', {'metadata': {'name': 's1'}, 'spec': {'clusterIP': '10.0.0.1'}, 'status': {'loadBalancer': {}}}),
+            ('service', 'MODIFIED', {'metadata': {'name': 's1'}, 'spec': {'clusterIP': '10.0.0.1'}, 'status': {'loadBalancer': {'ingress': [{'ip': '1.2.3.4'}]}}})
+        ])
+        self.assertIsNone(rollouthelpers.ResourceWaiter([deployment_manifest, service_manifest]).wait())
+        self.assertEqual(['deployment', 'pod', 'replicaset', 'service'], sorted(call[0][0] for call in mock_k8s_watch.call_args_list))
+
+    @patch('orchutils.k8s.logs')
+    @patch('orchutils.k8s.describe')
+    @patch('orchutils.k8s.watch')
+    def test_wait_pod_failure(self, mock_k8s_watch, mock_describe, mock_logs):
+        mock_k8s_watch.side_effect = mock_watch([
+            ('replicaset', 'ADDED', replica_sets[1]),
+            ('pod', 'ADDED', live_pod('d1-new-1', 'rs2-uid', crashing_container)),
+            ('deployment', 'ADDED', live_deployment(0))
+        ])
+        with self.assertRaises(Exception) as context:
+            rollouthelpers.ResourceWaiter([deployment_manifest]).wait()
+        self.assertIn('CrashLoopBackOff', str(context.exception))
+        mock_logs.assert_called_once_with('d1-new-1', namespace='ns', container='c1')
+
+    @patch('orchutils.k8s.watch')
+    def test_wait_watch_error(self, mock_k8s_watch):
+        mock_k8s_watch.side_effect = Exception('Error from server (Forbidden): forbidden')
+        self.assertRaises(Exception, rollouthelpers.ResourceWaiter([deployment_manifest]).wait)
+
+
+if __name__ == '__main__':
+    unittest.main()
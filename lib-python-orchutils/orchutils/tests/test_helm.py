@@ -459,7 +459,7 @@ Server: v2.15.0'''), (0, '''
 }'''), (0, '')]
         self.assertIsNone(helm.upgrade_tiller('namespace'))
         self.assertEqual(4, mock_exe_cmd.call_count)
-        self.assertIn('-n \'namespace\'', mock_exe_cmd.call_args_list[2][0][0])
+        self.assertEqual(['-n', 'namespace'], mock_exe_cmd.call_args_list[2][0][0][4:6])
         self.assertIn('--tiller-namespace \'namespace\'', mock_exe_cmd.call_args_list[3][0][0])
         self.assertIn('--service-account \'tiller\'', mock_exe_cmd.call_args_list[3][0][0])
         self.assertIn('--override \'"spec.template.spec.containers[0].command"="{{/tiller,--storage=secret}}"\'', mock_exe_cmd.call_args_list[3][0][0])
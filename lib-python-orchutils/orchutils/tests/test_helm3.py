@@ -0,0 +1,196 @@
+import json
+import os
+import shutil
+import tempfile
+import time
+import unittest
+import yaml
+from mock import patch
+
+from orchutils import helm3
+from test_helm import valid_manifest
+
+
+def fake_helm(cmd, **kwargs):
+    """
+    Simulates the helm commands used by install_chart. Pulled charts are written to the destination directory as archives containing the chart name and version.
+    """
+    if cmd[1] == 'pull':
+        destination = cmd[cmd.index('--destination') + 1]
+        (chart, version) = (cmd[2].split('/')[-1], cmd[cmd.index('--version') + 1])
+        with open(os.path.join(destination, '{chart}-{version}.tgz'.format(chart=chart, version=version)), 'w') as fh:
+            fh.write('{chart}:{version}'.format(chart=chart, version=version))
+    if cmd[1] == 'template':
+        return (0, valid_manifest)
+    if cmd[1] == 'env':
+        return (0, 'HELM_REPOSITORY_CONFIG="{helm_dir}/repositories.yaml"\nHELM_REPOSITORY_CACHE="{helm_dir}/repository"\n'.format(helm_dir=os.environ['TEST_HELM_DIR']))
+    return (0, '')
+
+
+def get_subcommands(mock_exe_cmd):
+    """
+    Returns the helm subcommands executed through a mocked exe_cmd, eg. "pull" or "update" for "helm repo update".
+    """
+    return [call[0][0][2] if call[0][0][1] == 'repo' else call[0][0][1] for call in mock_exe_cmd.call_args_list]
+
+
+class TestHelm3(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        os.environ['TEST_HELM_DIR'] = self.tmp_dir
+        os.makedirs(os.path.join(self.tmp_dir, 'repository'))
+        self.chart_cache_dir = helm3.chart_cache_dir
+        helm3.chart_cache_dir = os.path.join(self.tmp_dir, 'cache')
+
+    def tearDown(self):
+        helm3.chart_cache_dir = self.chart_cache_dir
+        helm3.helm_env.clear()
+        helm3.manifest_cache.clear()
+        del os.environ['TEST_HELM_DIR']
+        shutil.rmtree(self.tmp_dir)
+
+    @patch('baseutils.baseutils.exe_cmd')
+    def test_install_chart(self, mock_exe_cmd):
+        mock_exe_cmd.side_effect = fake_helm
+        self.assertIsNone(helm3.install_chart('repo/chart', '1.0.0', 'values.yaml', 'release', 'namespace'))
+        # The chart is downloaded once and installed from the archive without a separate dry-run render
+        self.assertEqual(['env', 'pull', 'install'], get_subcommands(mock_exe_cmd))
+        install_cmd = mock_exe_cmd.call_args_list[2][0][0]
+        self.assertTrue(install_cmd[3].startswith(helm3.chart_cache_dir))
+        self.assertNotIn('--dry-run', install_cmd)
+        mock_exe_cmd.reset_mock()
+        self.assertIsNone(helm3.install_chart('repo/chart', '1.0.0', 'values.yaml', 'release', 'namespace', validate_manifest=True, dry_run=True))
+        self.assertEqual(['template', 'install'], get_subcommands(mock_exe_cmd))
+        self.assertEqual(mock_exe_cmd.call_args_list[0][0][0][3], mock_exe_cmd.call_args_list[1][0][0][3])
+        self.assertIn('--dry-run', mock_exe_cmd.call_args_list[1][0][0])
+        mock_exe_cmd.reset_mock()
+        mock_exe_cmd.side_effect = lambda cmd, **kwargs: (0, valid_manifest.replace('replicas: 3', 'replicas: 1')) if cmd[1] == 'template' else fake_helm(cmd)
+        with self.assertRaises(Exception) as context:
+            with patch('orchutils.helm3.logger.error'):
+                helm3.install_chart('repo/chart', '1.0.0', 'values.yaml', 'release', 'namespace', validate_manifest=True)
+        self.assertIn('Chart pre-approval validation failed', str(context.exception))
+        self.assertNotIn('install', get_subcommands(mock_exe_cmd))
+
+    @patch('baseutils.baseutils.exe_cmd')
+    def test_pull_chart(self, mock_exe_cmd):
+        mock_exe_cmd.side_effect = fake_helm
+        with open(os.path.join(self.tmp_dir, 'repositories.yaml'), 'w') as fh:
+            yaml.safe_dump({'repositories': [{'name': 'repo', 'url': 'https://repo'}, {'name': 'mirror', 'url': 'https://repo/'}]}, fh)
+        archive = helm3.pull_chart('repo/chart', '1.0.0')
+        with open(archive) as fh:
+            self.assertEqual('chart:1.0.0', fh.read())
+        # Charts are cached by repository url, so the same chart from another repository name with the same url is not downloaded again
+        self.assertEqual(archive, helm3.pull_chart('mirror/chart', '1.0.0'))
+        self.assertEqual(1, get_subcommands(mock_exe_cmd).count('pull'))
+        self.assertNotEqual(archive, helm3.pull_chart('repo/chart', '1.0.1'))
+        self.assertEqual(2, get_subcommands(mock_exe_cmd).count('pull'))
+        # A corrupted archive is downloaded again
+        with open(archive, 'w') as fh:
+            fh.write('corrupted')
+        self.assertEqual(archive, helm3.pull_chart('repo/chart', '1.0.0'))
+        self.assertEqual(3, get_subcommands(mock_exe_cmd).count('pull'))
+        self.assertEqual(self.tmp_dir, helm3.pull_chart(self.tmp_dir, '1.0.0'))
+        self.assertEqual(0o700, os.stat(helm3.chart_cache_dir).st_mode & 0o777)
+        # A cache directory that other users could modify is not used
+        os.chmod(helm3.chart_cache_dir, 0o777)
+        self.assertRaises(Exception, helm3.pull_chart, 'repo/chart', '1.0.0')
+        os.chmod(helm3.chart_cache_dir, 0o700)
+        with patch('os.getuid', return_value=os.getuid() + 1):
+            self.assertRaises(Exception, helm3.pull_chart, 'repo/chart', '1.0.0')
+        self.assertEqual(3, get_subcommands(mock_exe_cmd).count('pull'))
+
+    @patch('baseutils.baseutils.exe_cmd')
+    def test_update_repos(self, mock_exe_cmd):
+        mock_exe_cmd.side_effect = fake_helm
+        with open(os.path.join(self.tmp_dir, 'repositories.yaml'), 'w') as fh:
+            yaml.safe_dump({'repositories': [{'name': 'repo', 'url': 'https://repo', 'username': 'user', 'password': 'pass'}]}, fh)
+        index_file = os.path.join(self.tmp_dir, 'repository', 'repo-index.yaml')
+        helm3.update_repos()
+        helm3.add_repo('repo', 'user', 'pass', repo_url='https://repo')
+        self.assertEqual(['env', 'update', 'add'], get_subcommands(mock_exe_cmd))
+        # Fresh indexes are not downloaded again unless forced or the repository configuration changes
+        with open(index_file, 'w'):
+            pass
+        mock_exe_cmd.reset_mock()
+        helm3.update_repos()
+        helm3.add_repo('repo', 'user', 'pass', repo_url='https://repo')
+        self.assertEqual(0, mock_exe_cmd.call_count)
+        helm3.add_repo('repo', 'user', 'new_pass', repo_url='https://repo')
+        helm3.update_repos(force=True)
+        self.assertEqual(['add', 'update'], get_subcommands(mock_exe_cmd))
+        mock_exe_cmd.reset_mock()
+        os.utime(index_file, (time.time() - helm3.repo_index_ttl, time.time() - helm3.repo_index_ttl))
+        helm3.update_repos()
+        self.assertEqual(['update'], get_subcommands(mock_exe_cmd))
+
+    @patch('baseutils.baseutils.exe_cmd')
+    def test_template_chart(self, mock_exe_cmd):
+        mock_exe_cmd.return_value = (1, 'parsing error message')
+        with self.assertRaises(Exception) as context:
+            with patch('orchutils.helm3.logger.error'):
+                helm3.template_chart('repo/chart', '1.0.0', 'values.yaml', 'release', 'namespace')
+        self.assertEqual('Failed to parse Helm template. parsing error message', str(context.exception))
+        self.assertIn('--version', mock_exe_cmd.call_args[0][0])
+
+    @patch('baseutils.baseutils.exe_cmd_stream')
+    @patch('baseutils.baseutils.exe_cmd')
+    def test_get_manifest(self, mock_exe_cmd, mock_exe_cmd_stream):
+        manifest = '---\n# Source: chart/templates/service.yaml\nkind: Service\nmetadata:\n  name: s1\n---\n# Empty\n---\nkind: Deployment\nmetadata:\n  name: d1\n'
+        mock_exe_cmd_stream.side_effect = lambda cmd, **kwargs: iter((('3\n' if cmd[2] == 'all' else '') + manifest).splitlines(True))
+        yaml_load = yaml.load
+        with patch('yaml.load', side_effect=yaml_load) as mock_load:
+            self.assertEqual(['d1'], [resource['metadata']['name'] for resource in helm3.get_manifest('release', resource_type='Deployment')])
+            # Resources of other types are not parsed until they are needed and the manifest of a revision is only retrieved once
+            self.assertEqual(1, mock_load.call_count)
+            self.assertEqual(['get', 'all', 'release', '--template', helm3.release_resource_templates['manifest']], mock_exe_cmd_stream.call_args[0][0][1:])
+            resources = helm3.get_manifest('release', revision=3)
+            self.assertEqual(['s1', 'd1'], [resource['metadata']['name'] for resource in resources])
+            resources[0]['metadata']['name'] = 'changed'
+            self.assertEqual(['s1', 'd1'], [resource['metadata']['name'] for resource in helm3.get_manifest('release', revision=3)])
+            self.assertEqual(2, mock_load.call_count)
+        self.assertEqual(1, mock_exe_cmd_stream.call_count)
+        # The latest revision is read from the output of helm rather than looked up separately
+        self.assertEqual(0, mock_exe_cmd.call_count)
+        # A new revision is retrieved again
+        helm3.get_manifest('release', revision=100)
+        self.assertEqual(2, mock_exe_cmd_stream.call_count)
+        self.assertEqual(['get', 'manifest', 'release', '--revision', '100'], mock_exe_cmd_stream.call_args[0][0][1:])
+        # Without a cache the manifest is retrieved every time
+        with patch('orchutils.helm3.manifest_cache_size', 0):
+            self.assertEqual(['s1', 'd1'], [resource['metadata']['name'] for resource in helm3.get_manifest('release', revision=4)])
+            self.assertEqual(['s1', 'd1'], [resource['metadata']['name'] for resource in helm3.get_manifest('release', revision=4)])
+        self.assertEqual(4, mock_exe_cmd_stream.call_count)
+        self.assertEqual(0, mock_exe_cmd.call_count)
+
+    @patch('baseutils.baseutils.exe_cmd_stream')
+    @patch('baseutils.baseutils.exe_cmd')
+    def test_upgrade_chart(self, mock_exe_cmd, mock_exe_cmd_stream):
+        revision = {'revision': 3, 'updated': '2020-01-01T00:00:00Z', 'status': 'deployed', 'chart': 'chart-1.0.0', 'description': 'Upgrade complete'}
+        mock_exe_cmd.side_effect = lambda cmd, **kwargs: (0, json.dumps([revision])) if cmd[1] == 'history' else fake_helm(cmd, **kwargs)
+        deployed_manifest = valid_manifest
+        mock_exe_cmd_stream.side_effect = lambda cmd, **kwargs: iter((deployed_manifest if cmd[2] == 'manifest' else '').splitlines(True))
+        # The upgrade is skipped when the rendered chart matches the deployed revision
+        self.assertEqual([], helm3.upgrade_chart('repo/chart', '1.0.0', 'values.yaml', 'release', 'console'))
+        self.assertEqual(['env', 'pull', 'history', 'template'], get_subcommands(mock_exe_cmd))
+        with patch('orchutils.helm3.get_manifest') as mock_get_manifest:
+            self.assertIsNone(helm3.wait_for_release_resources('release', resources=[]))
+            self.assertEqual(0, mock_get_manifest.call_count)
+        # Only changed resources are returned to be waited on
+        mock_exe_cmd.reset_mock()
+        helm3.manifest_cache.clear()
+        deployed_manifest = valid_manifest.replace('replicas: 3', 'replicas: 1')
+        changed_resources = helm3.upgrade_chart('repo/chart', '1.0.0', 'values.yaml', 'release', 'console')
+        self.assertEqual([('Deployment', 3)], [(resource['kind'], resource['spec']['replicas']) for resource in changed_resources])
+        self.assertEqual(['history', 'template', 'upgrade'], get_subcommands(mock_exe_cmd))
+        # Releases whose latest revision is of another chart version are always upgraded
+        mock_exe_cmd.reset_mock()
+        revision['chart'] = 'chart-0.9.0'
+        self.assertIsNone(helm3.upgrade_chart('repo/chart', '1.0.0', 'values.yaml', 'release', 'console'))
+        self.assertEqual(['history', 'upgrade'], get_subcommands(mock_exe_cmd))
+        mock_exe_cmd.reset_mock()
+        self.assertIsNone(helm3.upgrade_chart('repo/chart', '1.0.0', 'values.yaml', 'release', 'console', skip_unchanged=False))
+        self.assertEqual(['upgrade'], get_subcommands(mock_exe_cmd))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -8,6 +8,7 @@ from mock import patch
 
 import baseutils
 from orchutils import ibmcloud
+from orchutils.ibmcloudmodels.iksworker import IKSWorker
 from orchutils.ibmcloudmodels.servicepolicy import ServicePolicy
 from orchutils.ibmcloudmodels.target import Target
 from helpers.test_k8shelpers import namespace_pods_partial
@@ -104,6 +105,35 @@ class TestIBMCloud(unittest.TestCase):
             del signal.SIGALRM
             del signal.alarm
 
+    def test_get_worker_batches(self):
+        workers = []
+        for (i, location, pool_name) in [(1, 'dal10', 'default'), (2, 'dal10', 'default'), (3, 'dal12', 'default'), (4, 'dal13', 'default'), (5, 'dal13', 'edge')]:
+            worker_json = dict(workers_json[0], id='w{i}'.format(i=i), location=location, poolName=pool_name)
+            workers.append(IKSWorker(worker_json))
+        self.assertEqual([['w1'], ['w2'], ['w3'], ['w4'], ['w5']], [[worker.id for worker in batch] for batch in ibmcloud._get_worker_batches(workers, 1, 1)])
+        self.assertEqual([['w1', 'w3', 'w4'], ['w5', 'w2']], [[worker.id for worker in batch] for batch in ibmcloud._get_worker_batches(workers, 3, 1)])
+        self.assertEqual([['w1', 'w2', 'w3'], ['w4', 'w5']], [[worker.id for worker in batch] for batch in ibmcloud._get_worker_batches(workers, 3, 2)])
+
+    @patch('orchutils.ibmcloud.wait_for_worker')
+    @patch('orchutils.helpers.k8shelpers.wait_for_pdb_headroom')
+    @patch('orchutils.k8s.drain')
+    @patch('orchutils.k8s.cordon')
+    @patch('orchutils.ibmcloud.ks_worker_get')
+    @patch('baseutils.exe_cmd')
+    def test_replace_iks_workers_batched(self, mock_exe_cmd, mock_ks_worker_get, mock_cordon, mock_drain, mock_wait_for_pdb_headroom, mock_wait_for_worker):
+        workers = [IKSWorker(dict(workers_json[0], id='w{i}'.format(i=i), location='dal1{i}'.format(i=i % 3))) for i in range(5)]
+        mock_ks_worker_get.side_effect = lambda cluster_name, worker_id: None if worker_id == 'w4' else [worker for worker in workers if worker.id == worker_id][0]
+        mock_exe_cmd.return_value = (0, '')
+        progress = []
+        self.assertIsNone(ibmcloud.replace_iks_workers('cluster', workers, batch_size=3, progress_callback=lambda *args: progress.append(args[1:])))
+        self.assertEqual(2, mock_wait_for_pdb_headroom.call_count)
+        self.assertEqual(3, mock_cordon.call_count)  # Workers are only cordoned ahead of their drain when more than one is in the batch
+        self.assertEqual(4, mock_drain.call_count)  # w4 no longer exists
+        self.assertEqual(4, mock_exe_cmd.call_count)
+        self.assertEqual(4, mock_wait_for_worker.call_count)
+        self.assertEqual([1, 2, 3, 4, 5], [completed for (worker, completed, total) in progress])
+        self.assertEqual(['w0', 'w1', 'w2', 'w4', 'w3'], [worker.id for (worker, completed, total) in progress])
+
     @patch('time.sleep')
     @patch('baseutils.exe_cmd')
     def test_wait_for_worker(self, mock_exe_cmd, mock_sleep):
@@ -147,14 +177,14 @@ class TestIBMCloud(unittest.TestCase):
         mock_exe_cmd.return_value = (0, json.dumps(clusters_json[0]))
         cluster = ibmcloud.ks_cluster_get('test-priv-nosub')
         self.assertEqual('test-priv-nosub', cluster.name)
-        self.assertIn('get --cluster \'test-priv-nosub\'', mock_exe_cmd.call_args[0][0])
+        self.assertEqual(['/usr/local/bin/ibmcloud', 'ks', 'cluster', 'get', '--cluster', 'test-priv-nosub', '--json'], mock_exe_cmd.call_args[0][0])
 
     @patch('baseutils.exe_cmd')
     def test_ks_cluster_ls(self, mock_exe_cmd):
         mock_exe_cmd.return_value = (0, '[]')
         self.assertEqual([], ibmcloud.ks_cluster_ls())
         self.assertEqual(1, mock_exe_cmd.call_count)
-        self.assertIn('ks cluster ls', mock_exe_cmd.call_args[0][0])
+        self.assertEqual(['/usr/local/bin/ibmcloud', 'ks', 'cluster', 'ls', '--json'], mock_exe_cmd.call_args[0][0])
         mock_exe_cmd.return_value = (0, json.dumps(clusters_json))
         clusters = ibmcloud.ks_cluster_ls()
         self.assertEqual(3, len(clusters))
@@ -185,30 +215,52 @@ class TestIBMCloud(unittest.TestCase):
         self.assertNotIn('--worker-pool', mock_exe_cmd.call_args[0][0])
         self.assertEqual('kube-sjc03-cra8efa36505be48d0a382aa2fa7081082-w1', ibmcloud.ks_worker_ls('cluster', worker_pool_name='pool')[0].id)
         self.assertEqual(3, mock_exe_cmd.call_count)
-        self.assertIn('--worker-pool \'pool\'', mock_exe_cmd.call_args[0][0])
+        self.assertEqual(['--worker-pool', 'pool', '--json'], mock_exe_cmd.call_args[0][0][-3:])
+
+    @patch('baseutils.baseutils.ttl_cache_enabled', True)
+    @patch('baseutils.exe_cmd')
+    def test_cached_reads(self, mock_exe_cmd):
+        try:
+            mock_exe_cmd.return_value = (0, json.dumps(worker_pools_json))
+            self.assertEqual('bm12clsw08k9uctrq8cg-d423e5a', ibmcloud.ks_worker_pool_ls('cluster')[0].id)
+            self.assertEqual('bm12clsw08k9uctrq8cg-d423e5a', ibmcloud.ks_worker_pool_ls('cluster')[0].id)
+            self.assertEqual(1, mock_exe_cmd.call_count)
+            ibmcloud.ks_worker_pool_ls('cluster2')
+            self.assertEqual(2, mock_exe_cmd.call_count)
+            # Mutating calls discard the cached results they affect
+            mock_exe_cmd.return_value = (0, '')
+            ibmcloud.ks_worker_pool_rm('cluster', 'pool')
+            mock_exe_cmd.return_value = (0, '[]')
+            self.assertEqual([], ibmcloud.ks_worker_pool_ls('cluster'))
+            self.assertEqual(4, mock_exe_cmd.call_count)
+            ibmcloud.ks_worker_pool_ls('cluster2')
+            self.assertEqual(4, mock_exe_cmd.call_count)
+            ibmcloud.target(region='us-east')
+            ibmcloud.ks_worker_pool_ls('cluster2')
+            self.assertEqual(6, mock_exe_cmd.call_count)
+            # Polling for changes always retrieves current values
+            ibmcloud.ks_worker_pool_ls.refresh('cluster2')
+            self.assertEqual(7, mock_exe_cmd.call_count)
+        finally:
+            ibmcloud.ks_worker_pool_ls.invalidate()
 
     @patch('baseutils.exe_cmd')
     def test_ks_worker_pool_create_classic(self, mock_exe_cmd):
         mock_exe_cmd.return_value = (0, '')
         self.assertIsNone(ibmcloud.ks_worker_pool_create_classic('cluster', 'pool', 'machine', 2, 'shared'))
         self.assertEqual(1, mock_exe_cmd.call_count)
-        self.assertIn('--cluster \'cluster\'', mock_exe_cmd.call_args[0][0])
-        self.assertIn('--name \'pool\'', mock_exe_cmd.call_args[0][0])
-        self.assertIn('--machine-type \'machine\'', mock_exe_cmd.call_args[0][0])
-        self.assertIn('--size-per-zone 2', mock_exe_cmd.call_args[0][0])
-        self.assertIn('--hardware \'shared\'', mock_exe_cmd.call_args[0][0])
-        self.assertNotIn('--label', mock_exe_cmd.call_args[0][0])
+        self.assertEqual(['/usr/local/bin/ibmcloud', 'ks', 'worker-pool', 'create', 'classic', '--cluster', 'cluster', '--machine-type', 'machine', '--name', 'pool',
+                          '--size-per-zone', '2', '--hardware', 'shared'], mock_exe_cmd.call_args[0][0])
         self.assertIsNone(ibmcloud.ks_worker_pool_create_classic('cluster', 'pool', 'machine', 2, 'shared', {'key1': 'value1'}))
         self.assertEqual(2, mock_exe_cmd.call_count)
-        self.assertIn('--label \'key1=value1\'', mock_exe_cmd.call_args[0][0])
+        self.assertEqual(['--label', 'key1=value1'], mock_exe_cmd.call_args[0][0][-2:])
 
     @patch('baseutils.exe_cmd')
     def test_ks_worker_pool_get(self, mock_exe_cmd):
         mock_exe_cmd.return_value = (0, json.dumps(worker_pools_json[0]))
         self.assertEqual('bm12clsw08k9uctrq8cg-d423e5a', ibmcloud.ks_worker_pool_get('cluster', 'pool').id)
         self.assertEqual(1, mock_exe_cmd.call_count)
-        self.assertIn('--cluster \'cluster\'', mock_exe_cmd.call_args[0][0])
-        self.assertIn('--worker-pool \'pool\'', mock_exe_cmd.call_args[0][0])
+        self.assertEqual(['/usr/local/bin/ibmcloud', 'ks', 'worker-pool', 'get', '--cluster', 'cluster', '--worker-pool', 'pool', '--json'], mock_exe_cmd.call_args[0][0])
 
     @patch('baseutils.exe_cmd')
     def test_ks_worker_pool_ls(self, mock_exe_cmd):
@@ -234,18 +286,15 @@ class TestIBMCloud(unittest.TestCase):
         mock_exe_cmd.return_value = (0, '')
         self.assertIsNone(ibmcloud.ks_worker_pool_rm('cluster', 'pool'))
         self.assertEqual(1, mock_exe_cmd.call_count)
-        self.assertIn(' --cluster \'cluster\'', mock_exe_cmd.call_args[0][0])
-        self.assertIn(' --worker-pool \'pool\' -f', mock_exe_cmd.call_args[0][0])
+        self.assertEqual(['/usr/local/bin/ibmcloud', 'ks', 'worker-pool', 'rm', '--cluster', 'cluster', '--worker-pool', 'pool', '-f'], mock_exe_cmd.call_args[0][0])
 
     @patch('baseutils.exe_cmd')
     def test_ks_zone_add_classic(self, mock_exe_cmd):
         mock_exe_cmd.return_value = (0, '')
         self.assertIsNone(ibmcloud.ks_zone_add_classic('cluster', 'zone', 'pool', 'private_vlan_id', public_vlan_id='public_vlan_id'))
-        self.assertIn('public-vlan', mock_exe_cmd.call_args[0][0])
-        self.assertNotIn('private-only', mock_exe_cmd.call_args[0][0])
+        self.assertEqual(['--private-vlan', 'private_vlan_id', '--public-vlan', 'public_vlan_id'], mock_exe_cmd.call_args[0][0][-4:])
         self.assertIsNone(ibmcloud.ks_zone_add_classic('cluster', 'zone', 'pool', 'private_vlan_id',))
-        self.assertNotIn('public-vlan', mock_exe_cmd.call_args[0][0])
-        self.assertIn('private-only', mock_exe_cmd.call_args[0][0])
+        self.assertEqual(['--private-vlan', 'private_vlan_id', '--private-only'], mock_exe_cmd.call_args[0][0][-3:])
 
     @patch('baseutils.exe_cmd')
     def test_ks_cluster_remove(self, mock_exe_cmd):
@@ -431,20 +480,13 @@ wce-faas-pr-viewer                         AccessGroupId-kdphtsms-atjc-v5hk-d8mg
     def test_login(self, mock_exe_cmd):
         self.assertIsNone(ibmcloud.login('key', 'us-south', 'r-group'))
         self.assertEqual(1, mock_exe_cmd.call_count)
-        self.assertIn('-r \'us-south\'', mock_exe_cmd.call_args_list[0][0][0])
-        self.assertIn('-g \'r-group\'', mock_exe_cmd.call_args_list[0][0][0])
-        self.assertIn('--apikey \'key\'', mock_exe_cmd.call_args_list[0][0][0])
+        self.assertEqual(['-r', 'us-south', '-g', 'r-group', '--apikey', 'key'], mock_exe_cmd.call_args_list[0][0][0][4:])
         self.assertIsNone(ibmcloud.login('key', region='us-south', resource_group='r-group'))
         self.assertEqual(2, mock_exe_cmd.call_count)
-        self.assertIn('-r \'us-south\'', mock_exe_cmd.call_args_list[1][0][0])
-        self.assertIn('-g \'r-group\'', mock_exe_cmd.call_args_list[1][0][0])
-        self.assertIn('--apikey \'key\'', mock_exe_cmd.call_args_list[1][0][0])
+        self.assertEqual(['-r', 'us-south', '-g', 'r-group', '--apikey', 'key'], mock_exe_cmd.call_args_list[1][0][0][4:])
         self.assertIsNone(ibmcloud.login('key'))
         self.assertEqual(3, mock_exe_cmd.call_count)
-        self.assertNotIn('-r ', mock_exe_cmd.call_args_list[2][0][0])
-        self.assertIn('--no-region', mock_exe_cmd.call_args_list[2][0][0])
-        self.assertNotIn('-g', mock_exe_cmd.call_args_list[2][0][0])
-        self.assertIn('--apikey \'key\'', mock_exe_cmd.call_args_list[2][0][0])
+        self.assertEqual(['--no-region', '--apikey', 'key'], mock_exe_cmd.call_args_list[2][0][0][4:])
 
     @patch('baseutils.exe_cmd')
     def test_target(self, mock_exe_cmd):
@@ -496,9 +538,8 @@ wce-faas-pr-viewer                         AccessGroupId-kdphtsms-atjc-v5hk-d8mg
     def test_ks_infra_credentials(self, mock_exe_cmd):
         self.assertIsNone(ibmcloud.ks_infra_credentials('sl_user', 'sl_key'))
         self.assertEqual(1, mock_exe_cmd.call_count)
-        self.assertIn('ks credential set classic', mock_exe_cmd.call_args_list[0][0][0])
-        self.assertIn('--infrastructure-username \'sl_user\'', mock_exe_cmd.call_args_list[0][0][0])
-        self.assertIn('--infrastructure-api-key \'sl_key\'', mock_exe_cmd.call_args_list[0][0][0])
+        self.assertEqual(['/usr/local/bin/ibmcloud', 'ks', 'credential', 'set', 'classic', '--infrastructure-username', 'sl_user', '--infrastructure-api-key', 'sl_key'],
+                         mock_exe_cmd.call_args_list[0][0][0])
 
     @patch('baseutils.exe_cmd')
     def test_ks_cluster_master_auditwebhook_set(self, mock_exe_cmd):
@@ -602,20 +643,20 @@ Replicant Count            0
     @patch('baseutils.exe_cmd')
     def test_sl_file_volume_cancel(self, mock_exe_cmd):
         ibmcloud.sl_file_volume_cancel("12345")
-        mock_exe_cmd.assert_called_with('/usr/local/bin/ibmcloud sl file volume-cancel \'12345\' --immediate -f')
+        mock_exe_cmd.assert_called_with(['/usr/local/bin/ibmcloud', 'sl', 'file', 'volume-cancel', '12345', '--immediate', '-f'])
 
     @patch('baseutils.exe_cmd')
     def test_sl_block_volume_cancel(self, mock_exe_cmd):
         ibmcloud.sl_block_volume_cancel("54321")
-        mock_exe_cmd.assert_called_with('/usr/local/bin/ibmcloud sl block volume-cancel \'54321\' --immediate -f')
+        mock_exe_cmd.assert_called_with(['/usr/local/bin/ibmcloud', 'sl', 'block', 'volume-cancel', '54321', '--immediate', '-f'])
 
     @patch('baseutils.exe_cmd')
     def test_sl_call_api(self, mock_exe_cmd):
         mock_exe_cmd.return_value = (0, '{"key": "value"}')
         result = ibmcloud.sl_call_api('SoftLayer_Network_Storage', 'getBillingItem', '12345', mask='invoiceItem[totalOneTimeAmount,totalRecurringAmount]',
                                       parameters='', limit='0', offset='0')
-        mock_exe_cmd.assert_called_with('/usr/local/bin/ibmcloud sl call-api SoftLayer_Network_Storage getBillingItem \
---init \'12345\' --mask \'invoiceItem[totalOneTimeAmount,totalRecurringAmount]\'  --limit \'0\' --offset \'0\'')
+        mock_exe_cmd.assert_called_with(['/usr/local/bin/ibmcloud', 'sl', 'call-api', 'SoftLayer_Network_Storage', 'getBillingItem', '--init', '12345',
+                                         '--mask', 'invoiceItem[totalOneTimeAmount,totalRecurringAmount]', '--limit', '0', '--offset', '0'])
         self.assertEqual(type(result), type({}))
 
     def test_setup_cli(self):
@@ -0,0 +1,140 @@
+import json
+import threading
+import time
+import unittest
+from mock import patch
+try:  # python3
+    from http.server import BaseHTTPRequestHandler
+    from http.server import HTTPServer
+    from urllib.parse import parse_qs
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler
+    from BaseHTTPServer import HTTPServer
+    from urlparse import parse_qs
+
+from orchutils import ibmcloud
+from orchutils import iksclient
+from ibmcloudmodels.test_ikscluster import clusters_json
+from ibmcloudmodels.test_iksworker import workers_json
+from ibmcloudmodels.test_iksworkerpool import worker_pools_json
+
+
+class StubAPIHandler(BaseHTTPRequestHandler):
+    """
+    Serves the IAM token and containers API endpoints from the routes of the server, recording each request.
+    """
+    def do_request(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length') or 0)).decode('utf-8')
+        self.server.requests.append((self.command, self.path, dict(self.headers), body))
+        if self.command == 'POST' and self.path == '/identity/token':
+            self.server.token_count += 1
+            (status, response) = (200, {'access_token': 'token{count}'.format(count=self.server.token_count), 'refresh_token': 'refresh',
+                                        'expiration': int(time.time()) + 3600})
+        else:
+            route = self.server.routes.get((self.command, self.path), (404, {'code': 'G0004', 'description': 'The specified cluster could not be found.'}))
+            (status, response) = route.pop(0) if isinstance(route, list) else route
+        content = json.dumps(response).encode('utf-8') if response is not None else b''
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    do_GET = do_request
+    do_POST = do_request
+    do_PUT = do_request
+    do_DELETE = do_request
+
+    def log_message(self, format, *args):
+        pass
+
+
+class TestIKSClient(unittest.TestCase):
+    def setUp(self):
+        self.server = HTTPServer(('127.0.0.1', 0), StubAPIHandler)
+        self.server.requests = []
+        self.server.routes = {}
+        self.server.token_count = 0
+        self.server_thread = threading.Thread(target=self.server.serve_forever)
+        self.server_thread.daemon = True
+        self.server_thread.start()
+        endpoint = 'http://127.0.0.1:{port}'.format(port=self.server.server_port)
+        self.client = iksclient.IKSClient(api_key='key', resource_group='rg', endpoint=endpoint, iam_endpoint=endpoint)
+
+    def tearDown(self):
+        self.client.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_close(self):
+        self.assertIn(self.client, iksclient.open_clients)
+        self.client.close()
+        self.assertNotIn(self.client, iksclient.open_clients)  # Closed clients are not kept until exit
+
+    def test_authentication(self):
+        self.server.routes[('GET', '/global/v1/clusters')] = [(401, {'code': 'E0001', 'description': 'Token expired'}), (200, clusters_json), (200, clusters_json)]
+        self.assertEqual(clusters_json[0]['name'], self.client.list_clusters()[0].name)
+        self.assertEqual(clusters_json[0]['name'], self.client.list_clusters()[0].name)
+        # The expired token is replaced once and the new token is reused
+        self.assertEqual(2, self.server.token_count)
+        token_request = self.server.requests[0]
+        self.assertEqual({'grant_type': ['urn:ibm:params:oauth:grant-type:apikey'], 'apikey': ['key']}, parse_qs(token_request[3]))
+        (method, path, headers, body) = self.server.requests[-1]
+        self.assertEqual('Bearer token2', headers['Authorization'])
+        self.assertEqual('refresh', headers['X-Auth-Refresh-Token'])
+        self.assertEqual('rg', headers['X-Auth-Resource-Group'])
+
+    def test_clusters(self):
+        self.server.routes[('GET', '/global/v1/clusters/cluster1')] = (200, clusters_json[0])
+        self.assertEqual(clusters_json[0]['masterKubeVersion'], self.client.get_cluster('cluster1').master_kube_version)
+        self.assertIsNone(self.client.get_cluster('missing'))
+        self.server.routes[('PUT', '/global/v1/clusters/cluster1')] = (204, None)
+        self.assertIsNone(self.client.update_master('cluster1', '1.16.8'))
+        self.assertEqual({'action': 'update', 'version': '1.16.8'}, json.loads(self.server.requests[-1][3]))
+
+    def test_workers(self):
+        worker_id = workers_json[0]['id']
+        self.server.routes[('GET', '/global/v1/clusters/cluster1/workers')] = (200, workers_json)
+        self.server.routes[('GET', '/global/v1/clusters/cluster1/workers/{worker}'.format(worker=worker_id))] = (200, workers_json[0])
+        self.server.routes[('PUT', '/global/v1/clusters/cluster1/workers/{worker}'.format(worker=worker_id))] = [
+            (204, None), (409, {'code': 'E0036', 'description': 'The worker node is already up to date with the latest version.'})]
+        self.assertEqual(len(workers_json), len(self.client.list_workers('cluster1')))
+        self.assertEqual([], self.client.list_workers('cluster1', worker_pool_name='missing'))
+        self.assertEqual(worker_id, self.client.get_worker('cluster1', worker_id).id)
+        self.assertIsNone(self.client.get_worker('cluster1', 'missing'))
+        self.client.reload_worker('cluster1', worker_id)
+        self.assertEqual({'action': 'reload'}, json.loads(self.server.requests[-1][3]))
+        with self.assertRaises(iksclient.IKSAPIException) as context:
+            self.client.update_worker('cluster1', worker_id)
+        self.assertIn('The worker node is already up to date with the latest version', str(context.exception))
+        self.assertEqual(409, context.exception.status_code)
+
+    def test_worker_pools(self):
+        self.server.routes[('GET', '/global/v1/clusters/cluster1/workerpools')] = (200, worker_pools_json)
+        self.server.routes[('GET', '/global/v1/clusters/cluster1/workerpools/pool1')] = (200, worker_pools_json[0])
+        self.server.routes[('DELETE', '/global/v1/clusters/cluster1/workerpools/pool1')] = (204, None)
+        self.assertEqual(worker_pools_json[0]['id'], self.client.list_worker_pools('cluster1')[0].id)
+        self.assertEqual(worker_pools_json[0]['id'], self.client.get_worker_pool('cluster1', 'pool1').id)
+        self.assertIsNone(self.client.remove_worker_pool('cluster1', 'pool1'))
+        self.assertEqual('DELETE', self.server.requests[-1][0])
+
+    @patch('baseutils.exe_cmd')
+    def test_ibmcloud_backend(self, mock_exe_cmd):
+        self.server.routes[('GET', '/global/v1/clusters/cluster1/workers')] = (200, workers_json)
+        self.assertRaises(Exception, ibmcloud.set_backend, 'invalid')
+        try:
+            ibmcloud.set_backend('api')
+            with patch('orchutils.ibmcloud.IKSClient', return_value=self.client):
+                self.assertEqual(workers_json[0]['id'], ibmcloud.ks_worker_ls('cluster1')[0].id)
+                self.assertEqual(0, mock_exe_cmd.call_count)
+            # The cli is used when a client cannot be created
+            ibmcloud.set_backend('api')
+            with patch('orchutils.ibmcloud.IKSClient', side_effect=Exception('not logged in')):
+                self.assertIsNone(ibmcloud.get_api_client())
+                self.assertEqual('cli', ibmcloud.backend)
+        finally:
+            ibmcloud.set_backend('cli')
+
+
+if __name__ == '__main__':
+    unittest.main()
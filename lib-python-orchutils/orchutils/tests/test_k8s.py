@@ -201,15 +201,13 @@ class TestK8s(unittest.TestCase):
         mock_exe_cmd.return_value = (0, '')
         self.assertIsNone(k8s.cordon(node='node'))
         self.assertEqual(1, mock_exe_cmd.call_count)
-        self.assertIn(' cordon \'node\'', mock_exe_cmd.call_args[0][0])
-        self.assertNotIn('-l', mock_exe_cmd.call_args[0][0])
+        self.assertEqual([k8s.kubectl_binary, 'cordon', 'node'], mock_exe_cmd.call_args[0][0])
         self.assertIsNone(k8s.cordon(labels={'dedicated': 'edge'}))
         self.assertEqual(2, mock_exe_cmd.call_count)
-        self.assertIn(' -l \'dedicated=edge\'', mock_exe_cmd.call_args[0][0])
-        self.assertNotIn('\'node\'', mock_exe_cmd.call_args[0][0])
+        self.assertEqual([k8s.kubectl_binary, 'cordon', '-l', 'dedicated=edge'], mock_exe_cmd.call_args[0][0])
         self.assertIsNone(k8s.cordon(labels='key=value'))
         self.assertEqual(3, mock_exe_cmd.call_count)
-        self.assertIn(' cordon  -l \'key=value\'', mock_exe_cmd.call_args[0][0])
+        self.assertEqual([k8s.kubectl_binary, 'cordon', '-l', 'key=value'], mock_exe_cmd.call_args[0][0])
 
     @patch('baseutils.exe_cmd')
     def test_delete(self, mock_exe_cmd):
@@ -258,6 +256,7 @@ class TestK8s(unittest.TestCase):
         self.assertEqual([], k8s.get('clusterrolebinding'))
         self.assertEqual([], k8s.get('deployment', namespace='kube-config'))
         self.assertEqual([], k8s.get('pod', namespace='all'))
+        self.assertEqual([k8s.kubectl_binary, 'get', 'pod', '--all-namespaces', '-o', 'json'], mock_exe_cmd.call_args[0][0])
         mock_exe_cmd.return_value = (0, '{}')
         self.assertEqual({}, k8s.get('serviceaccount', name='name'))
         self.assertEqual({}, k8s.get('pod', name='name', namespace='kube-config'))
@@ -298,33 +297,29 @@ class TestK8s(unittest.TestCase):
         mock_exe_cmd.return_value = (0, '')
         self.assertIsNone(k8s.taint(['key1=v1:taint1'], node='node'))
         self.assertEqual(1, mock_exe_cmd.call_count)
-        self.assertIn(' taint node \'node\' ', mock_exe_cmd.call_args[0][0])
-        self.assertNotIn('-l', mock_exe_cmd.call_args[0][0])
+        self.assertEqual([k8s.kubectl_binary, 'taint', 'node', 'node', 'key1=v1:taint1', '--overwrite'], mock_exe_cmd.call_args[0][0])
         self.assertIsNone(k8s.taint(['key1=v1:taint1', 'key2=v2:taint2'], node='node'))
         self.assertEqual(2, mock_exe_cmd.call_count)
-        self.assertIn(' \'key1=v1:taint1\' \'key2=v2:taint2\'', mock_exe_cmd.call_args[0][0])
+        self.assertEqual([k8s.kubectl_binary, 'taint', 'node', 'node', 'key1=v1:taint1', 'key2=v2:taint2', '--overwrite'], mock_exe_cmd.call_args[0][0])
         self.assertIsNone(k8s.taint(['key1=v1:taint1'], labels={'dedicated': 'edge'}))
         self.assertEqual(3, mock_exe_cmd.call_count)
-        self.assertIn(' -l \'dedicated=edge\' ', mock_exe_cmd.call_args[0][0])
-        self.assertNotIn('\'node\'', mock_exe_cmd.call_args[0][0])
+        self.assertEqual([k8s.kubectl_binary, 'taint', 'node', '-l', 'dedicated=edge', 'key1=v1:taint1', '--overwrite'], mock_exe_cmd.call_args[0][0])
         self.assertIsNone(k8s.taint(['key1=v1:taint1'], labels='key=value'))
         self.assertEqual(4, mock_exe_cmd.call_count)
-        self.assertIn('taint node  -l \'key=value\' ', mock_exe_cmd.call_args[0][0])
+        self.assertEqual([k8s.kubectl_binary, 'taint', 'node', '-l', 'key=value', 'key1=v1:taint1', '--overwrite'], mock_exe_cmd.call_args[0][0])
 
     @patch('baseutils.exe_cmd')
     def test_uncordon(self, mock_exe_cmd):
         mock_exe_cmd.return_value = (0, '')
         self.assertIsNone(k8s.uncordon(node='node'))
         self.assertEqual(1, mock_exe_cmd.call_count)
-        self.assertIn(' uncordon \'node\'', mock_exe_cmd.call_args[0][0])
-        self.assertNotIn('-l', mock_exe_cmd.call_args[0][0])
+        self.assertEqual([k8s.kubectl_binary, 'uncordon', 'node'], mock_exe_cmd.call_args[0][0])
         self.assertIsNone(k8s.uncordon(labels={'dedicated': 'edge'}))
         self.assertEqual(2, mock_exe_cmd.call_count)
-        self.assertIn(' -l \'dedicated=edge\'', mock_exe_cmd.call_args[0][0])
-        self.assertNotIn('\'node\'', mock_exe_cmd.call_args[0][0])
+        self.assertEqual([k8s.kubectl_binary, 'uncordon', '-l', 'dedicated=edge'], mock_exe_cmd.call_args[0][0])
         self.assertIsNone(k8s.uncordon(labels='key=value'))
         self.assertEqual(3, mock_exe_cmd.call_count)
-        self.assertIn(' uncordon  -l \'key=value\'', mock_exe_cmd.call_args[0][0])
+        self.assertEqual([k8s.kubectl_binary, 'uncordon', '-l', 'key=value'], mock_exe_cmd.call_args[0][0])
 
     def test_install_kubectl(self):
         if os.name != 'nt':  # This is windows-specific and will not work on linux. No point attempting the test on windows
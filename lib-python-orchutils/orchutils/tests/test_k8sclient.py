@@ -0,0 +1,314 @@
+import json
+import os
+import shutil
+import requests
+import tempfile
+import threading
+import time
+import unittest
+from mock import Mock
+from mock import patch
+
+import baseutils
+from orchutils import k8s
+from orchutils import k8sclient
+
+kubeconfig_yaml = '''
+apiVersion: v1
+kind: Config
+current-context: mycluster
+clusters:
+- name: mycluster
+  cluster:
+    server: https://c1.containers.cloud.ibm.com:30000/
+    certificate-authority: ca.pem
+contexts:
+- name: mycluster
+  context:
+    cluster: mycluster
+    user: admin
+    namespace: console
+users:
+- name: admin
+  user:
+    auth-provider:
+      name: oidc
+      config:
+        id-token: my-id-token
+'''
+
+core_resources = {
+    'resources': [
+        {'name': 'pods', 'singularName': '', 'namespaced': True, 'kind': 'Pod', 'shortNames': ['po']},
+        {'name': 'pods/log', 'singularName': '', 'namespaced': True, 'kind': 'Pod'},
+        {'name': 'nodes', 'singularName': '', 'namespaced': False, 'kind': 'Node', 'shortNames': ['no']},
+        {'name': 'configmaps', 'singularName': '', 'namespaced': True, 'kind': 'ConfigMap', 'shortNames': ['cm']}
+    ]
+}
+apps_resources = {
+    'resources': [
+        {'name': 'deployments', 'singularName': '', 'namespaced': True, 'kind': 'Deployment', 'shortNames': ['deploy']},
+        {'name': 'statefulsets', 'singularName': '', 'namespaced': True, 'kind': 'StatefulSet', 'shortNames': ['sts']}
+    ]
+}
+groups = {'groups': [{'name': 'apps', 'preferredVersion': {'groupVersion': 'apps/v1', 'version': 'v1'}}]}
+
+
+def mock_response(status_code=200, body=None, text=None):
+    response = Mock()
+    response.status_code = status_code
+    response.ok = status_code < 400
+    response.text = text if text is not None else json.dumps(body)
+    response.content = response.text
+    response.json.return_value = body
+    return response
+
+
+def api_router(routes):
+    """
+    Creates a fake requests.Session.request implementation that returns responses based on method and path.
+    """
+    def request(method, url, **kwargs):
+        path = url.split(':30000', 1)[1]
+        if method == 'GET' and path == '/api/v1':
+            return mock_response(body=core_resources)
+        if method == 'GET' and path == '/apis':
+            return mock_response(body=groups)
+        if method == 'GET' and path == '/apis/apps/v1':
+            return mock_response(body=apps_resources)
+        response = routes.get((method, path))
+        if isinstance(response, list):
+            response = response.pop(0) if response else None
+        return response or mock_response(404, {'kind': 'Status', 'reason': 'NotFound', 'message': 'not found'})
+    return request
+
+
+class TestK8sClient(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.kubeconfig = os.path.join(self.tmp_dir, 'config')
+        with open(self.kubeconfig, 'w') as fh:
+            fh.write(kubeconfig_yaml)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_load_kubeconfig(self):
+        override_kubeconfig = os.path.join(self.tmp_dir, 'override')
+        with open(override_kubeconfig, 'w') as fh:
+            fh.write('current-context: other\ncontexts:\n- name: other\n  context:\n    cluster: mycluster\n')
+        config = k8sclient.load_kubeconfig(os.pathsep.join([override_kubeconfig, self.kubeconfig, '/does/not/exist']))
+        self.assertEqual('other', config['current-context'])
+        self.assertEqual(['mycluster', 'other'], sorted(config['contexts'].keys()))
+        self.assertEqual('https://c1.containers.cloud.ibm.com:30000/', config['clusters']['mycluster']['server'])
+        self.assertEqual(self.tmp_dir, config['clusters']['mycluster']['_base_dir'])
+
+    def test_client_configuration(self):
+        client = k8sclient.KubeClient(self.kubeconfig)
+        self.assertEqual('https://c1.containers.cloud.ibm.com:30000', client.server)
+        self.assertEqual('console', client.default_namespace)
+        self.assertEqual(os.path.join(self.tmp_dir, 'ca.pem'), client.session.verify)
+        self.assertEqual('Bearer my-id-token', client.session.headers['Authorization'])
+        self.assertIn(client, k8sclient.open_clients)
+        client.close()
+        self.assertNotIn(client, k8sclient.open_clients)  # Closed clients are not kept until exit
+        with self.assertRaises(Exception):
+            k8sclient.KubeClient(self.kubeconfig, context='missing')
+
+    def test_resolve(self):
+        client = k8sclient.KubeClient(self.kubeconfig)
+        with patch.object(client.session, 'request', side_effect=api_router({})) as mock_request:
+            for kind in ['Deployment', 'deployment', 'deployments', 'deploy', 'deployment.apps']:
+                self.assertEqual('/apis/apps/v1', client.resolve(kind)['base_path'])
+            self.assertEqual('/api/v1/namespaces/console/pods', client.resource_path(client.resolve('po')))
+            self.assertEqual('/api/v1/pods', client.resource_path(client.resolve('pod'), namespace='all'))
+            self.assertEqual('/api/v1/nodes/node1', client.resource_path(client.resolve('node'), namespace='ns', name='node1'))
+            self.assertEqual('/api/v1/namespaces/ns/pods/p1/log', client.resource_path(client.resolve('pod'), namespace='ns', name='p1', subresource='log'))
+            self.assertRaises(Exception, client.resolve, 'pods/log')
+            self.assertEqual(3, mock_request.call_count)  # Discovery is only performed once
+
+    def test_get(self):
+        client = k8sclient.KubeClient(self.kubeconfig)
+        routes = {
+            ('GET', '/apis/apps/v1/namespaces/console/deployments'): mock_response(body={'kind': 'DeploymentList', 'items': [{'metadata': {'name': 'd1'}}]}),
+            ('GET', '/apis/apps/v1/namespaces/ns/deployments/d1'): mock_response(body={'kind': 'Deployment', 'metadata': {'name': 'd1'}})
+        }
+        with patch.object(client.session, 'request', side_effect=api_router(routes)) as mock_request:
+            self.assertEqual([{'apiVersion': 'apps/v1', 'kind': 'Deployment', 'metadata': {'name': 'd1'}}], client.get('deployment', labels='app=d1'))
+            self.assertEqual({'labelSelector': 'app=d1'}, mock_request.call_args[1]['params'])
+            self.assertEqual('d1', client.get('deployment', namespace='ns', name='d1')['metadata']['name'])
+            with self.assertRaises(Exception) as context:
+                client.get('deployment', namespace='ns', name='d2')
+            self.assertEqual('Error from server (NotFound): not found', str(context.exception))
+
+    def test_watch(self):
+        client = k8sclient.KubeClient(self.kubeconfig)
+        pod1 = {'metadata': {'name': 'p1', 'namespace': 'ns', 'resourceVersion': '1'}}
+        pod2 = {'metadata': {'name': 'p2', 'namespace': 'ns', 'resourceVersion': '2'}}
+        watch_response = mock_response(body={})
+        watch_response.iter_lines.return_value = [
+            json.dumps({'type': 'MODIFIED', 'object': pod1}),
+            json.dumps({'type': 'ERROR', 'object': {'kind': 'Status', 'code': 410, 'reason': 'Expired'}})
+        ]
+        routes = {
+            ('GET', '/api/v1/namespaces/ns/pods'): [
+                mock_response(body={'metadata': {'resourceVersion': '1'}, 'items': [dict(pod1)]}),
+                watch_response,
+                mock_response(body={'metadata': {'resourceVersion': '3'}, 'items': [pod2]})
+            ]
+        }
+        with patch.object(client.session, 'request', side_effect=api_router(routes)):
+            events = client.watch('pod', namespace='ns')
+            self.assertEqual(('ADDED', 'p1'), next((event_type, resource['metadata']['name']) for (event_type, resource) in events))
+            self.assertEqual(('MODIFIED', 'p1'), next((event_type, resource['metadata']['name']) for (event_type, resource) in events))
+            # The watch expired so a re-list detects the deletion of p1 and the creation of p2
+            self.assertEqual(('DELETED', 'p1'), next((event_type, resource['metadata']['name']) for (event_type, resource) in events))
+            self.assertEqual(('ADDED', 'p2'), next((event_type, resource['metadata']['name']) for (event_type, resource) in events))
+            self.assertEqual('Pod', pod2['kind'])
+
+    def test_watch_stop(self):
+        client = k8sclient.KubeClient(self.kubeconfig)
+        pod1 = {'metadata': {'name': 'p1', 'namespace': 'ns', 'resourceVersion': '1'}}
+        closed = threading.Event()
+
+        def iter_lines():
+            yield json.dumps({'type': 'MODIFIED', 'object': pod1})
+            closed.wait(10)  # Blocks as if no further events arrive until the response is closed
+            raise requests.exceptions.ConnectionError('connection closed')
+        watch_response = mock_response(body={})
+        watch_response.iter_lines.side_effect = iter_lines
+        watch_response.close.side_effect = closed.set
+        routes = {('GET', '/api/v1/namespaces/ns/pods'): [mock_response(body={'metadata': {'resourceVersion': '1'}, 'items': [dict(pod1)]}), watch_response]}
+        stop_event = threading.Event()
+        with patch.object(client.session, 'request', side_effect=api_router(routes)):
+            events = client.watch('pod', namespace='ns', stop_event=stop_event)
+            self.assertEqual('ADDED', next(events)[0])
+            self.assertEqual('MODIFIED', next(events)[0])
+            # Stopping the watch closes the open request rather than waiting for another event
+            threading.Timer(0.1, stop_event.set).start()
+            start = time.time()
+            self.assertEqual([], list(events))
+            self.assertLess(time.time() - start, 5)
+
+    def test_apply(self):
+        client = k8sclient.KubeClient(self.kubeconfig)
+        resource = {'apiVersion': 'v1', 'kind': 'ConfigMap', 'metadata': {'name': 'cm1', 'namespace': 'ns', 'managedFields': []}, 'data': {'k': 'v'}}
+        routes = {('PATCH', '/api/v1/namespaces/ns/configmaps/cm1'): mock_response(201, {})}
+        with patch.object(client.session, 'request', side_effect=api_router(routes)) as mock_request:
+            client.apply(resource)
+            self.assertEqual('application/apply-patch+yaml', mock_request.call_args[1]['headers']['Content-Type'])
+            self.assertEqual({'fieldManager': 'orchutils', 'force': 'true'}, mock_request.call_args[1]['params'])
+            self.assertNotIn('managedFields', json.loads(mock_request.call_args[1]['data'])['metadata'])
+        # API servers without server-side apply are sent a create or merge patch
+        unsupported = mock_response(415, {'kind': 'Status', 'reason': 'UnsupportedMediaType', 'message': 'unsupported'})
+        routes = {
+            ('PATCH', '/api/v1/namespaces/ns/configmaps/cm1'): [unsupported],
+            ('GET', '/api/v1/namespaces/ns/configmaps/cm1'): mock_response(404, {'kind': 'Status', 'reason': 'NotFound', 'message': 'not found'}),
+            ('POST', '/api/v1/namespaces/ns/configmaps'): mock_response(201, {})
+        }
+        with patch.object(client.session, 'request', side_effect=api_router(routes)) as mock_request:
+            client.apply(resource)
+            self.assertEqual('POST', mock_request.call_args[0][0])
+        routes = {
+            ('GET', '/api/v1/namespaces/ns/configmaps/cm1'): mock_response(body=resource),
+            ('PATCH', '/api/v1/namespaces/ns/configmaps/cm1'): [unsupported, unsupported, mock_response(body=resource)]
+        }
+        with patch.object(client.session, 'request', side_effect=api_router(routes)) as mock_request:
+            client.apply(resource)
+            self.assertEqual('PATCH', mock_request.call_args[0][0])
+            self.assertEqual('application/merge-patch+json', mock_request.call_args[1]['headers']['Content-Type'])
+
+    @patch('time.sleep')
+    def test_delete(self, mock_sleep):
+        client = k8sclient.KubeClient(self.kubeconfig)
+        routes = {
+            ('DELETE', '/api/v1/namespaces/ns/pods/p1'): mock_response(body={}),
+            ('GET', '/api/v1/namespaces/ns/pods/p1'): [mock_response(body={})]
+        }
+        with patch.object(client.session, 'request', side_effect=api_router(routes)) as mock_request:
+            client.delete('pod', namespace='ns', name='p1', grace_period=5)
+            delete_call = [call for call in mock_request.call_args_list if call[0][0] == 'DELETE'][0]
+            self.assertEqual(5, json.loads(delete_call[1]['data'])['gracePeriodSeconds'])
+            self.assertEqual(1, mock_sleep.call_count)
+        # Waiting for the deletion stops at the deadline of an active timeout
+        routes[('GET', '/api/v1/namespaces/ns/pods/p1')] = mock_response(body={})
+        with patch.object(client.session, 'request', side_effect=api_router(routes)):
+            with self.assertRaises(baseutils.TimeoutException):
+                with baseutils.timeout(seconds=0):
+                    client.delete('pod', namespace='ns', name='p1')
+        self.assertRaises(Exception, client.delete, 'pod', namespace='ns')
+
+    def test_label(self):
+        client = k8sclient.KubeClient(self.kubeconfig)
+        routes = {('PATCH', '/api/v1/nodes/n1'): mock_response(body={})}
+        with patch.object(client.session, 'request', side_effect=api_router(routes)) as mock_request:
+            client.label('kubernetes.io/label=mylabel', 'node', name='n1')
+            self.assertEqual({'metadata': {'labels': {'kubernetes.io/label': 'mylabel'}}}, json.loads(mock_request.call_args[1]['data']))
+            client.label('kubernetes.io/label-', 'node', name='n1')
+            self.assertEqual({'metadata': {'labels': {'kubernetes.io/label': None}}}, json.loads(mock_request.call_args[1]['data']))
+
+    def test_apply_taints(self):
+        current = [{'key': 'k1', 'value': 'v1', 'effect': 'NoSchedule'}, {'key': 'k2', 'effect': 'NoExecute'}]
+        self.assertEqual([{'key': 'k2', 'effect': 'NoExecute'}, {'key': 'k1', 'value': 'v2', 'effect': 'NoSchedule'}], k8sclient.apply_taints(current, ['k1=v2:NoSchedule']))
+        self.assertEqual([{'key': 'k2', 'effect': 'NoExecute'}], k8sclient.apply_taints(current, ['k1:NoSchedule-']))
+        self.assertEqual([], k8sclient.apply_taints(current, ['k1-', 'k2-']))
+
+    def test_rollout_status_message(self):
+        deployment = {
+            'kind': 'Deployment',
+            'metadata': {'name': 'd1', 'generation': 2},
+            'spec': {'replicas': 3},
+            'status': {'observedGeneration': 1}
+        }
+        self.assertEqual(('Waiting for deployment spec update to be observed...\n', False), k8sclient.rollout_status_message(deployment))
+        deployment['status'] = {'observedGeneration': 2, 'replicas': 4, 'updatedReplicas': 3, 'availableReplicas': 3}
+        self.assertIn('1 old replicas are pending termination', k8sclient.rollout_status_message(deployment)[0])
+        deployment['status']['replicas'] = 3
+        self.assertEqual(('deployment "d1" successfully rolled out\n', True), k8sclient.rollout_status_message(deployment))
+        deployment['status']['conditions'] = [{'type': 'Progressing', 'reason': 'ProgressDeadlineExceeded'}]
+        self.assertRaises(Exception, k8sclient.rollout_status_message, deployment)
+        statefulset = {
+            'kind': 'StatefulSet',
+            'metadata': {'name': 's1', 'generation': 1},
+            'spec': {'replicas': 3, 'updateStrategy': {'type': 'RollingUpdate'}},
+            'status': {'observedGeneration': 1, 'readyReplicas': 3, 'currentReplicas': 3, 'updatedReplicas': 3, 'currentRevision': 'r1', 'updateRevision': 'r1'}
+        }
+        self.assertEqual(('statefulset rolling update complete 3 pods at revision r1...\n', True), k8sclient.rollout_status_message(statefulset))
+        statefulset['spec']['updateStrategy'] = {'type': 'OnDelete'}
+        with self.assertRaises(Exception) as context:
+            k8sclient.rollout_status_message(statefulset)
+        self.assertIn('Status is available only for RollingUpdate strategy type', str(context.exception))
+        daemonset = {
+            'kind': 'DaemonSet',
+            'metadata': {'name': 'ds1', 'generation': 1},
+            'spec': {},
+            'status': {'observedGeneration': 1, 'desiredNumberScheduled': 2, 'updatedNumberScheduled': 2, 'numberAvailable': 1}
+        }
+        self.assertEqual(('Waiting for daemon set "ds1" rollout to finish: 1 of 2 updated pods are available...\n', False), k8sclient.rollout_status_message(daemonset))
+
+    def test_k8s_backend(self):
+        original_kubeconfig = os.environ.get('KUBECONFIG')
+        os.environ['KUBECONFIG'] = self.kubeconfig
+        try:
+            self.assertRaises(Exception, k8s.set_backend, 'invalid')
+            k8s.set_backend('api')
+            with patch('orchutils.k8sclient.KubeClient.get') as mock_get:
+                mock_get.return_value = []
+                self.assertEqual([], k8s.get('pod', namespace='ns', labels={'app': 'a1'}))
+                mock_get.assert_called_once_with('pod', namespace='ns', name=None, labels='app=a1')
+            k8s.set_backend('api')
+            os.environ['KUBECONFIG'] = os.path.join(self.tmp_dir, 'missing')
+            with patch('baseutils.exe_cmd') as mock_exe_cmd:
+                mock_exe_cmd.return_value = (0, '{"items": [], "kind": "List"}')
+                self.assertEqual([], k8s.get('pod'))  # An unusable kubeconfig falls back to kubectl
+                self.assertEqual('kubectl', k8s.backend)
+        finally:
+            k8s.set_backend('kubectl')
+            if original_kubeconfig:
+                os.environ['KUBECONFIG'] = original_kubeconfig
+            else:
+                del os.environ['KUBECONFIG']
+
+
+if __name__ == '__main__':
+    unittest.main()
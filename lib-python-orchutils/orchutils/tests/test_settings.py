@@ -1,5 +1,7 @@
 import base64
 import os
+import shutil
+import tempfile
 import unittest
 import yaml
 from mock import patch
@@ -168,6 +170,91 @@ class TestSettings(unittest.TestCase):
         with self.assertRaises(IOError):
             settings.read_settings_file(os.path.join(settings.settings_dir, '..', 'mock_settings', 'common.yaml'))  # Directory traversal flow
 
+    @patch('orchutils.vault.decrypt_dict')
+    def test_read_settings_file_cache(self, mock_decrypt_dict):
+        def decrypt_dict(enc_key_name, data):
+            for key in data:
+                data[key] = data[key].replace('enc', 'dec')
+        mock_decrypt_dict.side_effect = decrypt_dict
+        settings.clear_cache()
+        settings_file = os.path.join(settings.settings_dir, 'cache-secret.yaml')
+        try:
+            with open(settings_file, 'w') as fh:
+                fh.write('secret1: enc1\nsecret2: enc2\nnested:\n  secret3: enc1\n')
+            result = settings.read_settings_file(settings_file, 'key')
+            self.assertEqual({'secret1': 'dec1', 'secret2': 'dec2', 'nested': {'secret3': 'dec1'}}, result)
+            self.assertEqual({'0': 'dec1', '1': 'dec2'}, mock_decrypt_dict.call_args[0][1])  # Duplicate values are only decrypted once
+            result['nested']['secret3'] = 'modified'
+            self.assertEqual({'secret1': 'dec1', 'secret2': 'dec2', 'nested': {'secret3': 'dec1'}}, settings.read_settings_file(settings_file, 'key'))
+            self.assertEqual(1, mock_decrypt_dict.call_count)
+            # A changed file is re-read, but only new values are decrypted
+            with open(settings_file, 'w') as fh:
+                fh.write('secret1: enc1\nsecret2: enc2\nsecret4: enc4\n')
+            self.assertEqual({'secret1': 'dec1', 'secret2': 'dec2', 'secret4': 'dec4'}, settings.read_settings_file(settings_file, 'key'))
+            self.assertEqual(2, mock_decrypt_dict.call_count)
+            self.assertEqual({'0': 'dec4'}, mock_decrypt_dict.call_args[0][1])
+            # Values are decrypted separately for each key
+            settings.read_settings_file(settings_file, 'other-key')
+            self.assertEqual(3, mock_decrypt_dict.call_count)
+            with patch('orchutils.settings.cache_size', 1):
+                settings.read_settings_file(os.path.join(settings.settings_dir, 'global.yaml'))
+                self.assertEqual(1, len(settings.settings_cache))
+            # Decrypted values are discarded in least recently used order
+            with open(settings_file, 'w') as fh:
+                fh.write('secret1: enc1\nsecret5: enc5\n')
+            with patch('orchutils.settings.decrypted_values_cache_size', 2):
+                self.assertEqual({'secret1': 'dec1', 'secret5': 'dec5'}, settings.read_settings_file(settings_file, 'key'))
+                self.assertEqual([('key', 'enc1'), ('key', 'enc5')], list(settings.decrypted_values))
+                self.assertEqual({'0': 'dec5'}, mock_decrypt_dict.call_args[0][1])
+        finally:
+            os.remove(settings_file)
+            settings.clear_cache()
+
+    @patch('orchutils.vault.decrypt_dict')
+    def test_compile_settings(self, mock_decrypt_dict):
+        def decrypt_dict(enc_key_name, data):
+            for key in data:
+                data[key] = '{key}:{value}'.format(key=enc_key_name, value=data[key])
+        mock_decrypt_dict.side_effect = decrypt_dict
+        tmp_dir = tempfile.mkdtemp()
+        settings_dir = os.path.join(tmp_dir, 'settings')
+        shutil.copytree(settings.settings_dir, settings_dir)
+        with open(os.path.join(settings_dir, 'global-secret.yaml'), 'w') as fh:
+            fh.write('secret_var1: global_enc1\nglobal_secret: global_enc2\n')
+        environments = [(None, None, None), (None, None, 'offering_name'), (None, None, 'test_offering'), ('test_category', None, None),
+                        ('test_category', None, 'offering_name'), ('test_category', None, 'test_offering'), ('test_category', 'test_metro', None),
+                        ('test_category', 'test_metro', 'offering_name'), ('test_category', 'test_metro', 'test_offering')]
+        try:
+            with patch('orchutils.settings.settings_dir', settings_dir), patch('orchutils.settings.snapshot_file', None):
+                settings.clear_cache()
+                expected = dict((environment, settings.get_settings(*environment)) for environment in environments)
+                custom_expected = settings.get_settings(global_settings='custom')
+                self.assertEqual('environment-test_offering-test_category-test_metro:secret1', expected[environments[8]]['secret_var1'])
+                self.assertEqual('settings-global:global_enc1', expected[environments[6]]['secret_var1'])
+                snapshot_path = settings.compile_settings(os.path.join(tmp_dir, 'settings.snapshot'))
+                self.assertEqual(snapshot_path, settings.snapshot_file)
+                self.assertEqual(sorted(environments, key=str), sorted(settings._load_snapshot()['environments'], key=str))
+                with patch('orchutils.settings.read_settings_file') as mock_read_settings_file:
+                    for environment in environments:
+                        self.assertEqual(expected[environment], settings.get_settings(*environment))
+                    self.assertEqual(0, mock_read_settings_file.call_count)
+                # A changed file only rebuilds the environments that include it
+                with open(os.path.join(settings_dir, 'test_category', 'test_metro', 'metro.yaml'), 'a') as fh:
+                    fh.write('\nmetro_var3: "metro3"\n')
+                with patch('orchutils.settings._build_snapshot_environments', wraps=settings._build_snapshot_environments) as mock_build:
+                    self.assertEqual('metro3', settings.get_settings(*environments[8])['metro_var3'])
+                    self.assertEqual(sorted(environments[6:], key=str), sorted(mock_build.call_args[0][1], key=str))
+                settings.loaded_snapshot = (None, None)
+                self.assertEqual('metro3', settings.get_settings(*environments[6])['metro_var3'])  # The rebuilt snapshot was saved
+                # Other prefixes are read from the settings files
+                with patch('orchutils.settings.read_settings_file', wraps=settings.read_settings_file) as mock_read_settings_file:
+                    self.assertEqual(custom_expected, settings.get_settings(global_settings='custom'))
+                    self.assertEqual(1, mock_read_settings_file.call_count)
+        finally:
+            settings.loaded_snapshot = (None, None)
+            settings.clear_cache()
+            shutil.rmtree(tmp_dir)
+
     def test_merge_settings(self):
         master = {
             'k1': 'v1m',
@@ -6,16 +6,18 @@ from orchutils import sos
 
 
 class TestSOS(unittest.TestCase):
+    @patch('orchutils.vault.distributed_lock')
     @patch('baseutils.local_lock')
     @patch('orchutils.vault.client')
     @patch('baseutils.exe_cmd')
-    def test_csutil_cluster_setup(self, mock_exe_cmd, mock_vault, mock_local_lock):
+    def test_csutil_cluster_setup(self, mock_exe_cmd, mock_vault, mock_local_lock, mock_distributed_lock):
         mock_exe_cmd.side_effect = [
             (0, '{"kind": "List", "items": [{"metadata": {"name": "sos-vpn-secret"}}]}'),
             (0, '{"data": {"name0001.ovpn": ""}}'),
             (0, '')
         ]
         mock_vault.read.side_effect = [
+            None,
             None,
             {
                 'lease_id': '',
@@ -31,11 +33,11 @@ class TestSOS(unittest.TestCase):
         os.environ['P2PAAS_ORCH_DIR'] = '/tmp'
         self.assertIsNone(sos.csutil_cluster_setup('cluster_name', 'p2paas', 'staging'))
         self.assertEqual(3, mock_exe_cmd.call_count)
-        self.assertEqual(2, mock_vault.read.call_count)
-        self.assertIn('--crn-service-name \'p2paas\'', mock_exe_cmd.call_args_list[2][0][0])
-        self.assertIn('--crn-cname \'staging\'', mock_exe_cmd.call_args_list[2][0][0])
-        self.assertIn('name0001.ovpn', mock_exe_cmd.call_args_list[2][0][0])
-        self.assertIn('cluster_name', mock_exe_cmd.call_args_list[2][0][0])
+        self.assertEqual(3, mock_vault.read.call_count)
+        setup_cmd = mock_exe_cmd.call_args_list[2][0][0]
+        self.assertEqual(['--crn-service-name', 'p2paas', '--crn-cname', 'staging'], setup_cmd[3:7])
+        self.assertTrue(setup_cmd[8].endswith('name0001.ovpn'))
+        self.assertIn('cluster_name', setup_cmd)
         del os.environ['P2PAAS_ORCH_DIR']
 
     @patch('baseutils.local_lock')
@@ -53,10 +55,11 @@ class TestSOS(unittest.TestCase):
         self.assertIn('cluster_name', mock_exe_cmd.call_args_list[2][0][0])
         del os.environ['P2PAAS_ORCH_DIR']
 
+    @patch('orchutils.vault.distributed_lock')
     @patch('baseutils.local_lock')
     @patch('orchutils.vault.client')
     @patch('baseutils.exe_cmd')
-    def test_reserve_iks_ovpn_config_name(self, mock_exe_cmd, mock_vault, mock_local_lock):
+    def test_reserve_iks_ovpn_config_name(self, mock_exe_cmd, mock_vault, mock_local_lock, mock_distributed_lock):
         mock_exe_cmd.side_effect = [
             (0, '{"kind": "List", "items": [{"metadata": {"name": "sos-vpn-secret"}}]}'),
             (0, '{"data": {"config0001.ovpn": ""}}')
@@ -95,6 +98,7 @@ class TestSOS(unittest.TestCase):
         self.assertEqual(3, mock_exe_cmd.call_count)
         self.assertEqual(2, mock_vault.list.call_count)
         self.assertEqual(2, mock_vault.write.call_count)
+        self.assertEqual(2, mock_distributed_lock.return_value.__enter__.call_count)
         mock_exe_cmd.side_effect = [
             (0, '{"kind": "List", "items": [{"metadata": {"name": "false"}}]}'),
         ]
@@ -127,10 +131,11 @@ class TestSOS(unittest.TestCase):
         self.assertEqual(4, mock_vault.list.call_count)
         self.assertEqual(2, mock_vault.write.call_count)
 
+    @patch('orchutils.vault.distributed_lock')
     @patch('baseutils.local_lock')
     @patch('orchutils.vault.client')
     @patch('baseutils.exe_cmd')
-    def test_get_current_iks_ovpn_config_name(self, mock_exe_cmd, mock_vault, mock_local_lock):
+    def test_get_current_iks_ovpn_config_name(self, mock_exe_cmd, mock_vault, mock_local_lock, mock_distributed_lock):
         mock_exe_cmd.side_effect = [
             (0, '{"kind": "List", "items": [{"metadata": {"name": "sos-vpn-secret"}}]}'),
             (0, '{"data": {"name0001.ovpn": ""}}')
@@ -138,8 +143,11 @@ class TestSOS(unittest.TestCase):
         mock_vault.read.return_value = None
         self.assertEqual('name0001.ovpn', sos._get_current_iks_ovpn_config_name('cluster_name'))
         self.assertEqual(2, mock_exe_cmd.call_count)
-        self.assertEqual(1, mock_vault.read.call_count)
+        self.assertEqual(2, mock_vault.read.call_count)
+        self.assertTrue(mock_local_lock.call_args_list[0][1]['shared'])
+        self.assertNotIn('shared', mock_local_lock.call_args_list[1][1])
         self.assertEqual(1, mock_vault.write.call_count)
+        mock_distributed_lock.assert_called_once_with(sos.iks_ovpn_reservation_lock_name, timeout=sos.iks_ovpn_reservation_lock_timeout)
         mock_exe_cmd.side_effect = [
             (0, '{"kind": "List", "items": [{"metadata": {"name": "false"}}]}'),
         ]
@@ -164,7 +172,7 @@ class TestSOS(unittest.TestCase):
             sos._reserve_iks_ovpn_config_name('cluster_name')
         self.assertIn('Cluster is using and ovpn config reserved by a different cluster', str(context.exception))
         self.assertEqual(5, mock_exe_cmd.call_count)
-        self.assertEqual(2, mock_vault.read.call_count)
+        self.assertEqual(3, mock_vault.read.call_count)
         self.assertEqual(1, mock_vault.write.call_count)
 
     def test_get_csutil_env(self):
@@ -180,10 +188,11 @@ class TestSOS(unittest.TestCase):
         del os.environ['IBMCLOUD_HOME']
         del os.environ['P2PAAS_ORCH_DIR']
 
+    @patch('orchutils.vault.distributed_lock')
     @patch('baseutils.local_lock')
     @patch('orchutils.vault.client')
     @patch('baseutils.exe_cmd')
-    def test_release_iks_ovpn_config_reservation(self, mock_exe_cmd, mock_vault, mock_local_lock):
+    def test_release_iks_ovpn_config_reservation(self, mock_exe_cmd, mock_vault, mock_local_lock, mock_distributed_lock):
         mock_exe_cmd.side_effect = [
             (0, '{"kind": "List", "items": [{"metadata": {"name": "sos-vpn-secret"}}]}'),
             (0, '{"data": {"name0001.ovpn": ""}}')
@@ -191,7 +200,7 @@ class TestSOS(unittest.TestCase):
         mock_vault.read.return_value = None
         self.assertIsNone(sos.release_iks_ovpn_config_reservation('cluster_name'))
         self.assertEqual(2, mock_exe_cmd.call_count)
-        self.assertEqual(1, mock_vault.read.call_count)
+        self.assertEqual(2, mock_vault.read.call_count)
         self.assertEqual(1, mock_vault.write.call_count)
         self.assertEqual(1, mock_vault.delete.call_count)
         mock_exe_cmd.side_effect = [
@@ -199,7 +208,7 @@ class TestSOS(unittest.TestCase):
         ]
         self.assertIsNone(sos.release_iks_ovpn_config_reservation('cluster_name'))
         self.assertEqual(3, mock_exe_cmd.call_count)
-        self.assertEqual(1, mock_vault.read.call_count)
+        self.assertEqual(2, mock_vault.read.call_count)
         self.assertEqual(1, mock_vault.write.call_count)
         self.assertEqual(1, mock_vault.delete.call_count)
         mock_vault.read.return_value = {
@@ -218,7 +227,7 @@ class TestSOS(unittest.TestCase):
         ]
         self.assertIsNone(sos.release_iks_ovpn_config_reservation('cluster_name'))
         self.assertEqual(5, mock_exe_cmd.call_count)
-        self.assertEqual(2, mock_vault.read.call_count)
+        self.assertEqual(3, mock_vault.read.call_count)
         self.assertEqual(1, mock_vault.write.call_count)
         self.assertEqual(1, mock_vault.delete.call_count)
 
@@ -1,12 +1,59 @@
 import base64
+import hvac
 import os
+import threading
+import time
 import unittest
 from mock import Mock
 from mock import patch
+try:  # python3
+    from http.server import BaseHTTPRequestHandler
+    from http.server import HTTPServer
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler
+    from BaseHTTPServer import HTTPServer
 
+import baseutils
 from orchutils import vault
 
 
+class KeepAliveHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header('Content-Length', '2')
+        self.end_headers()
+        self.wfile.write(b'{}')
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeKVv2(object):
+    """
+    An in-memory KV version 2 secrets engine supporting check-and-set writes.
+    """
+    def __init__(self):
+        self.secrets = {}
+        self.lock = threading.Lock()
+
+    def read_secret_version(self, path, mount_point='secret'):
+        with self.lock:
+            if (mount_point, path) not in self.secrets:
+                raise hvac.exceptions.InvalidPath()
+            (version, data) = self.secrets[(mount_point, path)]
+            return {'data': {'data': dict(data), 'metadata': {'version': version}}}
+
+    def create_or_update_secret(self, path, secret, cas=None, mount_point='secret'):
+        with self.lock:
+            version = self.secrets.get((mount_point, path), (0, None))[0]
+            if cas is not None and cas != version:
+                raise hvac.exceptions.InvalidRequest('check-and-set parameter did not match the current version')
+            self.secrets[(mount_point, path)] = (version + 1, dict(secret))
+            return {'data': {'version': version + 1}}
+
+
 class TestVault(unittest.TestCase):
     @classmethod
     def setUpClass(self):
@@ -21,8 +68,24 @@ class TestVault(unittest.TestCase):
         vault.client = None
         self.assertIsNone(vault.login('url', 'token'))
         self.assertIsNotNone(vault.client)
+        self.assertIs(vault.get_session(), mock_client.call_args[1]['session'])
         vault.client = 'client'
 
+    def test_get_connection_metrics(self):
+        server = HTTPServer(('127.0.0.1', 0), KeepAliveHandler)
+        server_thread = threading.Thread(target=server.serve_forever)
+        server_thread.daemon = True
+        server_thread.start()
+        try:
+            with patch('orchutils.vault.session', None):
+                for i in range(3):
+                    vault.get_session().get('http://127.0.0.1:{port}/v1/sys/health'.format(port=server.server_port)).raise_for_status()
+                self.assertEqual({'requests': 3, 'pool_misses': 1, 'pool_hits': 2}, vault.get_connection_metrics())
+                vault.get_session().close()
+        finally:
+            server.shutdown()
+            server.server_close()
+
     @patch('hvac.Client')
     def test_ensure_client(self, mock_client):
         # Test flow pulling creds from file
@@ -97,6 +160,24 @@ class TestVault(unittest.TestCase):
         vault.encrypt_dict('key', data)
         self.assertEqual(expected_result, data)
 
+    @patch('time.sleep')
+    @patch('orchutils.vault.transit_batch_size', 2)
+    @patch('orchutils.vault.client')
+    def test_decrypt_dict_batches(self, mock_client, mock_sleep):
+        attempts = []
+
+        def decrypt_data(enc_key_name, ciphertext, batch_input):
+            attempts.append([entry['ciphertext'] for entry in batch_input])
+            if attempts[-1] == ['enc3', 'enc4'] and attempts.count(attempts[-1]) == 1:
+                raise Exception('request timed out')
+            return {'data': {'batch_results': [{'plaintext': base64.b64encode(entry['ciphertext'].replace('enc', 'dec').encode('utf-8'))} for entry in batch_input]}}
+        mock_client.secrets.transit.decrypt_data = decrypt_data
+        data = dict(('k{i}'.format(i=i), 'enc{i}'.format(i=i)) for i in range(1, 6))
+        vault.decrypt_dict('key', data)
+        self.assertEqual(dict(('k{i}'.format(i=i), 'dec{i}'.format(i=i)) for i in range(1, 6)), data)
+        # Only the failed batch is resent
+        self.assertEqual([['enc1', 'enc2'], ['enc3', 'enc4'], ['enc3', 'enc4'], ['enc5']], sorted(attempts))
+
     def test_aggregate_dict_for_vault(self):
         # Test ciphertext mode
         data = {'k1': 'enc1', 'k2': {'k3': 'enc2'}}
@@ -123,6 +204,19 @@ class TestVault(unittest.TestCase):
         vault._restore_dict_from_vault(data, 'plaintext', aggregated_data)
         self.assertEqual(expected_result, data)
 
+    def test_index_dict_for_vault(self):
+        data = {'k1': 'v1', 'k2': {'k3': 'v3', 'k4': 4, 'k5': {'k6': 'v6'}}, 'k7': None}
+        index = vault._index_dict_for_vault(data)
+        self.assertEqual(['v1', 'v3', 'v6'], [container[key] for (container, key) in index])
+        self.assertIs(data['k2']['k5'], index[2][0])
+        # Results are written back to the indexed locations, however many values there are
+        data = dict(('k{i}'.format(i=i), {'nested': 'v{i}'.format(i=i)}) for i in range(5000))
+        index = vault._index_dict_for_vault(data)
+        aggregated_data = vault._aggregate_dict_for_vault(data, 'ciphertext', index)
+        vault._restore_dict_from_vault(data, 'ciphertext', [{'ciphertext': entry['ciphertext'].upper()} for entry in aggregated_data], index)
+        self.assertEqual('V4999', data['k4999']['nested'])
+        self.assertRaises(Exception, vault._restore_dict_from_vault, data, 'ciphertext', aggregated_data[1:], index)
+
     @patch('orchutils.vault.client')
     def test_decrypt_value(self, mock_client):
         mock_client.secrets.transit.decrypt_data.return_value = {
@@ -151,7 +245,7 @@ class TestVault(unittest.TestCase):
         }
         self.assertEqual('enc1', vault.encrypt_value('key', 'dec1'))
 
-    @patch('requests.post')
+    @patch('requests.Session.post')
     @patch('orchutils.vault.client')
     def test_issue_certificate(self, mock_client, mock_post):
         mock_client.url = 'http://url'
@@ -183,6 +277,36 @@ class TestVault(unittest.TestCase):
         ]
         self.assertEqual(expected_result, vault.issue_certificate('hostname', ca_mount='pki', role='role', ttl='2160h', revoke_cert=True))
 
+    @patch('time.sleep')
+    @patch('requests.Session.post')
+    @patch('orchutils.vault.client')
+    def test_issue_certificates(self, mock_client, mock_post, mock_sleep):
+        mock_client.url = 'http://url'
+        mock_client.token = 'token'
+        requests_sent = []
+
+        def post(url, json=None, headers=None):
+            requests_sent.append((url, json))
+            response = Mock()
+            if json.get('common_name') == 'bad.example.com':
+                response.raise_for_status.side_effect = Exception('invalid hostname')
+            elif not url.endswith('/revoke'):
+                response.json.return_value = {'data': {'certificate': json['common_name'], 'serial_number': json['common_name']}}
+            return response
+        mock_post.side_effect = post
+        results = vault.issue_certificates(['a.example.com,b.example.com', 'bad.example.com', 'c.example.com'], revoke_certs=True, concurrency=2)
+        self.assertEqual(['a.example.com,b.example.com', 'bad.example.com', 'c.example.com'], [result['hostnames'] for result in results])
+        self.assertEqual('a.example.com', results[0]['certificate']['certificate'])
+        self.assertIsNone(results[0]['error'])
+        self.assertIsNone(results[1]['certificate'])
+        self.assertIn('invalid hostname', str(results[1]['error']))
+        self.assertEqual('c.example.com', results[2]['certificate']['certificate'])
+        revoked = sorted(request[1]['serial_number'] for request in requests_sent if request[0].endswith('/revoke'))
+        self.assertEqual(['a.example.com', 'c.example.com'], revoked)
+        # Revocations are only sent once every certificate has been issued, including the retries of the failed certificate
+        self.assertEqual(10, len([request for request in requests_sent if request[1].get('common_name') == 'bad.example.com']))
+        self.assertTrue(all(url.endswith('/revoke') for (url, body) in requests_sent[-2:]))
+
     @patch('orchutils.vault.client')
     def test_delete(self, mock_client):
         self.assertIsNone(vault.delete('secret/my/path'))
@@ -221,6 +345,74 @@ class TestVault(unittest.TestCase):
         self.assertEqual('pass', vault.read('secret/my/path', property='password'))
         self.assertEqual(None, vault.read('secret/my/path', property='fake'))
 
+    @patch('time.sleep')
+    @patch('orchutils.vault.client')
+    def test_read_cache(self, mock_client, mock_sleep):
+        mock_client.read.return_value = {'data': {'user': 'user1'}}
+        mock_client.list.return_value = {'data': {'keys': ['path']}}
+        try:
+            vault.set_read_cache(ttl=60, path_ttls={'secret/uncached': 0})
+            self.assertEqual('user1', vault.read('secret/my/path', property='user'))
+            self.assertEqual({'user': 'user1'}, vault.read('secret/my/path'))
+            self.assertEqual(['path'], vault.list_keys('secret/my/'))
+            self.assertEqual(['path'], vault.list_keys('secret/my'))
+            self.assertEqual(1, mock_client.read.call_count)
+            self.assertEqual(1, mock_client.list.call_count)
+            # Cached values can be bypassed and paths can be excluded from the cache
+            vault.read('secret/my/path', cached=False)
+            vault.read('secret/uncached/path')
+            vault.read('secret/uncached/path')
+            self.assertEqual(4, mock_client.read.call_count)
+            # Writes and deletes invalidate the path and the lists of its parents
+            mock_client.read.return_value = {'data': {'user': 'user2'}}
+            vault.write('secret/my/path', {'user': 'user2'})
+            self.assertEqual('user2', vault.read('secret/my/path', property='user'))
+            vault.list_keys('secret/my')
+            self.assertEqual(2, mock_client.list.call_count)
+            vault.delete('secret/my/path/nested')
+            vault.list_keys('secret/my')
+            self.assertEqual(3, mock_client.list.call_count)
+            # An expired value is returned while it is refreshed. A failed refresh leaves the stale value in place
+            (timestamp, value) = vault.read_cache[('read', 'secret/my/path')]
+            vault.read_cache[('read', 'secret/my/path')] = (timestamp - 61, value)
+            mock_client.read.side_effect = Exception('Vault unavailable')
+            self.assertEqual('user2', vault.read('secret/my/path', property='user'))
+            self.assertEqual('user2', vault.read('secret/my/path', property='user'))
+            # Values that have been stale for too long are not returned
+            vault.read_cache[('read', 'secret/my/path')] = (timestamp - 61 - vault.read_cache_stale_ttl, value)
+            self.assertRaises(Exception, vault.read, 'secret/my/path')
+        finally:
+            vault.set_read_cache(enabled=False, path_ttls={})
+
+    @patch('orchutils.vault.client')
+    def test_distributed_lock(self, mock_client):
+        mock_client.secrets.kv.v2 = FakeKVv2()
+        holders = []
+        overlaps = []
+
+        def hold_lock():
+            with vault.distributed_lock('test', lease_seconds=30):
+                holders.append(None)
+                overlaps.append(len(holders))
+                time.sleep(0.1)
+                holders.remove(None)
+        threads = [threading.Thread(target=hold_lock) for i in range(3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(60)
+        self.assertEqual([1, 1, 1], overlaps)
+        self.assertEqual(3, baseutils.get_lock_stats()['vault:test']['acquisitions'])
+        # A held lease blocks other holders until the timeout, but an expired lease can be taken over
+        mock_client.secrets.kv.v2.create_or_update_secret(vault.lock_path + '/test', {'owner': 'other', 'expires': time.time() + 60}, mount_point=vault.lock_mount)
+        with self.assertRaises(baseutils.TimeoutException):
+            with vault.distributed_lock('test', timeout=0.1):
+                self.fail('The lock was acquired while it was held')
+        mock_client.secrets.kv.v2.create_or_update_secret(vault.lock_path + '/test', {'owner': 'other', 'expires': time.time() - 1}, mount_point=vault.lock_mount)
+        with vault.distributed_lock('test', timeout=0.1) as lock:
+            self.assertEqual(lock.owner, mock_client.secrets.kv.v2.read_secret_version(vault.lock_path + '/test', mount_point=vault.lock_mount)['data']['data']['owner'])
+        self.assertEqual('', mock_client.secrets.kv.v2.read_secret_version(vault.lock_path + '/test', mount_point=vault.lock_mount)['data']['data']['owner'])
+
     @patch('orchutils.vault.client')
     def test_write(self, mock_client):
         self.assertIsNone(vault.write('secret/my/path', {'k1': 'v1', 'k2': 'v2'}))
@@ -1,12 +1,18 @@
 import base64
+import concurrent.futures
+import copy
 import hvac
 import logging
 import os
 import requests
 import six
+import socket
+import threading
 import time
+import uuid
 import yaml
 from functools import wraps
+from requests.adapters import HTTPAdapter
 
 import baseutils
 
@@ -14,6 +20,24 @@ logger = logging.getLogger(__name__)
 certs_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'vault_certs')
 credentials_file = '/root/.vault/credentials'
 client = None
+pool_size = 20  # Maximum number of pooled connections to Vault, shared by the hvac client and the direct requests of this module
+session = None
+session_lock = threading.Lock()
+transit_batch_size = 500  # Maximum number of values sent to Vault in a single transit batch request by encrypt_dict and decrypt_dict
+transit_concurrency = 4  # Maximum number of transit batch requests sent to Vault at the same time
+certificate_concurrency = 8  # Maximum number of certificate requests sent to Vault at the same time by issue_certificates
+read_cache_enabled = os.environ.get('P2PAAS_VAULT_CACHE', '').lower() == 'true'  # Whether read and list_keys cache their results
+read_cache_ttl = 60  # Seconds for which a cached read or list is returned without contacting Vault
+read_cache_path_ttls = {}  # TTLs for paths starting with specific prefixes, overriding read_cache_ttl. The longest matching prefix is used
+read_cache_stale_ttl = 600  # Seconds after expiry during which a cached value is returned while it is refreshed in the background
+read_cache = {}
+read_cache_lock = threading.Lock()
+read_cache_generation = 0  # Incremented on every invalidation so that refreshes started before a write do not cache the old value
+read_cache_refreshing = set()
+lock_mount = os.environ.get('P2PAAS_VAULT_LOCK_MOUNT', 'secret')  # The mount point of the KV version 2 secrets engine that distributed locks are stored in
+lock_path = 'orchutils/locks'  # The path under lock_mount that distributed locks are stored at
+lock_retry_policy = baseutils.retry_policy(retries=5, interval=1, backoff=2, max_interval=10, jitter=True,
+                                           retry_on=lambda e: not isinstance(e, (hvac.exceptions.InvalidPath, hvac.exceptions.InvalidRequest)))
 
 
 def get_vault_ca():
@@ -31,7 +55,45 @@ def login(vault_url, vault_access_token):
     """
     global client
     logger.info('Creating Vault client object')
-    client = baseutils.retry(hvac.Client, url=vault_url, token=vault_access_token, verify=get_vault_ca())
+    client = baseutils.retry(hvac.Client, url=vault_url, token=vault_access_token, verify=get_vault_ca(), session=get_session())
+
+
+def get_session():
+    """
+    Retrieves the pooled, keep-alive HTTP session used for all requests to Vault, creating it on first use.
+    The session is shared by the hvac client and the direct requests of this module, so connections and TLS sessions are reused between calls.
+    It is safe for concurrent use from multiple threads. Up to pool_size connections are kept open.
+    Returns: The requests Session object
+    """
+    global session
+    with session_lock:
+        if session is None:
+            new_session = requests.Session()
+            adapter = HTTPAdapter(pool_maxsize=pool_size)
+            new_session.mount('https://', adapter)
+            new_session.mount('http://', adapter)
+            new_session.verify = get_vault_ca()
+            session = new_session
+    return session
+
+
+def get_connection_metrics():
+    """
+    Reports how well connections to Vault are being reused by the shared session.
+    Returns: A dictionary containing:
+        requests: The number of requests sent
+        pool_misses: The number of requests for which a new connection had to be opened
+        pool_hits: The number of requests sent over an existing pooled connection
+    """
+    request_count = connection_count = 0
+    for adapter in set(get_session().adapters.values()):
+        pools = adapter.poolmanager.pools
+        for pool_key in pools.keys():
+            pool = pools.get(pool_key)
+            if pool:
+                request_count += pool.num_requests
+                connection_count += pool.num_connections
+    return {'requests': request_count, 'pool_misses': connection_count, 'pool_hits': max(request_count - connection_count, 0)}
 
 
 def ensure_client(f):
@@ -74,14 +136,16 @@ def decrypt_dict(enc_key_name, data):
     Decrypts the values of a passed dictionary.
     The dictionary is recursively traversed to find all values and the values are passed in batch to Vault for decryption.
     It is therefore much more efficient to use this method to decrypt a dictionary with many values than individually calling decrypt for each one.
+    Values are sent in batches of up to transit_batch_size, with up to transit_concurrency batches in flight at once. Each batch is retried independently.
     Caution: The passed dictionary is mutated.
     Args:
         enc_key_name: The name of the Vault transit encryption key to use for decryption
         data: A dictionary of values to be decrypted. The dictionary can contain nested keys. The passed dictionary is mutated to contain the decrypted values
     """
-    enc_aggregated_data = _aggregate_dict_for_vault(data, 'ciphertext')
-    dec_aggregated_data = baseutils.retry(client.secrets.transit.decrypt_data, enc_key_name, None, batch_input=enc_aggregated_data)['data']['batch_results']
-    _restore_dict_from_vault(data, 'plaintext', dec_aggregated_data)
+    index = _index_dict_for_vault(data)
+    enc_aggregated_data = _aggregate_dict_for_vault(data, 'ciphertext', index)
+    dec_aggregated_data = _process_transit_batches(client.secrets.transit.decrypt_data, enc_key_name, enc_aggregated_data)
+    _restore_dict_from_vault(data, 'plaintext', dec_aggregated_data, index)
 
 
 @ensure_client
@@ -90,62 +154,109 @@ def encrypt_dict(enc_key_name, data):
     Encrypts the values of a passed dictionary.
     The dictionary is recursively traversed to find all values and the values are passed in batch to Vault for encryption.
     It is therefore much more efficient to use this method to encrypt a dictionary with many values than individually calling encrypt for each one.
+    Values are sent in batches of up to transit_batch_size, with up to transit_concurrency batches in flight at once. Each batch is retried independently.
     Caution: The passed dictionary is mutated.
     Args:
         enc_key_name: The name of the Vault transit encryption key to use for encryption
         data: A dictionary of values to be encrypted. The dictionary can contain nested keys. The passed dictionary is mutated to contain the encrypted values
     """
-    dec_aggregated_data = _aggregate_dict_for_vault(data, 'plaintext')
+    index = _index_dict_for_vault(data)
+    dec_aggregated_data = _aggregate_dict_for_vault(data, 'plaintext', index)
     try:
-        enc_aggregated_data = baseutils.retry(client.secrets.transit.encrypt_data, enc_key_name, None, batch_input=dec_aggregated_data)['data']['batch_results']
+        enc_aggregated_data = _process_transit_batches(client.secrets.transit.encrypt_data, enc_key_name, dec_aggregated_data)
     except Exception as e:
         if str(e) == 'encryption key not found':  # Create the key if it does not yet exist
             create_transit_key(enc_key_name)
-            enc_aggregated_data = baseutils.retry(client.secrets.transit.encrypt_data, enc_key_name, None, batch_input=dec_aggregated_data)['data']['batch_results']
+            enc_aggregated_data = _process_transit_batches(client.secrets.transit.encrypt_data, enc_key_name, dec_aggregated_data)
         else:
             raise
-    _restore_dict_from_vault(data, 'ciphertext', enc_aggregated_data)
+    _restore_dict_from_vault(data, 'ciphertext', enc_aggregated_data, index)
+
+
+def _process_transit_batches(func, enc_key_name, batch_input):
+    """
+    Passes a list of values to a Vault transit batch function, splitting it into batches of up to transit_batch_size values that are sent concurrently.
+    Each batch is retried on failure without resending the other batches.
+    Args:
+        func: The hvac transit function to call, ie. encrypt_data or decrypt_data
+        enc_key_name: The name of the Vault transit encryption key to use
+        batch_input: The list of aggregated values from _aggregate_dict_for_vault
+    Returns: The batch results of all values, in the same order as batch_input
+    """
+    batches = [batch_input[i:i + transit_batch_size] for i in range(0, len(batch_input), transit_batch_size)] or [batch_input]
+    if len(batches) == 1:
+        return _process_transit_batch(func, enc_key_name, batches[0])
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=min(transit_concurrency, len(batches)))
+    batch_futures = []
+    try:
+        for batch in batches:
+            batch_futures.append(executor.submit(_process_transit_batch, func, enc_key_name, batch))
+        return [result for batch_future in batch_futures for result in batch_future.result()]
+    finally:
+        for batch_future in batch_futures:
+            batch_future.cancel()  # Batches that have not started are not needed if one has failed
+        executor.shutdown(wait=True)
+
+
+def _process_transit_batch(func, enc_key_name, batch):
+    """
+    Sends a single transit batch request to Vault, retrying it on failure.
+    Returns: The batch results of the request
+    """
+    return baseutils.retry(func, enc_key_name, None, batch_input=batch)['data']['batch_results']
+
+
+def _index_dict_for_vault(data, index=None):
+    """
+    Builds an index of the locations of a dictionary's string values. The index fixes the order in which values are sent to Vault in a batch
+    so that the results can be written back without traversing the dictionary again.
+    Args:
+        data: The dictionary to index. Nested dictionaries are traversed
+        index: Internal parameter used as part of the functions recursive implementation. This is the eventual return value
+    Returns: A list of (dictionary, key) tuples, one for each string value
+    """
+    if index is None:
+        index = []
+    for (key, value) in data.items():
+        if isinstance(value, dict):
+            _index_dict_for_vault(value, index)
+        elif isinstance(value, six.string_types):
+            index.append((data, key))
+    return index
 
 
-def _aggregate_dict_for_vault(data, vault_key, aggregated_data=None):
+def _aggregate_dict_for_vault(data, vault_key, index=None):
     """
     Aggregates a dictionary's values in the form needed for passing as a batch list to Vaults encrypt and decrypt methods.
     Args:
         data: The data to be aggregated.
         vault_key: The dictionary key that Vault expects for the data. This is specific to the encrypt and decrypt functions of vault and is either 'plaintext' or 'ciphertext'
-        aggregated_data: Internal parameter used as part of the functions recursive implementation. This is the eventual return value
+        index: The index of the dictionary's values from _index_dict_for_vault. The same index must be passed to _restore_dict_from_vault (Optional, default: index data)
     Returns: A list of aggregated data of the form: [{vault_key: '<value>'}, ...]
     """
-    if aggregated_data is None:
-        aggregated_data = []
-    keys = list(data.keys())
-    keys.sort()  # Need to guarantee that iteration ordering in aggregate and restore function match while mutating the values
-    for key in keys:
-        value = data[key]
-        if isinstance(value, dict):
-            _aggregate_dict_for_vault(value, vault_key, aggregated_data)
-        elif isinstance(value, six.string_types):
-            aggregated_data.append({vault_key: base64.b64encode(value.encode('utf-8')) if vault_key == 'plaintext' else value})  # Plaintext must base64 encoded for Vault
-    return aggregated_data
+    if index is None:
+        index = _index_dict_for_vault(data)
+    if vault_key == 'plaintext':  # Plaintext must base64 encoded for Vault
+        return [{vault_key: base64.b64encode(container[key].encode('utf-8'))} for (container, key) in index]
+    return [{vault_key: container[key]} for (container, key) in index]
 
 
-def _restore_dict_from_vault(data, vault_key, aggregated_data):
+def _restore_dict_from_vault(data, vault_key, aggregated_data, index=None):
     """
     Restores aggregated data from Vault into an original data dictionary, overwriting existing encrypted values.
     Args:
         data: The original data dictionary to have decrypted values written into
         vault_key: The dictionary key that Vault returned. This is specific to the encrypt and decrypt functions of vault and is either 'plaintext' or 'ciphertext'
         aggregated_data: The raw data that Vault returned as part of a batch encrypt or decrypt process
+        index: The index of the dictionary's values that was used to aggregate the data sent to Vault (Optional, default: index data)
     """
-    keys = list(data.keys())
-    keys.sort()  # Need to guarantee that iteration ordering in aggregate and restore function match while mutating the values
-    for key in keys:
-        value = data[key]
-        if isinstance(value, dict):
-            _restore_dict_from_vault(value, vault_key, aggregated_data)
-        elif isinstance(value, six.string_types):
-            vault_entry = aggregated_data.pop(0)[vault_key]
-            data[key] = base64.b64decode(vault_entry).decode('utf-8') if vault_key == 'plaintext' else vault_entry
+    if index is None:
+        index = _index_dict_for_vault(data)
+    if len(index) != len(aggregated_data):
+        raise Exception('Vault returned {results} results for a batch of {values} values'.format(results=len(aggregated_data), values=len(index)))
+    for ((container, key), vault_entry) in zip(index, aggregated_data):
+        value = vault_entry[vault_key]
+        container[key] = base64.b64decode(value).decode('utf-8') if vault_key == 'plaintext' else value
 
 
 @ensure_client
@@ -184,89 +295,243 @@ def issue_certificate(hostnames, ca_mount='csp-intermediate-ca', role='csp-role'
                      revoked immediately. You will still receive the cert back, but it won't be tracked in Vault.
     Returns: The issued certificate as a dictionary containing all properties as returned from vault, which includes: private_key, certificate, ca_chain
     """
-    retry = True
-    retry_attempt = 0
-    while retry:
-        try:
-            response = requests.post('{vault_url}/v1/{ca_mount}/issue/{role}'.format(vault_url=client.url, ca_mount=ca_mount, role=role),
-                                     json={
-                                         'common_name': hostnames.split(',', 1)[0],
-                                         'alt_names': hostnames,
-                                         'ttl': ttl
-                                     },
-                                     headers={'X-Vault-Token': client.token},
-                                     verify=get_vault_ca())
-            response.raise_for_status()
-            vault_response = response.json()['data']
-            serial_number = vault_response['serial_number']
-            retry = False
-        except Exception:
-            retry_attempt += 1
-            if retry_attempt < 10:
-                time.sleep(5)
-            else:
-                raise
+    vault_response = _issue_certificate(hostnames, ca_mount, role, ttl)
     if revoke_cert:
-        retry = True
-        retry_attempt = 0
-        while retry:
-            try:
-                response = requests.post('{vault_url}/v1/{ca_mount}/revoke'.format(vault_url=client.url, ca_mount=ca_mount),
-                                         json={
-                                             'serial_number': serial_number
-                                         },
-                                         headers={'X-Vault-Token': client.token},
-                                         verify=get_vault_ca())
-                response.raise_for_status()
-                retry = False
-            except Exception:
-                retry_attempt += 1
-                if retry_attempt < 10:
-                    time.sleep(5)
-                else:
-                    break  # We don't need to fail a code flow just because we could not remove the cert from Vault
+        _revoke_certificate(vault_response['serial_number'], ca_mount)
     return vault_response
 
 
+@ensure_client
+def issue_certificates(hostname_sets, ca_mount='csp-intermediate-ca', role='csp-role', ttl='43800h', revoke_certs=False, concurrency=None):
+    """
+    Issues a certificate for each of a series of hostname sets, as per issue_certificate, with multiple certificates being issued concurrently.
+    A failure to issue one certificate does not prevent the others from being issued. Each failure is returned alongside the results.
+    If the certificates are to be revoked, the revocations are deferred until all certificates have been issued and are then sent together.
+    Args:
+        hostname_sets: A list of comma-seperated lists of hostnames, as per the hostnames argument of issue_certificate
+        ca_mount: The location where the secrets engine is mounted at in Vault (Optional, default: csp-intermediate-ca)
+        role: The Vault pki role to use when generating the certificates (Optional, default: 'csp-role')
+        ttl: Specifies the ttl of the certificates in a form like "2160h" - 2160 hours (Optional, default: "43800h" - 5 years)
+        revoke_certs: Whether to revoke the issued certificates. See the revoke_cert argument of issue_certificate (Optional, default: False)
+        concurrency: The maximum number of requests to send to Vault at the same time (Optional, default: certificate_concurrency)
+    Returns: A list with an entry for each hostname set, in the same order, of dictionaries containing:
+        hostnames: The hostname set
+        certificate: The issued certificate as returned by issue_certificate or None if the certificate could not be issued
+        error: The exception raised while issuing the certificate or None if it was issued
+    """
+    results = [{'hostnames': hostnames, 'certificate': None, 'error': None} for hostnames in hostname_sets]
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=concurrency or certificate_concurrency)
+    try:
+        result_futures = dict((executor.submit(_issue_certificate, result['hostnames'], ca_mount, role, ttl), result) for result in results)
+        for future in concurrent.futures.as_completed(result_futures):
+            result = result_futures[future]
+            try:
+                result['certificate'] = future.result()
+            except Exception as e:
+                logger.error('Failed to issue certificate for {hostnames}: {error}'.format(hostnames=result['hostnames'], error=e))
+                result['error'] = e
+        if revoke_certs:
+            serial_numbers = [result['certificate']['serial_number'] for result in results if result['certificate']]
+            list(executor.map(lambda serial_number: _revoke_certificate(serial_number, ca_mount), serial_numbers))
+    finally:
+        executor.shutdown(wait=True)
+    return results
+
+
+def _issue_certificate(hostnames, ca_mount, role, ttl):
+    """
+    Sends a request to Vault to issue a certificate, retrying on failure.
+    Returns: The issued certificate as returned by issue_certificate
+    """
+    def issue():
+        response = get_session().post('{vault_url}/v1/{ca_mount}/issue/{role}'.format(vault_url=client.url, ca_mount=ca_mount, role=role),
+                                      json={
+                                          'common_name': hostnames.split(',', 1)[0],
+                                          'alt_names': hostnames,
+                                          'ttl': ttl
+                                      },
+                                      headers={'X-Vault-Token': client.token})
+        response.raise_for_status()
+        return response.json()['data']
+    return baseutils.retry(issue, interval=5, retry=10)
+
+
+def _revoke_certificate(serial_number, ca_mount):
+    """
+    Sends a request to Vault to revoke a certificate, retrying on failure. A failure to revoke the certificate is logged but not raised.
+    """
+    def revoke():
+        response = get_session().post('{vault_url}/v1/{ca_mount}/revoke'.format(vault_url=client.url, ca_mount=ca_mount),
+                                      json={
+                                          'serial_number': serial_number
+                                      },
+                                      headers={'X-Vault-Token': client.token})
+        response.raise_for_status()
+    try:
+        baseutils.retry(revoke, interval=5, retry=10)
+    except Exception as e:
+        # We don't need to fail a code flow just because we could not remove the cert from Vault
+        logger.warning('Failed to revoke certificate {serial_number}: {error}'.format(serial_number=serial_number, error=e))
+
+
 @ensure_client
 def delete(path):
     """
     Deletes a secret at a given path in Vault.
         path: The path to delete the secrets at
     """
-    baseutils.retry(client.delete, path=path)
+    try:
+        baseutils.retry(client.delete, path=path)
+    finally:
+        _invalidate_read_cache(path)
 
 
 @ensure_client
-def list_keys(path):
+def list_keys(path, cached=True):
     """
     Retrieves a list of keys at a specified path in Vault.
     Args:
         path: The path to list the keys at, eg. secret/my/path
+        cached: Whether a cached list may be returned if the read cache is enabled. See set_read_cache (Optional, default: True)
     Returns: A list of keys at the specified path
     """
-    result = baseutils.retry(client.list, path=path) or {}
-    return result.get('data', {}).get('keys', [])
+    def list_path():
+        result = baseutils.retry(client.list, path=path) or {}
+        return result.get('data', {}).get('keys', [])
+    return _cached_read('list', path, list_path, cached)
 
 
 @ensure_client
-def read(path, property=None):
+def read(path, property=None, cached=True):
     """
     Retrieves a value from the Vault. This is not specific to a secret engine backend and anything can be queried.
     Vault secrets are returned as dictionaries. Only the actual value (data attribute of vault response) is returned, not the request metadata.
     Args:
         path: The path to the secret to retrieve. This must include the backend eg. secret/my/path
         property: A sub-property of the secret (under the data attribute) to retrieve (Optional)
+        cached: Whether a cached value may be returned if the read cache is enabled. See set_read_cache (Optional, default: True)
     Returns: The Vault secret as a dictionary or None if the value does not exist
     """
-    result = baseutils.retry(client.read, path=path)
-    if result:
-        result = result.get('data', {})
-        if property:
-            result = result.get(property)
+    def read_path():
+        result = baseutils.retry(client.read, path=path)
+        return result.get('data', {}) if result else result
+    result = _cached_read('read', path, read_path, cached)
+    if result and property:
+        result = result.get(property)
     return result
 
 
+def set_read_cache(enabled=True, ttl=None, path_ttls=None, stale_ttl=None):
+    """
+    Enables or disables the in-process cache of read and list_keys. The cache is disabled by default unless P2PAAS_VAULT_CACHE is set to "true".
+    Cached values of a path are discarded when the path is written or deleted through this module. Changes made by other processes are seen once the TTL expires.
+    Once a value has expired, it continues to be returned for up to stale_ttl seconds while it is refreshed in the background, so a slow or failing Vault does not
+    delay the caller. Only after that is the caller made to wait for Vault.
+    Args:
+        enabled: Whether to cache reads and lists (Optional, default: True)
+        ttl: The number of seconds for which values are cached (Optional, default: unchanged, initially 60)
+        path_ttls: A dictionary of path prefixes to TTLs in seconds, for paths that should be cached for a different time. A TTL of 0 disables caching (Optional)
+        stale_ttl: The number of seconds after expiry during which a cached value is still returned (Optional, default: unchanged, initially 600)
+    """
+    global read_cache_enabled, read_cache_ttl, read_cache_path_ttls, read_cache_stale_ttl
+    read_cache_enabled = enabled
+    if ttl is not None:
+        read_cache_ttl = ttl
+    if path_ttls is not None:
+        read_cache_path_ttls = path_ttls
+    if stale_ttl is not None:
+        read_cache_stale_ttl = stale_ttl
+    clear_read_cache()
+
+
+def clear_read_cache():
+    """
+    Discards all values cached by read and list_keys.
+    """
+    global read_cache_generation
+    with read_cache_lock:
+        read_cache.clear()
+        read_cache_generation += 1
+
+
+def _get_read_cache_ttl(path):
+    """
+    Returns the TTL of the cached values of a path, as configured by set_read_cache.
+    """
+    prefixes = [prefix for prefix in read_cache_path_ttls if path.startswith(prefix)]
+    return read_cache_path_ttls[max(prefixes, key=len)] if prefixes else read_cache_ttl
+
+
+def _cached_read(operation, path, func, cached):
+    """
+    Returns the result of a read or list of a path from the read cache, calling func to retrieve it from Vault if it is not cached or has expired.
+    An expired value that is still within the stale TTL is returned immediately and refreshed in a background thread.
+    """
+    path = path.rstrip('/')
+    ttl = _get_read_cache_ttl(path)
+    if not read_cache_enabled or ttl <= 0:
+        return func()
+    key = (operation, path)
+    if cached:
+        with read_cache_lock:
+            entry = read_cache.get(key)
+            age = time.time() - entry[0] if entry else None
+            refresh = entry is not None and ttl <= age < ttl + read_cache_stale_ttl and key not in read_cache_refreshing
+            if refresh:
+                read_cache_refreshing.add(key)
+        if entry and age < ttl + read_cache_stale_ttl:
+            if refresh:
+                refresh_thread = threading.Thread(target=_refresh_cached_read_in_background, args=(key, func))
+                refresh_thread.daemon = True
+                refresh_thread.start()
+            return copy.deepcopy(entry[1])
+    return _refresh_cached_read(key, func)
+
+
+def _refresh_cached_read(key, func):
+    """
+    Retrieves a value from Vault and caches it, unless the path was invalidated while the value was being retrieved.
+    Returns: The retrieved value
+    """
+    generation = read_cache_generation
+    value = func()
+    with read_cache_lock:
+        if generation == read_cache_generation:
+            read_cache[key] = (time.time(), copy.deepcopy(value))
+    return value
+
+
+def _refresh_cached_read_in_background(key, func):
+    """
+    Refreshes an expired cached value. Runs in a thread started by _cached_read. A failure leaves the stale value in place to be retried by a later read.
+    """
+    try:
+        _refresh_cached_read(key, func)
+    except Exception as e:
+        logger.warning('Failed to refresh cached Vault {operation} of {path}: {error}'.format(operation=key[0], path=key[1], error=e))
+    finally:
+        with read_cache_lock:
+            read_cache_refreshing.discard(key)
+
+
+def _invalidate_read_cache(path):
+    """
+    Discards the cached read of a path and the cached lists of all its parent paths, whose keys may have changed.
+    """
+    global read_cache_generation
+    path = path.rstrip('/')
+    parents = set()
+    parent = path
+    while '/' in parent:
+        parent = parent.rsplit('/', 1)[0]
+        parents.add(parent)
+    with read_cache_lock:
+        read_cache.pop(('read', path), None)
+        for parent in parents:
+            read_cache.pop(('list', parent), None)
+        read_cache_generation += 1
+
+
 @ensure_client
 def write(path, properties):
     """
@@ -276,4 +541,117 @@ def write(path, properties):
         path: The path to write the secrets to
         properties: The properties to write as key-value pairs passed as a dictionary
     """
-    baseutils.retry(client.write, path=path, **properties)
+    try:
+        baseutils.retry(client.write, path=path, **properties)
+    finally:
+        _invalidate_read_cache(path)
+
+
+class distributed_lock:
+    """
+    A lock shared by every system with access to Vault, for coordinating orchestration that runs on several hosts. Only one holder can hold the lock at a time.
+    The lock is a lease recorded in a secret of the KV version 2 secrets engine at lock_mount. The lease is written with check-and-set, so when several holders
+    try to take the lock at the same time only one of them succeeds. The lease is renewed in the background while the lock is held. If a holder dies without
+    releasing the lock, the lock can be taken once the lease has expired. Lease expiry is compared with the clock of each host, so hosts must have synchronised clocks.
+    The time spent waiting for the lock is recorded with the local locks. See baseutils.get_lock_stats.
+    This class is intended to be use via the 'with' syntax.
+    Example:
+        with vault.distributed_lock('sos_iks_ovpn_reservation', timeout=600):
+            do_something
+    """
+    def __init__(self, lock_name, lease_seconds=300, timeout=None):
+        """
+        Constructor for the lock object.
+        Args:
+            lock_name: The name of the lock. Contention for locks will only occur between locks with the same name
+            lease_seconds: The number of seconds the lock remains held if its holder stops renewing it (Optional, default: 300)
+            timeout: The maximum number of seconds to wait for the lock before raising a baseutils.TimeoutException. Any active baseutils.timeout also limits the wait
+                     (Optional, default: wait indefinitely)
+        """
+        self.lock_name = lock_name
+        self.path = '{lock_path}/{name}'.format(lock_path=lock_path, name=lock_name)
+        self.lease_seconds = lease_seconds
+        self.timeout = timeout
+        self.owner = '{host}:{pid}:{id}'.format(host=socket.gethostname(), pid=os.getpid(), id=uuid.uuid4().hex)
+        self.version = None
+        self.lost = False
+        self.stop_event = threading.Event()
+        self.renewal_thread = None
+
+    @ensure_client
+    def __enter__(self):
+        start_time = time.time()
+        contended = False
+        interval = 0.5
+        while not self._try_acquire():
+            contended = True
+            baseutils.check_timeout()
+            if self.timeout is not None and time.time() - start_time >= self.timeout:
+                raise baseutils.TimeoutException('Timed out after {timeout} seconds waiting for Vault lock "{name}"'.format(timeout=self.timeout, name=self.lock_name))
+            baseutils.sleep(interval)
+            interval = min(interval * 2, 10)
+        baseutils.record_lock_wait('vault:{name}'.format(name=self.lock_name), contended, time.time() - start_time)
+        self.lost = False
+        self.stop_event.clear()
+        self.renewal_thread = threading.Thread(target=self._renew)
+        self.renewal_thread.daemon = True
+        self.renewal_thread.start()
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.stop_event.set()
+        self.renewal_thread.join()
+        if not self.lost:
+            try:
+                if not self._write('', 0):
+                    logger.warning('Vault lock "{name}" was taken by another holder before it was released'.format(name=self.lock_name))
+            except Exception as e:
+                # The lock will become available once its lease expires
+                logger.warning('Failed to release Vault lock "{name}": {error}'.format(name=self.lock_name, error=e))
+
+    def _try_acquire(self):
+        """
+        Takes the lock if it is not held or its lease has expired.
+        Returns: Whether the lock was acquired
+        """
+        try:
+            response = baseutils.retry(client.secrets.kv.v2.read_secret_version, path=self.path, mount_point=lock_mount, policy=lock_retry_policy)
+            version = response['data']['metadata']['version']
+            lease = response['data']['data'] or {}
+        except hvac.exceptions.InvalidPath:
+            (version, lease) = (0, {})  # A check-and-set version of 0 only allows the write if the lock has never been created
+        if lease.get('owner') == self.owner:
+            self.version = version  # A previous write succeeded even though its response was lost
+            return True
+        if lease.get('owner') and lease.get('expires', 0) > time.time():
+            return False
+        self.version = version
+        return self._write(self.owner, time.time() + self.lease_seconds)
+
+    def _write(self, owner, expires):
+        """
+        Writes the lease of the lock, provided it has not changed since it was last read or written by this object.
+        Returns: Whether the lease was written. False if another holder changed the lease first
+        """
+        try:
+            response = baseutils.retry(client.secrets.kv.v2.create_or_update_secret, path=self.path, secret={'owner': owner, 'expires': expires}, cas=self.version,
+                                       mount_point=lock_mount, policy=lock_retry_policy)
+        except hvac.exceptions.InvalidRequest as e:
+            if 'check-and-set' not in str(e):
+                raise
+            return False
+        self.version = response['data']['version']
+        return True
+
+    def _renew(self):
+        """
+        Renews the lease of the held lock until it is released. Runs in the thread started by __enter__.
+        """
+        while not self.stop_event.wait(self.lease_seconds / 3.0):
+            try:
+                if not self._write(self.owner, time.time() + self.lease_seconds):
+                    self.lost = True
+                    logger.error('Lost Vault lock "{name}" to another holder. Its lease could not be renewed in time'.format(name=self.lock_name))
+                    return
+            except Exception as e:
+                logger.warning('Failed to renew Vault lock "{name}": {error}'.format(name=self.lock_name, error=e))
@@ -25,6 +25,7 @@ setup(
         'Programming Language :: Python :: 3.7'
     ],
     install_requires=[
+        'futures; python_version < "3"',  # Backport of concurrent.futures for Py2
         'hvac',
         'jinja2',
         'semver',